@@ -281,6 +281,15 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': os.path.join(LOG_DIR, 'mqtt.log'),
         },
+        # Trace campionate e slow log (una riga JSON per messaggio)
+        'trace_file': {
+            'class': 'logging.FileHandler',
+            'filename': os.path.join(LOG_DIR, 'mqtt_trace.log'),
+        },
+        'slow_file': {
+            'class': 'logging.FileHandler',
+            'filename': os.path.join(LOG_DIR, 'mqtt_slow.log'),
+        },
     },
     'loggers': {
         'mqtt': {
@@ -288,9 +297,54 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'mqtt.trace': {
+            'handlers': ['trace_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'mqtt.slow': {
+            'handlers': ['console', 'slow_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
+# Tracing campionato dei messaggi MQTT e slow log
+# Modificabile a runtime senza restart: python manage.py mqtt_tracing --help
+MQTT_TRACING = {
+    'ENABLED': os.getenv('MQTT_TRACING_ENABLED', 'false').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('MQTT_TRACING_SAMPLE_RATE', '0.01')),  # frazione messaggi campionati
+    'SLOW_THRESHOLD_MS': float(os.getenv('MQTT_SLOW_THRESHOLD_MS', '500')),  # 0 = slow log disabilitato
+    'CAPTURE_SQL': True,  # registra il testo SQL nelle trace campionate
+    'MAX_QUERIES': 200,  # max query registrate per trace
+    'CONTROL_FILE': os.path.join(LOG_DIR, 'mqtt_tracing.json'),
+}
+
+# Journal append-only dei messaggi MQTT raw (replay: python manage.py replay_journal --help)
+MQTT_JOURNAL = {
+    'ENABLED': os.getenv('MQTT_JOURNAL_ENABLED', 'false').lower() == 'true',
+    'DIR': os.getenv('MQTT_JOURNAL_DIR', os.path.join(BASE_DIR, 'mqtt_journal')),
+    'SEGMENT_MB': int(os.getenv('MQTT_JOURNAL_SEGMENT_MB', '64')),  # rotazione per dimensione
+    'SEGMENT_MAX_AGE': 3600,  # rotazione per età (secondi)
+    'MAX_TOTAL_MB': int(os.getenv('MQTT_JOURNAL_MAX_TOTAL_MB', '2048')),  # oltre, elimina i segmenti più vecchi
+    'FLUSH_INTERVAL': 1.0,  # secondi
+}
+
+# Spool write-ahead locale dell'ingest: i messaggi ricevuti sono scritti su disco prima
+# del processing e riprocessati al riavvio se non committati (crash o DB non disponibile)
+MQTT_SPOOL = {
+    'ENABLED': os.getenv('MQTT_SPOOL_ENABLED', 'false').lower() == 'true',
+    'DIR': os.getenv('MQTT_SPOOL_DIR', os.path.join(BASE_DIR, 'mqtt_spool')),
+    'SYNC_MODE': os.getenv('MQTT_SPOOL_SYNC_MODE', 'batch'),  # 'batch' (fsync periodico) o 'always'
+    'FSYNC_INTERVAL': 0.05,  # secondi, solo SYNC_MODE 'batch'
+    'SEGMENT_MB': 16,
+    'MAX_TOTAL_MB': int(os.getenv('MQTT_SPOOL_MAX_TOTAL_MB', '1024')),  # oltre, elimina il backlog più vecchio
+    'CHECKPOINT_INTERVAL': 1.0,  # secondi
+    'CHECKPOINT_EVERY': 200,  # record
+    'DB_RETRY_MAX_DELAY': 30,  # backoff massimo (secondi) con DB non disponibile
+}
+
 # MQTT Service Configuration
 import socket
 
@@ -301,9 +355,54 @@ MQTT_CONFIG = {
     'LWT_ENABLED': os.getenv('MQTT_LWT_ENABLED', 'true').lower() == 'true',
     'SHUTDOWN_TIMEOUT': int(os.getenv('MQTT_SHUTDOWN_TIMEOUT', '5')),
     'RECONNECT_MAX_DELAY': int(os.getenv('MQTT_RECONNECT_MAX_DELAY', '300')),
+    # Endpoint Prometheus /metrics servito dal processo mqtt_service (0 = disabilitato)
+    'METRICS_PORT': int(os.getenv('MQTT_METRICS_PORT', '9108')),
+    'METRICS_ADDR': os.getenv('MQTT_METRICS_ADDR', '0.0.0.0'),
+    # Job di force discovery: worker nel processo mqtt_service
+    'DISCOVERY_WORKER_ENABLED': os.getenv('MQTT_DISCOVERY_WORKER_ENABLED', 'true').lower() == 'true',
+    'DISCOVERY_BATCH_SIZE': int(os.getenv('MQTT_DISCOVERY_BATCH_SIZE', '50')),
+    'DISCOVERY_POLL_INTERVAL': float(os.getenv('MQTT_DISCOVERY_POLL_INTERVAL', '2')),
+    'DISCOVERY_STALE_AFTER': int(os.getenv('MQTT_DISCOVERY_STALE_AFTER', '300')),
+    # Flush in background dei contatori MqttApiVersionUsage (secondi)
+    'VERSION_USAGE_FLUSH_INTERVAL': int(os.getenv('MQTT_VERSION_USAGE_FLUSH_INTERVAL', '60')),
+    # Limite dimensione dei payload compressi (gzip/zlib) dopo la decompressione
+    'MAX_DECOMPRESSED_PAYLOAD_BYTES': int(os.getenv('MQTT_MAX_DECOMPRESSED_PAYLOAD_BYTES', str(8 * 1024 * 1024))),
+    # Liste device/sensori servite con .values() + JSON in streaming invece dei ModelSerializer
+    'API_FAST_LISTS': os.getenv('MQTT_API_FAST_LISTS', 'true').lower() == 'true',
+    # Cache risposte API (device, sensori, siti) invalidata dagli eventi di ingest
+    'RESPONSE_CACHE_ENABLED': os.getenv('MQTT_RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+    'RESPONSE_CACHE_TTL': int(os.getenv('MQTT_RESPONSE_CACHE_TTL', '300')),
+    # Change feed (delta sync): giorni di conservazione dei tombstone delle eliminazioni
+    'CHANGE_TOMBSTONE_RETENTION_DAYS': int(os.getenv('MQTT_CHANGE_TOMBSTONE_RETENTION_DAYS', '7')),
+    # Contatori di salute per sito (SiteHealth): ricalcolo dei siti toccati e riconciliazione completa (secondi)
+    'SITE_HEALTH_FLUSH_INTERVAL': float(os.getenv('MQTT_SITE_HEALTH_FLUSH_INTERVAL', '2')),
+    'SITE_HEALTH_FULL_RECONCILE_INTERVAL': int(os.getenv('MQTT_SITE_HEALTH_FULL_RECONCILE_INTERVAL', '600')),
+    # Evento WebSocket sensor_readings (letture appena salvate) per i client iscritti al datalogger
+    'WS_READINGS_ENABLED': os.getenv('MQTT_WS_READINGS_ENABLED', 'true').lower() == 'true',
+    # Stream live per sensore con decimazione per client (subscribe_stream, vedi stream_fanout)
+    'WS_STREAM_ENABLED': os.getenv('MQTT_WS_STREAM_ENABLED', 'true').lower() == 'true',
+    # Hot state dei sensori: ultime letture in Redis, riga Sensor scritta in ritardo (write-behind)
+    'HOT_STATE_ENABLED': os.getenv('MQTT_HOT_STATE_ENABLED', 'false').lower() == 'true',
+    'HOT_STATE_DEPTH': int(os.getenv('MQTT_HOT_STATE_DEPTH', '3')),
+    'HOT_STATE_FLUSH_INTERVAL': float(os.getenv('MQTT_HOT_STATE_FLUSH_INTERVAL', '10')),
+    'HOT_STATE_TTL': int(os.getenv('MQTT_HOT_STATE_TTL', '3600')),
+    # Snapshot dello stato live del servizio nella cache condivisa (status_registry), in secondi
+    'STATUS_PUBLISH_INTERVAL': float(os.getenv('MQTT_STATUS_PUBLISH_INTERVAL', '5')),
+    # Snapshot distinti del payload raw (senza letture) conservati per gateway
+    'METADATA_SNAPSHOTS_KEEP': int(os.getenv('MQTT_METADATA_SNAPSHOTS_KEEP', '20')),
 }
 
 
+# Cache condivisa tra processi (API e mqtt_service): stesso Redis dei Channels, database separato
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'bfg',
+        'TIMEOUT': 300,
+    }
+}
+
 # CHANNEL_LAYERS configuration for Django Channels
 CHANNEL_LAYERS = {
     "default": {
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import MqttConnection, MqttTopic, DiscoveredTopic, Gateway, Datalogger, Sensor
+from .models import (
+    MqttConnection, MqttTopic, DiscoveredTopic, Gateway, Datalogger, Sensor, DiscoveryJob,
+    GatewayState, DataloggerState, SensorState, GatewayMetadataSnapshot
+)
 
 
 # ============================================================================
@@ -68,7 +71,8 @@ class DiscoveredTopicAdmin(admin.ModelAdmin):
     list_display = ['topic_path', 'site', 'message_count', 'is_processed', 'processor_name', 'first_seen_at', 'last_seen_at', 'message_frequency_display']
     list_filter = ['site', 'is_processed', 'processor_name', 'first_seen_at']
     search_fields = ['topic_path', 'topic_pattern', 'site__name']
-    readonly_fields = ['first_seen_at', 'last_seen_at', 'message_count', 'payload_size_avg', 'message_frequency_seconds']
+    readonly_fields = ['first_seen_at', 'last_seen_at', 'message_count', 'payload_size_avg', 'message_frequency_seconds',
+                       'compression', 'compressed_message_count', 'compression_ratio_avg']
     list_editable = ['is_processed']
     ordering = ['-last_seen_at']
 
@@ -77,7 +81,8 @@ class DiscoveredTopicAdmin(admin.ModelAdmin):
             'fields': ('site', 'topic_path', 'topic_pattern')
         }),
         ('Discovery Stats', {
-            'fields': ('first_seen_at', 'last_seen_at', 'message_count', 'payload_size_avg', 'message_frequency_seconds'),
+            'fields': ('first_seen_at', 'last_seen_at', 'message_count', 'payload_size_avg', 'message_frequency_seconds',
+                       'compression', 'compressed_message_count', 'compression_ratio_avg'),
             'classes': ['collapse']
         }),
         ('Processing', {
@@ -100,6 +105,26 @@ class DiscoveredTopicAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(DiscoveryJob)
+class DiscoveryJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'site', 'status', 'progress_display', 'success_count', 'error_count', 'requested_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'site', 'created_at']
+    search_fields = ['site__name', 'message']
+    readonly_fields = [
+        'site', 'requested_by', 'status', 'total_topics', 'processed_count', 'success_count', 'error_count',
+        'results', 'message', 'worker', 'created_at', 'started_at', 'finished_at', 'updated_at'
+    ]
+    ordering = ['-created_at']
+
+    def progress_display(self, obj):
+        return f"{obj.processed_count}/{obj.total_topics} ({obj.progress_percent:.0f}%)"
+    progress_display.short_description = 'Progress'
+
+    def has_add_permission(self, request):
+        # I job si creano solo tramite API force_discovery
+        return False
+
+
 @admin.register(MqttTopic)
 class MqttTopicAdmin(admin.ModelAdmin):
     list_display = ['get_full_topic', 'mqtt_connection_site', 'is_active', 'qos_level', 'priority', 'description_preview']
@@ -147,20 +172,77 @@ class MqttTopicAdmin(admin.ModelAdmin):
 # MONITORING SYSTEM SECTION
 # ============================================================================
 
+class DeviceStateInline(admin.StackedInline):
+    """Stato live del device (tabella *State separata), aggiornato dal servizio MQTT: sola lettura"""
+    extra = 0
+    can_delete = False
+    classes = ['wide']
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class GatewayStateInline(DeviceStateInline):
+    model = GatewayState
+    fields = ['is_online', 'last_seen_at']
+
+
+class GatewayMetadataSnapshotInline(admin.TabularInline):
+    """Storico degli snapshot del payload raw (senza letture), dal più recente: sola lettura"""
+    model = GatewayMetadataSnapshot
+    extra = 0
+    fields = ['recorded_at', 'content_hash', 'metadata']
+    readonly_fields = ['recorded_at', 'content_hash', 'metadata']
+    classes = ['collapse']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class DataloggerStateInline(DeviceStateInline):
+    model = DataloggerState
+    fields = ['is_online', 'acquisition_status', 'last_seen_at']
+
+
+class SensorStateInline(DeviceStateInline):
+    model = SensorState
+    fields = [
+        'is_online', 'last_reading', 'consecutive_misses', 'total_messages', 'total_readings', 'last_seen_at',
+        ('last_timestamp_1', 'last_data_1'),
+        ('last_timestamp_2', 'last_data_2'),
+        ('last_timestamp_3', 'last_data_3'),
+    ]
+
+
+@admin.display(boolean=True, description='Online', ordering='state__is_online')
+def state_is_online(obj):
+    return getattr(getattr(obj, 'state', None), 'is_online', None)
+
+
+@admin.display(description='Last seen at', ordering='state__last_seen_at')
+def state_last_seen_at(obj):
+    return getattr(getattr(obj, 'state', None), 'last_seen_at', None)
+
+
 @admin.register(Gateway)
 class GatewayAdmin(admin.ModelAdmin):
     """Admin per Gateway (ex SystemInfo)"""
-    list_display = ['label', 'site', 'serial_number', 'hostname', 'is_online', 'connection_status', 'cpu_load_percent', 'ram_percent_used', 'disk_percent_used', 'uptime_display']
-    list_filter = ['is_online', 'connection_status', 'site', 'created_at']
+    list_display = ['label', 'site', 'serial_number', 'hostname', state_is_online, 'connection_status', 'cpu_load_percent', 'ram_percent_used', 'disk_percent_used', 'uptime_display']
+    list_filter = ['state__is_online', 'connection_status', 'site', 'created_at']
     search_fields = ['label', 'serial_number', 'site__name', 'hostname', 'ip_address']
-    readonly_fields = ['serial_number', 'last_status_change', 'mqtt_api_version', 'created_at', 'updated_at', 'uptime_display']
+    readonly_fields = ['serial_number', 'last_status_change', 'mqtt_api_version', 'created_at', 'updated_at', 'uptime_display',
+                       'raw_metadata', 'raw_metadata_hash']
+    inlines = [GatewayStateInline, GatewayMetadataSnapshotInline]
 
     fieldsets = (
         ('Gateway Information', {
             'fields': ('site', 'serial_number', 'label', 'hostname', 'ip_address', 'firmware_version', 'os_version', 'mqtt_api_version')
         }),
         ('Status & Monitoring', {
-            'fields': ('is_online', 'connection_status', 'last_status_change', 'expected_heartbeat_interval', 'system_uptime', 'uptime_display'),
+            'fields': ('connection_status', 'last_status_change', 'expected_heartbeat_interval', 'system_uptime', 'uptime_display'),
             'classes': ('wide',)
         }),
         ('CPU Metrics', {
@@ -176,7 +258,7 @@ class GatewayAdmin(admin.ModelAdmin):
             'classes': ('wide',)
         }),
         ('Raw Data', {
-            'fields': ('raw_metadata',),
+            'fields': ('raw_metadata', 'raw_metadata_hash'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -186,7 +268,7 @@ class GatewayAdmin(admin.ModelAdmin):
     )
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('site')
+        return super().get_queryset(request).select_related('site', 'state')
 
     def uptime_display(self, obj):
         """Human-readable uptime"""
@@ -216,26 +298,26 @@ class SensorInline(admin.TabularInline):
     """Inline per visualizzare sensori del datalogger"""
     model = Sensor
     extra = 0
-    fields = ['label', 'serial_number', 'sensor_type', 'is_online', 'total_readings', 'uptime_percentage']
-    readonly_fields = ['serial_number', 'total_readings', 'uptime_percentage', 'last_reading']
+    fields = ['label', 'serial_number', 'sensor_type', 'uptime_percentage']
+    readonly_fields = ['serial_number', 'uptime_percentage']
     classes = ['collapse']
 
 
 @admin.register(Datalogger)
 class DataloggerAdmin(admin.ModelAdmin):
     """Admin per Datalogger auto-discovered"""
-    list_display = ['label', 'site', 'datalogger_type', 'device_id', 'serial_number', 'is_online', 'connection_status', 'sensors_count', 'uptime_percentage', 'last_seen_at']
-    list_filter = ['is_online', 'connection_status', 'datalogger_type', 'site', 'last_seen_at', 'created_at']
+    list_display = ['label', 'site', 'datalogger_type', 'device_id', 'serial_number', state_is_online, 'connection_status', 'sensors_count', 'uptime_percentage', state_last_seen_at]
+    list_filter = ['state__is_online', 'connection_status', 'datalogger_type', 'site', 'state__last_seen_at', 'created_at']
     search_fields = ['label', 'serial_number', 'site__name', 'datalogger_type', 'device_id']
-    readonly_fields = ['serial_number', 'datalogger_type', 'device_id', 'last_seen_at', 'last_status_change', 'total_heartbeats', 'missed_heartbeats', 'mqtt_api_version', 'created_at', 'updated_at']
-    inlines = [SensorInline]
+    readonly_fields = ['serial_number', 'datalogger_type', 'device_id', 'last_status_change', 'total_heartbeats', 'missed_heartbeats', 'mqtt_api_version', 'created_at', 'updated_at']
+    inlines = [DataloggerStateInline, SensorInline]
 
     fieldsets = (
         ('Datalogger Information', {
             'fields': ('site', 'serial_number', 'label', 'datalogger_type', 'device_id', 'mqtt_api_version')
         }),
         ('Connection & Monitoring', {
-            'fields': ('is_online', 'connection_status', 'last_seen_at', 'last_status_change', 'expected_heartbeat_interval', 'firmware_version', 'ip_address'),
+            'fields': ('connection_status', 'last_status_change', 'expected_heartbeat_interval', 'firmware_version', 'ip_address'),
             'classes': ('wide',)
         }),
         ('Statistics', {
@@ -253,10 +335,10 @@ class DataloggerAdmin(admin.ModelAdmin):
     )
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('site').prefetch_related('sensors')
+        return super().get_queryset(request).select_related('site', 'state').prefetch_related('sensors')
 
     def sensors_count(self, obj):
-        online_count = obj.sensors.filter(is_online=True).count()
+        online_count = obj.sensors.filter(state__is_online=True).count()
         total_count = obj.sensors.count()
         return f"{online_count}/{total_count}"
     sensors_count.short_description = 'Sensors (Online/Total)'
@@ -271,41 +353,29 @@ class DataloggerAdmin(admin.ModelAdmin):
 @admin.register(Sensor)
 class SensorAdmin(admin.ModelAdmin):
     """Admin per Sensor con dati near real-time integrati"""
-    list_display = ['label', 'datalogger', 'sensor_type', 'serial_number', 'is_online', 'last_reading', 'total_readings', 'uptime_percentage', 'min_max_display']
-    list_filter = ['is_online', 'sensor_type', 'datalogger__site', 'datalogger__datalogger_type', 'last_reading', 'created_at']
+    list_display = ['label', 'datalogger', 'sensor_type', 'serial_number', state_is_online, 'last_reading', 'total_readings', 'uptime_percentage', 'min_max_display']
+    list_filter = ['state__is_online', 'sensor_type', 'datalogger__site', 'datalogger__datalogger_type', 'state__last_reading', 'created_at']
     search_fields = ['label', 'serial_number', 'datalogger__label', 'datalogger__site__name', 'sensor_type']
     readonly_fields = [
-        'serial_number', 'last_reading', 'total_messages', 'total_readings',
+        'serial_number',
         'min_value_ever', 'max_value_ever', 'min_recorded_at', 'max_recorded_at',
-        'first_seen_at', 'last_seen_at', 'consecutive_misses',
-        'last_timestamp_1', 'last_data_1', 'last_timestamp_2', 'last_data_2', 'last_timestamp_3', 'last_data_3',
+        'first_seen_at',
         'created_at', 'updated_at'
     ]
+    inlines = [SensorStateInline]
 
     fieldsets = (
         ('Sensor Information', {
             'fields': ('datalogger', 'serial_number', 'label', 'sensor_type', 'unit_of_measure')
         }),
-        ('Status', {
-            'fields': ('is_online', 'last_reading', 'consecutive_misses'),
-            'classes': ('wide',)
-        }),
         ('Statistics', {
-            'fields': ('total_messages', 'total_readings', 'uptime_percentage', 'first_seen_at', 'last_seen_at'),
+            'fields': ('uptime_percentage', 'first_seen_at'),
             'classes': ('wide',)
         }),
         ('Min/Max Records', {
             'fields': ('min_value_ever', 'min_recorded_at', 'max_value_ever', 'max_recorded_at'),
             'classes': ('wide',)
         }),
-        ('Near Real-Time Data (Last 3 Readings)', {
-            'fields': (
-                ('last_timestamp_1', 'last_data_1'),
-                ('last_timestamp_2', 'last_data_2'),
-                ('last_timestamp_3', 'last_data_3'),
-            ),
-            'classes': ('collapse',)
-        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -313,7 +383,15 @@ class SensorAdmin(admin.ModelAdmin):
     )
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('datalogger', 'datalogger__site')
+        return super().get_queryset(request).select_related('datalogger', 'datalogger__site', 'state')
+
+    @admin.display(description='Last reading', ordering='state__last_reading')
+    def last_reading(self, obj):
+        return getattr(getattr(obj, 'state', None), 'last_reading', None)
+
+    @admin.display(description='Total readings', ordering='state__total_readings')
+    def total_readings(self, obj):
+        return getattr(getattr(obj, 'state', None), 'total_readings', None)
 
     def min_max_display(self, obj):
         """Display min/max values"""
@@ -7,11 +7,36 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
+from django.db.models import Count, Q
 
+from sites.access import site_access
 from ..models import Datalogger, Sensor
+from ..services.change_feed import CursorExpired, change_feed
+from ..services.hot_state import sensor_hot_state
+from ..services.response_cache import cached_response, datalogger_scope, response_cache, site_scope
+from .fast_json import (
+    datalogger_columns,
+    datalogger_row_builder,
+    sensor_columns,
+    sensor_row_builder,
+    streaming_json_response
+)
+from .pagination import (
+    MAX_PAGE_SIZE,
+    MAX_STREAM_PAGE_SIZE,
+    PaginationError,
+    paginate_keyset,
+    parse_fields,
+    parse_limit
+)
+from .permissions import HasSiteAccess
 from .serializers import (
+    ChangeTombstoneSerializer,
     DataloggerSerializer,
+    GatewaySerializer,
+    SensorChangeSerializer,
     SensorSerializer,
     DataloggerDetailSerializer,
     SensorDetailSerializer
@@ -19,6 +44,63 @@ from .serializers import (
 
 logger = logging.getLogger(__name__)
 
+# Ordinamento keyset (coperto dagli indici site/label/id e datalogger/label/id)
+DATALOGGER_ORDERING = ('site_id', 'label', 'id')
+SENSOR_ORDERING = ('label', 'id')
+
+# Colonne DB necessarie per i campi serializzati che non sono colonne dirette
+DATALOGGER_FIELD_SOURCES = {
+    'site_id': ('site',),
+    'site_name': ('site__name',),
+    'is_online': ('state__is_online',),
+    'last_seen_at': ('state__last_seen_at',),
+    'sensors_count': (),
+    'active_sensors_count': (),
+}
+SENSOR_LATEST_READING_SOURCES = (
+    'state__last_timestamp_1', 'state__last_data_1', 'state__last_timestamp_2', 'state__last_data_2',
+    'state__last_timestamp_3', 'state__last_data_3',
+)
+SENSOR_FIELD_SOURCES = {
+    'datalogger_label': ('datalogger__label',),
+    'site_name': ('datalogger__site__name',),
+    'latest_readings': SENSOR_LATEST_READING_SOURCES,
+    'current_value': SENSOR_LATEST_READING_SOURCES,
+    **{
+        field: (f'state__{field}',)
+        for field in ('is_online', 'last_reading', 'total_messages', 'total_readings',
+                      'last_seen_at', 'consecutive_misses')
+    },
+}
+
+
+def _only_columns(fields, sources, required):
+    """Colonne per queryset.only() dato l'elenco dei campi richiesti"""
+    columns = set(required)
+    for field in fields:
+        columns.update(sources.get(field, (field,)))
+    return columns
+
+
+def _site_param_scope(request, **kwargs):
+    """Le liste sono cacheabili solo se filtrate per sito (il frontend passa sempre site_id)"""
+    site_id = request.GET.get('site_id', '')
+    return [site_scope(int(site_id))] if site_id.isdigit() else None
+
+
+def _datalogger_param_scope(request, **kwargs):
+    datalogger_id = request.GET.get('datalogger_id', '')
+    return [datalogger_scope(int(datalogger_id))] if datalogger_id.isdigit() else None
+
+
+def _datalogger_kwarg_scope(request, datalogger_id, **kwargs):
+    return [datalogger_scope(datalogger_id)]
+
+
+def _fast_lists_enabled():
+    """Read path .values() + JSON in streaming per le liste (vedi fast_json)"""
+    return getattr(settings, 'MQTT_CONFIG', {}).get('API_FAST_LISTS', True)
+
 
 def is_superuser(user):
     """Verifica che l'utente sia superuser."""
@@ -26,18 +108,35 @@ def is_superuser(user):
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
+@cached_response('dataloggers_list', _site_param_scope)
 def dataloggers_list(request):
     """
-    Lista tutti i datalogger auto-discovered.
+    Lista i datalogger auto-discovered, paginata con cursore.
 
     GET /v1/mqtt/dataloggers/
     Query params:
     - site_id: Filtra per sito specifico
     - online_only: true per mostrare solo datalogger online
+    - limit: elementi per pagina (default 200, max 1000; 20000 con il read path veloce)
+    - cursor: next_cursor della pagina precedente
+    - fields: proiezione sparsa, es. fields=id,label,is_online
+    - include_total: true per aggiungere total_count (query COUNT aggiuntiva)
+
+    change_cursor è il cursore del change feed (changes/) letto prima delle righe.
+    Una query per pagina: i conteggi sensori sono annotati, non calcolati per riga.
+    Con il read path veloce (default) le righe sono lette con .values() e la risposta
+    è in streaming, con pagine fino a 20000 elementi.
     """
     try:
-        queryset = Datalogger.objects.select_related('site').all()
+        fast = _fast_lists_enabled()
+        try:
+            limit = parse_limit(request.GET.get('limit'), MAX_STREAM_PAGE_SIZE if fast else MAX_PAGE_SIZE)
+            fields = parse_fields(request.GET.get('fields'), DataloggerSerializer.Meta.fields)
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = site_access.filter_queryset(Datalogger.objects.all(), request.user)
 
         # Filtro per sito se specificato
         site_id = request.GET.get('site_id')
@@ -53,17 +152,56 @@ def dataloggers_list(request):
         # Filtro solo online se richiesto
         online_only = request.GET.get('online_only', '').lower() == 'true'
         if online_only:
-            queryset = queryset.filter(is_online=True)
+            queryset = queryset.filter(state__is_online=True)
+
+        total_count = None
+        if request.GET.get('include_total', '').lower() == 'true':
+            total_count = queryset.count()
+
+        # Prima delle righe: i cambiamenti successivi restano > change_cursor
+        change_cursor = change_feed.current_cursor()
+
+        output_fields = fields or DataloggerSerializer.Meta.fields
+        if fast:
+            # Solo le colonne serializzate + quelle del cursore
+            columns = datalogger_columns(output_fields)
+            queryset = queryset.values(*dict.fromkeys(list(DATALOGGER_ORDERING) + columns))
+        else:
+            if 'site_name' in output_fields:
+                queryset = queryset.select_related('site')
+            if {'is_online', 'last_seen_at'} & set(output_fields):
+                queryset = queryset.select_related('state')
+            if fields is not None:
+                queryset = queryset.only(*_only_columns(fields, DATALOGGER_FIELD_SOURCES, ('site', 'label')))
+        if 'sensors_count' in output_fields:
+            queryset = queryset.annotate(sensors_count=Count('sensors'))
+        if 'active_sensors_count' in output_fields:
+            queryset = queryset.annotate(
+                active_sensors_count=Count('sensors', filter=Q(sensors__state__is_online=True))
+            )
 
-        # Ordina per sito e label
-        queryset = queryset.order_by('site__name', 'label')
+        try:
+            dataloggers, next_cursor = paginate_keyset(
+                queryset, DATALOGGER_ORDERING, request.GET.get('cursor'), limit
+            )
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = DataloggerSerializer(queryset, many=True)
+        response = {
+            'dataloggers': None,
+            'count': len(dataloggers),
+            'next_cursor': next_cursor,
+            'change_cursor': str(change_cursor),
+        }
+        if total_count is not None:
+            response['total_count'] = total_count
 
-        return Response({
-            'dataloggers': serializer.data,
-            'total_count': len(serializer.data)
-        }, status=status.HTTP_200_OK)
+        if fast:
+            rows = map(datalogger_row_builder(output_fields), dataloggers)
+            return streaming_json_response(request, response, 'dataloggers', rows)
+
+        response['dataloggers'] = DataloggerSerializer(dataloggers, many=True, fields=fields).data
+        return Response(response, status=status.HTTP_200_OK)
 
     except Exception as e:
         logger.error(f"Error in dataloggers_list API: {e}")
@@ -74,7 +212,8 @@ def dataloggers_list(request):
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
+@cached_response('datalogger_detail', _datalogger_kwarg_scope)
 def datalogger_detail(request, datalogger_id):
     """
     Dettaglio di un datalogger specifico con sensori.
@@ -82,9 +221,10 @@ def datalogger_detail(request, datalogger_id):
     GET /v1/mqtt/dataloggers/{datalogger_id}/
     """
     try:
-        datalogger = Datalogger.objects.select_related('site').prefetch_related('sensors').get(
+        datalogger = Datalogger.objects.select_related('site', 'state').prefetch_related('sensors__state').get(
             id=datalogger_id
         )
+        sensor_hot_state.apply_to_sensors(datalogger.sensors.all())
 
         serializer = DataloggerDetailSerializer(datalogger)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -103,7 +243,7 @@ def datalogger_detail(request, datalogger_id):
 
 
 @api_view(['PATCH'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
 @user_passes_test(is_superuser)
 def update_datalogger_label(request, datalogger_id):
     """
@@ -124,6 +264,7 @@ def update_datalogger_label(request, datalogger_id):
 
         datalogger.label = new_label
         datalogger.save(update_fields=['label'])
+        response_cache.bump_on_commit(site_scope(datalogger.site_id), datalogger_scope(datalogger.id))
 
         serializer = DataloggerSerializer(datalogger)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -142,12 +283,15 @@ def update_datalogger_label(request, datalogger_id):
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
+@cached_response('sensors_by_datalogger', _datalogger_param_scope)
 def sensors_by_datalogger(request):
     """
-    Lista sensori per un datalogger specifico.
+    Lista sensori per un datalogger specifico, paginata con cursore.
 
     GET /v1/mqtt/sensors/by_datalogger?datalogger_id=X
+    Query params: limit, cursor, fields (come dataloggers_list)
+    change_cursor: cursore per changes/?datalogger_id=X (aggiornamenti incrementali)
     """
     try:
         datalogger_id = request.GET.get('datalogger_id')
@@ -157,23 +301,65 @@ def sensors_by_datalogger(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        fast = _fast_lists_enabled()
         try:
-            datalogger = Datalogger.objects.select_related('site').get(id=int(datalogger_id))
+            limit = parse_limit(request.GET.get('limit'), MAX_STREAM_PAGE_SIZE if fast else MAX_PAGE_SIZE)
+            fields = parse_fields(request.GET.get('fields'), SensorSerializer.Meta.fields)
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            datalogger = (
+                Datalogger.objects.select_related('site', 'state')
+                .annotate(
+                    sensors_count=Count('sensors'),
+                    active_sensors_count=Count('sensors', filter=Q(sensors__state__is_online=True))
+                )
+                .get(id=int(datalogger_id))
+            )
         except (Datalogger.DoesNotExist, ValueError):
             return Response(
                 {'error': f'Datalogger {datalogger_id} not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        sensors = datalogger.sensors.all().order_by('label')
-        sensor_serializer = SensorSerializer(sensors, many=True)
-        datalogger_serializer = DataloggerSerializer(datalogger)
+        change_cursor = change_feed.current_cursor()
+
+        # datalogger.sensors imposta sensor.datalogger = datalogger: nessuna query per riga
+        sensors = datalogger.sensors.all()
+        output_fields = fields or SensorSerializer.Meta.fields
+        if fast:
+            sensors = sensors.values(*dict.fromkeys(list(SENSOR_ORDERING) + sensor_columns(output_fields)))
+        else:
+            columns = _only_columns(output_fields, SENSOR_FIELD_SOURCES, ('datalogger', 'label'))
+            if any(column.startswith('state__') for column in columns):
+                sensors = sensors.select_related('state')
+            if fields is not None:
+                # datalogger_label / site_name arrivano dal datalogger già caricato
+                sensors = sensors.only(*(c for c in columns if not c.startswith('datalogger__')))
 
-        return Response({
-            'datalogger': datalogger_serializer.data,
-            'sensors': sensor_serializer.data,
-            'count': len(sensor_serializer.data)
-        }, status=status.HTTP_200_OK)
+        try:
+            sensors, next_cursor = paginate_keyset(sensors, SENSOR_ORDERING, request.GET.get('cursor'), limit)
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = {
+            'datalogger': DataloggerSerializer(datalogger).data,
+            'sensors': None,
+            'count': len(sensors),
+            'next_cursor': next_cursor,
+            'change_cursor': str(change_cursor),
+        }
+
+        # Letture non ancora scritte su Postgres (hot state, una get_many per pagina)
+        if fast:
+            sensor_hot_state.apply_to_rows(sensors)
+            rows = map(sensor_row_builder(output_fields, datalogger.label, datalogger.site.name), sensors)
+            return streaming_json_response(request, response, 'sensors', rows)
+
+        sensor_hot_state.apply_to_sensors(sensors)
+        response['sensors'] = SensorSerializer(sensors, many=True, fields=fields).data
+        return Response(response, status=status.HTTP_200_OK)
 
     except Exception as e:
         logger.error(f"Error in sensors_by_datalogger API: {e}")
@@ -184,7 +370,7 @@ def sensors_by_datalogger(request):
 
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
 def sensor_detail(request, sensor_id):
     """
     Dettaglio di un sensore specifico.
@@ -192,7 +378,8 @@ def sensor_detail(request, sensor_id):
     GET /v1/mqtt/sensors/{sensor_id}/
     """
     try:
-        sensor = Sensor.objects.select_related('datalogger__site').get(id=sensor_id)
+        sensor = Sensor.objects.select_related('datalogger__site', 'datalogger__state', 'state').get(id=sensor_id)
+        sensor_hot_state.apply_to_sensors([sensor])
 
         serializer = SensorDetailSerializer(sensor)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -211,7 +398,7 @@ def sensor_detail(request, sensor_id):
 
 
 @api_view(['PATCH'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, HasSiteAccess])
 @user_passes_test(is_superuser)
 def update_sensor_label(request, sensor_id):
     """
@@ -232,6 +419,7 @@ def update_sensor_label(request, sensor_id):
 
         sensor.label = new_label
         sensor.save(update_fields=['label'])
+        response_cache.bump_on_commit(datalogger_scope(sensor.datalogger_id))
 
         serializer = SensorSerializer(sensor)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -246,4 +434,65 @@ def update_sensor_label(request, sensor_id):
         return Response(
             {'error': f'Internal error: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, HasSiteAccess])
+def changes_feed(request):
+    """
+    Change feed (delta sync): gateway, datalogger e sensori cambiati dopo un cursore.
+
+    GET /v1/mqtt/changes/?site_id=X  oppure  ?datalogger_id=Y
+    Query params:
+    - cursor: cursor della risposta precedente o change_cursor delle liste (assente = sync completo)
+    - limit: righe per tipo (default 200, max 1000)
+
+    Righe nello stesso formato delle liste (i sensori con datalogger_id), eliminazioni in deleted.
+    Con has_more=true richiamare subito con il nuovo cursor. 410 con reset=true se il cursore
+    è scaduto (tombstone già eliminati): ricaricare le liste complete.
+    """
+    try:
+        site_id = request.GET.get('site_id')
+        datalogger_id = request.GET.get('datalogger_id')
+        if not site_id and not datalogger_id:
+            return Response(
+                {'error': 'site_id or datalogger_id parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            site_id = int(site_id) if site_id else None
+            datalogger_id = int(datalogger_id) if datalogger_id else None
+            cursor = request.GET.get('cursor')
+            after = int(cursor) if cursor else None
+            if after is not None and after < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Invalid site_id, datalogger_id or cursor parameter'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = parse_limit(request.GET.get('limit'))
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch = change_feed.read(after, limit, site_id=site_id, datalogger_id=datalogger_id)
+        except CursorExpired as e:
+            return Response({'error': str(e), 'reset': True}, status=status.HTTP_410_GONE)
+
+        return Response({
+            'cursor': str(batch.cursor),
+            'has_more': batch.has_more,
+            'gateways': GatewaySerializer(batch.gateways, many=True).data,
+            'dataloggers': DataloggerSerializer(batch.dataloggers, many=True).data,
+            'sensors': SensorChangeSerializer(batch.sensors, many=True).data,
+            'deleted': ChangeTombstoneSerializer(batch.deleted, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        logger.error(f"Error in changes_feed API: {e}")
+        return Response(
+            {'error': f'Internal error: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
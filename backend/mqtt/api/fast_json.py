@@ -0,0 +1,199 @@
+"""
+Read path veloce per le liste device/sensori.
+
+Invece di istanziare modelli e ModelSerializer per ogni riga, le liste leggono
+solo le colonne necessarie con .values() e costruiscono direttamente i dict di
+risposta, con lo stesso formato (ordine dei campi, datetime, current_value) di
+DataloggerSerializer / SensorSerializer. La risposta è codificata a blocchi in
+una StreamingHttpResponse, compressa gzip se il client lo accetta.
+"""
+from datetime import timezone as dt_timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import current_value_from_data
+
+# Righe codificate per blocco dello stream
+STREAM_CHUNK_ROWS = 500
+
+# Stesso formato del JSONRenderer di DRF (UNICODE_JSON / COMPACT_JSON / STRICT_JSON)
+_encoder = JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+LATEST_READING_COLUMNS = (
+    ('state__last_timestamp_1', 'state__last_data_1'),
+    ('state__last_timestamp_2', 'state__last_data_2'),
+    ('state__last_timestamp_3', 'state__last_data_3'),
+)
+
+# Campi serializzati letti dalla tabella di stato (colonne state__<campo>)
+DATALOGGER_STATE_FIELDS = {'is_online', 'last_seen_at'}
+SENSOR_STATE_FIELDS = {
+    'is_online', 'last_reading', 'total_messages', 'total_readings', 'last_seen_at', 'consecutive_misses'
+}
+
+DATALOGGER_DATETIME_FIELDS = {'last_seen_at', 'created_at', 'updated_at'}
+SENSOR_DATETIME_FIELDS = {'last_reading', 'first_seen_at', 'last_seen_at', 'created_at', 'updated_at'}
+
+
+def _encode(value) -> str:
+    return _encoder.encode(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def format_datetime(value, tz) -> Optional[str]:
+    """
+    Come serializers.DateTimeField: fuso orario corrente, ISO 8601, 'Z' per UTC.
+    tz è risolto una volta per risposta (get_current_timezone per campo domina il costo).
+    """
+    if not value:
+        return None
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, dt_timezone.utc)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _current_timezone():
+    return timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+def datalogger_columns(fields: Sequence[str]) -> List[str]:
+    """Colonne .values() per i campi di DataloggerSerializer richiesti"""
+    columns = []
+    for field in fields:
+        if field == 'site_name':
+            columns.append('site__name')
+        elif field in DATALOGGER_STATE_FIELDS:
+            columns.append(f'state__{field}')
+        elif field not in ('sensors_count', 'active_sensors_count'):
+            columns.append(field)
+    return columns
+
+
+def sensor_columns(fields: Sequence[str]) -> List[str]:
+    """
+    Colonne .values() per i campi di SensorSerializer richiesti.
+    datalogger_label / site_name arrivano dal datalogger della lista.
+    """
+    columns = []
+    for field in fields:
+        if field in ('latest_readings', 'current_value'):
+            for timestamp_column, data_column in LATEST_READING_COLUMNS:
+                if timestamp_column not in columns:
+                    columns += [timestamp_column, data_column]
+        elif field in SENSOR_STATE_FIELDS:
+            columns.append(f'state__{field}')
+        elif field not in ('datalogger_label', 'site_name'):
+            columns.append(field)
+    return columns
+
+
+def datalogger_row_builder(fields: Sequence[str]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Funzione riga .values() -> dict con il formato di DataloggerSerializer"""
+    fields = tuple(fields)
+    tz = _current_timezone()
+
+    def build(values: Dict[str, Any]) -> Dict[str, Any]:
+        row = {}
+        for field in fields:
+            if field == 'site_name':
+                row[field] = values['site__name']
+            elif field == 'last_seen_at':
+                row[field] = format_datetime(values['state__last_seen_at'], tz)
+            elif field in DATALOGGER_STATE_FIELDS:
+                row[field] = values[f'state__{field}']
+            elif field in DATALOGGER_DATETIME_FIELDS:
+                row[field] = format_datetime(values[field], tz)
+            else:
+                row[field] = values[field]
+        return row
+    return build
+
+
+def sensor_row_builder(fields: Sequence[str], datalogger_label: str,
+                       site_name: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Funzione riga .values() -> dict con il formato di SensorSerializer.
+    Le ultime letture sono estratte una sola volta per riga (latest_readings e current_value).
+    """
+    fields = tuple(fields)
+    tz = _current_timezone()
+
+    def build(values: Dict[str, Any]) -> Dict[str, Any]:
+        readings = [
+            {'timestamp': values[timestamp_column], 'data': values[data_column]}
+            for timestamp_column, data_column in LATEST_READING_COLUMNS
+            if values.get(timestamp_column)
+        ]
+        row = {}
+        for field in fields:
+            if field == 'datalogger_label':
+                row[field] = datalogger_label
+            elif field == 'site_name':
+                row[field] = site_name
+            elif field == 'latest_readings':
+                row[field] = readings
+            elif field == 'current_value':
+                row[field] = current_value_from_data(readings[0]['data']) if readings else None
+            elif field in SENSOR_STATE_FIELDS:
+                value = values[f'state__{field}']
+                row[field] = format_datetime(value, tz) if field in SENSOR_DATETIME_FIELDS else value
+            elif field in SENSOR_DATETIME_FIELDS:
+                row[field] = format_datetime(values[field], tz)
+            else:
+                row[field] = values[field]
+        return row
+    return build
+
+
+def iter_json_object(data: Dict[str, Any], stream_key: str, rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Codifica {..., stream_key: [rows...], ...} a blocchi di STREAM_CHUNK_ROWS righe,
+    senza costruire l'intero documento JSON in memoria.
+    """
+    yield b'{'
+    first = True
+    for key, value in data.items():
+        prefix = '' if first else ','
+        first = False
+        if key != stream_key:
+            yield f"{prefix}{_encode(key)}:{_encode(value)}".encode('utf-8')
+            continue
+
+        yield f"{prefix}{_encode(key)}:[".encode('utf-8')
+        chunk = []
+        separator = ''
+        for row in rows:
+            chunk.append(_encode(row))
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield (separator + ','.join(chunk)).encode('utf-8')
+                chunk = []
+                separator = ','
+        if chunk:
+            yield (separator + ','.join(chunk)).encode('utf-8')
+        yield b']'
+    yield b'}'
+
+
+def streaming_json_response(request, data: Dict[str, Any], stream_key: str,
+                            rows: Iterable[Dict[str, Any]], status: int = 200) -> StreamingHttpResponse:
+    """StreamingHttpResponse JSON, compressa gzip se accettato dal client"""
+    content = iter_json_object(data, stream_key, rows)
+    gzip_accepted = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '').lower()
+    if gzip_accepted:
+        content = compress_sequence(content)
+
+    response = StreamingHttpResponse(content, content_type='application/json', status=status)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if gzip_accepted:
+        response['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,106 @@
+"""
+Keyset (cursor) pagination e proiezioni sparse per le liste API MQTT.
+
+La paginazione keyset filtra sull'ultima riga della pagina precedente invece
+di usare OFFSET: ogni pagina è una singola query che scorre un indice, con
+costo costante anche sulle ultime pagine di un sito grande.
+"""
+import base64
+import json
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from django.db.models import Q, QuerySet
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# Read path veloce (.values() + streaming, vedi fast_json): pagine più grandi
+MAX_STREAM_PAGE_SIZE = 20000
+
+
+class PaginationError(ValueError):
+    """Parametri di paginazione/proiezione non validi (risposta 400)"""
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Cursore opaco (base64 url-safe) con i valori delle colonne di ordinamento"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError('Invalid cursor')
+    return values
+
+
+def parse_limit(value: Optional[str], max_size: int = MAX_PAGE_SIZE) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('Invalid limit parameter')
+    if limit < 1:
+        raise PaginationError('Invalid limit parameter')
+    return min(limit, max_size)
+
+
+def parse_fields(value: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """
+    Parametro fields=id,label,is_online -> lista di campi (None = tutti).
+    'id' è sempre incluso: serve al client come chiave.
+    """
+    if not value:
+        return None
+    requested = {f.strip() for f in value.split(',') if f.strip()}
+    unknown = sorted(requested - set(allowed))
+    if unknown:
+        raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+    requested.add('id')
+    # Stesso ordine dei campi del serializer
+    return [f for f in allowed if f in requested]
+
+
+def keyset_filter(ordering: Sequence[str], values: Sequence) -> Q:
+    """
+    (a, b, c) > (va, vb, vc) espanso in
+    a > va OR (a = va AND b > vb) OR (a = va AND b = vb AND c > vc)
+    Tutte le colonne sono ordinate in modo ascendente.
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        condition |= Q(**equal, **{f'{field}__gt': value})
+        equal[field] = value
+    return condition
+
+
+def paginate_keyset(queryset: QuerySet, ordering: Sequence[str], cursor: Optional[str],
+                    limit: int) -> Tuple[list, Optional[str]]:
+    """
+    Restituisce (righe della pagina, cursore della pagina successiva o None).
+    Le colonne di ordering sono attributi diretti del modello (es. 'site_id', 'label'),
+    presenti anche nelle righe di un queryset .values(), e l'ultima deve essere univoca
+    (tipicamente 'id').
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+
+    # Una riga in più per sapere se esiste una pagina successiva senza COUNT
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([_cursor_value(last, field) for field in ordering])
+
+
+def _cursor_value(obj, field: str):
+    value = obj[field] if isinstance(obj, dict) else getattr(obj, field)
+    return value.isoformat() if hasattr(value, 'isoformat') else value
@@ -0,0 +1,53 @@
+"""
+Permessi per le API dei device: il sito richiesto deve essere tra quelli accessibili
+all'utente (sites.access, insieme di site id in cache; superuser: tutti).
+"""
+from rest_framework.permissions import BasePermission
+
+from sites.access import site_access
+from ..models import Datalogger, Sensor
+
+
+class HasSiteAccess(BasePermission):
+    """
+    site_id / datalogger_id (query string) o datalogger_id / sensor_id (URL) devono
+    appartenere a un sito accessibile. Verificato prima della view, quindi anche prima
+    della cache delle risposte. Un device inesistente passa (la view risponde 404).
+    Sito di datalogger e sensori dalla cache di site_access: una GET condizionale non
+    modificata (304) non legge le tabelle dei device.
+    """
+    message = 'You do not have access to this site'
+
+    def has_permission(self, request, view):
+        if request.user.is_superuser:
+            return True
+
+        site_id = self._site_id(request, getattr(view, 'kwargs', {}) or {})
+        return site_id is None or site_access.has_access(request.user, site_id)
+
+    def _site_id(self, request, kwargs):
+        site_id = request.GET.get('site_id', '')
+        if site_id.isdigit():
+            return int(site_id)
+
+        datalogger_id = str(kwargs.get('datalogger_id') or request.GET.get('datalogger_id', ''))
+        if datalogger_id.isdigit():
+            return self._datalogger_site_id(int(datalogger_id))
+
+        sensor_id = str(kwargs.get('sensor_id', ''))
+        if sensor_id.isdigit():
+            datalogger_id = site_access.device_parent('sensor', int(sensor_id), _load_sensor_datalogger_id)
+            return None if datalogger_id is None else self._datalogger_site_id(datalogger_id)
+        return None
+
+    def _datalogger_site_id(self, datalogger_id):
+        return site_access.device_parent('datalogger', datalogger_id, _load_datalogger_site_id)
+
+
+# Relazioni lette solo alla prima richiesta: poi dalla cache di site_access (mqtt.signals le invalida)
+def _load_datalogger_site_id(datalogger_id):
+    return Datalogger.objects.filter(pk=datalogger_id).order_by().values_list('site_id', flat=True).first()
+
+
+def _load_sensor_datalogger_id(sensor_id):
+    return Sensor.objects.filter(pk=sensor_id).order_by().values_list('datalogger_id', flat=True).first()
@@ -2,7 +2,7 @@
 Serializers per API di controllo MQTT
 """
 from rest_framework import serializers
-from ..models import MqttConnection, Datalogger, Sensor
+from ..models import ChangeTombstone, MqttConnection, Gateway, Datalogger, Sensor, SensorState
 
 
 class MqttConnectionStatusSerializer(serializers.Serializer):
@@ -66,10 +66,44 @@ class MqttConnectionListSerializer(serializers.ModelSerializer):
         ]
 
 
-class DataloggerSerializer(serializers.ModelSerializer):
-    """Serializer per Datalogger auto-discovered."""
+def current_value_from_data(latest_data):
+    """Valore principale di una lettura - SEMPRE dati RAW"""
+    if 'acc00' in latest_data:
+        return latest_data['acc00']
+    elif 'incli_x' in latest_data:
+        return latest_data['incli_x']
+    elif 'temperature' in latest_data:
+        return latest_data['temperature']
+    elif 'value' in latest_data:
+        return latest_data['value']
+    return None
+
+
+class SparseFieldsMixin:
+    """
+    Proiezione sparsa: SensorSerializer(qs, many=True, fields=['id', 'label'])
+    serializza solo i campi richiesti (parametro API fields=).
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DataloggerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer per Datalogger auto-discovered.
+
+    I conteggi sensori usano le annotazioni sensors_count / active_sensors_count
+    se presenti nel queryset (vedi dataloggers_list), altrimenti una COUNT per riga.
+    """
 
     site_name = serializers.CharField(source='site.name', read_only=True)
+    is_online = serializers.BooleanField(source='state.is_online', read_only=True)
+    last_seen_at = serializers.DateTimeField(source='state.last_seen_at', read_only=True)
     sensors_count = serializers.SerializerMethodField()
     active_sensors_count = serializers.SerializerMethodField()
 
@@ -84,25 +118,35 @@ class DataloggerSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'site_id', 'last_seen_at', 'connection_status', 'mqtt_api_version',
+            'id', 'site_id', 'connection_status', 'mqtt_api_version',
             'expected_heartbeat_interval', 'total_heartbeats', 'missed_heartbeats',
             'uptime_percentage', 'created_at', 'updated_at'
         ]
 
     def get_sensors_count(self, obj):
         """Conta totale sensori per questo datalogger."""
+        if hasattr(obj, 'sensors_count'):
+            return obj.sensors_count
         return obj.sensors.count()
 
     def get_active_sensors_count(self, obj):
         """Conta sensori online per questo datalogger."""
-        return obj.sensors.filter(is_online=True).count()
+        if hasattr(obj, 'active_sensors_count'):
+            return obj.active_sensors_count
+        return obj.sensors.filter(state__is_online=True).count()
 
 
-class SensorSerializer(serializers.ModelSerializer):
+class SensorSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer per Sensor auto-discovered."""
 
     datalogger_label = serializers.CharField(source='datalogger.label', read_only=True)
     site_name = serializers.CharField(source='datalogger.site.name', read_only=True)
+    is_online = serializers.BooleanField(source='state.is_online', read_only=True)
+    last_reading = serializers.DateTimeField(source='state.last_reading', read_only=True)
+    total_messages = serializers.IntegerField(source='state.total_messages', read_only=True)
+    total_readings = serializers.IntegerField(source='state.total_readings', read_only=True)
+    last_seen_at = serializers.DateTimeField(source='state.last_seen_at', read_only=True)
+    consecutive_misses = serializers.IntegerField(source='state.consecutive_misses', read_only=True)
     latest_readings = serializers.SerializerMethodField()
     current_value = serializers.SerializerMethodField()
 
@@ -117,34 +161,33 @@ class SensorSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'last_reading', 'total_messages', 'total_readings',
-            'min_value_ever', 'max_value_ever', 'first_seen_at', 'last_seen_at',
-            'uptime_percentage', 'consecutive_misses', 'created_at', 'updated_at'
+            'id', 'min_value_ever', 'max_value_ever', 'first_seen_at',
+            'uptime_percentage', 'created_at', 'updated_at'
         ]
 
+    def _state(self, obj):
+        """Stato live del sensore (None se non ancora creato)"""
+        try:
+            return obj.state
+        except SensorState.DoesNotExist:
+            return None
+
     def get_latest_readings(self, obj):
         """Ritorna ultimi 3 dati del sensore."""
-        return obj.get_latest_readings()
+        state = self._state(obj)
+        return state.get_latest_readings() if state else []
 
     def get_current_value(self, obj):
         """Estrae valore corrente principale del sensore."""
-        latest_readings = obj.get_latest_readings()
-        if not latest_readings:
+        state = self._state(obj)
+        if state is None:
             return None
-
-        # Prende il dato più recente
-        latest_data = latest_readings[0]['data']
-
-        # Cerca valore principale - SEMPRE dati RAW
-        if 'acc00' in latest_data:
-            return latest_data['acc00']
-        elif 'incli_x' in latest_data:
-            return latest_data['incli_x']
-        elif 'temperature' in latest_data:
-            return latest_data['temperature']
-        elif 'value' in latest_data:
-            return latest_data['value']
-
+        # Dato più recente: primo slot con timestamp (come get_latest_readings, senza costruire la lista)
+        for timestamp, data in ((state.last_timestamp_1, state.last_data_1),
+                                (state.last_timestamp_2, state.last_data_2),
+                                (state.last_timestamp_3, state.last_data_3)):
+            if timestamp:
+                return current_value_from_data(data)
         return None
 
 
@@ -163,4 +206,37 @@ class DataloggerDetailSerializer(DataloggerSerializer):
     sensors = SensorSerializer(many=True, read_only=True)
 
     class Meta(DataloggerSerializer.Meta):
-        fields = DataloggerSerializer.Meta.fields + ['sensors']
\ No newline at end of file
+        fields = DataloggerSerializer.Meta.fields + ['sensors']
+
+class GatewaySerializer(serializers.ModelSerializer):
+    """Serializer per Gateway (change feed)."""
+
+    is_online = serializers.BooleanField(source='state.is_online', read_only=True)
+    last_seen_at = serializers.DateTimeField(source='state.last_seen_at', read_only=True)
+
+    class Meta:
+        model = Gateway
+        fields = [
+            'id', 'site_id', 'serial_number', 'label', 'hostname', 'ip_address',
+            'firmware_version', 'os_version', 'is_online', 'connection_status',
+            'mqtt_api_version', 'expected_heartbeat_interval', 'system_uptime',
+            'cpu_load_percent', 'ram_percent_used', 'disk_percent_used',
+            'last_seen_at', 'created_at', 'updated_at'
+        ]
+
+
+class SensorChangeSerializer(SensorSerializer):
+    """Sensore nel change feed: con datalogger_id, le righe possono essere di più datalogger."""
+
+    class Meta(SensorSerializer.Meta):
+        fields = ['id', 'datalogger_id'] + SensorSerializer.Meta.fields[1:]
+
+
+class ChangeTombstoneSerializer(serializers.ModelSerializer):
+    """Eliminazione nel change feed."""
+
+    id = serializers.IntegerField(source='object_id')
+
+    class Meta:
+        model = ChangeTombstone
+        fields = ['kind', 'id', 'datalogger_id']
@@ -9,8 +9,10 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
 from ..services.mqtt_service import mqtt_service
+from ..services.status_registry import service_status
 from ..models import MqttConnection, Datalogger, Sensor, DiscoveredTopic
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -190,7 +192,8 @@ def manager_status(request):
         error_connections = len([c for c in all_connections if c.get('status') == 'error'])
 
         status_data = {
-            'is_running': mqtt_service.is_running(),
+            # Il servizio gira nel processo mqtt_service: stato dal registry condiviso
+            'is_running': mqtt_service.is_running() or service_status.is_running(),
             'total_connections': total_connections,
             'active_connections': active_connections,
             'connected_connections': connected_connections,
@@ -342,10 +345,13 @@ def restart_manager(request):
 @permission_classes([IsAuthenticated])
 def force_discovery(request, site_id):
     """
-    Forza refresh discovery per un sito - rilegge tutti i discovered topics
-    e aggiorna datalogger/sensori.
+    Forza refresh discovery per un sito - accoda un job che rilegge tutti i
+    discovered topics e aggiorna datalogger/sensori in background.
+    Se per il sito c'è già un job in coda o in esecuzione, ritorna quello.
 
     POST /v1/mqtt/sites/{site_id}/discover/
+    Avanzamento: GET /v1/mqtt/discovery-jobs/{job_id}/ o eventi WebSocket
+    discovery_job_progress / discovery_job_finished
     """
     try:
         # Check superuser permission
@@ -358,8 +364,7 @@ def force_discovery(request, site_id):
         logger.info(f"API request to force discovery refresh for site {site_id} by user {request.user}")
 
         from sites.models import Site
-        from ..services.message_processor import message_processor
-        import json
+        from ..services.discovery_jobs import discovery_job_runner, serialize_job
 
         # Verifica che il sito esista
         try:
@@ -370,68 +375,100 @@ def force_discovery(request, site_id):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Recupera tutti i discovered topics per questo sito
-        discovered_topics = DiscoveredTopic.objects.filter(site=site).order_by('-last_seen_at')
-
-        if not discovered_topics.exists():
+        if not DiscoveredTopic.objects.filter(site=site).exists():
             return Response(
                 {'success': True, 'message': 'No MQTT topics discovered yet. Make sure IoT devices are sending messages to the broker.', 'processed_count': 0, 'total_topics': 0},
                 status=status.HTTP_200_OK
             )
 
-        processed_count = 0
-        success_count = 0
-        error_count = 0
+        job, created = discovery_job_runner.enqueue(site, request.user)
+        message = (
+            f"Discovery refresh queued (job {job.id})" if created
+            else f"Discovery refresh already {job.status} (job {job.id})"
+        )
+
+        return Response({
+            'success': True,
+            'message': message,
+            **serialize_job(job),
+            'status_url': reverse('mqtt:discovery_job_status', args=[job.id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    except ValueError:
+        return Response(
+            {'success': False, 'message': 'Invalid site_id'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        logger.error(f"Error in force_discovery API for site {site_id}: {e}")
+        return Response(
+            {'success': False, 'message': f'Internal error: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def discovery_job_status(request, job_id):
+    """
+    Stato e risultati di un job di force discovery.
+
+    GET /v1/mqtt/discovery-jobs/{job_id}/
+    """
+    try:
+        if not request.user.is_superuser:
+            return Response(
+                {'success': False, 'message': 'Superuser permission required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        from ..models import DiscoveryJob
+        from ..services.discovery_jobs import serialize_job
 
-        # Re-processa tutti i topic scoperti
-        for topic in discovered_topics:
-            try:
-                if topic.sample_payload:
-                    # Converte il payload in bytes per simulare un messaggio MQTT
-                    payload_str = json.dumps(topic.sample_payload)
-                    payload_bytes = payload_str.encode('utf-8')
+        try:
+            job = DiscoveryJob.objects.get(id=job_id)
+        except DiscoveryJob.DoesNotExist:
+            return Response(
+                {'success': False, 'message': f'Discovery job {job_id} not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
 
-                    # Re-processa il messaggio
-                    result = message_processor.process_message(
-                        site_id=site.id,
-                        topic=topic.topic_path,
-                        payload=payload_bytes,
-                        qos=0,
-                        retain=False
-                    )
+        return Response({'success': True, **serialize_job(job)}, status=status.HTTP_200_OK)
 
-                    if result:
-                        success_count += 1
-                    else:
-                        error_count += 1
+    except Exception as e:
+        logger.error(f"Error in discovery_job_status API for job {job_id}: {e}")
+        return Response(
+            {'success': False, 'message': f'Internal error: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
-                    processed_count += 1
 
-            except Exception as e:
-                logger.error(f"Error reprocessing topic {topic.topic_path}: {e}")
-                error_count += 1
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def response_cache_stats(request):
+    """
+    Hit/miss della cache risposte API, aggregati su tutti i processi.
 
-        # Statistiche finali
-        total_topics = discovered_topics.count()
+    GET /v1/mqtt/cache/stats/
+    """
+    try:
+        if not request.user.is_superuser:
+            return Response(
+                {'success': False, 'message': 'Superuser permission required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
 
-        message = f"Discovery refresh completed: {success_count} successful, {error_count} errors, {total_topics} total topics"
+        from ..services.response_cache import response_cache
 
         return Response({
             'success': True,
-            'message': message,
-            'processed_count': processed_count,
-            'success_count': success_count,
-            'error_count': error_count,
-            'total_topics': total_topics
+            'enabled': response_cache.enabled,
+            'ttl': response_cache.ttl,
+            'endpoints': response_cache.stats()
         }, status=status.HTTP_200_OK)
 
-    except ValueError:
-        return Response(
-            {'success': False, 'message': 'Invalid site_id'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
     except Exception as e:
-        logger.error(f"Error in force_discovery API for site {site_id}: {e}")
+        logger.error(f"Error in response_cache_stats API: {e}")
         return Response(
             {'success': False, 'message': f'Internal error: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -647,36 +684,32 @@ def mqtt_service_health(request):
         JSON con stato servizio e metriche connessioni
     """
     try:
-        from ..services.mqtt_service import mqtt_service
         from django.conf import settings
-        import subprocess
+        from django.db.models import Count, Q
 
-        # Check if mqtt_service supervisord program is running
-        # (MQTT service runs in separate process, so we can't use mqtt_service.is_running())
+        # Stato pubblicato dal processo mqtt_service (heartbeat con TTL): nessun supervisorctl
         try:
-            result = subprocess.run(
-                ['supervisorctl', 'status', 'mqtt_service'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            is_running = 'RUNNING' in result.stdout
+            snapshots = service_status.snapshots()
         except Exception as e:
-            logger.warning(f"Could not check supervisord status: {e}")
-            is_running = False
+            logger.warning(f"Could not read MQTT service status registry: {e}")
+            snapshots = []
+        is_running = service_status.is_running(snapshots)
 
         # Query database directly since connections run in separate process
         from ..models import MqttConnection
         all_connections = MqttConnection.objects.all()
 
-        total = all_connections.count()
-        enabled = all_connections.filter(is_enabled=True).count()
-        healthy = all_connections.filter(is_enabled=True, status='connected').count()
+        counts = all_connections.aggregate(
+            total=Count('id'),
+            enabled=Count('id', filter=Q(is_enabled=True)),
+            healthy=Count('id', filter=Q(is_enabled=True, status='connected')),
+        )
+        total, enabled, healthy = counts['total'], counts['enabled'], counts['healthy']
 
         # Build connections list for verbose mode
         connections = []
         if request.GET.get('verbose') == 'true':
-            for conn in all_connections:
+            for conn in all_connections.select_related('site'):
                 connections.append({
                     'site_id': conn.site_id,
                     'site_name': conn.site.name,
@@ -703,7 +736,24 @@ def mqtt_service_health(request):
             'timestamp': datetime.utcnow().isoformat() + 'Z',
             'service': {
                 'running': is_running,
-                'instance_id': settings.MQTT_CONFIG.get('INSTANCE_ID', 'unknown')
+                'instance_id': settings.MQTT_CONFIG.get('INSTANCE_ID', 'unknown'),
+                'instances': [
+                    {
+                        'instance_id': snapshot['instance_id'],
+                        'hostname': snapshot['hostname'],
+                        'pid': snapshot['pid'],
+                        'running': snapshot['running'],
+                        'started_at': snapshot['started_at'],
+                        'heartbeat_at': snapshot['heartbeat_at'],
+                        'heartbeat_age': snapshot['heartbeat_age'],
+                        'connections_connected': sum(
+                            1 for c in snapshot['connections'].values() if c['handler_connected']
+                        ),
+                        'messages': snapshot['messages'],
+                        'queues': snapshot['queues'],
+                    }
+                    for snapshot in snapshots
+                ],
             },
             'connections': {
                 'total': total,
@@ -1,10 +1,28 @@
 import json
 import asyncio
+import time
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from sites.access import site_access
+from .models import Sensor
+from .services.broadcast import readings_group
+from .services.hot_state import sensor_hot_state
+from .services.stream_fanout import RAW, STREAM_MODES, resolve_rate, stream_group, stream_subscriptions
+from .services.ws_frame_codec import BINARY_SUBPROTOCOL, select_subprotocol
+
 # Nome del gruppo a cui tutti i client si uniranno per ricevere broadcast
 GROUP_NAME = "mqtt_status_updates"
 
+# Datalogger a cui una singola connessione può iscriversi per gli eventi sensor_readings
+MAX_READING_SUBSCRIPTIONS = 50
+
+# Sensori a cui una singola connessione può iscriversi per gli stream live (sensor_stream)
+MAX_STREAM_SUBSCRIPTIONS = 20
+
+# Intervallo di rilettura dei siti accessibili per le connessioni filtrate (secondi)
+SITE_ACCESS_REFRESH = 30
+
 class MqttStatusConsumer(AsyncWebsocketConsumer):
     """
     Questo consumer gestisce le connessioni WebSocket per gli aggiornamenti
@@ -15,14 +33,30 @@ class MqttStatusConsumer(AsyncWebsocketConsumer):
         """
         Chiamato quando un client tenta di connettersi via WebSocket.
         """
+        # Datalogger iscritti agli eventi sensor_readings (opt-in)
+        self.reading_subscriptions = set()
+        # Stream live: sensor_id -> (rate, mode) del livello a cui la connessione è iscritta
+        self.stream_subscriptions = {}
+        # Canali dell'ultimo stream_schema inviato per sensore (solo subprotocol binario)
+        self.stream_schemas = {}
+        # Siti accessibili (sites.access) per gli utenti autenticati non superuser: gli eventi
+        # di altri siti non vengono inoltrati. None = nessun filtro (superuser, connessioni
+        # senza utente di sessione, come in precedenza)
+        user = self.scope.get('user')
+        self.site_ids = None
+        if user is not None and user.is_authenticated and not user.is_superuser:
+            await self._refresh_site_ids()
+
         # Aggiunge il client al gruppo di broadcast
         await self.channel_layer.group_add(
             GROUP_NAME,
             self.channel_name
         )
 
-        # Accetta la connessione WebSocket
-        await self.accept()
+        # Accetta la connessione WebSocket (frame binari per sensor_stream se negoziati)
+        subprotocol = select_subprotocol(self.scope.get('subprotocols') or [])
+        self.binary_frames = subprotocol == BINARY_SUBPROTOCOL
+        await self.accept(subprotocol=subprotocol)
 
         # Invia un messaggio di conferma connessione
         await self.send(text_data=json.dumps({
@@ -39,6 +73,117 @@ class MqttStatusConsumer(AsyncWebsocketConsumer):
             GROUP_NAME,
             self.channel_name
         )
+        for datalogger_id in getattr(self, 'reading_subscriptions', ()):
+            await self.channel_layer.group_discard(readings_group(datalogger_id), self.channel_name)
+        for sensor_id in list(getattr(self, 'stream_subscriptions', {})):
+            await self._leave_stream(sensor_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Messaggi dal client. Iscrizione opt-in alle letture live dei sensori:
+        {"type": "subscribe_readings", "datalogger_ids": [1, 2]}
+        {"type": "unsubscribe_readings", "datalogger_ids": [1]}
+        Risponde con {"type": "readings_subscription", "datalogger_ids": [...]} (iscrizioni attive),
+        seguito con l'hot state attivo da uno snapshot sensor_readings ("snapshot": true) per
+        ogni datalogger appena iscritto.
+
+        Stream live di un sensore alla frequenza massima indicata (Hz, assente = piena frequenza):
+        {"type": "subscribe_stream", "sensor_id": 7, "max_rate": 10, "mode": "envelope"}
+        {"type": "unsubscribe_stream", "sensor_id": 7}
+        Risponde con {"type": "stream_subscription", "sensor_id", "rate", "mode", "subscribed"}.
+        """
+        try:
+            data = json.loads(text_data or '')
+            action = data.get('type')
+            if action in ('subscribe_stream', 'unsubscribe_stream'):
+                await self._receive_stream(action, data)
+                return
+            requested = {int(i) for i in data.get('datalogger_ids', [])}
+        except (ValueError, TypeError, AttributeError, KeyError):
+            # Messaggio malformato (es. subscribe_stream senza sensor_id): ignorato, la connessione resta aperta
+            return
+
+        added = []
+        if action == 'subscribe_readings':
+            for datalogger_id in requested - self.reading_subscriptions:
+                if len(self.reading_subscriptions) >= MAX_READING_SUBSCRIPTIONS:
+                    break
+                await self.channel_layer.group_add(readings_group(datalogger_id), self.channel_name)
+                self.reading_subscriptions.add(datalogger_id)
+                added.append(datalogger_id)
+        elif action == 'unsubscribe_readings':
+            for datalogger_id in requested & self.reading_subscriptions:
+                await self.channel_layer.group_discard(readings_group(datalogger_id), self.channel_name)
+                self.reading_subscriptions.discard(datalogger_id)
+        else:
+            return
+
+        await self.send(text_data=json.dumps({
+            "type": "readings_subscription",
+            "datalogger_ids": sorted(self.reading_subscriptions)
+        }))
+
+        # Ultime letture dall'hot state per i datalogger appena iscritti (niente REST iniziale)
+        if sensor_hot_state.enabled:
+            for datalogger_id in added:
+                snapshot = await sync_to_async(sensor_hot_state.datalogger_snapshot)(datalogger_id)
+                if snapshot and await self._site_allowed(snapshot["site_id"]):
+                    await self.send(text_data=json.dumps(snapshot))
+
+    async def _refresh_site_ids(self):
+        self.site_ids = await sync_to_async(site_access.site_ids)(self.scope['user'])
+        self.site_ids_loaded_at = time.monotonic()
+
+    async def _site_allowed(self, site_id):
+        if self.site_ids is None:
+            return True
+        if time.monotonic() - self.site_ids_loaded_at > SITE_ACCESS_REFRESH:
+            await self._refresh_site_ids()
+        return site_id in self.site_ids
+
+    async def _receive_stream(self, action, data):
+        sensor_id = int(data['sensor_id'])
+        if action == 'subscribe_stream' and self.site_ids is not None:
+            site_id = await sync_to_async(
+                lambda: Sensor.objects.filter(pk=sensor_id).values_list('datalogger__site_id', flat=True).first()
+            )()
+            if not await self._site_allowed(site_id):
+                action = 'unsubscribe_stream'
+        if action == 'unsubscribe_stream':
+            await self._leave_stream(sensor_id)
+            rate, mode = None, None
+        else:
+            max_rate = data.get('max_rate')
+            rate = resolve_rate(None if max_rate is None else float(max_rate))
+            mode = RAW if rate is None else data.get('mode', 'decimate')
+            if mode not in STREAM_MODES + (RAW,):
+                raise ValueError(f"Unknown stream mode {mode}")
+            current = self.stream_subscriptions.get(sensor_id)
+            if current != (rate, mode):
+                if current is None and len(self.stream_subscriptions) >= MAX_STREAM_SUBSCRIPTIONS:
+                    rate, mode = None, None
+                else:
+                    await self._leave_stream(sensor_id)
+                    await self.channel_layer.group_add(stream_group(sensor_id, rate, mode), self.channel_name)
+                    await sync_to_async(stream_subscriptions.add)(sensor_id, rate, mode)
+                    self.stream_subscriptions[sensor_id] = (rate, mode)
+
+        await self.send(text_data=json.dumps({
+            "type": "stream_subscription",
+            "sensor_id": sensor_id,
+            "rate": rate,
+            "mode": mode,
+            "subscribed": sensor_id in self.stream_subscriptions,
+        }))
+
+    async def _leave_stream(self, sensor_id):
+        subscription = self.stream_subscriptions.pop(sensor_id, None)
+        self.stream_schemas.pop(sensor_id, None)
+        if subscription is None:
+            return
+        rate, mode = subscription
+        await self.channel_layer.group_discard(stream_group(sensor_id, rate, mode), self.channel_name)
+        await sync_to_async(stream_subscriptions.remove)(sensor_id, rate, mode)
 
     async def status_update(self, event):
         """
@@ -50,5 +195,23 @@ class MqttStatusConsumer(AsyncWebsocketConsumer):
         """
         message = event["message"]
 
+        # Eventi dei siti non accessibili all'utente (sensor_stream: sito verificato all'iscrizione)
+        if "site_id" in message and not await self._site_allowed(message["site_id"]):
+            return
+
+        # Stream live con subprotocol binario: frame già codificato da stream_fanout,
+        # preceduto dai nomi dei canali quando cambiano
+        if self.binary_frames and "binary" in event:
+            sensor_id = message["sensor_id"]
+            if self.stream_schemas.get(sensor_id) != event["channels"]:
+                self.stream_schemas[sensor_id] = event["channels"]
+                await self.send(text_data=json.dumps({
+                    "type": "stream_schema",
+                    "sensor_id": sensor_id,
+                    "channels": event["channels"],
+                }))
+            await self.send(bytes_data=event["binary"])
+            return
+
         # Invia il messaggio al client attraverso la connessione WebSocket
         await self.send(text_data=json.dumps(message))
\ No newline at end of file
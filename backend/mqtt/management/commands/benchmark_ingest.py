@@ -0,0 +1,267 @@
+"""
+Management command per il micro-benchmark in-process del message processor.
+
+Genera payload di telemetria sintetici (formato [sito]/gateway/[n]/dataloggers/telemetry,
+vedi fleet_simulator.build_telemetry_payload) con forma configurabile
+gateways × devices × channels e li processa con MqttMessageProcessor.
+
+Utilizzo:
+    python manage.py benchmark_ingest                                # Forma di default (2×10×3)
+    python manage.py benchmark_ingest --gateways 5 --devices 50 --channels 4 --rounds 20
+    python manage.py benchmark_ingest --save-baseline                # Salva baseline JSON
+    python manage.py benchmark_ingest --compare --max-regression 15  # Confronta con baseline
+    python manage.py benchmark_ingest --api-version 2                # Telemetria compatta v2
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mqtt.services import metrics
+from mqtt.services.fleet_simulator import build_schema_payload, build_telemetry_payload, \
+    build_telemetry_payload_v2
+from mqtt.services.message_processor import message_processor
+
+DEFAULT_BASELINE_PATH = os.path.join(settings.BASE_DIR, 'benchmarks', 'ingest_baseline.json')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the MQTT ingest hot path (MqttMessageProcessor) with synthetic telemetry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateways', type=int, default=2, help='Number of gateways (default: 2)')
+        parser.add_argument('--devices', type=int, default=10, help='Devices per gateway (default: 10)')
+        parser.add_argument('--channels', type=int, default=3, help='Channels per device (default: 3)')
+        parser.add_argument('--rounds', type=int, default=10, help='Telemetry messages per gateway (default: 10)')
+        parser.add_argument('--warmup', type=int, default=1, help='Warm-up rounds excluded from results (default: 1)')
+        parser.add_argument('--site-id', type=int, help='Use an existing site instead of a temporary one')
+        parser.add_argument('--keep', action='store_true', help='Keep the temporary benchmark site and devices')
+        parser.add_argument('--with-broadcast', action='store_true', help='Include WebSocket broadcasts (needs Redis)')
+        parser.add_argument('--api-version', type=int, choices=[1, 2], default=1,
+                            help='Telemetry payload format: 1 = verbose, 2 = schema + columnar values (default: 1)')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='Baseline JSON path')
+        parser.add_argument('--save-baseline', action='store_true', help='Store results as the new baseline')
+        parser.add_argument('--compare', action='store_true', help='Compare results with the stored baseline')
+        parser.add_argument(
+            '--max-regression', type=float, default=None,
+            help='With --compare: fail if msgs/s drops or p99 grows by more than this percentage'
+        )
+        parser.add_argument('--label', help='Label stored with the results (default: git commit)')
+
+    def handle(self, *args, **options):
+        for name in ('gateways', 'devices', 'channels', 'rounds'):
+            if options[name] < 1:
+                raise CommandError(f'--{name} must be >= 1')
+
+        shape = {
+            'gateways': options['gateways'],
+            'devices': options['devices'],
+            'channels': options['channels'],
+            'rounds': options['rounds'],
+            'warmup': options['warmup'],
+            'broadcast': options['with_broadcast'],
+            'api_version': options['api_version'],
+        }
+
+        site, temporary = self._get_site(options.get('site_id'))
+        channel_layer = message_processor.channel_layer
+        if not options['with_broadcast']:
+            message_processor.channel_layer = None
+
+        try:
+            self.stdout.write(
+                f"🏁 Benchmarking ingest: {shape['gateways']} gateways × {shape['devices']} devices × "
+                f"{shape['channels']} channels, {shape['rounds']} rounds (+{shape['warmup']} warm-up), "
+                f"API v{shape['api_version']}"
+            )
+            results = self._run(site, shape)
+        finally:
+            message_processor.channel_layer = channel_layer
+            if temporary and not options['keep']:
+                site.delete()
+
+        report = {
+            'label': options.get('label') or self._git_revision(),
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'db_vendor': self._db_vendor(),
+            },
+            'shape': shape,
+            'results': results,
+        }
+        self._print_results(results)
+
+        if options['compare']:
+            self._compare(report, options['baseline'], options.get('max_regression'))
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"💾 Baseline saved to {options['baseline']}"))
+
+    def _get_site(self, site_id):
+        from sites.models import Site
+
+        if site_id:
+            try:
+                return Site.objects.get(id=site_id), False
+            except Site.DoesNotExist:
+                raise CommandError(f'Site {site_id} not found')
+
+        name = f"benchmark-ingest-{int(time.time())}"
+        site = Site.objects.create(name=name, code=name.upper(), customer_name='benchmark')
+        return site, True
+
+    def _run(self, site, shape):
+        site_code = f"bench{site.id}"
+        base_ts = timezone.now()
+        latencies = []
+        query_counts = []
+        db_seconds = 0.0
+        failures = 0
+        total_seconds = 0.0
+        payload_bytes_total = 0
+        decode_seconds = 0.0
+
+        if shape['api_version'] == 2:
+            # Dizionario canali pubblicato una volta per gateway (retained), fuori dalle misure
+            for gateway_number in range(1, shape['gateways'] + 1):
+                schema = build_schema_payload(site_code, gateway_number, shape['devices'], shape['channels'])
+                message_processor.process_message(
+                    site.id, f"{site_code}/gateway/{gateway_number}/dataloggers/schema",
+                    json.dumps(schema).encode('utf-8'), 0, True
+                )
+
+        for round_index in range(shape['warmup'] + shape['rounds']):
+            measured = round_index >= shape['warmup']
+            timestamp = base_ts + timedelta(seconds=round_index * 5)
+
+            for gateway_number in range(1, shape['gateways'] + 1):
+                if shape['api_version'] == 2:
+                    payload = build_telemetry_payload_v2(
+                        shape['devices'], shape['channels'], timestamp, seed=round_index
+                    )
+                else:
+                    payload = build_telemetry_payload(
+                        site_code, gateway_number, shape['devices'], shape['channels'],
+                        timestamp, seed=round_index
+                    )
+                topic = f"{site_code}/gateway/{gateway_number}/dataloggers/telemetry"
+                payload_bytes = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+                with metrics.query_probe() as probe:
+                    start = time.perf_counter()
+                    ok = message_processor.process_message(site.id, topic, payload_bytes, 0, False)
+                    elapsed = time.perf_counter() - start
+
+                if not measured:
+                    continue
+
+                decode_start = time.perf_counter()
+                json.loads(payload_bytes)
+                decode_seconds += time.perf_counter() - decode_start
+                payload_bytes_total += len(payload_bytes)
+
+                latencies.append(elapsed)
+                query_counts.append(probe.count)
+                db_seconds += probe.seconds
+                total_seconds += elapsed
+                if not ok:
+                    failures += 1
+
+        latencies.sort()
+        messages = len(latencies)
+        devices_per_message = shape['devices']
+        return {
+            'messages': messages,
+            'failures': failures,
+            'msgs_per_sec': round(messages / total_seconds, 2) if total_seconds else 0.0,
+            'devices_per_sec': round(messages * devices_per_message / total_seconds, 2) if total_seconds else 0.0,
+            'latency_ms': {
+                'p50': round(metrics.percentile(latencies, 50) * 1000, 3),
+                'p90': round(metrics.percentile(latencies, 90) * 1000, 3),
+                'p99': round(metrics.percentile(latencies, 99) * 1000, 3),
+                'max': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            },
+            'db_queries_per_message': round(sum(query_counts) / messages, 2) if messages else 0.0,
+            'db_ms_per_message': round(db_seconds * 1000 / messages, 3) if messages else 0.0,
+            'payload_bytes_per_message': round(payload_bytes_total / messages, 1) if messages else 0.0,
+            'json_decode_us_per_message': round(decode_seconds * 1_000_000 / messages, 1) if messages else 0.0,
+        }
+
+    def _print_results(self, results):
+        latency = results['latency_ms']
+        self.stdout.write('')
+        self.stdout.write('📊 RESULTS:')
+        self.stdout.write(f"   Messages: {results['messages']} ({results['failures']} failed)")
+        self.stdout.write(f"   Throughput: {results['msgs_per_sec']} msgs/s ({results['devices_per_sec']} devices/s)")
+        self.stdout.write(
+            f"   Latency: p50 {latency['p50']} ms, p90 {latency['p90']} ms, "
+            f"p99 {latency['p99']} ms, max {latency['max']} ms"
+        )
+        self.stdout.write(
+            f"   DB: {results['db_queries_per_message']} queries/msg, "
+            f"{results['db_ms_per_message']} ms/msg"
+        )
+        self.stdout.write(
+            f"   Payload: {results['payload_bytes_per_message']} bytes/msg, "
+            f"JSON decode {results['json_decode_us_per_message']} µs/msg"
+        )
+
+    def _compare(self, report, baseline_path, max_regression):
+        try:
+            with open(baseline_path, 'r') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read baseline {baseline_path}: {e}')
+
+        if baseline.get('shape') != report['shape']:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Baseline shape differs: {baseline.get('shape')} - results are not directly comparable"
+            ))
+
+        old, new = baseline['results'], report['results']
+        checks = [
+            ('msgs/s', old['msgs_per_sec'], new['msgs_per_sec'], True),
+            ('p50 ms', old['latency_ms']['p50'], new['latency_ms']['p50'], False),
+            ('p99 ms', old['latency_ms']['p99'], new['latency_ms']['p99'], False),
+            ('queries/msg', old['db_queries_per_message'], new['db_queries_per_message'], False),
+        ]
+
+        self.stdout.write('')
+        self.stdout.write(f"📐 COMPARISON with baseline '{baseline.get('label')}' ({baseline.get('created_at')}):")
+        regressions = []
+        for name, before, after, higher_is_better in checks:
+            change = ((after - before) / before * 100.0) if before else 0.0
+            worse = -change if higher_is_better else change
+            marker = '🔴' if worse > 0 else '🟢'
+            self.stdout.write(f"   {marker} {name}: {before} → {after} ({change:+.1f}%)")
+            if name in ('msgs/s', 'p99 ms', 'queries/msg') and max_regression is not None and worse > max_regression:
+                regressions.append(f"{name} {change:+.1f}%")
+
+        if regressions:
+            raise CommandError(f"Performance regression over {max_regression}%: {', '.join(regressions)}")
+
+    def _git_revision(self):
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5
+            )
+            return result.stdout.strip() or 'unknown'
+        except Exception:
+            return 'unknown'
+
+    def _db_vendor(self):
+        from django.db import connection
+        return connection.vendor
@@ -101,14 +101,14 @@ class Command(BaseCommand):
 
         # Check Gateways
         gateways = Gateway.objects.filter(
-            is_online=True,
+            state__is_online=True,
             expected_heartbeat_interval__isnull=False,
-            last_seen_at__isnull=False
-        )
+            state__last_seen_at__isnull=False
+        ).select_related('state')
         for gateway in gateways:
             stats['gateways_checked'] += 1
             timeout = gateway.expected_heartbeat_interval * 2.5
-            elapsed = (now - gateway.last_seen_at).total_seconds()
+            elapsed = (now - gateway.state.last_seen_at).total_seconds()
             if elapsed > timeout:
                 stats['gateways_offline'] += 1
                 self.stdout.write(
@@ -118,14 +118,14 @@ class Command(BaseCommand):
 
         # Check Dataloggers
         dataloggers = Datalogger.objects.filter(
-            is_online=True,
+            state__is_online=True,
             expected_heartbeat_interval__isnull=False,
-            last_seen_at__isnull=False
-        )
+            state__last_seen_at__isnull=False
+        ).select_related('state')
         for dl in dataloggers:
             stats['dataloggers_checked'] += 1
             timeout = dl.expected_heartbeat_interval * 2.5
-            elapsed = (now - dl.last_seen_at).total_seconds()
+            elapsed = (now - dl.state.last_seen_at).total_seconds()
             if elapsed > timeout:
                 stats['dataloggers_offline'] += 1
                 self.stdout.write(
@@ -135,14 +135,14 @@ class Command(BaseCommand):
 
         # Check Sensors
         sensors = Sensor.objects.filter(
-            is_online=True,
+            state__is_online=True,
             expected_heartbeat_interval__isnull=False,
-            last_seen_at__isnull=False
-        )
+            state__last_seen_at__isnull=False
+        ).select_related('state')
         for sensor in sensors:
             stats['sensors_checked'] += 1
             timeout = sensor.expected_heartbeat_interval * 2.5
-            elapsed = (now - sensor.last_seen_at).total_seconds()
+            elapsed = (now - sensor.state.last_seen_at).total_seconds()
             if elapsed > timeout:
                 stats['sensors_offline'] += 1
 
@@ -159,10 +159,11 @@ class Command(BaseCommand):
 
         # Gateways
         self.stdout.write('\n🌐 GATEWAYS:')
-        for gw in Gateway.objects.all().order_by('serial_number'):
-            if gw.last_seen_at:
-                elapsed = (now - gw.last_seen_at).total_seconds()
-                status = '🟢 ONLINE' if gw.is_online else '🔴 OFFLINE'
+        for gw in Gateway.objects.select_related('state').order_by('serial_number'):
+            state = getattr(gw, 'state', None)
+            if state and state.last_seen_at:
+                elapsed = (now - state.last_seen_at).total_seconds()
+                status = '🟢 ONLINE' if state.is_online else '🔴 OFFLINE'
                 self.stdout.write(
                     f'   {status} {gw.serial_number}: '
                     f'last_seen={elapsed:.0f}s ago, '
@@ -173,10 +174,11 @@ class Command(BaseCommand):
 
         # Dataloggers
         self.stdout.write('\n💾 DATALOGGERS:')
-        for dl in Datalogger.objects.all().order_by('serial_number'):
-            if dl.last_seen_at:
-                elapsed = (now - dl.last_seen_at).total_seconds()
-                status = '🟢 ONLINE' if dl.is_online else '🔴 OFFLINE'
+        for dl in Datalogger.objects.select_related('state').order_by('serial_number'):
+            state = getattr(dl, 'state', None)
+            if state and state.last_seen_at:
+                elapsed = (now - state.last_seen_at).total_seconds()
+                status = '🟢 ONLINE' if state.is_online else '🔴 OFFLINE'
                 self.stdout.write(
                     f'   {status} {dl.serial_number}: '
                     f'last_seen={elapsed:.0f}s ago, '
@@ -189,7 +191,7 @@ class Command(BaseCommand):
         sensor_count = Sensor.objects.count()
         if sensor_count > 0:
             self.stdout.write(f'\n🌡️  SENSORS ({sensor_count} total):')
-            online = Sensor.objects.filter(is_online=True).count()
-            offline = Sensor.objects.filter(is_online=False).count()
+            online = Sensor.objects.filter(state__is_online=True).count()
+            offline = Sensor.objects.exclude(state__is_online=True).count()
             self.stdout.write(f'   🟢 Online: {online}')
             self.stdout.write(f'   🔴 Offline: {offline}')
@@ -0,0 +1,68 @@
+"""
+Management command per attivare/modificare il tracing MQTT a runtime.
+
+Il processo mqtt_service rilegge il file di controllo entro un secondo,
+senza bisogno di restart.
+
+Utilizzo:
+    python manage.py mqtt_tracing                          # Mostra configurazione
+    python manage.py mqtt_tracing --enable --sample-rate 0.05
+    python manage.py mqtt_tracing --slow-ms 250
+    python manage.py mqtt_tracing --disable
+    python manage.py mqtt_tracing --reset                  # Torna ai default di settings
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mqtt.services.tracing import message_tracer
+
+
+class Command(BaseCommand):
+    help = 'Enable, disable or tune sampled MQTT message tracing and the slow-message log at runtime'
+
+    def add_arguments(self, parser):
+        toggle = parser.add_mutually_exclusive_group()
+        toggle.add_argument('--enable', action='store_true', help='Enable sampled tracing')
+        toggle.add_argument('--disable', action='store_true', help='Disable sampled tracing')
+        toggle.add_argument('--reset', action='store_true', help='Remove the control file (use settings defaults)')
+        parser.add_argument('--sample-rate', type=float, help='Fraction of messages to trace (0.0 - 1.0)')
+        parser.add_argument('--slow-ms', type=float, help='Slow log threshold in milliseconds (0 = disabled)')
+        parser.add_argument('--capture-sql', choices=['on', 'off'], help='Capture SQL text in sampled traces')
+
+    def handle(self, *args, **options):
+        control_file = message_tracer.control_file
+
+        if options['reset']:
+            if control_file and os.path.exists(control_file):
+                os.remove(control_file)
+            self.stdout.write(self.style.SUCCESS('✅ Tracing reset to settings defaults'))
+            return
+
+        sample_rate = options.get('sample_rate')
+        if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+            raise CommandError('--sample-rate must be between 0.0 and 1.0')
+
+        changes = {
+            'sample_rate': sample_rate,
+            'slow_threshold_ms': options.get('slow_ms'),
+        }
+        if options['enable']:
+            changes['enabled'] = True
+        elif options['disable']:
+            changes['enabled'] = False
+        if options.get('capture_sql'):
+            changes['capture_sql'] = options['capture_sql'] == 'on'
+
+        if any(value is not None for value in changes.values()):
+            try:
+                config = message_tracer.write_control(**changes)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot write tracing control file: {e}')
+            self.stdout.write(self.style.SUCCESS(f'✅ Tracing updated ({control_file})'))
+        else:
+            config = message_tracer.config
+
+        self.stdout.write('📋 Tracing configuration:')
+        for key, value in config.to_dict().items():
+            self.stdout.write(f'   {key}: {value}')
@@ -0,0 +1,168 @@
+"""
+Management command per il replay del journal dei messaggi MQTT raw.
+
+Rilegge i segmenti del journal (via mmap) e ripassa i messaggi al message_processor
+rispettando i tempi originali (1×), accelerati (N×) o alla massima velocità.
+
+Utilizzo:
+    python manage.py replay_journal --from 2025-11-25T10:00 --to 2025-11-25T11:00
+    python manage.py replay_journal --from 2025-11-25T10:00 --speed 10      # 10× più veloce
+    python manage.py replay_journal --speed max --site-id 3                  # Solo sito 3, senza attese
+    python manage.py replay_journal --topic 'site_001/gateway/+/status' --dry-run
+"""
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from mqtt.services.journal import message_journal
+from mqtt.services.local_broker import topic_matches
+from mqtt.services.message_processor import message_processor
+
+
+def parse_time(value: str) -> float:
+    """Accetta ISO 8601 (senza timezone = timezone di default) o epoch in secondi"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Invalid time '{value}' (use ISO 8601 or epoch seconds)")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed.timestamp()
+
+
+class Command(BaseCommand):
+    help = 'Replay raw MQTT messages from the message journal through the message processor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='Start time (ISO 8601 or epoch), inclusive')
+        parser.add_argument('--to', dest='end', help='End time (ISO 8601 or epoch), exclusive')
+        parser.add_argument('--speed', default='1', help="Replay speed: 1 = real time, N = N× faster, 'max' = no waits")
+        parser.add_argument('--site-id', type=int, help='Only replay messages received for this site')
+        parser.add_argument('--target-site-id', type=int, help='Process messages as if received by this site')
+        parser.add_argument('--topic', help='Only replay topics matching this MQTT filter (+ and # allowed)')
+        parser.add_argument('--dir', help='Journal directory (default: MQTT_JOURNAL["DIR"])')
+        parser.add_argument('--limit', type=int, help='Stop after N messages')
+        parser.add_argument('--no-broadcast', action='store_true', help='Do not send WebSocket events while replaying')
+        parser.add_argument('--dry-run', action='store_true', help='Only count matching messages per topic')
+
+    def handle(self, *args, **options):
+        start = parse_time(options['start']) if options.get('start') else None
+        end = parse_time(options['end']) if options.get('end') else None
+        if start is not None and end is not None and end <= start:
+            raise CommandError('--to must be after --from')
+
+        speed_option = str(options['speed']).lower()
+        if speed_option in ('max', '0'):
+            speed = None
+        else:
+            try:
+                speed = float(speed_option)
+            except ValueError:
+                raise CommandError("--speed must be a number or 'max'")
+            if speed <= 0:
+                raise CommandError("--speed must be > 0 (or 'max')")
+
+        directory = options.get('dir') or message_journal.directory
+        if not directory:
+            raise CommandError("No journal directory configured (MQTT_JOURNAL['DIR'] or --dir)")
+
+        records = self._filtered(
+            message_journal.read(start, end, directory=directory),
+            options.get('site_id'), options.get('topic'), options.get('limit')
+        )
+
+        if options['dry_run']:
+            self._dry_run(records)
+            return
+
+        channel_layer = message_processor.channel_layer
+        if options['no_broadcast']:
+            message_processor.channel_layer = None
+        try:
+            self._replay(records, speed, options.get('target_site_id'))
+        finally:
+            message_processor.channel_layer = channel_layer
+
+    def _filtered(self, records, site_id, topic_filter, limit):
+        count = 0
+        for record in records:
+            if site_id is not None and record.site_id != site_id:
+                continue
+            if topic_filter and not topic_matches(topic_filter, record.topic):
+                continue
+            yield record
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def _dry_run(self, records):
+        per_topic = Counter()
+        first = last = None
+        total_bytes = 0
+        for record in records:
+            per_topic[record.topic] += 1
+            total_bytes += len(record.payload)
+            first = record.received_at if first is None else first
+            last = record.received_at
+
+        total = sum(per_topic.values())
+        self.stdout.write(f"📼 {total} messages, {total_bytes} payload bytes")
+        if total:
+            self.stdout.write(
+                f"   From {datetime.fromtimestamp(first).isoformat()} to {datetime.fromtimestamp(last).isoformat()}"
+            )
+            for topic, count in per_topic.most_common(20):
+                self.stdout.write(f"   {count:>8}  {topic}")
+
+    def _replay(self, records, speed, target_site_id):
+        replayed = failed = 0
+        max_lag = 0.0
+        origin = None
+        wall_start = time.monotonic()
+        last_report = wall_start
+
+        self.stdout.write(f"▶️  Replaying at {'max speed' if speed is None else f'{speed:g}×'}")
+
+        for record in records:
+            if speed is not None:
+                if origin is None:
+                    origin = record.received_at
+                due = wall_start + (record.received_at - origin) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+
+            ok = message_processor.process_message(
+                target_site_id or record.site_id, record.topic, record.payload, record.qos, record.retain
+            )
+            replayed += 1
+            if not ok:
+                failed += 1
+
+            now = time.monotonic()
+            if now - last_report >= 10:
+                self.stdout.write(f"   ... {replayed} messages replayed ({failed} failed)")
+                last_report = now
+
+        elapsed = time.monotonic() - wall_start
+        rate = replayed / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Replayed {replayed} messages in {elapsed:.1f}s ({rate:.1f} msgs/s, {failed} failed)"
+        ))
+        if speed is not None and max_lag > 1:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Processing fell behind the requested speed by up to {max_lag:.1f}s"
+            ))
@@ -0,0 +1,68 @@
+"""
+Management command per eseguire i job di force discovery in coda.
+
+Normalmente i job sono eseguiti dal worker interno al processo mqtt_service;
+questo comando permette di eseguirli da un worker separato o manualmente.
+
+Utilizzo:
+    python manage.py run_discovery_jobs              # Svuota la coda ed esce
+    python manage.py run_discovery_jobs --loop       # Worker continuo
+    python manage.py run_discovery_jobs --job-id 12  # Riesegue un job specifico
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mqtt.models import DiscoveryJob
+from mqtt.services.discovery_jobs import discovery_job_runner
+
+
+class Command(BaseCommand):
+    help = 'Run queued force discovery jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue until interrupted')
+        parser.add_argument('--limit', type=int, help='Stop after N jobs')
+        parser.add_argument('--job-id', type=int, help='Run this job now, whatever its current status')
+        parser.add_argument('--batch-size', type=int, help='Telemetry topics per batch (default: MQTT_CONFIG)')
+
+    def handle(self, *args, **options):
+        if options.get('batch_size'):
+            if options['batch_size'] < 1:
+                raise CommandError('--batch-size must be >= 1')
+            discovery_job_runner.batch_size = options['batch_size']
+
+        if options.get('job_id'):
+            self._run_single(options['job_id'])
+            return
+
+        if options['loop']:
+            self.stdout.write(f"🔁 Discovery worker {discovery_job_runner.worker_id} polling every "
+                              f"{discovery_job_runner.poll_interval}s (Ctrl+C to stop)")
+            try:
+                discovery_job_runner.loop()
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.WARNING('Stopped'))
+            return
+
+        executed = discovery_job_runner.run_pending(limit=options.get('limit'))
+        self.stdout.write(self.style.SUCCESS(f"✅ {executed} discovery jobs executed"))
+
+    def _run_single(self, job_id):
+        try:
+            job = DiscoveryJob.objects.select_related('site').get(id=job_id)
+        except DiscoveryJob.DoesNotExist:
+            raise CommandError(f"Discovery job {job_id} not found")
+
+        job.status = 'running'
+        job.worker = discovery_job_runner.worker_id
+        job.started_at = timezone.now()
+        job.finished_at = None
+        job.processed_count = job.success_count = job.error_count = 0
+        job.save(update_fields=[
+            'status', 'worker', 'started_at', 'finished_at',
+            'processed_count', 'success_count', 'error_count', 'updated_at'
+        ])
+
+        job = discovery_job_runner.run_job(job)
+        style = self.style.SUCCESS if job.status == 'completed' else self.style.ERROR
+        self.stdout.write(style(f"Job {job.id} {job.status}: {job.message}"))
@@ -0,0 +1,257 @@
+"""
+Management command per il load test end-to-end con una flotta di gateway simulati.
+
+Avvia un broker MQTT locale (LocalMqttBroker), crea un sito temporaneo con la sua
+MqttConnection puntata al broker e avvia la connessione tramite il vero MQTTService:
+i messaggi percorrono broker → paho → MQTTConnectionManager → message_processor.
+
+Misura:
+- latenza publish → commit DB (per tipo di messaggio)
+- latenza publish → primo evento WebSocket
+- tempi di rilevamento offline dei gateway in dropout
+
+Utilizzo:
+    python manage.py simulate_fleet                                   # 50 gateway per 60s
+    python manage.py simulate_fleet --gateways 2000 --interval 30 --duration 300
+    python manage.py simulate_fleet --dropout-rate 0.05 --offline-check-interval 5
+    python manage.py simulate_fleet --report-json /tmp/fleet_report.json
+"""
+import json
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mqtt.services.fleet_simulator import FleetSimulator, LatencyTracker, ProbeChannelLayer
+from mqtt.services.local_broker import LocalMqttBroker
+from mqtt.services.message_processor import message_processor
+from mqtt.services.mqtt_service import mqtt_service
+from mqtt.services.tracing import message_tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run a simulated gateway fleet against a local MQTT broker and the real MQTTService'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateways', type=int, default=50, help='Virtual gateways (default: 50)')
+        parser.add_argument('--devices', type=int, default=5, help='Devices per gateway (default: 5)')
+        parser.add_argument('--channels', type=int, default=2, help='Channels per device (default: 2)')
+        parser.add_argument('--interval', type=float, default=10.0, help='Telemetry interval in seconds (default: 10)')
+        parser.add_argument(
+            '--status-interval', type=float, default=60.0,
+            help='gateway/status and datalogger/all/status interval in seconds, 0 disables (default: 60)'
+        )
+        parser.add_argument('--jitter', type=float, default=0.1, help='Interval jitter as a fraction (default: 0.1)')
+        parser.add_argument('--duration', type=float, default=60.0, help='Publishing time in seconds (default: 60)')
+        parser.add_argument(
+            '--dropout-rate', type=float, default=0.0,
+            help='Probability per telemetry tick that a gateway goes silent (default: 0)'
+        )
+        parser.add_argument(
+            '--dropout-duration', type=float,
+            help='Silence length in seconds (default: 4 × interval, beyond the 2.5 × interval timeout)'
+        )
+        parser.add_argument(
+            '--offline-check-interval', type=float, default=5.0,
+            help='How often check_offline_devices runs during the simulation (default: 5s)'
+        )
+        parser.add_argument('--drain-timeout', type=float, default=60.0,
+                            help='Max seconds to wait for the backlog after publishing stops (default: 60)')
+        parser.add_argument('--host', default='127.0.0.1', help='Broker bind address (default: 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=0, help='Broker port, 0 = random free port (default: 0)')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible schedules')
+        parser.add_argument('--forward-broadcasts', action='store_true',
+                            help='Also send WebSocket events to the real channel layer')
+        parser.add_argument('--keep', action='store_true', help='Keep the simulation site and its devices')
+        parser.add_argument('--report-json', help='Write the final report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['gateways'] < 1 or options['devices'] < 1 or options['channels'] < 1:
+            raise CommandError('--gateways, --devices and --channels must be >= 1')
+        if options['interval'] <= 0:
+            raise CommandError('--interval must be > 0')
+
+        broker = LocalMqttBroker(options['host'], options['port'])
+        try:
+            port = broker.start()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"📡 Local broker listening on {options['host']}:{port}")
+
+        tracker = LatencyTracker()
+        original_layer = message_processor.channel_layer
+        message_processor.channel_layer = ProbeChannelLayer(
+            tracker.on_event, original_layer if options['forward_broadcasts'] else None
+        )
+        message_tracer.add_listener(tracker.on_trace)
+
+        site = None
+        stop_event = threading.Event()
+        checker = None
+        try:
+            site = self._create_site(options['host'], port)
+            site_code = site.code.lower()
+
+            result = mqtt_service.start_connection(site.id)
+            if not result['success']:
+                raise CommandError(result['message'])
+
+            if not self._wait_for_subscription(broker, f"{site_code}/gateway/0/status", timeout=15):
+                raise CommandError('MQTTService did not subscribe to the local broker')
+            self.stdout.write(self.style.SUCCESS(f"✅ MQTTService connected for site {site.name}"))
+
+            simulator = FleetSimulator(
+                broker, tracker, site_code,
+                gateways=options['gateways'],
+                devices=options['devices'],
+                channels=options['channels'],
+                interval=options['interval'],
+                status_interval=options['status_interval'],
+                jitter=options['jitter'],
+                dropout_rate=options['dropout_rate'],
+                dropout_duration=options.get('dropout_duration'),
+                seed=options.get('seed'),
+            )
+
+            if options['offline_check_interval'] > 0:
+                checker = threading.Thread(
+                    target=self._offline_checker,
+                    args=(options['offline_check_interval'], stop_event),
+                    name="fleet-offline-checker",
+                    daemon=True
+                )
+                checker.start()
+
+            self.stdout.write(
+                f"🚀 Simulating {options['gateways']} gateways × {options['devices']} devices "
+                f"for {options['duration']:.0f}s (interval {options['interval']}s)"
+            )
+            try:
+                simulator.run(options['duration'], stop_event)
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.WARNING('Interrupted, draining backlog...'))
+
+            self._drain(tracker, options['drain_timeout'])
+            report = self._build_report(options, tracker, simulator, broker)
+            self._print_report(report)
+
+            if options.get('report_json'):
+                with open(options['report_json'], 'w') as f:
+                    json.dump(report, f, indent=2)
+                self.stdout.write(self.style.SUCCESS(f"💾 Report saved to {options['report_json']}"))
+
+        finally:
+            stop_event.set()
+            if checker:
+                checker.join(timeout=10)
+            if site is not None:
+                mqtt_service.stop_connection(site.id)
+            message_tracer.remove_listener(tracker.on_trace)
+            message_processor.channel_layer = original_layer
+            broker.stop()
+            if site is not None and not options['keep']:
+                site.delete()
+
+    def _create_site(self, host, port):
+        from sites.models import Site
+        from mqtt.models import MqttConnection, MqttTopic
+
+        code = f"SIM{int(time.time())}"
+        site = Site.objects.create(name=f"fleet-simulation-{code}", code=code, customer_name='simulation')
+        connection = MqttConnection.objects.create(
+            site=site,
+            broker_host=host,
+            broker_port=port,
+            client_id_prefix=f"sim_{code.lower()}",
+            keep_alive_interval=30,
+            is_enabled=True,
+        )
+        MqttTopic.objects.create(
+            mqtt_connection=connection,
+            topic_pattern=f"{code.lower()}/#",
+            qos_level=0,
+            description='Fleet simulation',
+        )
+        return site
+
+    def _wait_for_subscription(self, broker, topic, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if broker.has_subscriber(topic):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _offline_checker(self, interval, stop_event):
+        while not stop_event.wait(interval):
+            try:
+                message_processor.check_offline_devices()
+            except Exception as e:
+                logger.error(f"Offline check failed during simulation: {e}")
+
+    def _drain(self, tracker, timeout):
+        deadline = time.monotonic() + timeout
+        pending = tracker.pending_commits()
+        while pending and time.monotonic() < deadline:
+            time.sleep(0.5)
+            pending = tracker.pending_commits()
+        if pending:
+            self.stdout.write(self.style.WARNING(f"⚠️  {pending} messages still pending after drain timeout"))
+
+    def _build_report(self, options, tracker, simulator, broker):
+        detections = list(tracker.offline_detections)
+        timeout = options['interval'] * 2.5
+        true_detections = [d['silence_seconds'] for d in detections if not d['false_positive']]
+
+        report = tracker.summary()
+        report['config'] = {
+            key: options.get(key) for key in (
+                'gateways', 'devices', 'channels', 'interval', 'status_interval', 'jitter',
+                'duration', 'dropout_rate', 'dropout_duration', 'offline_check_interval', 'seed'
+            )
+        }
+        report['broker'] = dict(broker.stats)
+        report['offline_detection'] = {
+            'dropouts': simulator.dropout_count(),
+            'detected': len(true_detections),
+            'false_positives': sum(1 for d in detections if d['false_positive']),
+            'expected_timeout_s': timeout,
+            'silence_before_detection_s': {
+                'min': round(min(true_detections), 2) if true_detections else None,
+                'avg': round(sum(true_detections) / len(true_detections), 2) if true_detections else None,
+                'max': round(max(true_detections), 2) if true_detections else None,
+            },
+        }
+        return report
+
+    def _print_report(self, report):
+        self.stdout.write('')
+        self.stdout.write('📊 FLEET SIMULATION REPORT:')
+        self.stdout.write(f"   Published: {report['published']}")
+        self.stdout.write(f"   Processed: {report['processed']} (pending {report['pending']}, unmatched {report['unmatched']})")
+        self.stdout.write(
+            f"   Broker: {report['broker']['messages_in']} in, {report['broker']['messages_out']} out, "
+            f"{report['broker']['connections']} connections"
+        )
+
+        for title, key in (('publish → DB commit', 'publish_to_commit'), ('publish → WebSocket', 'publish_to_websocket')):
+            self.stdout.write(f"   Latency {title}:")
+            for kind, stats in sorted(report[key].items()):
+                self.stdout.write(
+                    f"      {kind}: n={stats['count']} p50 {stats['p50_ms']} ms, p90 {stats['p90_ms']} ms, "
+                    f"p99 {stats['p99_ms']} ms, max {stats['max_ms']} ms"
+                )
+
+        offline = report['offline_detection']
+        silence = offline['silence_before_detection_s']
+        self.stdout.write(
+            f"   Offline detection: {offline['detected']}/{offline['dropouts']} dropouts detected, "
+            f"{offline['false_positives']} false positives (timeout {offline['expected_timeout_s']}s)"
+        )
+        if offline['detected']:
+            self.stdout.write(
+                f"      silence before detection: min {silence['min']}s, avg {silence['avg']}s, max {silence['max']}s"
+            )
@@ -5,8 +5,10 @@ import logging
 import signal
 import sys
 import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from mqtt.services import metrics
 from mqtt.services.mqtt_service import mqtt_service
 
 # Configura logging
@@ -79,6 +81,9 @@ class Command(BaseCommand):
         # Configura signal handlers per shutdown pulito
         self._setup_signal_handlers()
 
+        # Endpoint Prometheus /metrics su porta dedicata
+        self._start_metrics_server()
+
         # Avvia service
         success = mqtt_service.start()
 
@@ -92,6 +97,17 @@ class Command(BaseCommand):
         # Mantieni servizio attivo
         self._keep_alive()
 
+    def _start_metrics_server(self):
+        """Avvia l'endpoint /metrics se configurato"""
+        port = settings.MQTT_CONFIG.get('METRICS_PORT', 0)
+        if not port:
+            logger.info("Metrics endpoint disabled (MQTT_METRICS_PORT=0)")
+            return
+
+        addr = settings.MQTT_CONFIG.get('METRICS_ADDR', '0.0.0.0')
+        if metrics.start_http_server(port, addr):
+            self.stdout.write(f"📈 Metrics available on http://{addr}:{port}/metrics")
+
     def _stop_service(self):
         """Ferma il servizio MQTT"""
         self.stdout.write(self.style.WARNING('🛑 Stopping MQTT Service...'))
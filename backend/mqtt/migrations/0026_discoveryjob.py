@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0025_merge_20251126_0839'),
+        ('sites', '0005_alter_site_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('total_topics', models.IntegerField(default=0)),
+                ('processed_count', models.IntegerField(default=0)),
+                ('success_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('results', models.JSONField(blank=True, default=dict, help_text='Statistiche per tipo topic ed errori')),
+                ('message', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, help_text='Worker che ha preso in carico il job', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discovery_jobs', to='sites.site')),
+            ],
+            options={
+                'verbose_name': 'Discovery Job',
+                'verbose_name_plural': 'Discovery Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='mqtt_discov_status_83cdcb_idx'), models.Index(fields=['site', 'status'], name='mqtt_discov_site_id_25f27b_idx')],
+            },
+        ),
+    ]
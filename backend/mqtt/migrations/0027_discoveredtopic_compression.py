@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0026_discoveryjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoveredtopic',
+            name='compressed_message_count',
+            field=models.IntegerField(default=0, help_text='Numero di messaggi ricevuti compressi'),
+        ),
+        migrations.AddField(
+            model_name='discoveredtopic',
+            name='compression',
+            field=models.CharField(blank=True, help_text="Compressione dell'ultimo payload compresso ricevuto (gzip, zlib)", max_length=10),
+        ),
+        migrations.AddField(
+            model_name='discoveredtopic',
+            name='compression_ratio_avg',
+            field=models.FloatField(blank=True, help_text='Rapporto medio dimensione decompressa / dimensione ricevuta', null=True),
+        ),
+    ]
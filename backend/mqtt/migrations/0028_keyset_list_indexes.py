@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0027_discoveredtopic_compression'),
+        ('sites', '0005_alter_site_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datalogger',
+            index=models.Index(fields=['site', 'label', 'id'], name='mqtt_datalo_site_id_57ee1e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensor',
+            index=models.Index(fields=['datalogger', 'label', 'id'], name='mqtt_sensor_datalog_56de9e_idx'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:18
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_change_seq(apps, schema_editor):
+    """
+    change_seq distinti per le righe esistenti (il primo sync completo pagina senza
+    gruppi di valori uguali) e contatore allineato al valore massimo assegnato.
+    """
+    ChangeSequence = apps.get_model('mqtt', 'ChangeSequence')
+    offset = 0
+    for model_name in ('Gateway', 'Datalogger', 'Sensor'):
+        model = apps.get_model('mqtt', model_name)
+        model.objects.update(change_seq=F('id') + offset)
+        offset += model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    ChangeSequence.objects.create(pk=1, value=offset)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0028_keyset_list_indexes'),
+        ('sites', '0005_alter_site_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+                ('pruned_through', models.BigIntegerField(default=0, help_text='Tombstone eliminati fino a questo valore: cursori più vecchi richiedono un resync completo')),
+            ],
+            options={
+                'verbose_name': 'Change Sequence',
+                'verbose_name_plural': 'Change Sequence',
+            },
+        ),
+        migrations.CreateModel(
+            name='ChangeTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change_seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('gateway', 'Gateway'), ('datalogger', 'Datalogger'), ('sensor', 'Sensor')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('site_id', models.BigIntegerField(blank=True, null=True)),
+                ('datalogger_id', models.BigIntegerField(blank=True, help_text='Datalogger del sensore (o il datalogger stesso)', null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Change Tombstone',
+                'verbose_name_plural': 'Change Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='datalogger',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)"),
+        ),
+        migrations.AddField(
+            model_name='gateway',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)"),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)"),
+        ),
+        migrations.RunPython(backfill_change_seq, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='datalogger',
+            index=models.Index(fields=['site', 'change_seq'], name='mqtt_datalo_site_id_05a6ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gateway',
+            index=models.Index(fields=['site', 'change_seq'], name='mqtt_gatewa_site_id_a7ccaa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensor',
+            index=models.Index(fields=['datalogger', 'change_seq'], name='mqtt_sensor_datalog_80acdb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changetombstone',
+            index=models.Index(fields=['site_id', 'change_seq'], name='mqtt_change_site_id_d6fa31_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changetombstone',
+            index=models.Index(fields=['datalogger_id', 'change_seq'], name='mqtt_change_datalog_35cdec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changetombstone',
+            index=models.Index(fields=['deleted_at'], name='mqtt_change_deleted_36539b_idx'),
+        ),
+    ]
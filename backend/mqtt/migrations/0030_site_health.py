@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_site_health(apps, schema_editor):
+    """Contatori iniziali per tutti i siti (stessi GROUP BY di site_health.reconcile)"""
+    Site = apps.get_model('sites', 'Site')
+    SiteHealth = apps.get_model('mqtt', 'SiteHealth')
+    counters = {site_id: {} for site_id in Site.objects.values_list('id', flat=True)}
+    for model_name, prefix, site_field in (
+        ('Gateway', 'gateways', 'site_id'),
+        ('Datalogger', 'dataloggers', 'site_id'),
+        ('Sensor', 'sensors', 'datalogger__site_id'),
+    ):
+        rows = (
+            apps.get_model('mqtt', model_name).objects.values(site_field)
+            .annotate(total=Count('id'), online=Count('id', filter=Q(is_online=True)))
+            .order_by()
+        )
+        for row in rows:
+            counters[row[site_field]][f'{prefix}_total'] = row['total']
+            counters[row[site_field]][f'{prefix}_online'] = row['online']
+    SiteHealth.objects.bulk_create(
+        [SiteHealth(site_id=site_id, **values) for site_id, values in counters.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0029_change_feed'),
+        ('sites', '0005_alter_site_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteHealth',
+            fields=[
+                ('site', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='health', serialize=False, to='sites.site')),
+                ('gateways_total', models.PositiveIntegerField(default=0)),
+                ('gateways_online', models.PositiveIntegerField(default=0)),
+                ('dataloggers_total', models.PositiveIntegerField(default=0)),
+                ('dataloggers_online', models.PositiveIntegerField(default=0)),
+                ('sensors_total', models.PositiveIntegerField(default=0)),
+                ('sensors_online', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Site Health',
+                'verbose_name_plural': 'Site Health',
+            },
+        ),
+        migrations.RunPython(backfill_site_health, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:40
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+# (modello device, modello stato, campo FK dello stato, colonne spostate)
+STATE_COLUMNS = (
+    ('Gateway', 'GatewayState', 'gateway', ('is_online', 'last_seen_at')),
+    ('Datalogger', 'DataloggerState', 'datalogger', ('is_online', 'last_seen_at', 'acquisition_status')),
+    ('Sensor', 'SensorState', 'sensor', (
+        'is_online', 'last_seen_at', 'last_reading',
+        'last_timestamp_1', 'last_data_1', 'last_timestamp_2', 'last_data_2', 'last_timestamp_3', 'last_data_3',
+        'total_messages', 'total_readings', 'consecutive_misses',
+    )),
+)
+
+
+def copy_device_state(apps, schema_editor):
+    """Una riga *State per ogni device, con i valori correnti e lo stesso change_seq"""
+    for device_name, state_name, fk, columns in STATE_COLUMNS:
+        State = apps.get_model('mqtt', state_name)
+        rows = apps.get_model('mqtt', device_name).objects.values('id', 'change_seq', *columns)
+        batch = []
+        for row in rows.iterator(chunk_size=2000):
+            device_id = row.pop('id')
+            batch.append(State(**{f'{fk}_id': device_id}, **row))
+            if len(batch) >= 2000:
+                State.objects.bulk_create(batch)
+                batch = []
+        State.objects.bulk_create(batch)
+
+
+def restore_device_state(apps, schema_editor):
+    for device_name, state_name, fk, columns in STATE_COLUMNS:
+        Device = apps.get_model('mqtt', device_name)
+        states = apps.get_model('mqtt', state_name).objects.values(f'{fk}_id', *columns)
+        batch = []
+        for row in states.iterator(chunk_size=2000):
+            batch.append(Device(id=row.pop(f'{fk}_id'), **row))
+            if len(batch) >= 2000:
+                Device.objects.bulk_update(batch, columns)
+                batch = []
+        Device.objects.bulk_update(batch, columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0030_site_health'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataloggerState',
+            fields=[
+                ('change_seq', models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)")),
+                ('is_online', models.BooleanField(default=False)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('datalogger', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='mqtt.datalogger')),
+                ('acquisition_status', models.CharField(choices=[('running', 'Running'), ('stopped', 'Stopped'), ('paused', 'Paused'), ('error', 'Error'), ('offline', 'Offline'), ('unknown', 'Unknown')], default='running', help_text='Acquisition/measurement status', max_length=20)),
+            ],
+            options={
+                'verbose_name': 'Datalogger State',
+                'verbose_name_plural': 'Datalogger States',
+            },
+        ),
+        migrations.CreateModel(
+            name='GatewayState',
+            fields=[
+                ('change_seq', models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)")),
+                ('is_online', models.BooleanField(default=False)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('gateway', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='mqtt.gateway')),
+            ],
+            options={
+                'verbose_name': 'Gateway State',
+                'verbose_name_plural': 'Gateway States',
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorState',
+            fields=[
+                ('change_seq', models.BigIntegerField(default=0, editable=False, help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)")),
+                ('is_online', models.BooleanField(default=False)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('sensor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='mqtt.sensor')),
+                ('last_reading', models.DateTimeField(blank=True, null=True)),
+                ('last_timestamp_1', models.DateTimeField(blank=True, null=True)),
+                ('last_data_1', models.JSONField(blank=True, default=dict)),
+                ('last_timestamp_2', models.DateTimeField(blank=True, null=True)),
+                ('last_data_2', models.JSONField(blank=True, default=dict)),
+                ('last_timestamp_3', models.DateTimeField(blank=True, null=True)),
+                ('last_data_3', models.JSONField(blank=True, default=dict)),
+                ('total_messages', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('total_readings', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('consecutive_misses', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+            options={
+                'verbose_name': 'Sensor State',
+                'verbose_name_plural': 'Sensor States',
+            },
+        ),
+        migrations.RunPython(copy_device_state, restore_device_state),
+    ]
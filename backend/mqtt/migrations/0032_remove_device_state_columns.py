@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Colonne spostate nelle tabelle *State (0031). Migrazione separata: su PostgreSQL
+    l'ALTER TABLE non può stare nella transazione che ha appena inserito le righe di stato
+    (trigger delle FK ancora pendenti).
+    """
+
+    dependencies = [
+        ('mqtt', '0031_device_state'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='datalogger',
+            name='mqtt_datalo_is_onli_1af348_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='datalogger',
+            name='mqtt_datalo_last_se_8c26ab_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sensor',
+            name='mqtt_sensor_datalog_1c4cd9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sensor',
+            name='mqtt_sensor_last_re_fcafde_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sensor',
+            name='mqtt_sensor_last_ti_ede342_idx',
+        ),
+        migrations.RemoveField(
+            model_name='datalogger',
+            name='acquisition_status',
+        ),
+        migrations.RemoveField(
+            model_name='datalogger',
+            name='is_online',
+        ),
+        migrations.RemoveField(
+            model_name='datalogger',
+            name='last_seen_at',
+        ),
+        migrations.RemoveField(
+            model_name='gateway',
+            name='is_online',
+        ),
+        migrations.RemoveField(
+            model_name='gateway',
+            name='last_seen_at',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='consecutive_misses',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='is_online',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_data_1',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_data_2',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_data_3',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_reading',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_seen_at',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_timestamp_1',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_timestamp_2',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='last_timestamp_3',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='total_messages',
+        ),
+        migrations.RemoveField(
+            model_name='sensor',
+            name='total_readings',
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:52
+
+import hashlib
+import json
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Copie congelate di mqtt.services.metadata_snapshots: la migrazione non deve cambiare
+# se il servizio cambia le chiavi escluse o la forma dell'hash
+READING_KEYS = frozenset({
+    'value', 'values', 'timestamp',
+    'system_uptime', 'uptime', 'uptime_seconds', 'cpu_load_percent',
+    'ram_used_gb', 'ram_percent_used', 'disk_free_gb', 'disk_percent_used',
+})
+
+
+def strip_readings(data):
+    if isinstance(data, dict):
+        return {key: strip_readings(value) for key, value in data.items() if key not in READING_KEYS}
+    if isinstance(data, list):
+        return [strip_readings(value) for value in data]
+    return data
+
+
+def content_hash(metadata):
+    encoded = json.dumps(metadata, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def snapshot_raw_metadata(apps, schema_editor):
+    """Il raw_metadata corrente di ogni gateway (senza letture) diventa il suo primo snapshot"""
+    Gateway = apps.get_model('mqtt', 'Gateway')
+    Snapshot = apps.get_model('mqtt', 'GatewayMetadataSnapshot')
+    for gateway in Gateway.objects.only('id', 'raw_metadata', 'updated_at').iterator(chunk_size=500):
+        if not gateway.raw_metadata:
+            continue
+        metadata = strip_readings(gateway.raw_metadata)
+        gateway.raw_metadata_hash = content_hash(metadata)
+        Snapshot.objects.create(
+            gateway=gateway, content_hash=gateway.raw_metadata_hash,
+            metadata=metadata, recorded_at=gateway.updated_at
+        )
+        Gateway.objects.filter(pk=gateway.pk).update(raw_metadata_hash=gateway.raw_metadata_hash)
+
+
+def restore_raw_metadata(apps, schema_editor):
+    Gateway = apps.get_model('mqtt', 'Gateway')
+    Snapshot = apps.get_model('mqtt', 'GatewayMetadataSnapshot')
+    for gateway in Gateway.objects.exclude(raw_metadata_hash='').only('id', 'raw_metadata_hash'):
+        snapshot = Snapshot.objects.filter(gateway=gateway, content_hash=gateway.raw_metadata_hash).first()
+        if snapshot is not None:
+            Gateway.objects.filter(pk=gateway.pk).update(raw_metadata=snapshot.metadata)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0032_remove_device_state_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gateway',
+            name='raw_metadata_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 dello snapshot corrente del payload (GatewayMetadataSnapshot)', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='GatewayMetadataSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Ultima volta in cui il payload è passato a questo contenuto')),
+                ('gateway', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metadata_snapshots', to='mqtt.gateway')),
+            ],
+            options={
+                'verbose_name': 'Gateway Metadata Snapshot',
+                'verbose_name_plural': 'Gateway Metadata Snapshots',
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['gateway', '-recorded_at'], name='mqtt_gatewa_gateway_d9f6af_idx')],
+                'unique_together': {('gateway', 'content_hash')},
+            },
+        ),
+        migrations.RunPython(snapshot_raw_metadata, restore_raw_metadata),
+        migrations.RemoveField(
+            model_name='gateway',
+            name='raw_metadata',
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+from django.db.models import F, Max
+
+DEVICE_MODELS = ('Gateway', 'Datalogger', 'Sensor')
+STATE_MODELS = ('GatewayState', 'DataloggerState', 'SensorState')
+
+
+def _scalar(connection, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+
+
+def use_transaction_ids(apps, schema_editor):
+    """
+    PostgreSQL: change_seq diventa l'id della transazione. I valori del vecchio contatore
+    possono superare gli id attuali: le righe esistenti ricevono valori distinti sotto
+    l'xmin corrente (come il backfill di 0029) e i cursori esistenti scadono (410, resync).
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    head = _scalar(connection, 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint - 1')
+
+    total = sum(
+        apps.get_model('mqtt', name).objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        for name in DEVICE_MODELS
+    )
+    offset = 0
+    for name in DEVICE_MODELS:
+        model = apps.get_model('mqtt', name)
+        if total < head:
+            model.objects.update(change_seq=F('id') + offset)
+            offset += model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        else:
+            model.objects.update(change_seq=0)
+    for name in STATE_MODELS:
+        apps.get_model('mqtt', name).objects.update(change_seq=0)
+    apps.get_model('mqtt', 'ChangeTombstone').objects.all().delete()
+    apps.get_model('mqtt', 'ChangeSequence').objects.update_or_create(
+        pk=1, defaults={'pruned_through': head}
+    )
+
+
+def use_counter(apps, schema_editor):
+    """Contatore ripreso oltre gli id di transazione già assegnati"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    value = _scalar(connection, 'SELECT pg_current_xact_id()::text::bigint')
+    apps.get_model('mqtt', 'ChangeSequence').objects.update_or_create(
+        pk=1, defaults={'value': value, 'pruned_through': value}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0033_gateway_metadata_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_transaction_ids, use_counter),
+    ]
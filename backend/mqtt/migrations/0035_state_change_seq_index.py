@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mqtt', '0034_change_seq_transaction_ids'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataloggerstate',
+            index=models.Index(fields=['change_seq'], name='mqtt_datalo_change__3da4b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gatewaystate',
+            index=models.Index(fields=['change_seq'], name='mqtt_gatewa_change__f8ede3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorstate',
+            index=models.Index(fields=['change_seq'], name='mqtt_sensor_change__a9e933_idx'),
+        ),
+    ]
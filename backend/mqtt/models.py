@@ -1,4 +1,7 @@
-from django.db import models
+import copy
+
+from django.db import connection, models, transaction
+from django.conf import settings
 from django.utils import timezone
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
@@ -197,6 +200,18 @@ class DiscoveredTopic(models.Model):
         null=True, blank=True,
         help_text="Dimensione media payload in bytes"
     )
+    compression = models.CharField(
+        max_length=10, blank=True,
+        help_text="Compressione dell'ultimo payload compresso ricevuto (gzip, zlib)"
+    )
+    compressed_message_count = models.IntegerField(
+        default=0,
+        help_text="Numero di messaggi ricevuti compressi"
+    )
+    compression_ratio_avg = models.FloatField(
+        null=True, blank=True,
+        help_text="Rapporto medio dimensione decompressa / dimensione ricevuta"
+    )
     message_frequency_seconds = models.FloatField(
         null=True, blank=True,
         help_text="Frequenza media messaggi in secondi"
@@ -226,7 +241,152 @@ class DiscoveredTopic(models.Model):
     def __str__(self):
         return f"{self.topic_path} ({self.message_count} msgs)"
 
-class Gateway(models.Model):
+class ChangeSequence(models.Model):
+    """
+    Sequenza del change feed (delta sync di gateway/datalogger/sensori): una sola riga.
+
+    PostgreSQL: il valore allocato è l'id della transazione che scrive i device
+    (pg_current_xact_id), senza lock condivisi: ingest di siti e thread diversi non si
+    serializzano. I valori però diventano visibili fuori ordine, quindi il cursore che
+    si restituisce ai client è l'xmin dello snapshot - 1 (current()): tutte le transazioni
+    con id inferiore sono concluse, un client che ha letto fino a N non può perdere una
+    riga con change_seq <= N committata dopo.
+
+    Altri backend (SQLite in sviluppo): contatore in value, l'UPDATE che alloca tiene il lock
+    della riga fino al commit (SQLite serializza comunque le scritture).
+    """
+    value = models.BigIntegerField(default=0)
+    pruned_through = models.BigIntegerField(
+        default=0,
+        help_text="Tombstone eliminati fino a questo valore: cursori più vecchi richiedono un resync completo"
+    )
+
+    class Meta:
+        verbose_name = "Change Sequence"
+        verbose_name_plural = "Change Sequence"
+
+    def __str__(self):
+        return f"change_seq {self.value}"
+
+    @staticmethod
+    def uses_transaction_ids() -> bool:
+        return connection.vendor == 'postgresql'
+
+    @classmethod
+    def allocate(cls) -> int:
+        """
+        Valore della sequenza per la transazione corrente. Va chiamato nella transazione
+        che scrive le righe (tutte le righe della transazione hanno lo stesso valore su PostgreSQL).
+        """
+        if cls.uses_transaction_ids():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_current_xact_id()::text::bigint')
+                return cursor.fetchone()[0]
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            # UPDATE ... RETURNING: una sola query (SQLite >= 3.35)
+            cursor.execute(f'UPDATE {table} SET "value" = "value" + 1 WHERE "id" = 1 RETURNING "value"')
+            row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        cls.objects.get_or_create(pk=1)
+        return cls.allocate()
+
+    @classmethod
+    def current(cls) -> int:
+        """Valore fino al quale tutte le scritture sono committate (cursore da restituire ai client)"""
+        if cls.uses_transaction_ids():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint - 1')
+                return cursor.fetchone()[0]
+        return cls.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+
+class ChangeTracked(models.Model):
+    """
+    Righe esposte dal change feed: change_seq viene riallocato a ogni save().
+    I path bulk (bulk_create / bulk_update / update()) impostano change_seq esplicitamente.
+
+    Dirty tracking: le istanze lette dal DB ricordano i valori caricati. save() senza
+    update_fields scrive solo i campi cambiati (più quelli auto_now) e non esegue nessuna
+    query se non è cambiato nulla (niente nuovo change_seq, niente post_save).
+    """
+    change_seq = models.BigIntegerField(
+        default=0,
+        editable=False,
+        help_text="Valore di ChangeSequence dell'ultima modifica (delta sync)"
+    )
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_loaded_values(fields)
+
+    def _remember_loaded_values(self, fields=None):
+        """Valori correnti come 'salvati' (tutti, o solo fields dopo un save/refresh parziale)"""
+        if fields is None or not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+        attnames = None if fields is None else {self._meta.get_field(name).attname for name in fields}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (attnames is None or field.attname in attnames):
+                value = self.__dict__[field.attname]
+                # JSON modificabili in place: copia per il confronto
+                self._loaded_values[field.attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def get_dirty_fields(self):
+        """Nomi dei campi cambiati rispetto ai valori letti dal DB (tutti per un'istanza non salvata)"""
+        fields = [
+            field for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname != 'change_seq' and not getattr(field, 'auto_now', False)
+        ]
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or self._state.adding:
+            return [field.name for field in fields]
+        return [
+            field.name for field in fields
+            if field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
+    def _tracks_update(self, kwargs):
+        """save(**kwargs) è un UPDATE senza update_fields di una riga letta dal DB"""
+        return (
+            kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not self._state.adding
+            and hasattr(self, '_loaded_values')
+        )
+
+    def is_noop_save(self, kwargs):
+        """True se save(**kwargs) su una riga già salvata non cambierebbe nessun campo"""
+        return self._tracks_update(kwargs) and not self.get_dirty_fields()
+
+    def save(self, *args, **kwargs):
+        if self.is_noop_save(kwargs):
+            return
+        update_fields = kwargs.get('update_fields')
+        if self._tracks_update(kwargs):
+            auto_now = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+            update_fields = self.get_dirty_fields() + auto_now
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_seq'}
+        # Allocazione e scrittura nella stessa transazione (vedi ChangeSequence)
+        with transaction.atomic(savepoint=False):
+            self.change_seq = ChangeSequence.allocate()
+            super().save(*args, **kwargs)
+        self._remember_loaded_values(kwargs.get('update_fields'))
+
+
+class Gateway(ChangeTracked):
     """
     Gateway/Sistema principale del sito (evoluzione di SystemInfo)
     Gestisce informazioni sistema generale ricevute via gateway/heartbeat
@@ -259,8 +419,7 @@ class Gateway(models.Model):
     firmware_version = models.CharField(max_length=50, blank=True)
     os_version = models.CharField(max_length=255, blank=True, help_text="Sistema operativo e versione")
 
-    # Status tracking
-    is_online = models.BooleanField(default=False)
+    # Stato online / ultimo messaggio in GatewayState (gateway.state)
 
     # System uptime (come stringa dal payload)
     system_uptime = models.CharField(max_length=100, blank=True, help_text="Uptime formato stringa (es: '14 days, 3:24:30')")
@@ -311,8 +470,12 @@ class Gateway(models.Model):
         help_text="Spazio disco utilizzato in percentuale"
     )
 
-    # Raw MQTT payload for debugging
-    raw_metadata = models.JSONField(default=dict, blank=True)
+    # Raw MQTT payload for debugging: snapshot senza letture in GatewayMetadataSnapshot,
+    # qui solo l'hash del contenuto corrente (confronto senza query a ogni messaggio)
+    raw_metadata_hash = models.CharField(
+        max_length=64, blank=True,
+        help_text="SHA-256 dello snapshot corrente del payload (GatewayMetadataSnapshot)"
+    )
 
     # MQTT API versioning and dynamic monitoring fields
     mqtt_api_version = models.CharField(
@@ -343,10 +506,6 @@ class Gateway(models.Model):
         null=True, blank=True,
         help_text='When device went offline'
     )
-    last_seen_at = models.DateTimeField(
-        null=True, blank=True,
-        help_text='Ultimo messaggio ricevuto dal gateway'
-    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -355,10 +514,22 @@ class Gateway(models.Model):
         verbose_name = "Gateway"
         verbose_name_plural = "Gateways"
         ordering = ['site__name']
+        indexes = [
+            # Change feed per sito
+            models.Index(fields=['site', 'change_seq']),
+        ]
 
     def __str__(self):
         return f"{self.label} ({self.site.name})"
 
+    @property
+    def raw_metadata(self):
+        """Ultimo payload ricevuto (senza letture), dallo snapshot corrente"""
+        if not self.raw_metadata_hash:
+            return {}
+        snapshot = self.metadata_snapshots.filter(content_hash=self.raw_metadata_hash).first()
+        return snapshot.metadata if snapshot else {}
+
     def clean(self):
         super().clean()
         # Validazioni custom per Gateway
@@ -381,11 +552,13 @@ class Gateway(models.Model):
         # Default label = serial_number se non specificato
         if not self.label and self.serial_number:
             self.label = self.serial_number
+        if self.is_noop_save(kwargs):
+            return  # Nessun campo cambiato: né validazione né UPDATE
         self.full_clean()  # Chiama clean() e validatori
         super().save(*args, **kwargs)
 
 
-class Datalogger(models.Model):
+class Datalogger(ChangeTracked):
     """
     Datalogger auto-discovered via MQTT heartbeat
     Ogni datalogger ha serial_number univoco + label editabile
@@ -416,9 +589,7 @@ class Datalogger(models.Model):
     datalogger_type = models.CharField(max_length=50, blank=True, help_text="monstro, adaq, etc. - dal topic")
     device_id = models.CharField(max_length=50, blank=True, help_text="Device ID dal topic (1, 2, 3...)")
 
-    # Status e comunicazione ENHANCED (Fase 3)
-    is_online = models.BooleanField(default=False)
-    last_seen_at = models.DateTimeField(null=True, blank=True, help_text="Ultimo heartbeat ricevuto (ENHANCED)")
+    # Stato online, ultimo heartbeat e acquisition_status in DataloggerState (datalogger.state)
 
     # Metadata dal payload
     firmware_version = models.CharField(max_length=50, blank=True)
@@ -458,19 +629,6 @@ class Datalogger(models.Model):
         default='online',
         help_text='Current connection status'
     )
-    acquisition_status = models.CharField(
-        max_length=20,
-        choices=[
-            ('running', 'Running'),
-            ('stopped', 'Stopped'),
-            ('paused', 'Paused'),
-            ('error', 'Error'),
-            ('offline', 'Offline'),
-            ('unknown', 'Unknown')
-        ],
-        default='running',
-        help_text='Acquisition/measurement status'
-    )
     expected_heartbeat_interval = models.IntegerField(
         default=60,
         help_text='Expected heartbeat interval in seconds'
@@ -492,8 +650,10 @@ class Datalogger(models.Model):
         indexes = [
             models.Index(fields=['site', 'datalogger_type', 'device_id']),
             models.Index(fields=['serial_number']),
-            models.Index(fields=['is_online']),
-            models.Index(fields=['last_seen_at']),
+            # Paginazione keyset di dataloggers_list
+            models.Index(fields=['site', 'label', 'id']),
+            # Change feed per sito
+            models.Index(fields=['site', 'change_seq']),
         ]
         verbose_name = "Datalogger"
         verbose_name_plural = "Dataloggers"
@@ -522,14 +682,16 @@ class Datalogger(models.Model):
         # Default label = serial_number se non specificato
         if not self.label and self.serial_number:
             self.label = self.serial_number
+        if self.is_noop_save(kwargs):
+            return  # Nessun campo cambiato: né validazione né UPDATE
         self.full_clean()  # Chiama clean() e validatori
         super().save(*args, **kwargs)
 
 
-class Sensor(models.Model):
+class Sensor(ChangeTracked):
     """
-    Sensori auto-discovered con dati near real-time integrati
-    Ogni sensore ha serial_number + label editabile + ultimi 3 dati + statistiche
+    Sensori auto-discovered: serial_number + label editabile + statistiche.
+    Stato online, ultimi 3 dati e contatori in SensorState (sensor.state)
     """
     datalogger = models.ForeignKey(Datalogger, on_delete=models.CASCADE, related_name='sensors')
     serial_number = models.CharField(
@@ -557,53 +719,21 @@ class Sensor(models.Model):
     sensor_type = models.CharField(max_length=50, blank=True)
     unit_of_measure = models.CharField(max_length=50, blank=True)
 
-    # Status tracking
-    is_online = models.BooleanField(default=False)
-    last_reading = models.DateTimeField(null=True, blank=True)
-
-    # === DATI NEAR REAL-TIME (ultimi 3 valori) ===
-    # Ultimo dato (più recente)
-    last_timestamp_1 = models.DateTimeField(null=True, blank=True)
-    last_data_1 = models.JSONField(default=dict, blank=True)
-
-    # Penultimo dato
-    last_timestamp_2 = models.DateTimeField(null=True, blank=True)
-    last_data_2 = models.JSONField(default=dict, blank=True)
-
-    # Terzultimo dato
-    last_timestamp_3 = models.DateTimeField(null=True, blank=True)
-    last_data_3 = models.JSONField(default=dict, blank=True)
-
     # === STATISTICHE AGGREGATE ===
-    # Contatori
-    total_messages = models.IntegerField(
-        default=0,
-        validators=[MinValueValidator(0)]
-    )
-    total_readings = models.IntegerField(
-        default=0,
-        validators=[MinValueValidator(0)]
-    )
-
     # Valori min/max da sempre registrati
     min_value_ever = models.FloatField(null=True, blank=True)
     max_value_ever = models.FloatField(null=True, blank=True)
     min_recorded_at = models.DateTimeField(null=True, blank=True)
     max_recorded_at = models.DateTimeField(null=True, blank=True)
 
-    # Periodo di attività
+    # Periodo di attività (ultimo messaggio in SensorState)
     first_seen_at = models.DateTimeField(null=True, blank=True)
-    last_seen_at = models.DateTimeField(null=True, blank=True)
 
     # Benchmark qualità comunicazione
     uptime_percentage = models.FloatField(
         default=100.0,
         validators=[MinValueValidator(0.0), MaxValueValidator(100.0)]
     )
-    consecutive_misses = models.IntegerField(
-        default=0,
-        validators=[MinValueValidator(0)]
-    )
 
     # MQTT API versioning and dynamic monitoring fields
     mqtt_api_version = models.CharField(
@@ -643,10 +773,11 @@ class Sensor(models.Model):
     class Meta:
         unique_together = ('datalogger', 'serial_number')
         indexes = [
-            models.Index(fields=['datalogger', 'is_online']),
             models.Index(fields=['serial_number']),
-            models.Index(fields=['last_reading']),
-            models.Index(fields=['last_timestamp_1']),
+            # Paginazione keyset di sensors_by_datalogger
+            models.Index(fields=['datalogger', 'label', 'id']),
+            # Change feed per datalogger
+            models.Index(fields=['datalogger', 'change_seq']),
         ]
         verbose_name = "Sensor"
         verbose_name_plural = "Sensors"
@@ -658,13 +789,162 @@ class Sensor(models.Model):
     def clean(self):
         super().clean()
         # Validazioni custom
-        if self.total_readings > self.total_messages:
-            raise ValidationError("Total readings cannot exceed total messages")
-
         if self.min_value_ever is not None and self.max_value_ever is not None:
             if self.min_value_ever > self.max_value_ever:
                 raise ValidationError("Min value cannot be greater than max value")
 
+    def save(self, *args, **kwargs):
+        # Default label = serial_number se non specificato
+        if not self.label and self.serial_number:
+            self.label = self.serial_number
+        if self.is_noop_save(kwargs):
+            return  # Nessun campo cambiato: né validazione né UPDATE
+        self.full_clean()  # Chiama clean() e validatori
+        super().save(*args, **kwargs)
+
+    def update_min_max_stats(self, value):
+        """Aggiorna statistiche min/max globali"""
+        from django.utils import timezone
+
+        if self.min_value_ever is None or value < self.min_value_ever:
+            self.min_value_ever = value
+            self.min_recorded_at = timezone.now()
+
+        if self.max_value_ever is None or value > self.max_value_ever:
+            self.max_value_ever = value
+            self.max_recorded_at = timezone.now()
+
+
+ACQUISITION_STATUS_CHOICES = [
+    ('running', 'Running'),
+    ('stopped', 'Stopped'),
+    ('paused', 'Paused'),
+    ('error', 'Error'),
+    ('offline', 'Offline'),
+    ('unknown', 'Unknown')
+]
+
+
+class DeviceState(ChangeTracked):
+    """
+    Stato che cambia a ogni messaggio (online, ultimo messaggio), separato dai metadati del device.
+
+    La riga del device (label, validatori, JSON, indici secondari) non viene più riscritta
+    dall'ingest: ogni messaggio aggiorna solo questa tupla stretta, con il solo indice su
+    change_seq (meno WAL e bloat). Lo stato ha un change_seq proprio: il change feed legge
+    separatamente device e stati e riporta il device se è cambiato l'uno o l'altro.
+    """
+    is_online = models.BooleanField(default=False)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def upsert(cls, device_id, **values):
+        """Scrive i campi indicati dello stato del device (INSERT ... ON CONFLICT DO UPDATE)"""
+        with transaction.atomic(savepoint=False):
+            values['change_seq'] = ChangeSequence.allocate()
+            cls.bulk_upsert([cls(**{cls._meta.pk.attname: device_id}, **values)], list(values))
+
+    @classmethod
+    def bulk_upsert(cls, states, fields, batch_size=500):
+        """Versione bulk di upsert: change_seq va impostato dal chiamante e incluso in fields"""
+        return cls.objects.bulk_create(
+            states,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=[cls._meta.pk.name],
+            update_fields=fields,
+        )
+
+
+class GatewayState(DeviceState):
+    """Stato live di un Gateway"""
+    gateway = models.OneToOneField(Gateway, on_delete=models.CASCADE, primary_key=True, related_name='state')
+
+    class Meta:
+        verbose_name = "Gateway State"
+        verbose_name_plural = "Gateway States"
+        indexes = [
+            # Change feed: sorgente stato
+            models.Index(fields=['change_seq']),
+        ]
+
+    def __str__(self):
+        return f"state of gateway {self.gateway_id}"
+
+
+class DataloggerState(DeviceState):
+    """Stato live di un Datalogger (con lo stato di acquisizione riportato dal payload)"""
+    datalogger = models.OneToOneField(Datalogger, on_delete=models.CASCADE, primary_key=True, related_name='state')
+    acquisition_status = models.CharField(
+        max_length=20,
+        choices=ACQUISITION_STATUS_CHOICES,
+        default='running',
+        help_text='Acquisition/measurement status'
+    )
+
+    class Meta:
+        verbose_name = "Datalogger State"
+        verbose_name_plural = "Datalogger States"
+        indexes = [
+            # Change feed: sorgente stato
+            models.Index(fields=['change_seq']),
+        ]
+
+    def __str__(self):
+        return f"state of datalogger {self.datalogger_id}"
+
+
+class SensorState(DeviceState):
+    """Stato live di un Sensor: ultimi 3 dati (rolling buffer) e contatori"""
+    sensor = models.OneToOneField(Sensor, on_delete=models.CASCADE, primary_key=True, related_name='state')
+    last_reading = models.DateTimeField(null=True, blank=True)
+
+    # === DATI NEAR REAL-TIME (ultimi 3 valori) ===
+    # Ultimo dato (più recente)
+    last_timestamp_1 = models.DateTimeField(null=True, blank=True)
+    last_data_1 = models.JSONField(default=dict, blank=True)
+
+    # Penultimo dato
+    last_timestamp_2 = models.DateTimeField(null=True, blank=True)
+    last_data_2 = models.JSONField(default=dict, blank=True)
+
+    # Terzultimo dato
+    last_timestamp_3 = models.DateTimeField(null=True, blank=True)
+    last_data_3 = models.JSONField(default=dict, blank=True)
+
+    # Contatori
+    total_messages = models.IntegerField(
+        default=0,
+        validators=[MinValueValidator(0)]
+    )
+    total_readings = models.IntegerField(
+        default=0,
+        validators=[MinValueValidator(0)]
+    )
+    consecutive_misses = models.IntegerField(
+        default=0,
+        validators=[MinValueValidator(0)]
+    )
+
+    class Meta:
+        verbose_name = "Sensor State"
+        verbose_name_plural = "Sensor States"
+        indexes = [
+            # Change feed: sorgente stato
+            models.Index(fields=['change_seq']),
+        ]
+
+    def __str__(self):
+        return f"state of sensor {self.sensor_id}"
+
+    def clean(self):
+        super().clean()
+        if self.total_readings > self.total_messages:
+            raise ValidationError("Total readings cannot exceed total messages")
+
         # Validazione coerenza timestamp
         timestamps = [
             self.last_timestamp_1,
@@ -679,20 +959,39 @@ class Sensor(models.Model):
                 if valid_timestamps[i] < valid_timestamps[i + 1]:
                     raise ValidationError("Timestamp readings must be in descending order")
 
-    def save(self, *args, **kwargs):
-        # Default label = serial_number se non specificato
-        if not self.label and self.serial_number:
-            self.label = self.serial_number
-        self.full_clean()  # Chiama clean() e validatori
-        super().save(*args, **kwargs)
+    @classmethod
+    def record_reading(cls, sensor_id, timestamp, data):
+        """
+        Nuovo dato per un sensore con un solo UPDATE (shift del rolling buffer e contatori
+        calcolati dal database, nessuna lettura preventiva). Crea lo stato se manca.
+        """
+        with transaction.atomic(savepoint=False):
+            change_seq = ChangeSequence.allocate()
+            updated = cls.objects.filter(pk=sensor_id).update(
+                last_timestamp_3=models.F('last_timestamp_2'),
+                last_data_3=models.F('last_data_2'),
+                last_timestamp_2=models.F('last_timestamp_1'),
+                last_data_2=models.F('last_data_1'),
+                last_timestamp_1=timestamp,
+                last_data_1=models.Value(data, output_field=models.JSONField()),
+                total_messages=models.F('total_messages') + 1,
+                total_readings=models.F('total_readings') + 1,
+                last_reading=timestamp,
+                last_seen_at=timestamp,
+                consecutive_misses=0,
+                is_online=True,
+                change_seq=change_seq,
+            )
+            if not updated:
+                state = cls(sensor_id=sensor_id, change_seq=change_seq)
+                state.add_new_reading(timestamp, data)
+                cls.objects.bulk_create([state])
 
     def add_new_reading(self, timestamp, data):
         """
         Aggiunge nuovo dato shiftando gli ultimi 3
         Implementa rolling buffer: nuovo→1, 1→2, 2→3
         """
-        from django.utils import timezone
-
         # Shift dei dati: 1→2, 2→3, nuovo→1
         self.last_timestamp_3 = self.last_timestamp_2
         self.last_data_3 = self.last_data_2
@@ -709,25 +1008,10 @@ class Sensor(models.Model):
         self.last_reading = timestamp
         self.last_seen_at = timestamp
 
-        if not self.first_seen_at:
-            self.first_seen_at = timestamp
-
         # Reset consecutive misses se riceve dato
         self.consecutive_misses = 0
         self.is_online = True
 
-    def update_min_max_stats(self, value):
-        """Aggiorna statistiche min/max globali"""
-        from django.utils import timezone
-
-        if self.min_value_ever is None or value < self.min_value_ever:
-            self.min_value_ever = value
-            self.min_recorded_at = timezone.now()
-
-        if self.max_value_ever is None or value > self.max_value_ever:
-            self.max_value_ever = value
-            self.max_recorded_at = timezone.now()
-
     def get_latest_readings(self):
         """Ritorna lista degli ultimi 3 dati ordinati (più recente primo)"""
         readings = []
@@ -753,6 +1037,96 @@ class Sensor(models.Model):
         return readings
 
 
+class GatewayMetadataSnapshot(models.Model):
+    """
+    Payload raw di un gateway senza letture (valori, timestamp, metriche di sistema),
+    deduplicato per hash del contenuto. Una riga nuova solo quando cambiano la struttura
+    o i campi non di lettura; storico limitato (services.metadata_snapshots).
+    """
+    gateway = models.ForeignKey(Gateway, on_delete=models.CASCADE, related_name='metadata_snapshots')
+    content_hash = models.CharField(max_length=64)
+    metadata = models.JSONField(default=dict, blank=True)
+    recorded_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="Ultima volta in cui il payload è passato a questo contenuto"
+    )
+
+    class Meta:
+        verbose_name = "Gateway Metadata Snapshot"
+        verbose_name_plural = "Gateway Metadata Snapshots"
+        ordering = ['-recorded_at']
+        unique_together = ('gateway', 'content_hash')
+        indexes = [
+            models.Index(fields=['gateway', '-recorded_at']),
+        ]
+
+    def __str__(self):
+        return f"metadata of gateway {self.gateway_id} ({self.content_hash[:12]})"
+
+
+class ChangeTombstone(models.Model):
+    """
+    Eliminazione di un gateway/datalogger/sensore nel change feed.
+    Nessuna FK: il sito o il datalogger possono non esistere più.
+    """
+    KIND_CHOICES = [
+        ('gateway', 'Gateway'),
+        ('datalogger', 'Datalogger'),
+        ('sensor', 'Sensor'),
+    ]
+
+    change_seq = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    site_id = models.BigIntegerField(null=True, blank=True)
+    datalogger_id = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Datalogger del sensore (o il datalogger stesso)"
+    )
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Change Tombstone"
+        verbose_name_plural = "Change Tombstones"
+        indexes = [
+            models.Index(fields=['site_id', 'change_seq']),
+            models.Index(fields=['datalogger_id', 'change_seq']),
+            models.Index(fields=['deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted (seq {self.change_seq})"
+
+
+class SiteHealth(models.Model):
+    """
+    Contatori per sito di gateway / datalogger / sensori totali e online.
+    Ricalcolati in blocco da services.site_health (siti toccati dagli eventi di ingest
+    e riconciliazione periodica): la vista di sintesi legge una riga per sito.
+    """
+    site = models.OneToOneField(
+        'sites.Site', on_delete=models.CASCADE, primary_key=True, related_name='health'
+    )
+    gateways_total = models.PositiveIntegerField(default=0)
+    gateways_online = models.PositiveIntegerField(default=0)
+    dataloggers_total = models.PositiveIntegerField(default=0)
+    dataloggers_online = models.PositiveIntegerField(default=0)
+    sensors_total = models.PositiveIntegerField(default=0)
+    sensors_online = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Site Health"
+        verbose_name_plural = "Site Health"
+
+    def __str__(self):
+        return (
+            f"Site {self.site_id}: {self.gateways_online}/{self.gateways_total} gateways, "
+            f"{self.dataloggers_online}/{self.dataloggers_total} dataloggers, "
+            f"{self.sensors_online}/{self.sensors_total} sensors online"
+        )
+
+
 class MqttApiVersionUsage(models.Model):
     """
     Tracking dell'utilizzo delle versioni MQTT API per analytics
@@ -835,3 +1209,63 @@ class MqttDowntimeEvent(models.Model):
         return None
 
 
+
+
+class DiscoveryJob(models.Model):
+    """
+    Job asincrono di force discovery: rielabora i sample_payload dei DiscoveredTopic di un sito.
+    Creato dall'API force_discovery, eseguito dal worker del servizio MQTT (o da run_discovery_jobs).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    site = models.ForeignKey('sites.Site', on_delete=models.CASCADE, related_name='discovery_jobs')
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='+'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Avanzamento
+    total_topics = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)
+    success_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+
+    results = models.JSONField(default=dict, blank=True, help_text="Statistiche per tipo topic ed errori")
+    message = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True, help_text="Worker che ha preso in carico il job")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Discovery Job"
+        verbose_name_plural = "Discovery Jobs"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['site', 'status']),
+        ]
+
+    def __str__(self):
+        return f"Discovery job {self.id} for {self.site.name} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    @property
+    def progress_percent(self):
+        """Percentuale di topic elaborati"""
+        if not self.total_topics:
+            return 100.0 if self.is_finished else 0.0
+        return round(self.processed_count * 100.0 / self.total_topics, 1)
@@ -4,6 +4,12 @@ from asgiref.sync import async_to_sync
 # Nome del gruppo definito nel consumer
 GROUP_NAME = "mqtt_status_updates"
 
+
+def readings_group(datalogger_id: int) -> str:
+    """Gruppo opt-in degli eventi sensor_readings di un datalogger (subscribe_readings nel consumer)"""
+    return f"mqtt_readings_dl_{datalogger_id}"
+
+
 def broadcast_status_update(site_id: int, status: str, is_enabled: bool):
     """
     Invia un messaggio di aggiornamento di stato al gruppo WebSocket.
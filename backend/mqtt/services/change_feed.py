@@ -0,0 +1,194 @@
+"""
+Change feed (delta sync) di gateway, datalogger e sensori.
+
+Ogni scrittura di Gateway / Datalogger / Sensor o del loro stato live (GatewayState /
+DataloggerState / SensorState) imposta change_seq con un valore di ChangeSequence (save()
+dei modelli e path bulk del message processor), ogni eliminazione lascia un ChangeTombstone.
+Un client che conosce il cursore N legge solo i device con change_seq del device o dello
+stato > N. Le due colonne sono lette con query separate (ognuna su un indice di change_seq)
+e unite in Python: il costo è proporzionale ai cambiamenti, non alla dimensione del sito.
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, Max, Q, QuerySet
+from django.utils import timezone
+
+from ..models import ChangeSequence, ChangeTombstone, Datalogger, Gateway, Sensor
+
+logger = logging.getLogger(__name__)
+
+# Intervallo minimo tra due pulizie dei tombstone (secondi)
+TOMBSTONE_PRUNE_INTERVAL = 3600
+
+
+class CursorExpired(Exception):
+    """Cursore precedente ai tombstone eliminati (o successivo alla sequenza): serve un sync completo"""
+
+
+@dataclass
+class ChangeBatch:
+    """Una pagina del change feed: righe con cursore < change_seq <= cursor"""
+    cursor: int
+    has_more: bool
+    gateways: List[Gateway] = field(default_factory=list)
+    dataloggers: List[Datalogger] = field(default_factory=list)
+    sensors: List[Sensor] = field(default_factory=list)
+    deleted: List[ChangeTombstone] = field(default_factory=list)
+
+
+class ChangeFeed:
+    """Lettura del change feed per sito o per datalogger e gestione dei tombstone"""
+
+    def __init__(self):
+        self._last_prune = 0.0
+
+    def _sources(self, site_id: Optional[int], datalogger_id: Optional[int]) -> Dict[str, QuerySet]:
+        if datalogger_id is not None:
+            return {
+                'dataloggers': Datalogger.objects.filter(pk=datalogger_id),
+                'sensors': Sensor.objects.filter(datalogger_id=datalogger_id),
+                'deleted': ChangeTombstone.objects.filter(datalogger_id=datalogger_id),
+            }
+        return {
+            'gateways': Gateway.objects.filter(site_id=site_id),
+            'dataloggers': Datalogger.objects.filter(site_id=site_id),
+            'sensors': Sensor.objects.filter(datalogger__site_id=site_id),
+            'deleted': ChangeTombstone.objects.filter(site_id=site_id),
+        }
+
+    def _rows(self, name: str, ids) -> QuerySet:
+        """Righe complete da restituire (con le relazioni e i conteggi usati dai serializer)"""
+        if name == 'gateways':
+            return Gateway.objects.filter(pk__in=ids).select_related('state')
+        if name == 'dataloggers':
+            return Datalogger.objects.filter(pk__in=ids).select_related('site', 'state').annotate(
+                sensors_count=Count('sensors'),
+                active_sensors_count=Count('sensors', filter=Q(sensors__state__is_online=True)),
+            )
+        if name == 'sensors':
+            return Sensor.objects.filter(pk__in=ids).select_related('datalogger__site', 'state')
+        return ChangeTombstone.objects.filter(pk__in=ids)
+
+    def _changes(self, queryset: QuerySet, name: str, **seq_filter) -> List[Tuple[int, int]]:
+        """
+        Coppie (change_seq, id) dei cambiamenti della sorgente: quelli del device e, per i
+        device, quelli del loro stato live (due query distinte, mai un max() sul join).
+        I kwargs filtrano change_seq (es. gt / lte / exact) e limit tronca ogni query.
+        """
+        limit = seq_filter.pop('limit', None)
+        columns = ['change_seq'] if name == 'deleted' else ['change_seq', 'state__change_seq']
+        changes = set()
+        for column in columns:
+            rows = queryset.filter(**{f'{column}__{lookup}': value for lookup, value in seq_filter.items()})
+            rows = rows.order_by(column, 'id').values_list(column, 'id')
+            changes.update(rows if limit is None else rows[:limit])
+        return sorted(changes)
+
+    def read(self, after: Optional[int], limit: int, site_id: Optional[int] = None,
+             datalogger_id: Optional[int] = None) -> ChangeBatch:
+        """
+        Righe cambiate dopo il cursore after (None = sync completo), per sito o per datalogger.
+
+        Ogni sorgente legge al più limit + 1 cambiamenti in ordine di change_seq; il cursore
+        restituito è il valore più alto fino al quale tutte le sorgenti sono complete.
+        Una pagina non spezza mai un valore di change_seq: se una singola scrittura
+        (es. un batch di telemetria) ha toccato più di limit righe, la pagina le include tutte.
+        Ogni riga compare una sola volta, nella pagina del suo ultimo cambiamento.
+        """
+        head = ChangeSequence.current()
+        pruned_through = ChangeSequence.objects.filter(pk=1).values_list('pruned_through', flat=True).first() or 0
+        if after is not None and (after < pruned_through or after > head):
+            raise CursorExpired(f"Cursor {after} outside the retained change range ({pruned_through}-{head})")
+
+        since = -1 if after is None else after
+        upper = head
+        fetched = {}
+        for name, queryset in self._sources(site_id, datalogger_id).items():
+            changes = self._changes(queryset, name, gt=since, lte=head, limit=limit + 1)[:limit + 1]
+            if len(changes) > limit:
+                boundary = changes[limit][0]
+                if changes[0][0] == boundary:
+                    changes = self._changes(queryset, name, exact=boundary)
+                    upper = min(upper, boundary)
+                else:
+                    # I cambiamenti con change_seq < boundary sono tutti in changes
+                    upper = min(upper, boundary - 1)
+            fetched[name] = changes
+
+        batch = ChangeBatch(cursor=upper, has_more=upper < head)
+        for name, changes in fetched.items():
+            ids = {object_id for seq, object_id in changes if seq <= upper}
+            rows = [(self._feed_seq(row), row) for row in self._rows(name, ids)] if ids else []
+            # Una riga con un cambiamento successivo al cursore arriva nella pagina di quel cambiamento
+            rows = sorted((item for item in rows if item[0] <= upper), key=lambda item: (item[0], item[1].pk))
+            setattr(batch, name, [row for _, row in rows])
+        return batch
+
+    @staticmethod
+    def _feed_seq(row) -> int:
+        """Ultimo cambiamento della riga: del device o del suo stato live"""
+        try:
+            state = getattr(row, 'state', None)
+        except ObjectDoesNotExist:
+            state = None
+        return max(row.change_seq, state.change_seq if state is not None else 0)
+
+    def current_cursor(self) -> int:
+        """Cursore da cui un client che ha appena letto le liste complete può proseguire"""
+        return ChangeSequence.current()
+
+    def record_deletion(self, instance) -> None:
+        """Tombstone per un Gateway / Datalogger / Sensor eliminato (segnale post_delete)"""
+        if isinstance(instance, Sensor):
+            kind = 'sensor'
+            datalogger_id = instance.datalogger_id
+            site_id = Datalogger.objects.filter(pk=datalogger_id).values_list('site_id', flat=True).first()
+        elif isinstance(instance, Datalogger):
+            kind, datalogger_id, site_id = 'datalogger', instance.pk, instance.site_id
+        else:
+            kind, datalogger_id, site_id = 'gateway', None, instance.site_id
+
+        with transaction.atomic(savepoint=False):
+            ChangeTombstone.objects.create(
+                change_seq=ChangeSequence.allocate(),
+                kind=kind,
+                object_id=instance.pk,
+                site_id=site_id,
+                datalogger_id=datalogger_id,
+            )
+
+    def prune_tombstones(self, force: bool = False) -> int:
+        """
+        Elimina i tombstone più vecchi di CHANGE_TOMBSTONE_RETENTION_DAYS (al più una volta
+        ogni TOMBSTONE_PRUNE_INTERVAL). I cursori precedenti diventano scaduti.
+        Ritorna il numero di tombstone eliminati.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_prune < TOMBSTONE_PRUNE_INTERVAL:
+            return 0
+        self._last_prune = now
+
+        retention_days = getattr(settings, 'MQTT_CONFIG', {}).get('CHANGE_TOMBSTONE_RETENTION_DAYS', 7)
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        with transaction.atomic():
+            through = ChangeTombstone.objects.filter(deleted_at__lt=cutoff).aggregate(
+                through=Max('change_seq')
+            )['through']
+            if through is None:
+                return 0
+            ChangeSequence.objects.filter(pk=1, pruned_through__lt=through).update(pruned_through=through)
+            deleted, _ = ChangeTombstone.objects.filter(change_seq__lte=through).delete()
+
+        logger.info(f"Change feed: pruned {deleted} tombstones (through seq {through})")
+        return deleted
+
+
+# Singleton instance
+change_feed = ChangeFeed()
@@ -0,0 +1,340 @@
+"""
+Discovery Jobs - Force discovery asincrono con avanzamento
+
+L'API force_discovery crea un DiscoveryJob e ritorna subito. Il job viene eseguito
+dal worker avviato da MQTTService (o dal comando run_discovery_jobs): rielabora i
+sample_payload dei DiscoveredTopic del sito usando il path batch del processor
+per la telemetria. Avanzamento e risultati sono salvati sul job e inviati via
+WebSocket (eventi discovery_job_progress / discovery_job_finished).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from mqtt.models import DiscoveredTopic, DiscoveryJob
+from mqtt.services import metrics
+from mqtt.services.payload_codec import split_topic_suffix
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+# Ordine di elaborazione: i gateway prima, poi gli schema v2 e la telemetria (che crea
+# dataloggers/sensori), infine gli status aggregati che si riferiscono ai dataloggers esistenti
+TOPIC_TYPE_ORDER = (
+    'gateway_status', 'dataloggers_schema', 'dataloggers_telemetry', 'datalogger_status_aggregated', 'unknown'
+)
+
+# Intervallo minimo tra due eventi WebSocket di avanzamento
+PROGRESS_BROADCAST_INTERVAL = 1.0
+
+discovery_jobs_total = metrics.registry.counter(
+    'mqtt_discovery_jobs_total',
+    'Force discovery jobs executed, by final status',
+    ['status']
+)
+discovery_topics_total = metrics.registry.counter(
+    'mqtt_discovery_topics_total',
+    'Discovered topics reprocessed by force discovery jobs, by result',
+    ['result']
+)
+
+
+def serialize_job(job: DiscoveryJob) -> Dict[str, Any]:
+    """Rappresentazione del job per API e WebSocket"""
+    return {
+        'job_id': job.id,
+        'site_id': job.site_id,
+        'status': job.status,
+        'total_topics': job.total_topics,
+        'processed_count': job.processed_count,
+        'success_count': job.success_count,
+        'error_count': job.error_count,
+        'progress_percent': job.progress_percent,
+        'message': job.message,
+        'results': job.results,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class DiscoveryJobRunner:
+    """
+    Esegue i DiscoveryJob in coda. Più worker possono girare in parallelo:
+    la presa in carico è un UPDATE condizionato sullo stato 'pending'.
+    """
+
+    def __init__(self):
+        config = getattr(settings, 'MQTT_CONFIG', {})
+        self.enabled = config.get('DISCOVERY_WORKER_ENABLED', True)
+        self.batch_size = max(int(config.get('DISCOVERY_BATCH_SIZE', 50)), 1)
+        self.poll_interval = config.get('DISCOVERY_POLL_INTERVAL', 2.0)
+        self.stale_after = config.get('DISCOVERY_STALE_AFTER', 300)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Coda
+    # ------------------------------------------------------------------
+
+    def enqueue(self, site, user=None) -> Tuple[DiscoveryJob, bool]:
+        """
+        Accoda un job per il sito. Se ne esiste già uno attivo viene riutilizzato.
+
+        Returns:
+            tuple: (job, created)
+        """
+        with transaction.atomic():
+            existing = (
+                DiscoveryJob.objects.select_for_update()
+                .filter(site=site, status__in=ACTIVE_STATUSES)
+                .order_by('created_at')
+                .first()
+            )
+            if existing is not None:
+                return existing, False
+
+            job = DiscoveryJob.objects.create(
+                site=site,
+                requested_by=user if user is not None and user.is_authenticated else None,
+            )
+
+        logger.info(f"Discovery job {job.id} queued for site {site.id}")
+        self._broadcast(job, 'discovery_job_progress')
+        return job, True
+
+    def claim_next(self) -> Optional[DiscoveryJob]:
+        """Prende in carico il job pending più vecchio (None se la coda è vuota)"""
+        while True:
+            candidate = (
+                DiscoveryJob.objects.filter(status='pending')
+                .order_by('created_at')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if candidate is None:
+                return None
+
+            now = timezone.now()
+            claimed = DiscoveryJob.objects.filter(id=candidate, status='pending').update(
+                status='running', worker=self.worker_id, started_at=now, updated_at=now
+            )
+            if claimed:
+                return DiscoveryJob.objects.select_related('site').get(id=candidate)
+            # Preso da un altro worker nel frattempo: riprova con il successivo
+
+    def requeue_stale(self) -> int:
+        """Rimette in coda i job 'running' senza avanzamento da più di stale_after secondi (worker morto)"""
+        cutoff = timezone.now() - timedelta(seconds=self.stale_after)
+        count = DiscoveryJob.objects.filter(status='running', updated_at__lt=cutoff).update(
+            status='pending', worker='', processed_count=0, success_count=0, error_count=0,
+            updated_at=timezone.now()
+        )
+        if count:
+            logger.warning(f"Requeued {count} stale discovery jobs")
+        return count
+
+    def run_pending(self, limit: Optional[int] = None) -> int:
+        """Esegue i job in coda fino a svuotarla (o fino a limit job). Ritorna il numero di job eseguiti."""
+        executed = 0
+        self.requeue_stale()
+        while limit is None or executed < limit:
+            if self._stop_event.is_set():
+                break
+            job = self.claim_next()
+            if job is None:
+                break
+            self.run_job(job)
+            executed += 1
+        return executed
+
+    # ------------------------------------------------------------------
+    # Esecuzione
+    # ------------------------------------------------------------------
+
+    def run_job(self, job: DiscoveryJob) -> DiscoveryJob:
+        """Esegue un job già preso in carico (status 'running')"""
+        from mqtt.services.message_processor import message_processor
+
+        logger.info(f"Running discovery job {job.id} for site {job.site_id} (worker {self.worker_id})")
+        started = time.perf_counter()
+        results = {'by_type': {}, 'skipped_without_payload': 0, 'errors': []}
+
+        try:
+            grouped, skipped = self._load_topics(job.site_id, message_processor)
+            results['skipped_without_payload'] = skipped
+            job.total_topics = sum(len(items) for items in grouped.values())
+            DiscoveryJob.objects.filter(id=job.id).update(total_topics=job.total_topics, updated_at=timezone.now())
+            self._broadcast(job, 'discovery_job_progress')
+
+            last_broadcast = time.monotonic()
+            for topic_type in TOPIC_TYPE_ORDER:
+                items = grouped.get(topic_type, [])
+                type_stats = results['by_type'].setdefault(topic_type, {'topics': len(items), 'success': 0, 'errors': 0})
+
+                for index in range(0, len(items), self.batch_size):
+                    if self._stop_event.is_set():
+                        raise InterruptedError('Worker stopping')
+
+                    chunk = items[index:index + self.batch_size]
+                    ok, failed = self._process_chunk(job.site_id, topic_type, chunk, results, message_processor)
+                    type_stats['success'] += ok
+                    type_stats['errors'] += failed
+                    job.processed_count += len(chunk)
+                    job.success_count += ok
+                    job.error_count += failed
+
+                    DiscoveryJob.objects.filter(id=job.id).update(
+                        processed_count=job.processed_count,
+                        success_count=job.success_count,
+                        error_count=job.error_count,
+                        updated_at=timezone.now()
+                    )
+                    if time.monotonic() - last_broadcast >= PROGRESS_BROADCAST_INTERVAL:
+                        self._broadcast(job, 'discovery_job_progress')
+                        last_broadcast = time.monotonic()
+
+            results['duration_seconds'] = round(time.perf_counter() - started, 3)
+            job.status = 'completed'
+            job.message = (
+                f"Discovery refresh completed: {job.success_count} successful, "
+                f"{job.error_count} errors, {job.total_topics} total topics"
+            )
+
+        except InterruptedError:
+            # Arresto del servizio: il job torna in coda e riparte da capo al prossimo avvio
+            DiscoveryJob.objects.filter(id=job.id).update(
+                status='pending', worker='', processed_count=0, success_count=0, error_count=0,
+                updated_at=timezone.now()
+            )
+            logger.info(f"Discovery job {job.id} interrupted, requeued")
+            job.status = 'pending'
+            return job
+
+        except Exception as e:
+            logger.error(f"Discovery job {job.id} failed: {e}", exc_info=True)
+            job.status = 'failed'
+            job.message = f"Discovery refresh failed: {e}"
+
+        job.results = results
+        job.finished_at = timezone.now()
+        job.save(update_fields=[
+            'status', 'message', 'results', 'total_topics', 'processed_count',
+            'success_count', 'error_count', 'finished_at', 'updated_at'
+        ])
+        discovery_jobs_total.inc(job.status)
+        self._broadcast(job, 'discovery_job_finished')
+        logger.info(f"Discovery job {job.id} {job.status}: {job.message}")
+        return job
+
+    def _load_topics(self, site_id: int, processor) -> Tuple[Dict[str, list], int]:
+        """Raggruppa i topic con sample_payload per tipo (i topic senza payload JSON vengono saltati)"""
+        grouped: Dict[str, list] = {}
+        skipped = 0
+        topics = (
+            DiscoveredTopic.objects.filter(site_id=site_id)
+            .order_by('-last_seen_at')
+            .values_list('topic_path', 'sample_payload')
+        )
+        for topic_path, payload in topics.iterator(chunk_size=500):
+            if not payload:
+                skipped += 1
+                continue
+            # sample_payload è già decompresso: si elabora col topic logico (senza .gz/.zlib)
+            topic_path = split_topic_suffix(topic_path)[0]
+            topic_type = processor._parse_topic_structure(topic_path)['type']
+            grouped.setdefault(topic_type if topic_type in TOPIC_TYPE_ORDER else 'unknown', []).append(
+                (topic_path, payload)
+            )
+        return grouped, skipped
+
+    def _process_chunk(self, site_id: int, topic_type: str, chunk: list, results: Dict[str, Any],
+                       processor) -> Tuple[int, int]:
+        """Elabora un blocco di topic dello stesso tipo. Ritorna (successi, errori)."""
+        if topic_type == 'unknown':
+            # Come in process_message: topic non riconosciuti sono solo "discovered"
+            discovery_topics_total.inc('unrecognized', amount=len(chunk))
+            return len(chunk), 0
+
+        if topic_type == 'dataloggers_telemetry':
+            try:
+                stats = processor.persist_telemetry_batch(site_id, chunk)
+            except Exception as e:
+                self._record_error(results, f"telemetry batch ({len(chunk)} topics)", e)
+                discovery_topics_total.inc('error', amount=len(chunk))
+                return 0, len(chunk)
+            failed = min(stats['errors'], len(chunk))
+            discovery_topics_total.inc('ok', amount=len(chunk) - failed)
+            discovery_topics_total.inc('error', amount=failed)
+            return len(chunk) - failed, failed
+
+        ok = failed = 0
+        for topic_path, payload in chunk:
+            try:
+                topic_info = processor._parse_topic_structure(topic_path)
+                success = processor._dispatch(site_id, topic_path, payload, topic_info)
+            except Exception as e:
+                self._record_error(results, topic_path, e)
+                success = False
+            if success:
+                ok += 1
+            else:
+                failed += 1
+        discovery_topics_total.inc('ok', amount=ok)
+        discovery_topics_total.inc('error', amount=failed)
+        return ok, failed
+
+    def _record_error(self, results: Dict[str, Any], what: str, error: Exception) -> None:
+        logger.error(f"Discovery job error on {what}: {error}")
+        if len(results['errors']) < 50:
+            results['errors'].append({'topic': what, 'error': str(error)})
+
+    def _broadcast(self, job: DiscoveryJob, event_type: str) -> None:
+        from mqtt.services.message_processor import message_processor
+        message_processor._broadcast_update(job.site_id, event_type, serialize_job(job))
+
+    # ------------------------------------------------------------------
+    # Worker thread (processo mqtt_service)
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.loop, name="mqtt-discovery-worker", daemon=True)
+        self._thread.start()
+        logger.info(f"Discovery job worker started (worker {self.worker_id})")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("Discovery job worker did not terminate cleanly")
+        self._thread = None
+
+    def loop(self) -> None:
+        """Polling della coda finché non viene richiesto lo stop"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Error in discovery job worker: {e}")
+            finally:
+                close_old_connections()
+            self._stop_event.wait(self.poll_interval)
+
+
+# Singleton instance
+discovery_job_runner = DiscoveryJobRunner()
@@ -0,0 +1,429 @@
+"""
+Fleet Simulator - Gateway virtuali che pubblicano su un broker MQTT locale
+
+Ogni gateway virtuale pubblica gateway/status, datalogger/all/status e
+dataloggers/telemetry con il proprio intervallo (più jitter) e può andare in
+dropout (silenzio) per simulare dispositivi offline. Il LatencyTracker misura
+la latenza end-to-end publish → commit DB → evento WebSocket.
+"""
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from mqtt.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tipi canale usati per i device sintetici (gli altri diventano ch1, ch2, ...)
+CHANNEL_TYPES = [
+    ('accelerometer', 3),
+    ('inclinometer', 3),
+]
+
+TELEMETRY = 'telemetry'
+GATEWAY_STATUS = 'gateway_status'
+DATALOGGER_STATUS = 'datalogger_status'
+
+
+def _iso_timestamp(timestamp: datetime) -> str:
+    return timestamp.isoformat().replace('+00:00', 'Z')
+
+
+def build_telemetry_payload(site_code, gateway_number, devices, channels, timestamp, interval=5, seed=0):
+    """Costruisce un payload telemetry sintetico per un gateway (formato TEST_PAYLOAD)"""
+    device_list = []
+    for d in range(devices):
+        data = []
+        for c, (channel_type, width) in enumerate(_channel_types(channels)):
+            base = (seed + d + c) % 97
+            data.append({
+                "type": channel_type,
+                "value": [round(base * 0.01 + i * 0.001, 4) for i in range(width)]
+            })
+        device_list.append({
+            "type": "monstr-o",
+            "serial_number_device": device_serial(site_code, gateway_number, d),
+            "data": data
+        })
+
+    return {
+        "serial_number_gateway": gateway_serial(site_code, gateway_number),
+        "timestamp": _iso_timestamp(timestamp),
+        "message_interval_seconds": interval,
+        "mqtt_api_version": "1.0.0",
+        "dataloggers": [
+            {
+                "serial_number_datalogger": f"{site_code}_datalogger_{gateway_number}",
+                "status_datalogger": "running",
+                "devices": device_list
+            }
+        ]
+    }
+
+
+def build_schema_payload(site_code, gateway_number, devices, channels, interval=5, schema_id=1):
+    """Dizionario canali v2 (retained su [sito]/gateway/[n]/dataloggers/schema) per build_telemetry_payload_v2"""
+    return {
+        "mqtt_api_version": "v2.0.0",
+        "schema_id": schema_id,
+        "serial_number_gateway": gateway_serial(site_code, gateway_number),
+        "message_interval_seconds": interval,
+        "devices": [
+            {
+                "serial": device_serial(site_code, gateway_number, d),
+                "type": "monstr-o",
+                "channels": [channel_type for channel_type, _ in _channel_types(channels)]
+            }
+            for d in range(devices)
+        ]
+    }
+
+
+def build_telemetry_payload_v2(devices, channels, timestamp, seed=0, schema_id=1):
+    """Telemetria compatta v2: stessi valori di build_telemetry_payload, un solo array per slot"""
+    values = []
+    for d in range(devices):
+        for c, (_, width) in enumerate(_channel_types(channels)):
+            base = (seed + d + c) % 97
+            values.append([round(base * 0.01 + i * 0.001, 4) for i in range(width)])
+    return {
+        "mqtt_api_version": "v2.0.0",
+        "schema_id": schema_id,
+        "timestamp": round(timestamp.timestamp(), 3),
+        "values": values
+    }
+
+
+def _channel_types(channels):
+    """(tipo, larghezza) dei canali sintetici: CHANNEL_TYPES, poi ch1, ch2, ..."""
+    return [
+        CHANNEL_TYPES[c] if c < len(CHANNEL_TYPES) else (f"ch{c - len(CHANNEL_TYPES) + 1}", 1)
+        for c in range(channels)
+    ]
+
+
+def gateway_serial(site_code: str, gateway_number: int) -> str:
+    return f"{site_code}-gateway_{gateway_number}"
+
+
+def device_serial(site_code: str, gateway_number: int, device_index: int) -> str:
+    return f"{site_code.upper()}G{gateway_number:05d}D{device_index:04d}"
+
+
+class ProbeChannelLayer:
+    """
+    Channel layer sostitutivo per MqttMessageProcessor: registra ogni evento
+    WebSocket (per la misura di latenza) e opzionalmente lo inoltra al layer reale.
+    """
+
+    def __init__(self, on_event: Callable[[Dict[str, Any]], None], inner=None):
+        self.on_event = on_event
+        self.inner = inner
+
+    async def group_send(self, group: str, message: Dict[str, Any]) -> None:
+        try:
+            self.on_event(message.get('message', {}))
+        except Exception as e:
+            logger.error(f"Probe channel layer callback error: {e}")
+        if self.inner is not None:
+            await self.inner.group_send(group, message)
+
+
+class _PendingPublish:
+    __slots__ = ('published_at', 'expected_events', 'events')
+
+    def __init__(self, published_at: float, expected_events: int):
+        self.published_at = published_at
+        self.expected_events = expected_events
+        self.events = 0
+
+
+class LatencyTracker:
+    """
+    Correla i messaggi pubblicati con il loro commit (listener del message_tracer)
+    e con il primo evento WebSocket generato.
+
+    Il commit è correlato in ordine FIFO per topic (una connessione processa i
+    messaggi in ordine); l'evento WebSocket tramite il serial number contenuto
+    nell'evento, mappato sul gateway che lo ha pubblicato.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending_commit: Dict[str, deque] = defaultdict(deque)
+        self._pending_ws: Dict[tuple, deque] = defaultdict(deque)
+        self._serial_owner: Dict[str, str] = {}
+        self._last_publish_wall: Dict[str, float] = {}
+        self.is_silent: Callable[[str], bool] = lambda serial: False
+
+        self.published: Dict[str, int] = defaultdict(int)
+        self.processed: Dict[str, int] = defaultdict(int)
+        self.commit_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.ws_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.offline_detections: List[Dict[str, Any]] = []
+        self.unmatched = 0
+
+    def register_serial(self, serial: str, gateway: str) -> None:
+        self._serial_owner[serial] = gateway
+
+    def on_published(self, topic: str, kind: str, gateway: str, expected_events: int) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.published[kind] += 1
+            pending_ws = _PendingPublish(now, expected_events)
+            self._pending_commit[topic].append((now, kind, (gateway, kind), pending_ws))
+            self._pending_ws[(gateway, kind)].append(pending_ws)
+            if kind == TELEMETRY:
+                # Solo la telemetria aggiorna last_seen_at del gateway
+                self._last_publish_wall[gateway] = time.time()
+
+    def on_trace(self, trace) -> None:
+        """Listener del message_tracer: il messaggio è stato processato e committato"""
+        now = time.perf_counter()
+        with self._lock:
+            pending = self._pending_commit.get(trace.topic)
+            if not pending:
+                self.unmatched += 1
+                return
+            published_at, kind, ws_key, pending_ws = pending.popleft()
+            self.processed[f"{kind}:{'ok' if trace.result else 'error'}"] += 1
+            self.commit_latencies[kind].append(now - published_at)
+
+            # Un messaggio fallito non genera eventi: non deve restare in attesa
+            if not trace.result and pending_ws.events == 0:
+                try:
+                    self._pending_ws[ws_key].remove(pending_ws)
+                except ValueError:
+                    pass
+
+    def on_event(self, message: Dict[str, Any]) -> None:
+        """Callback del ProbeChannelLayer per ogni evento WebSocket"""
+        now = time.perf_counter()
+        event_type = message.get('type')
+        serial = message.get('serial_number')
+
+        if event_type == 'gateway_offline':
+            self._on_gateway_offline(serial)
+            return
+
+        if event_type == 'gateway_update':
+            key = (serial, GATEWAY_STATUS)
+        elif event_type == 'datalogger_update' and message.get('status') == 'online':
+            owner = self._serial_owner.get(serial)
+            if owner is None:
+                return
+            # Telemetria e status aggregato generano entrambi datalogger_update:
+            # attribuisce l'evento alla pubblicazione pendente più vecchia del gateway
+            with self._lock:
+                candidates = [
+                    (self._pending_ws[(owner, kind)][0].published_at, kind)
+                    for kind in (TELEMETRY, DATALOGGER_STATUS)
+                    if self._pending_ws.get((owner, kind))
+                ]
+            if not candidates:
+                return
+            key = (owner, min(candidates)[1])
+        else:
+            return
+
+        with self._lock:
+            pending = self._pending_ws.get(key)
+            if not pending:
+                return
+            head = pending[0]
+            if head.events == 0:
+                self.ws_latencies[key[1]].append(now - head.published_at)
+            head.events += 1
+            if head.events >= head.expected_events:
+                pending.popleft()
+
+    def _on_gateway_offline(self, serial: str) -> None:
+        now = time.time()
+        with self._lock:
+            last_publish = self._last_publish_wall.get(serial)
+        if last_publish is None:
+            return
+        self.offline_detections.append({
+            'gateway': serial,
+            'silence_seconds': now - last_publish,
+            'false_positive': not self.is_silent(serial),
+        })
+
+    def pending_commits(self) -> int:
+        with self._lock:
+            return sum(len(pending) for pending in self._pending_commit.values())
+
+    def summary(self) -> Dict[str, Any]:
+        def latency_stats(values: List[float]) -> Dict[str, float]:
+            ordered = sorted(values)
+            return {
+                'count': len(ordered),
+                'p50_ms': round(metrics.percentile(ordered, 50) * 1000, 2),
+                'p90_ms': round(metrics.percentile(ordered, 90) * 1000, 2),
+                'p99_ms': round(metrics.percentile(ordered, 99) * 1000, 2),
+                'max_ms': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            }
+
+        with self._lock:
+            return {
+                'published': dict(self.published),
+                'processed': dict(self.processed),
+                'unmatched': self.unmatched,
+                'pending': sum(len(pending) for pending in self._pending_commit.values()),
+                'publish_to_commit': {kind: latency_stats(v) for kind, v in self.commit_latencies.items()},
+                'publish_to_websocket': {kind: latency_stats(v) for kind, v in self.ws_latencies.items()},
+            }
+
+
+class VirtualGateway:
+    """Stato di un gateway simulato"""
+
+    __slots__ = ('number', 'serial', 'topic_prefix', 'interval', 'devices', 'silent_until', 'dropouts')
+
+    def __init__(self, site_code: str, number: int, interval: float, devices: int):
+        self.number = number
+        self.serial = gateway_serial(site_code, number)
+        self.topic_prefix = f"{site_code}/gateway/{number}"
+        self.interval = interval
+        self.devices = devices
+        self.silent_until = 0.0
+        self.dropouts = 0
+
+
+class FleetSimulator:
+    """
+    Scheduler dei gateway virtuali. Pubblica direttamente sul LocalMqttBroker:
+    il percorso broker → paho → MQTTService resta quello reale.
+    """
+
+    def __init__(self, broker, tracker: LatencyTracker, site_code: str, gateways: int, devices: int,
+                 channels: int, interval: float, status_interval: float, jitter: float = 0.1,
+                 dropout_rate: float = 0.0, dropout_duration: Optional[float] = None, seed: Optional[int] = None):
+        self.broker = broker
+        self.tracker = tracker
+        self.site_code = site_code
+        self.channels = channels
+        self.status_interval = status_interval
+        self.jitter = jitter
+        self.dropout_rate = dropout_rate
+        self.dropout_duration = dropout_duration if dropout_duration is not None else interval * 4
+        self.random = random.Random(seed)
+        self.gateways = [VirtualGateway(site_code, n, interval, devices) for n in range(1, gateways + 1)]
+        self._by_serial = {gateway.serial: gateway for gateway in self.gateways}
+        self._round = 0
+
+        for gateway in self.gateways:
+            for d in range(devices):
+                tracker.register_serial(device_serial(site_code, gateway.number, d), gateway.serial)
+        tracker.is_silent = self.is_silent
+
+    def is_silent(self, serial: str) -> bool:
+        gateway = self._by_serial.get(serial)
+        return gateway is not None and time.monotonic() < gateway.silent_until
+
+    def run(self, duration: float, stop_event: threading.Event) -> None:
+        """Pubblica secondo gli intervalli dei gateway finché scade duration o stop_event"""
+        start = time.monotonic()
+        end = start + duration
+        schedule = []
+        sequence = 0
+
+        # Distribuisce la prima pubblicazione sull'intervallo per evitare raffiche
+        for gateway in self.gateways:
+            schedule.append((start + self.random.uniform(0, gateway.interval), sequence, gateway, TELEMETRY))
+            sequence += 1
+            if self.status_interval > 0:
+                for kind in (GATEWAY_STATUS, DATALOGGER_STATUS):
+                    schedule.append((start + self.random.uniform(0, self.status_interval), sequence, gateway, kind))
+                    sequence += 1
+        heapq.heapify(schedule)
+
+        while schedule and not stop_event.is_set():
+            due, _, gateway, kind = schedule[0]
+            now = time.monotonic()
+            if due >= end:
+                break
+            if due > now:
+                stop_event.wait(min(due - now, 0.5))
+                continue
+
+            heapq.heappop(schedule)
+            if kind == TELEMETRY:
+                self._maybe_drop(gateway, now)
+                interval = gateway.interval
+            else:
+                interval = self.status_interval
+
+            if now >= gateway.silent_until:
+                self._publish(gateway, kind)
+
+            jitter = interval * self.jitter
+            heapq.heappush(schedule, (due + interval + self.random.uniform(-jitter, jitter), sequence, gateway, kind))
+            sequence += 1
+
+    def _maybe_drop(self, gateway: VirtualGateway, now: float) -> None:
+        if now < gateway.silent_until or self.dropout_rate <= 0:
+            return
+        if self.random.random() < self.dropout_rate:
+            gateway.silent_until = now + self.dropout_duration
+            gateway.dropouts += 1
+            logger.info(f"Simulated dropout: {gateway.serial} silent for {self.dropout_duration:.0f}s")
+
+    def _publish(self, gateway: VirtualGateway, kind: str) -> None:
+        timestamp = datetime.now(dt_timezone.utc)
+
+        if kind == TELEMETRY:
+            self._round += 1
+            topic = f"{gateway.topic_prefix}/dataloggers/telemetry"
+            payload = build_telemetry_payload(
+                self.site_code, gateway.number, gateway.devices, self.channels,
+                timestamp, interval=int(gateway.interval), seed=self._round
+            )
+            expected_events = gateway.devices
+        elif kind == DATALOGGER_STATUS:
+            topic = f"{gateway.topic_prefix}/datalogger/all/status"
+            payload = {
+                "timestamp": _iso_timestamp(timestamp),
+                "dataloggers": [
+                    {
+                        "serial_number": device_serial(self.site_code, gateway.number, d),
+                        "status": "running",
+                        # Stessi sensori della telemetria: quelli assenti verrebbero marcati offline
+                        "sensors_data": [
+                            {"serial_number": f"{device_serial(self.site_code, gateway.number, d)}-{channel}"}
+                            for channel in self._channel_names()
+                        ]
+                    }
+                    for d in range(gateway.devices)
+                ]
+            }
+            expected_events = gateway.devices
+        else:
+            topic = f"{gateway.topic_prefix}/status"
+            payload = {
+                "serial_number": gateway.serial,
+                "timestamp": _iso_timestamp(timestamp),
+                "firmware_version": "sim-1.0",
+                "hostname": f"sim-gw-{gateway.number}",
+            }
+            expected_events = 1
+
+        if not expected_events:
+            return
+        self.tracker.on_published(topic, kind, gateway.serial, expected_events)
+        self.broker.publish(topic, json.dumps(payload).encode('utf-8'))
+
+    def _channel_names(self) -> List[str]:
+        return [
+            CHANNEL_TYPES[c][0] if c < len(CHANNEL_TYPES) else f"ch{c - len(CHANNEL_TYPES) + 1}"
+            for c in range(self.channels)
+        ]
+
+    def dropout_count(self) -> int:
+        return sum(gateway.dropouts for gateway in self.gateways)
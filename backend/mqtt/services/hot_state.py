@@ -0,0 +1,373 @@
+"""
+Hot state dei sensori: ultime letture e stato nella cache condivisa (Redis), con scrittura
+ritardata (write-behind) dello stato SensorState su Postgres.
+
+Con HOT_STATE_ENABLED il path di ingest per-messaggio non riscrive più lo stato del sensore
+(3 JSON) a ogni lettura: aggiorna il buffer in memoria del processo mqtt_service e scrive
+le voci dei sensori toccati con un solo set_many (pipeline Redis). Le righe SensorState
+sono aggiornate al più ogni HOT_STATE_FLUSH_INTERVAL secondi con un bulk_update, con
+contatori incrementati del numero di letture accumulate.
+
+    mqtt:hot:sensor:{id}   {'datalogger_id', 'readings': [(timestamp, data), ...] (più recente
+                            prima, HOT_STATE_DEPTH letture), 'last_seen_at', 'is_online',
+                            'pending': letture non ancora scritte su Postgres}
+
+Le API dei sensori e lo snapshot WebSocket di subscribe_readings sovrappongono le voci con
+letture pendenti alle righe lette dal DB (una get_many per pagina). Dopo il flush le voci
+restano come cache delle ultime letture ma il DB torna la fonte (stato offline incluso).
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.utils import timezone
+
+from ..models import ChangeSequence, Sensor, SensorState
+
+logger = logging.getLogger(__name__)
+
+HOT_KEY = 'mqtt:hot:sensor:{sensor_id}'
+
+# Slot delle ultime letture su SensorState (last_timestamp_N / last_data_N)
+DB_READING_SLOTS = 3
+
+# Campi di SensorState scritti dal flush write-behind
+FLUSH_FIELDS = [
+    'last_timestamp_1', 'last_data_1', 'last_timestamp_2', 'last_data_2', 'last_timestamp_3', 'last_data_3',
+    'total_messages', 'total_readings', 'last_reading', 'last_seen_at',
+    'consecutive_misses', 'is_online', 'change_seq',
+]
+
+
+class SensorHotState:
+    """Buffer delle ultime letture per sensore, voci in Redis e flush ritardato su Postgres"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+        self._lock = threading.Lock()
+        # sensor_id -> {'datalogger_id', 'readings'} (processo mqtt_service)
+        self._buffers: Dict[int, Dict[str, Any]] = {}
+        # sensor_id -> {'count', 'first_seen_at', 'last_seen_at', 'interval'} non ancora su Postgres
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._last_flush = 0.0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _config(self, key: str, default):
+        return getattr(settings, 'MQTT_CONFIG', {}).get(key, default)
+
+    @property
+    def enabled(self) -> bool:
+        return self._config('HOT_STATE_ENABLED', False)
+
+    @property
+    def depth(self) -> int:
+        return max(self._config('HOT_STATE_DEPTH', DB_READING_SLOTS), DB_READING_SLOTS)
+
+    # ------------------------------------------------------------------
+    # Ingest (processo mqtt_service)
+    # ------------------------------------------------------------------
+
+    def record_on_commit(self, datalogger_id: int, interval: Optional[int], readings: List[tuple]) -> None:
+        """
+        record() dopo il commit della transazione di ingest: chi legge Redis non vede letture
+        annullate da un rollback e il flush non gira dentro la transazione (come
+        site_health.mark_dirty_on_commit).
+        """
+        if readings:
+            transaction.on_commit(lambda: self.record(datalogger_id, interval, readings))
+
+    def record(self, datalogger_id: int, interval: Optional[int], readings: List[tuple]) -> None:
+        """
+        Nuove letture (sensor_id, timestamp, data) dei sensori di un datalogger:
+        buffer, voci Redis in un solo set_many e coda per il flush su Postgres.
+        Da chiamare fuori dalle transazioni (record_on_commit).
+        """
+        if not readings:
+            return
+        self._seed({sensor_id for sensor_id, _, _ in readings})
+
+        entries = {}
+        with self._lock:
+            for sensor_id, timestamp, data in readings:
+                buffer = self._buffers.setdefault(sensor_id, {'datalogger_id': datalogger_id, 'readings': []})
+                buffer['readings'] = [(timestamp, data)] + buffer['readings'][:self.depth - 1]
+
+                pending = self._pending.setdefault(sensor_id, {'count': 0, 'first_seen_at': timestamp})
+                pending['count'] += 1
+                pending['last_seen_at'] = timestamp
+                pending['interval'] = interval
+                entries[HOT_KEY.format(sensor_id=sensor_id)] = self._entry(buffer, pending)
+
+        self._store(entries)
+        self.flush()
+
+    def _seed(self, sensor_ids: Iterable[int]) -> None:
+        """Buffer dei sensori non ancora visti dal processo, caricati dalle colonne last_* (una query)"""
+        with self._lock:
+            missing = [sensor_id for sensor_id in sensor_ids if sensor_id not in self._buffers]
+        if not missing:
+            return
+
+        columns = [f'last_{kind}_{slot}' for slot in range(1, DB_READING_SLOTS + 1) for kind in ('timestamp', 'data')]
+        rows = SensorState.objects.filter(pk__in=missing).values('sensor_id', 'sensor__datalogger_id', *columns)
+        with self._lock:
+            for row in rows:
+                self._buffers.setdefault(row['sensor_id'], {
+                    'datalogger_id': row['sensor__datalogger_id'],
+                    'readings': [
+                        (row[f'last_timestamp_{slot}'], row[f'last_data_{slot}'])
+                        for slot in range(1, DB_READING_SLOTS + 1)
+                        if row[f'last_timestamp_{slot}']
+                    ],
+                })
+
+    def _entry(self, buffer: Dict[str, Any], pending: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        readings = buffer['readings']
+        return {
+            'datalogger_id': buffer['datalogger_id'],
+            'readings': list(readings),
+            'last_seen_at': readings[0][0] if readings else None,
+            'is_online': True,
+            'pending': pending['count'] if pending else 0,
+        }
+
+    def _store(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        try:
+            self.cache.set_many(entries, timeout=self._config('HOT_STATE_TTL', 3600))
+        except Exception as e:
+            logger.warning(f"Could not write sensor hot state: {e}")
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Scrive su Postgres le letture pendenti (al più ogni HOT_STATE_FLUSH_INTERVAL, se non force).
+        Ritorna il numero di sensori aggiornati.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                return 0
+            if not force and now - self._last_flush < self._config('HOT_STATE_FLUSH_INTERVAL', 10.0):
+                return 0
+            self._last_flush = now
+            pending, self._pending = self._pending, {}
+            rows = {
+                sensor_id: (info, self._buffers[sensor_id]['readings'][:DB_READING_SLOTS])
+                for sensor_id, info in pending.items()
+            }
+
+        try:
+            self._write(rows)
+        except Exception as e:
+            # Riprova al prossimo flush, sommando alle letture arrivate nel frattempo
+            with self._lock:
+                for sensor_id, (info, _) in rows.items():
+                    current = self._pending.get(sensor_id)
+                    if current is None:
+                        self._pending[sensor_id] = info
+                    else:
+                        current['count'] += info['count']
+                        current['first_seen_at'] = info['first_seen_at']
+            logger.error(f"Error flushing sensor hot state: {e}")
+            return 0
+
+        # Voci senza nuove letture nel frattempo: il DB è di nuovo allineato
+        with self._lock:
+            entries = {
+                HOT_KEY.format(sensor_id=sensor_id): self._entry(self._buffers[sensor_id], None)
+                for sensor_id in rows if sensor_id not in self._pending
+            }
+        self._store(entries)
+        return len(rows)
+
+    def _write(self, rows: Dict[int, tuple]) -> None:
+        now = timezone.now()
+        with transaction.atomic():
+            # Un solo valore del change feed per tutte le righe del flush
+            change_seq = ChangeSequence.allocate()
+            existing = set(SensorState.objects.filter(pk__in=list(rows)).values_list('pk', flat=True))
+            new_states, updated_states, intervals = [], [], {}
+            for sensor_id, (info, readings) in rows.items():
+                slots = readings + [(None, {})] * (DB_READING_SLOTS - len(readings))
+                state = SensorState(sensor_id=sensor_id)
+                for slot, (timestamp, data) in enumerate(slots, start=1):
+                    setattr(state, f'last_timestamp_{slot}', timestamp)
+                    setattr(state, f'last_data_{slot}', data)
+                if sensor_id in existing:
+                    state.total_messages = models.F('total_messages') + info['count']
+                    state.total_readings = models.F('total_readings') + info['count']
+                    updated_states.append(state)
+                else:
+                    state.total_messages = state.total_readings = info['count']
+                    new_states.append(state)
+                state.last_reading = info['last_seen_at']
+                state.last_seen_at = info['last_seen_at']
+                state.consecutive_misses = 0
+                state.is_online = True
+                state.change_seq = change_seq
+                if info['interval'] is not None:
+                    intervals.setdefault(info['interval'], []).append(sensor_id)
+            SensorState.objects.bulk_create(new_states, batch_size=500)
+            SensorState.objects.bulk_update(updated_states, FLUSH_FIELDS, batch_size=500)
+
+            # Riga Sensor solo per i sensori con intervallo atteso cambiato
+            for interval, sensor_ids in intervals.items():
+                Sensor.objects.filter(pk__in=sensor_ids).exclude(expected_heartbeat_interval=interval).update(
+                    expected_heartbeat_interval=interval, updated_at=now, change_seq=change_seq
+                )
+
+    def merge_on_commit(self, readings: List[tuple]) -> None:
+        """
+        Letture (sensor_id, timestamp, data) scritte direttamente su Postgres dal path batch
+        (v2, discovery): dopo il commit entrano nel buffer dei sensori già visti, ordinate per
+        timestamp. Le letture pendenti restano in coda (contatori e ultime letture non persi):
+        il flush successivo riscrive gli slot dal buffer, che include la lettura del batch.
+        """
+        if readings:
+            transaction.on_commit(lambda: self._merge(readings))
+
+    def _merge(self, readings: List[tuple]) -> None:
+        entries = {}
+        with self._lock:
+            for sensor_id, timestamp, data in readings:
+                buffer = self._buffers.get(sensor_id)
+                if buffer is None:
+                    # Processo che non ha il sensore in memoria: ricaricato dal DB alla prossima lettura
+                    continue
+                merged = {ts: value for ts, value in buffer['readings']}
+                merged[timestamp] = data
+                buffer['readings'] = sorted(merged.items(), key=lambda item: item[0], reverse=True)[:self.depth]
+                pending = self._pending.get(sensor_id)
+                if pending is not None and pending['last_seen_at'] < timestamp:
+                    pending['last_seen_at'] = timestamp
+                entries[HOT_KEY.format(sensor_id=sensor_id)] = self._entry(buffer, pending)
+        self._store(entries)
+
+    def forget(self, sensor_ids: Iterable[int]) -> None:
+        """Sensori eliminati: buffer, letture pendenti e voci scartati"""
+        sensor_ids = list(sensor_ids)
+        if not sensor_ids:
+            return
+        with self._lock:
+            for sensor_id in sensor_ids:
+                self._buffers.pop(sensor_id, None)
+                self._pending.pop(sensor_id, None)
+        try:
+            self.cache.delete_many([HOT_KEY.format(sensor_id=sensor_id) for sensor_id in sensor_ids])
+        except Exception as e:
+            logger.warning(f"Could not discard sensor hot state: {e}")
+
+    # ------------------------------------------------------------------
+    # Lettura (API, consumer WebSocket)
+    # ------------------------------------------------------------------
+
+    def latest(self, sensor_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Voci hot state dei sensori indicati (una round trip), {} se disabilitato o non disponibile"""
+        sensor_ids = list(sensor_ids)
+        if not sensor_ids or not self.enabled:
+            return {}
+        try:
+            values = self.cache.get_many([HOT_KEY.format(sensor_id=sensor_id) for sensor_id in sensor_ids])
+        except Exception as e:
+            logger.warning(f"Sensor hot state unavailable: {e}")
+            return {}
+        return {int(key.rsplit(':', 1)[1]): entry for key, entry in values.items()}
+
+    def _overlay(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Valori di colonna di SensorState come sarebbero dopo il flush delle letture pendenti"""
+        readings = entry['readings'][:DB_READING_SLOTS]
+        readings = readings + [(None, {})] * (DB_READING_SLOTS - len(readings))
+        values = {}
+        for slot, (timestamp, data) in enumerate(readings, start=1):
+            values[f'last_timestamp_{slot}'] = timestamp
+            values[f'last_data_{slot}'] = data
+        values.update({
+            'last_reading': entry['last_seen_at'],
+            'last_seen_at': entry['last_seen_at'],
+            'is_online': entry['is_online'],
+            'consecutive_misses': 0,
+        })
+        return values
+
+    def apply_to_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Righe .values() (read path veloce, colonne state__*): colonne presenti sovrascritte dalle voci pendenti"""
+        entries = self.latest(row['id'] for row in rows)
+        for row in rows:
+            entry = entries.get(row['id'])
+            if not entry or not entry['pending']:
+                continue
+            for column, value in self._overlay(entry).items():
+                if f'state__{column}' in row:
+                    row[f'state__{column}'] = value
+            for column in ('total_messages', 'total_readings'):
+                if row.get(f'state__{column}') is not None:
+                    row[f'state__{column}'] += entry['pending']
+        return rows
+
+    def apply_to_sensors(self, sensors: Iterable[Sensor]) -> None:
+        """Istanze Sensor (serializer): campi caricati dello stato sovrascritti dalle voci pendenti"""
+        sensors = list(sensors)
+        entries = self.latest(sensor.pk for sensor in sensors)
+        for sensor in sensors:
+            entry = entries.get(sensor.pk)
+            if not entry or not entry['pending']:
+                continue
+            try:
+                state = sensor.state
+            except SensorState.DoesNotExist:
+                continue
+            deferred = state.get_deferred_fields()
+            for column, value in self._overlay(entry).items():
+                if column not in deferred:
+                    setattr(state, column, value)
+            for column in ('total_messages', 'total_readings'):
+                if column not in deferred:
+                    setattr(state, column, getattr(state, column) + entry['pending'])
+
+    def datalogger_snapshot(self, datalogger_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Evento sensor_readings (snapshot) con l'ultima lettura in hot state di ogni sensore
+        del datalogger, inviato al client quando si iscrive. None se non ci sono voci.
+        """
+        from ..api.serializers import current_value_from_data
+
+        rows = list(Sensor.objects.filter(datalogger_id=datalogger_id).values_list('id', 'datalogger__site_id'))
+        entries = self.latest(sensor_id for sensor_id, _ in rows)
+        readings = [
+            {
+                "id": sensor_id,
+                "timestamp": _format_timestamp(entries[sensor_id]['readings'][0][0]),
+                "data": entries[sensor_id]['readings'][0][1],
+                "current_value": current_value_from_data(entries[sensor_id]['readings'][0][1]),
+            }
+            for sensor_id, _ in rows
+            if sensor_id in entries and entries[sensor_id]['readings']
+        ]
+        if not readings:
+            return None
+        return {
+            "type": "sensor_readings",
+            "snapshot": True,
+            "site_id": rows[0][1],
+            "datalogger_id": datalogger_id,
+            "readings": readings,
+        }
+
+
+def _format_timestamp(timestamp: datetime) -> str:
+    """Come latest_readings nelle API (ISO 8601, 'Z' per UTC)"""
+    value = timestamp.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+# Singleton instance
+sensor_hot_state = SensorHotState()
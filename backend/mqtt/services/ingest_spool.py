@@ -0,0 +1,401 @@
+"""
+MQTT Ingest Spool - Write-ahead log locale per l'ingest dei messaggi
+
+Con lo spool abilitato ogni messaggio ricevuto viene scritto su un segmento
+append-only prima di ritornare dal callback paho (quindi prima del PUBACK per
+QoS 1). Un thread drainer processa i record in ordine e avanza un checkpoint
+dopo il commit sul DB. Al riavvio i record oltre il checkpoint vengono
+riprocessati per primi: un crash o un'interruzione del DB diventano backlog
+invece di perdita di dati (semantica at-least-once).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, connection
+
+from mqtt.services import metrics
+from mqtt.services.segment_log import FILE_MAGIC, SegmentWriter, encode_record, iter_segment, list_segments
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PREFIX = 'spool'
+CHECKPOINT_FILE = 'spool.checkpoint'
+
+spool_appended = metrics.registry.counter(
+    'mqtt_spool_records_appended_total',
+    'Messages written to the ingest spool'
+)
+spool_committed = metrics.registry.counter(
+    'mqtt_spool_records_committed_total',
+    'Spooled messages processed and checkpointed'
+)
+spool_db_outages = metrics.registry.counter(
+    'mqtt_spool_db_outages_total',
+    'Times the spool drainer paused to retry a record (database unavailable or handler error)'
+)
+spool_dropped_segments = metrics.registry.counter(
+    'mqtt_spool_dropped_segments_total',
+    'Spool segments with uncommitted records removed by the disk limit'
+)
+spool_backlog_bytes = metrics.registry.gauge(
+    'mqtt_spool_backlog_bytes',
+    'Bytes in the ingest spool not yet processed'
+)
+
+
+class DatabaseFailureProbe:
+    """
+    execute_wrapper che ricorda il primo errore di connessione al DB (OperationalError /
+    InterfaceError) anche se il chiamante lo intercetta e ritorna solo False.
+    Gli errori sui dati (IntegrityError, DataError, ...) riguardano il payload e non contano.
+    """
+
+    __slots__ = ('error',)
+
+    def __init__(self):
+        self.error: Optional[Exception] = None
+
+    def __call__(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError) as e:
+            if self.error is None:
+                self.error = e
+            raise
+
+
+class IngestSpool:
+    """
+    Spool durevole tra callback MQTT e message processor.
+
+    SYNC_MODE:
+        'batch'  - fsync in background ogni FSYNC_INTERVAL (finestra di perdita limitata)
+        'always' - il callback attende l'fsync (group commit tra connessioni concorrenti)
+    """
+
+    def __init__(self):
+        config = getattr(settings, 'MQTT_SPOOL', {})
+        self.enabled = config.get('ENABLED', False)
+        self.directory = config.get('DIR')
+        self.sync_mode = config.get('SYNC_MODE', 'batch')
+        self.fsync_interval = config.get('FSYNC_INTERVAL', 0.05)
+        self.checkpoint_interval = config.get('CHECKPOINT_INTERVAL', 1.0)
+        self.checkpoint_every = config.get('CHECKPOINT_EVERY', 200)
+        self.db_retry_max_delay = config.get('DB_RETRY_MAX_DELAY', 30)
+
+        self._writer = SegmentWriter(
+            self.directory,
+            SPOOL_PREFIX,
+            segment_bytes=int(config.get('SEGMENT_MB', 16)) * 1024 * 1024,
+            max_total_bytes=int(config.get('MAX_TOTAL_MB', 1024)) * 1024 * 1024,
+            fsync=True,
+            buffered=False,
+            on_remove=self._on_segment_removed,
+        ) if self.directory else None
+
+        if self.enabled and not self._writer:
+            logger.error("MQTT spool enabled but MQTT_SPOOL['DIR'] is not configured")
+            self.enabled = False
+
+        self._handler: Optional[Callable[[int, str, bytes], bool]] = None
+        self._append_lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._data_cond = threading.Condition()
+        self._appended_seq = 0
+        self._durable_seq = 0
+        self._syncing = False
+
+        # Cursore del drainer: (segmento, offset del prossimo record da processare)
+        self._cursor: Tuple[Optional[str], int] = (None, 0)
+        self._checkpointed: Tuple[Optional[str], int] = (None, 0)
+        self._since_checkpoint = 0
+        self._last_checkpoint = 0.0
+
+        self._stop = threading.Event()
+        self._drainer: Optional[threading.Thread] = None
+        self._fsyncer: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._drainer is not None and self._drainer.is_alive()
+
+    # ------------------------------------------------------------------
+    # Ciclo di vita
+    # ------------------------------------------------------------------
+
+    def start(self, handler: Callable[[int, str, bytes], bool]) -> None:
+        """
+        Avvia drainer e fsync in background. Il backlog non committato di
+        esecuzioni precedenti viene processato prima dei nuovi messaggi.
+
+        Args:
+            handler: callback(site_id, topic, payload) -> bool che processa un messaggio
+        """
+        if not self.enabled or self.running:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._handler = handler
+        self._stop.clear()
+        self._cursor = self._checkpointed = self._load_checkpoint()
+
+        backlog = self.backlog_bytes()
+        if backlog:
+            logger.warning(f"Ingest spool: replaying {backlog} bytes of uncommitted messages")
+
+        spool_backlog_bytes.set_function(self.backlog_bytes)
+        self._drainer = threading.Thread(target=self._drain_loop, name="mqtt-spool-drainer", daemon=True)
+        self._drainer.start()
+        if self.sync_mode != 'always':
+            self._fsyncer = threading.Thread(target=self._fsync_loop, name="mqtt-spool-fsync", daemon=True)
+            self._fsyncer.start()
+        logger.info(f"Ingest spool started in {self.directory} (sync mode: {self.sync_mode})")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Ferma il drainer (i record non processati restano nello spool) e salva il checkpoint"""
+        if not self._drainer:
+            return
+
+        self._stop.set()
+        with self._data_cond:
+            self._data_cond.notify_all()
+        self._drainer.join(timeout)
+        if self._drainer.is_alive():
+            logger.warning("Ingest spool drainer did not stop in time")
+        if self._fsyncer:
+            self._fsyncer.join(timeout)
+
+        self._writer.close()
+        self._write_checkpoint()
+        self._drainer = None
+        self._fsyncer = None
+        logger.info(f"Ingest spool stopped (backlog: {self.backlog_bytes()} bytes)")
+
+    # ------------------------------------------------------------------
+    # Scrittura (thread delle connessioni MQTT)
+    # ------------------------------------------------------------------
+
+    def append(self, site_id: int, topic: str, payload: bytes, qos: int = 0, retain: bool = False) -> None:
+        """Scrive un messaggio nello spool; con SYNC_MODE 'always' ritorna dopo l'fsync"""
+        received_at = time.time()
+        record = encode_record(received_at, site_id, topic, qos, retain, payload)
+        with self._append_lock:
+            self._writer.append(record, received_at)
+            self._appended_seq += 1
+            seq = self._appended_seq
+        spool_appended.inc()
+
+        if self.sync_mode == 'always':
+            self._wait_durable(seq)
+
+        with self._data_cond:
+            self._data_cond.notify()
+
+    def _wait_durable(self, seq: int) -> None:
+        """Group commit: un solo thread esegue l'fsync per tutti i record in attesa"""
+        with self._sync_cond:
+            while self._durable_seq < seq:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                target = self._appended_seq
+                self._sync_cond.release()
+                try:
+                    self._writer.sync()
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                self._durable_seq = max(self._durable_seq, target)
+                self._sync_cond.notify_all()
+
+    def _fsync_loop(self) -> None:
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self._writer.sync()
+            except Exception as e:
+                logger.error(f"Ingest spool fsync error: {e}")
+
+    def _on_segment_removed(self, path: str) -> None:
+        segment, _ = self._cursor
+        if segment is None or os.path.basename(path) >= os.path.basename(segment):
+            spool_dropped_segments.inc()
+            logger.error(f"Ingest spool over disk limit: dropping unprocessed segment {path}")
+
+    # ------------------------------------------------------------------
+    # Drainer
+    # ------------------------------------------------------------------
+
+    def _drain_loop(self) -> None:
+        logger.info("Ingest spool drainer started")
+        while not self._stop.is_set():
+            try:
+                processed = self._drain_available()
+            except Exception as e:
+                logger.error(f"Ingest spool drainer error: {e}", exc_info=True)
+                processed = 0
+
+            self._maybe_checkpoint(force=processed == 0)
+            if processed == 0:
+                with self._data_cond:
+                    self._data_cond.wait(0.5)
+
+        self._maybe_checkpoint(force=True)
+        close_old_connections()
+        logger.info("Ingest spool drainer stopped")
+
+    def _drain_available(self) -> int:
+        """
+        Processa i record disponibili a partire dal cursore.
+
+        Returns:
+            int: record processati (+1 se il cursore è passato al segmento successivo)
+        """
+        segments = list_segments(self.directory, SPOOL_PREFIX)
+        if not segments:
+            return 0
+
+        segment, offset = self._cursor
+        names = [os.path.basename(path) for path in segments]
+        if segment is None or os.path.basename(segment) not in names:
+            # Primo avvio o segmento eliminato: riparte dal primo segmento successivo
+            following = [
+                path for path in segments
+                if segment is None or os.path.basename(path) > os.path.basename(segment)
+            ]
+            if not following:
+                return 0
+            segment, offset = following[0], 0
+            self._cursor = (segment, offset)
+
+        # Letto PRIMA dell'iterazione: se il writer ha già ruotato, il segmento è completo
+        sealed = segment != self._writer.current_segment
+
+        processed = 0
+        for record in iter_segment(segment, offset):
+            if self._stop.is_set():
+                return processed
+            if not self._process_record(record):
+                return processed
+            self._cursor = (segment, record.end_offset)
+            processed += 1
+            self._maybe_checkpoint()
+
+        index = names.index(os.path.basename(segment))
+        if sealed and index + 1 < len(segments):
+            self._cursor = (segments[index + 1], 0)
+            self._maybe_checkpoint(force=True)
+            self._remove_segment(segment)
+            processed += 1
+        return processed
+
+    def _process_record(self, record) -> bool:
+        """
+        Processa un record. Il record è consumato se il handler ha avuto successo o se ha
+        rifiutato il messaggio senza errori di database (payload non decodificabile, non
+        valido, ...: ritentare darebbe lo stesso risultato). Errori di connessione al DB,
+        anche se intercettati dal message processor, ed eccezioni del handler: attesa con
+        backoff e nuovo tentativo dello stesso record, il cursore non avanza.
+        """
+        delay = 1.0
+        while not self._stop.is_set():
+            probe = DatabaseFailureProbe()
+            try:
+                with connection.execute_wrapper(probe):
+                    ok = self._handler(record.site_id, record.topic, record.payload)
+                # Connessione non stabilita: l'errore non passa dall'execute_wrapper
+                failed = probe.error is not None or (not ok and connection.connection is None)
+                error = probe.error or 'cannot connect to the database'
+            except Exception as e:
+                ok, failed, error = False, True, e
+
+            if ok or not failed:
+                spool_committed.inc()
+                return True
+
+            spool_db_outages.inc()
+            logger.warning(
+                f"Ingest spool: processing {record.topic} failed ({error}), retrying in {delay:.0f}s "
+                f"(backlog {self.backlog_bytes()} bytes)"
+            )
+            # Forza una nuova connessione al prossimo tentativo
+            try:
+                connection.close()
+            except DatabaseError:
+                pass
+            self._stop.wait(delay)
+            delay = min(delay * 2, self.db_retry_max_delay)
+        return False
+
+    def _remove_segment(self, path: str) -> None:
+        try:
+            os.remove(path)
+            logger.debug(f"Ingest spool: removed processed segment {path}")
+        except OSError as e:
+            logger.error(f"Ingest spool: cannot remove segment {path}: {e}")
+
+    # ------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------
+
+    def _maybe_checkpoint(self, force: bool = False) -> None:
+        if self._cursor == self._checkpointed:
+            return
+        self._since_checkpoint += 1
+        now = time.monotonic()
+        if force or self._since_checkpoint >= self.checkpoint_every or now - self._last_checkpoint >= self.checkpoint_interval:
+            self._write_checkpoint()
+
+    def _write_checkpoint(self) -> None:
+        segment, offset = self._cursor
+        if segment is None:
+            return
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'segment': os.path.basename(segment), 'offset': offset}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._checkpointed = self._cursor
+            self._since_checkpoint = 0
+            self._last_checkpoint = time.monotonic()
+        except OSError as e:
+            logger.error(f"Ingest spool: cannot write checkpoint: {e}")
+
+    def _load_checkpoint(self) -> Tuple[Optional[str], int]:
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return os.path.join(self.directory, data['segment']), int(data['offset'])
+        except FileNotFoundError:
+            return None, 0
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ingest spool: invalid checkpoint {path} ({e}), replaying all segments")
+            return None, 0
+
+    def backlog_bytes(self) -> int:
+        """Byte nello spool successivi al cursore del drainer"""
+        segment, offset = self._cursor
+        total = 0
+        for path in list_segments(self.directory, SPOOL_PREFIX):
+            if segment is not None and os.path.basename(path) < os.path.basename(segment):
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            start = max(offset, len(FILE_MAGIC)) if path == segment else len(FILE_MAGIC)
+            total += max(size - start, 0)
+        return total
+
+
+# Singleton instance
+ingest_spool = IngestSpool()
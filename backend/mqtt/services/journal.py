@@ -0,0 +1,125 @@
+"""
+MQTT Message Journal - Journal append-only dei messaggi raw ricevuti
+
+Ogni messaggio ricevuto da MQTTConnectionManager._on_message viene scritto
+(received_at, site_id, topic, qos, retain, payload) su segmenti a rotazione.
+Il comando replay_journal li rilegge per riprocessarli o riprodurre il carico.
+"""
+import logging
+import threading
+import time
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+from mqtt.services import metrics
+from mqtt.services.segment_log import SegmentRecord, SegmentWriter, encode_record, iter_segment, \
+    list_segments, segment_start_time
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = 'journal'
+
+journal_records = metrics.registry.counter(
+    'mqtt_journal_records_total',
+    'Raw MQTT messages written to the message journal'
+)
+journal_bytes = metrics.registry.counter(
+    'mqtt_journal_bytes_total',
+    'Bytes written to the message journal'
+)
+journal_errors = metrics.registry.counter(
+    'mqtt_journal_errors_total',
+    'Message journal write errors'
+)
+
+
+class MessageJournal:
+    """
+    Journal opzionale (settings.MQTT_JOURNAL['ENABLED']).
+    Gli errori di scrittura vengono loggati ma non interrompono mai l'ingest.
+    """
+
+    def __init__(self):
+        config = getattr(settings, 'MQTT_JOURNAL', {})
+        self.enabled = config.get('ENABLED', False)
+        self.directory = config.get('DIR')
+        self.flush_interval = config.get('FLUSH_INTERVAL', 1.0)
+        self._writer = SegmentWriter(
+            self.directory,
+            JOURNAL_PREFIX,
+            segment_bytes=int(config.get('SEGMENT_MB', 64)) * 1024 * 1024,
+            max_total_bytes=int(config.get('MAX_TOTAL_MB', 2048)) * 1024 * 1024,
+            max_segment_age=config.get('SEGMENT_MAX_AGE', 3600),
+            flush_interval=self.flush_interval,
+        ) if self.directory else None
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_lock = threading.Lock()
+
+        if self.enabled and not self._writer:
+            logger.error("MQTT journal enabled but MQTT_JOURNAL['DIR'] is not configured")
+            self.enabled = False
+
+    def append(self, site_id: int, topic: str, qos: int, retain: bool, payload: bytes,
+               received_at: Optional[float] = None) -> None:
+        """Scrive un messaggio raw nel journal (no-op se disabilitato)"""
+        if not self.enabled:
+            return
+
+        received_at = received_at if received_at is not None else time.time()
+        try:
+            record = encode_record(received_at, site_id, topic, qos, retain, payload)
+            self._writer.append(record, received_at)
+            journal_records.inc()
+            journal_bytes.inc(amount=len(record))
+        except Exception as e:
+            journal_errors.inc()
+            logger.error(f"Error writing MQTT journal: {e}")
+            return
+
+        if self._flusher is None:
+            self._start_flusher()
+
+    def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+
+    def _start_flusher(self) -> None:
+        """Thread che forza il flush anche nei periodi senza traffico"""
+        with self._flusher_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="mqtt-journal-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._writer.flush()
+            except Exception as e:
+                logger.error(f"Error flushing MQTT journal: {e}")
+
+    def read(self, start: Optional[float] = None, end: Optional[float] = None,
+             directory: Optional[str] = None) -> Iterator[SegmentRecord]:
+        """
+        Itera i record con received_at nell'intervallo [start, end), in ordine.
+        I segmenti interamente fuori intervallo non vengono aperti.
+        """
+        segments = list_segments(directory or self.directory, JOURNAL_PREFIX)
+        for index, path in enumerate(segments):
+            if end is not None and segment_start_time(path) >= end:
+                break
+            if start is not None and index + 1 < len(segments) and segment_start_time(segments[index + 1]) <= start:
+                continue
+
+            for record in iter_segment(path):
+                if start is not None and record.received_at < start:
+                    continue
+                if end is not None and record.received_at >= end:
+                    continue
+                yield record
+
+
+# Singleton instance
+message_journal = MessageJournal()
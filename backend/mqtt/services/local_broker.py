@@ -0,0 +1,368 @@
+"""
+Local MQTT Broker - Broker MQTT 3.1.1 minimale in-process per test e simulazioni
+
+Supporta il sottoinsieme di protocollo usato da MQTTConnectionManager (paho):
+CONNECT/CONNACK, SUBSCRIBE/SUBACK (wildcard + e #), UNSUBSCRIBE, PUBLISH QoS 0/1/2
+in ingresso (consegna con QoS massimo 1), retained messages, PINGREQ e DISCONNECT.
+Non implementa sessioni persistenti, will message né autenticazione: non è pensato
+per la produzione.
+"""
+import asyncio
+import logging
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tipi pacchetto MQTT (nibble alto del primo byte)
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Verifica se un topic corrisponde a un filtro MQTT con wildcard + e #"""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+
+    # I topic di sistema ($SYS/...) non sono coperti dalle wildcard al primo livello
+    if topic.startswith('$') and filter_parts[0] in ('+', '#'):
+        return False
+
+    for index, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[index]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('!H', len(data)) + data
+
+
+def _packet(first_byte: int, body: bytes = b'') -> bytes:
+    return bytes([first_byte]) + _encode_length(len(body)) + body
+
+
+class _ClientSession:
+    """Stato di un client connesso"""
+
+    def __init__(self, broker: 'LocalMqttBroker', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id: Optional[str] = None
+        self.subscriptions: Dict[str, int] = {}
+        self._next_packet_id = 0
+        self.closed = False
+
+    @property
+    def peer(self) -> str:
+        return str(self.writer.get_extra_info('peername'))
+
+    def next_packet_id(self) -> int:
+        self._next_packet_id = self._next_packet_id % 65535 + 1
+        return self._next_packet_id
+
+    def send(self, data: bytes) -> None:
+        if not self.closed:
+            self.writer.write(data)
+
+    def deliver(self, topic: str, payload: bytes, qos: int, retain: bool = False) -> None:
+        first_byte = (PUBLISH << 4) | (qos << 1) | (1 if retain else 0)
+        body = _encode_string(topic)
+        if qos > 0:
+            body += struct.pack('!H', self.next_packet_id())
+        self.send(_packet(first_byte, body + payload))
+        self.broker.stats['messages_out'] += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    async def read_packet(self) -> Tuple[int, int, bytes]:
+        header = await self.reader.readexactly(1)
+        multiplier = 1
+        length = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+            if multiplier > 128 ** 3:
+                raise ValueError("Malformed remaining length")
+        body = await self.reader.readexactly(length) if length else b''
+        return header[0] >> 4, header[0] & 0x0F, body
+
+
+class LocalMqttBroker:
+    """
+    Broker MQTT in-process eseguito su un event loop asyncio in un thread dedicato.
+
+    Utilizzo:
+        broker = LocalMqttBroker(port=0)   # porta 0 = porta libera scelta dal sistema
+        broker.start()
+        broker.publish('site/gateway/1/status', b'{}')
+        broker.stop()
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 1883):
+        self.host = host
+        self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._sessions: List[_ClientSession] = []
+        self._retained: Dict[str, Tuple[bytes, int]] = {}
+        self.stats = {
+            'connections': 0,
+            'messages_in': 0,
+            'messages_out': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Ciclo di vita
+    # ------------------------------------------------------------------
+
+    def start(self, timeout: float = 10.0) -> int:
+        """
+        Avvia il broker in un thread daemon.
+
+        Returns:
+            int: porta TCP effettiva in ascolto
+        """
+        if self._thread and self._thread.is_alive():
+            return self.port
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="mqtt-local-broker", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout) or self._server is None:
+            raise RuntimeError(f"Local MQTT broker did not start on {self.host}:{self.port}")
+        return self.port
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Chiude tutte le connessioni e ferma il broker"""
+        if not self.loop or not self._thread:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            logger.info(f"Local MQTT broker listening on {self.host}:{self.port}")
+        except OSError as e:
+            logger.error(f"Cannot start local MQTT broker on {self.host}:{self.port}: {e}")
+            self._server = None
+            self._ready.set()
+            return
+
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            logger.info("Local MQTT broker stopped")
+
+    async def _shutdown(self) -> None:
+        for session in list(self._sessions):
+            session.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.loop.stop()
+
+    # ------------------------------------------------------------------
+    # API thread-safe
+    # ------------------------------------------------------------------
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False) -> None:
+        """Pubblica un messaggio come se arrivasse da un client (thread-safe)"""
+        if not self.loop:
+            raise RuntimeError("Local MQTT broker is not running")
+        self.loop.call_soon_threadsafe(self._route, topic, payload, qos, retain)
+
+    def has_subscriber(self, topic: str) -> bool:
+        """True se almeno un client è sottoscritto a un filtro che copre il topic"""
+        return any(
+            topic_matches(topic_filter, topic)
+            for session in list(self._sessions)
+            for topic_filter in list(session.subscriptions)
+        )
+
+    def client_count(self) -> int:
+        return len(self._sessions)
+
+    # ------------------------------------------------------------------
+    # Protocollo
+    # ------------------------------------------------------------------
+
+    def _route(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        self.stats['messages_in'] += 1
+
+        if retain:
+            if payload:
+                self._retained[topic] = (payload, qos)
+            else:
+                self._retained.pop(topic, None)
+
+        for session in list(self._sessions):
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    granted = max(granted or 0, sub_qos)
+            if granted is not None:
+                session.deliver(topic, payload, min(qos, granted, 1))
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = _ClientSession(self, reader, writer)
+        try:
+            packet_type, flags, body = await session.read_packet()
+            if packet_type != CONNECT:
+                return
+            self._handle_connect(session, body)
+
+            while not session.closed:
+                packet_type, flags, body = await session.read_packet()
+
+                if packet_type == PUBLISH:
+                    self._handle_publish(session, flags, body)
+                elif packet_type == PUBREL:
+                    session.send(_packet(PUBCOMP << 4, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    self._handle_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._handle_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(_packet(PINGRESP << 4))
+                elif packet_type == DISCONNECT:
+                    break
+                # PUBACK/PUBREC/PUBCOMP dai subscriber: nessuno stato da aggiornare
+
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning(f"Local broker: error on client {session.client_id or session.peer}: {e}")
+        finally:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            session.close()
+            logger.debug(f"Local broker: client {session.client_id} disconnected")
+
+    def _handle_connect(self, session: _ClientSession, body: bytes) -> None:
+        offset = 0
+        name_length = struct.unpack_from('!H', body, offset)[0]
+        offset += 2 + name_length + 1  # protocol name + protocol level
+        offset += 1 + 2  # connect flags + keep alive
+        client_id_length = struct.unpack_from('!H', body, offset)[0]
+        offset += 2
+        session.client_id = body[offset:offset + client_id_length].decode('utf-8') or f"anon-{id(session)}"
+
+        # Client takeover: stesso client_id chiude la sessione precedente (come i broker reali)
+        for existing in list(self._sessions):
+            if existing.client_id == session.client_id:
+                logger.info(f"Local broker: client takeover for {session.client_id}")
+                self._sessions.remove(existing)
+                existing.close()
+
+        self._sessions.append(session)
+        self.stats['connections'] += 1
+        session.send(_packet(CONNACK << 4, b'\x00\x00'))
+        logger.debug(f"Local broker: client {session.client_id} connected from {session.peer}")
+
+    def _handle_publish(self, session: _ClientSession, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic_length = struct.unpack_from('!H', body, 0)[0]
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+
+        if qos > 0:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            if qos == 1:
+                session.send(_packet(PUBACK << 4, packet_id))
+            else:
+                session.send(_packet(PUBREC << 4, packet_id))
+
+        self._route(topic, body[offset:], qos, retain)
+
+    def _handle_subscribe(self, session: _ClientSession, body: bytes) -> None:
+        packet_id = body[:2]
+        offset = 2
+        granted = bytearray()
+        new_filters = []
+
+        while offset < len(body):
+            filter_length = struct.unpack_from('!H', body, offset)[0]
+            offset += 2
+            topic_filter = body[offset:offset + filter_length].decode('utf-8')
+            offset += filter_length
+            requested_qos = body[offset] & 0x03
+            offset += 1
+
+            qos = min(requested_qos, 1)
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            new_filters.append(topic_filter)
+
+        session.send(_packet((SUBACK << 4), packet_id + bytes(granted)))
+
+        for topic_filter in new_filters:
+            for topic, (payload, qos) in self._retained.items():
+                if topic_matches(topic_filter, topic):
+                    session.deliver(topic, payload, min(qos, session.subscriptions[topic_filter]), retain=True)
+
+    def _handle_unsubscribe(self, session: _ClientSession, body: bytes) -> None:
+        packet_id = body[:2]
+        offset = 2
+        while offset < len(body):
+            filter_length = struct.unpack_from('!H', body, offset)[0]
+            offset += 2
+            session.subscriptions.pop(body[offset:offset + filter_length].decode('utf-8'), None)
+            offset += filter_length
+        session.send(_packet(UNSUBACK << 4, packet_id))
@@ -1,15 +1,33 @@
 """
 MQTT Message Processor - Gestisce i messaggi MQTT ricevuti
 """
+import functools
 import json
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
 from typing import Dict, Any, List, Optional
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction, models
+from django.core.exceptions import ValidationError
 
-from ..models import MqttConnection, DiscoveredTopic, Gateway, Datalogger, Sensor
+from ..models import (
+    ChangeSequence, MqttConnection, DiscoveredTopic, Gateway, Datalogger, Sensor,
+    GatewayState, DataloggerState, SensorState,
+)
 from .mqtt_versioning import versioned_processor
+from . import metrics
+from .tracing import message_tracer
+from .payload_codec import DecodedPayload, PayloadDecodeError, decode_payload, split_topic_suffix
+from .response_cache import response_cache
+from .site_health import site_health
+from .hot_state import sensor_hot_state
+from .metadata_snapshots import gateway_metadata
+from .broadcast import readings_group
+from .stream_fanout import stream_fanout
+from ..api.serializers import current_value_from_data
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
@@ -23,19 +41,30 @@ class MqttMessageProcessor:
     1. [sito]/gateway/[n]/status -> Info generiche Gateway (salva raw data)
     2. [sito]/gateway/[n]/datalogger/all/status -> Dati aggregati Datalogger/Sensori (formato legacy)
     3. [sito]/gateway/[n]/dataloggers/telemetry -> Telemetria completa devices + sensori
+    4. [sito]/gateway/[n]/dataloggers/schema -> Dizionario canali per la telemetria compatta v2
     """
 
     def __init__(self):
         self.channel_layer = get_channel_layer()
+        # Accumulatori per-thread (tempo broadcast del messaggio corrente)
+        self._local = threading.local()
+        # Tabelle handler per major version di mqtt_api_version
+        self.versioned_processor = versioned_processor
+        self.versioned_processor.bind(self)
 
     def _broadcast_update(self, site_id: int, event_type: str, data: dict = None):
         """
-        Invia aggiornamento via WebSocket
+        Invia aggiornamento via WebSocket e invalida le risposte API in cache toccate dall'evento
+        (e i contatori di salute del sito, ricalcolati in blocco da site_health)
         """
-        try:
-            if not self.channel_layer:
-                return
+        response_cache.invalidate_event(site_id, event_type, data)
+        site_health.mark_dirty_on_commit(site_id)
 
+        if not self.channel_layer:
+            return
+
+        start = time.perf_counter()
+        try:
             message = {
                 "type": event_type,
                 "site_id": site_id,
@@ -51,59 +80,202 @@ class MqttMessageProcessor:
                     "message": message
                 }
             )
+            metrics.broadcasts.inc(event_type)
         except Exception as e:
+            metrics.broadcast_errors.inc(event_type)
             logger.error(f"Error broadcasting WebSocket update: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.stage_duration.observe(elapsed, 'broadcast')
+            self._local.broadcast_seconds = getattr(self._local, 'broadcast_seconds', 0.0) + elapsed
+
+    def _broadcast_readings(self, site_id: int, datalogger_id: int, readings: List[tuple]):
+        """
+        Evento opt-in sensor_readings con le letture appena salvate, inviato solo ai client
+        iscritti al datalogger (subscribe_readings): le viste live si aggiornano senza REST.
+
+        Args:
+            readings: lista di (sensor_id, timestamp, data)
+        """
+        if not readings or not self.channel_layer or not self._readings_enabled():
+            return
+
+        start = time.perf_counter()
+        try:
+            message = {
+                "type": "sensor_readings",
+                "site_id": site_id,
+                "datalogger_id": datalogger_id,
+                "readings": [
+                    {
+                        "id": sensor_id,
+                        "timestamp": self._format_reading_timestamp(timestamp),
+                        "data": data,
+                        "current_value": current_value_from_data(data),
+                    }
+                    for sensor_id, timestamp, data in readings
+                ]
+            }
+            async_to_sync(self.channel_layer.group_send)(
+                readings_group(datalogger_id),
+                {
+                    "type": "status_update",
+                    "message": message
+                }
+            )
+            metrics.broadcasts.inc("sensor_readings")
+        except Exception as e:
+            metrics.broadcast_errors.inc("sensor_readings")
+            logger.error(f"Error broadcasting sensor readings: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.stage_duration.observe(elapsed, 'broadcast')
+            self._local.broadcast_seconds = getattr(self._local, 'broadcast_seconds', 0.0) + elapsed
+
+    def _broadcast_datalogger_telemetry(self, site_id: int, datalogger: Datalogger,
+                                        readings: Optional[List[tuple]]):
+        """
+        Eventi di un datalogger dopo la telemetria (da chiamare a commit avvenuto): datalogger_update
+        (has_readings: segue un evento sensor_readings per i client iscritti) e letture live
+        """
+        self._broadcast_update(site_id, "datalogger_update", {
+            "datalogger_id": datalogger.id,
+            "serial_number": datalogger.serial_number,
+            "status": "online",
+            "has_readings": bool(readings) and self._readings_enabled()
+        })
+        self._broadcast_readings(site_id, datalogger.id, readings)
+        self._publish_streams(readings)
+
+    def _publish_streams(self, readings: Optional[List[tuple]]):
+        """Letture salvate agli stream live per sensore (subscribe_stream), ridotte per livello in stream_fanout"""
+        if not readings or not getattr(settings, 'MQTT_CONFIG', {}).get('WS_STREAM_ENABLED', True):
+            return
+        for sensor_id, timestamp, data in readings:
+            stream_fanout.publish(sensor_id, timestamp, data)
+
+    def _readings_enabled(self) -> bool:
+        return getattr(settings, 'MQTT_CONFIG', {}).get('WS_READINGS_ENABLED', True)
+
+    def _format_reading_timestamp(self, timestamp: datetime) -> str:
+        """Come latest_readings nelle API (ISO 8601, 'Z' per UTC)"""
+        value = timestamp.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
 
     def process_message(self, site_id: int, topic: str, payload: bytes, qos: int, retain: bool) -> bool:
         """
         Entry point per il processing dei messaggi.
+        Registra metriche per stage (decode, discovery, persist, broadcast) e query DB;
+        i messaggi campionati o lenti vengono scritti nel trace/slow log.
         """
-        try:
-            # Decodifica payload JSON
-            payload_data = None
+        started = time.perf_counter()
+        topic_type = 'unknown'
+        result = False
+        trace = message_tracer.begin(site_id, topic, payload)
+        self._local.trace = trace
+        self._local.broadcast_seconds = 0.0
+
+        capture_sql = trace.sampled and message_tracer.config.capture_sql
+        with metrics.query_probe(capture_sql, message_tracer.config.max_queries) as probe:
             try:
-                if isinstance(payload, bytes):
-                    payload_str = payload.decode('utf-8')
-                else:
-                    payload_str = payload
-                payload_data = json.loads(payload_str)
-            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError) as e:
-                # Log solo errori gravi, ignoriamo payload non-json
+                # Decodifica payload: decompressione (gzip/zlib) se presente, poi JSON
+                stage_start = started
                 payload_data = None
+                decoded = None
+                try:
+                    decoded = decode_payload(topic, payload)
+                except PayloadDecodeError as e:
+                    logger.warning(f"Cannot decode compressed payload on topic {topic}: {e}")
+                # Topic logico: senza suffisso di compressione (.gz, .zlib, ...)
+                logical_topic = decoded.topic if decoded else split_topic_suffix(topic)[0]
+                try:
+                    if decoded is not None:
+                        payload_data = json.loads(decoded.data)
+                except (json.JSONDecodeError, UnicodeDecodeError, TypeError) as e:
+                    # Log solo errori gravi, ignoriamo payload non-json
+                    payload_data = None
+                stage_start = self._observe_stage('decode', stage_start)
+
+                # Parse della struttura topic
+                topic_info = self._parse_topic_structure(logical_topic)
+                topic_type = topic_info['type']
+                metrics.messages_received.inc(site_id, topic_type)
+
+                # **STEP 1: AUTO-DISCOVERY - Salva TUTTI i topic ricevuti**
+                self._save_discovered_topic(site_id, topic, payload_data, payload, decoded)
+                stage_start = self._observe_stage('discovery', stage_start)
+
+                # **STEP 2: PROCESSING - solo per topic riconosciuti**
+                # Se il topic non è riconosciuto, log e ignora (ma è già stato salvato in discovered_topic)
+                if decoded is None:
+                    result = False
+                elif topic_type == 'unknown':
+                    logger.debug(f"Topic discovered but not recognized for processing: {topic}")
+                    result = True
+                else:
+                    logger.info(f"Processing topic: {topic} (Type: {topic_type})")
+                    result = self._dispatch(site_id, logical_topic, payload_data, topic_info)
 
-            # **STEP 1: AUTO-DISCOVERY - Salva TUTTI i topic ricevuti**
-            self._save_discovered_topic(site_id, topic, payload_data, payload)
-
-            # **STEP 2: PARSING e PROCESSING - solo per topic riconosciuti**
-            # Parse della struttura topic
-            topic_info = self._parse_topic_structure(topic)
-
-            # Se il topic non è riconosciuto, log e ignora (ma è già stato salvato in discovered_topic)
-            if topic_info['type'] == 'unknown':
-                logger.debug(f"Topic discovered but not recognized for processing: {topic}")
-                return True
-
-            logger.info(f"Processing topic: {topic} (Type: {topic_info['type']})")
-
-            # Dispatcher
-            if topic_info['type'] == 'gateway_status':
-                return self._process_gateway_status(site_id, topic, payload_data, topic_info)
-
-            elif topic_info['type'] == 'datalogger_status_aggregated':
-                return self._process_datalogger_status_aggregated(site_id, topic, payload_data, topic_info)
-
-            elif topic_info['type'] == 'dataloggers_telemetry':
-                return self._process_dataloggers_telemetry(site_id, topic, payload_data, topic_info)
+                    # Il tempo di broadcast è misurato a parte, lo escludiamo dal persist
+                    persist_seconds = max(
+                        time.perf_counter() - stage_start - self._local.broadcast_seconds, 0.0
+                    )
+                    metrics.stage_duration.observe(persist_seconds, 'persist')
+                    trace.add_stage('persist', persist_seconds)
+                    trace.add_stage('broadcast', self._local.broadcast_seconds)
 
+            except Exception as e:
+                logger.error(f"Error processing MQTT message for site {site_id}, topic {topic}: {e}")
+                result = False
+
+        total_seconds = time.perf_counter() - started
+        metrics.messages_processed.inc(site_id, topic_type, 'ok' if result else 'error')
+        metrics.message_duration.observe(total_seconds, topic_type)
+        metrics.db_queries_per_message.observe(probe.count, topic_type)
+        metrics.db_time_per_message.observe(probe.seconds, topic_type)
+
+        trace.topic_type = topic_type
+        trace.result = result
+        trace.total_ms = total_seconds * 1000.0
+        trace.query_count = probe.count
+        trace.db_ms = probe.seconds * 1000.0
+        trace.queries = probe.queries
+        message_tracer.finish(trace)
+        self._local.trace = None
+        return result
+
+    def _dispatch(self, site_id: int, topic: str, payload_data: Dict[str, Any], topic_info: Dict[str, Any]) -> bool:
+        """
+        Instrada il messaggio all'handler del tipo di topic, scelto dalla tabella
+        della major version indicata da mqtt_api_version nel payload.
+        """
+        handler = self.versioned_processor.get_handler(site_id, topic, payload_data, topic_info['type'])
+        if handler is None:
             return True
 
-        except Exception as e:
-            logger.error(f"Error processing MQTT message for site {site_id}, topic {topic}: {e}")
-            return False
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.handler = handler.__name__
+        return handler(site_id, topic, payload_data, topic_info)
+
+    def _observe_stage(self, stage: str, stage_start: float) -> float:
+        """Registra la durata di uno stage e ritorna l'istante di inizio del successivo"""
+        now = time.perf_counter()
+        metrics.stage_duration.observe(now - stage_start, stage)
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.add_stage(stage, now - stage_start)
+        return now
+
+    def _count_devices(self, count: int = 1) -> None:
+        """Aggiorna il numero di dispositivi toccati dal messaggio corrente (per lo slow log)"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.device_count += count
 
     def _parse_topic_structure(self, topic: str) -> Dict[str, Any]:
         """
-        Parsea la struttura topic accettando SOLO i tre formati richiesti.
+        Parsea la struttura topic accettando SOLO i formati gestiti.
         """
         try:
             parts = topic.split('/')
@@ -144,6 +316,14 @@ class MqttMessageProcessor:
                     'gateway_number': gateway_number
                 }
 
+            # FORMATO 4: [sito]/gateway/[n]/dataloggers/schema (dizionario canali v2, retained)
+            if len(parts) == 5 and parts[3] == 'dataloggers' and parts[4] == 'schema':
+                return {
+                    'type': 'dataloggers_schema',
+                    'site_code': site_code,
+                    'gateway_number': gateway_number
+                }
+
             return {'type': 'unknown'}
 
         except Exception:
@@ -176,14 +356,11 @@ class MqttMessageProcessor:
                     defaults={
                         'site': site,
                         'label': f"Gateway {topic_info['gateway_number']}",
-                        'is_online': True,
-                        'raw_metadata': data  # SALVA IL RAW DATA COME RICHIESTO
                     }
                 )
 
-                # Aggiorna sempre raw_metadata e status
-                gateway.is_online = True
-                gateway.raw_metadata = data
+                # Snapshot del raw data (senza letture) solo se il contenuto è cambiato
+                gateway_metadata.record(gateway, data)
                 gateway.site = site # Assicura che il sito sia corretto
                 
                 # Se ci sono campi specifici nel root del json che matchano il modello, aggiornali
@@ -196,9 +373,11 @@ class MqttMessageProcessor:
                     gateway.firmware_version = data['firmware_version']
 
                 gateway.save()
+                GatewayState.upsert(gateway.id, is_online=True)
 
                 action = "Created" if created else "Updated"
-                logger.info(f"{action} Gateway {serial_number} status (saved raw data)")
+                logger.info(f"{action} Gateway {serial_number} status")
+                self._count_devices()
 
                 # Broadcast opzionale per aggiornare UI se necessario
                 self._broadcast_update(site_id, "gateway_update", {
@@ -235,7 +414,6 @@ class MqttMessageProcessor:
                 defaults={
                     'site': site,
                     'label': f"Gateway {topic_info['gateway_number']}",
-                    'is_online': True
                 }
             )
 
@@ -265,20 +443,17 @@ class MqttMessageProcessor:
                             'site': site,
                             'gateway': gateway,
                             'label': dl_serial,
-                            'is_online': is_online,
-                            'acquisition_status': status,
                             'datalogger_type': 'monstro', # Default
-                            'last_seen_at': timestamp
                         }
                     )
 
                     # Aggiorna campi
                     datalogger.gateway = gateway
                     datalogger.site = site
-                    datalogger.is_online = is_online
-                    datalogger.acquisition_status = status
-                    datalogger.last_seen_at = timestamp
                     datalogger.save()
+                    DataloggerState.upsert(
+                        datalogger.id, is_online=is_online, acquisition_status=status, last_seen_at=timestamp
+                    )
 
                     # 3. Processa i sensori del datalogger
                     sensors_raw = dl_data.get('sensors_data', [])
@@ -287,7 +462,9 @@ class MqttMessageProcessor:
                     # 4. Gestione MISSING SENSORS (Logica Offline)
                     # Imposta offline tutti i sensori di questo datalogger che NON sono stati processati (non presenti nel payload)
                     if processed_sensor_ids is not None:
-                        datalogger.sensors.exclude(id__in=processed_sensor_ids).update(is_online=False)
+                        SensorState.objects.filter(sensor__datalogger=datalogger, is_online=True).exclude(
+                            sensor_id__in=processed_sensor_ids
+                        ).update(is_online=False, change_seq=ChangeSequence.allocate())
 
                     # 5. Broadcast evento specifico per QUESTO datalogger
                     # Questo assicura che useMqttEvents nel frontend invalidi le query ['sensors', dlId]
@@ -299,6 +476,7 @@ class MqttMessageProcessor:
                     
                     processed_count += 1
 
+            self._count_devices(processed_count)
             logger.info(f"Processed aggregated status: {processed_count} dataloggers")
             return True
 
@@ -362,20 +540,16 @@ class MqttMessageProcessor:
                     defaults={
                         'site': site,
                         'label': f"Gateway {topic_info['gateway_number']}",
-                        'is_online': True,
                         'expected_heartbeat_interval': message_interval,
-                        'last_seen_at': timestamp,
-                        'raw_metadata': data  # Salva payload completo come metadata
                     }
                 )
 
-                if not created:
-                    gateway.is_online = True
-                    gateway.site = site
-                    gateway.expected_heartbeat_interval = message_interval
-                    gateway.last_seen_at = timestamp
-                    gateway.raw_metadata = data
-                    gateway.save()
+                # Payload come snapshot senza letture: scritto solo se cambia la struttura
+                gateway_metadata.record(gateway, data)
+                gateway.site = site
+                gateway.expected_heartbeat_interval = message_interval
+                gateway.save()
+                GatewayState.upsert(gateway.id, is_online=True, last_seen_at=timestamp)
 
                 logger.info(f"Gateway {gateway_serial} {'created' if created else 'updated'}")
 
@@ -420,40 +594,41 @@ class MqttMessageProcessor:
                                 'gateway': gateway,
                                 'label': device_serial,
                                 'datalogger_type': datalogger_type,
-                                'is_online': True,
-                                'acquisition_status': dl_data.get('status_datalogger', 'running'),
                                 'expected_heartbeat_interval': message_interval,
-                                'last_seen_at': timestamp
                             }
                         )
 
                         if not dl_created:
                             datalogger.gateway = gateway
                             datalogger.site = site
-                            datalogger.is_online = True
                             datalogger.datalogger_type = datalogger_type
-                            datalogger.acquisition_status = dl_data.get('status_datalogger', 'running')
                             datalogger.expected_heartbeat_interval = message_interval
-                            datalogger.last_seen_at = timestamp
                             datalogger.save()
+                        DataloggerState.upsert(
+                            datalogger.id,
+                            is_online=True,
+                            acquisition_status=dl_data.get('status_datalogger', 'running'),
+                            last_seen_at=timestamp,
+                        )
 
                         # 4. SENSORI: Processa data array del device
                         sensor_data_list = device.get('data', [])
+                        readings = []
                         if isinstance(sensor_data_list, list):
                             processed_sensors = self._process_device_sensors(
-                                datalogger, device_serial, sensor_data_list, timestamp
+                                datalogger, device_serial, sensor_data_list, timestamp, readings
                             )
                             processed_sensors_total += processed_sensors
 
-                        # 5. Broadcast update per questo datalogger
-                        self._broadcast_update(site_id, "datalogger_update", {
-                            "datalogger_id": datalogger.id,
-                            "serial_number": datalogger.serial_number,
-                            "status": "online"
-                        })
+                        # 5. Broadcast update e letture di questo datalogger dopo il commit:
+                        # i client non vedono valori che REST / change feed non restituiscono ancora
+                        transaction.on_commit(functools.partial(
+                            self._broadcast_datalogger_telemetry, site_id, datalogger, readings
+                        ))
 
                         processed_dataloggers += 1
 
+            self._count_devices(processed_dataloggers)
             logger.info(
                 f"Telemetry processed: {processed_dataloggers} dataloggers, "
                 f"{processed_sensors_total} sensors"
@@ -469,7 +644,8 @@ class MqttMessageProcessor:
         datalogger: Datalogger,
         device_serial: str,
         sensor_data_list: List[Dict],
-        timestamp: datetime
+        timestamp: datetime,
+        readings: Optional[List[tuple]] = None
     ) -> int:
         """
         Processa i sensori di un device creando un Sensor per ogni combinazione device+type.
@@ -479,11 +655,14 @@ class MqttMessageProcessor:
             device_serial: Serial number del device (es: "MNA000123")
             sensor_data_list: Lista di dati sensori [{"type": "accelerometer", "value": [x,y,z]}, ...]
             timestamp: Timestamp della lettura
+            readings: se passata, riceve (sensor_id, timestamp, data) delle letture salvate
 
         Returns:
             Numero di sensori processati
         """
         processed_count = 0
+        # Hot state: letture in Redis, riga Sensor aggiornata dal flush write-behind
+        hot_readings = [] if sensor_hot_state.enabled else None
 
         for sensor_data in sensor_data_list:
             if not isinstance(sensor_data, dict):
@@ -501,6 +680,15 @@ class MqttMessageProcessor:
             sensor_serial = f"{device_serial}-{sensor_type}"
 
             try:
+                if hot_readings is not None:
+                    sensor_id = self._resolve_sensor_id(datalogger, sensor_serial, sensor_type, timestamp)
+                    reading_data = self._format_sensor_value(sensor_type, sensor_value)
+                    hot_readings.append((sensor_id, timestamp, reading_data))
+                    processed_count += 1
+                    if readings is not None:
+                        readings.append((sensor_id, timestamp, reading_data))
+                    continue
+
                 with transaction.atomic():
                     sensor, created = Sensor.objects.get_or_create(
                         datalogger=datalogger,
@@ -508,9 +696,7 @@ class MqttMessageProcessor:
                         defaults={
                             'label': sensor_serial,
                             'sensor_type': sensor_type,
-                            'is_online': True,
                             'expected_heartbeat_interval': datalogger.expected_heartbeat_interval,
-                            'last_reading': timestamp,
                             'first_seen_at': timestamp
                         }
                     )
@@ -519,20 +705,404 @@ class MqttMessageProcessor:
                     # Se value è array, convertiamo in dict con chiavi appropriate
                     reading_data = self._format_sensor_value(sensor_type, sensor_value)
 
-                    # Aggiorna il sensore con la nuova lettura
-                    sensor.add_new_reading(timestamp, reading_data)
+                    # Nuova lettura nello stato del sensore; la riga Sensor solo se cambiano i metadati
+                    SensorState.record_reading(sensor.id, timestamp, reading_data)
                     sensor.expected_heartbeat_interval = datalogger.expected_heartbeat_interval
+                    if sensor.first_seen_at is None:
+                        sensor.first_seen_at = timestamp
                     sensor.save()
 
                     processed_count += 1
+                    if readings is not None:
+                        readings.append((sensor.id, timestamp, reading_data))
                     logger.debug(f"Sensor {sensor_serial} updated with value: {reading_data}")
 
             except Exception as e:
                 logger.error(f"Error processing sensor {sensor_serial}: {e}")
                 continue
 
+        if hot_readings:
+            # Siamo nella transazione del datalogger: Redis e flush solo dopo il commit
+            sensor_hot_state.record_on_commit(datalogger.id, datalogger.expected_heartbeat_interval, hot_readings)
         return processed_count
 
+    def _resolve_sensor_id(self, datalogger: Datalogger, sensor_serial: str, sensor_type: str,
+                           timestamp: datetime) -> int:
+        """Id del sensore (creato senza letture se nuovo): con l'hot state la riga non viene riscritta"""
+        sensor_id = Sensor.objects.filter(
+            datalogger=datalogger, serial_number=sensor_serial
+        ).values_list('id', flat=True).first()
+        if sensor_id is not None:
+            return sensor_id
+        sensor, _ = Sensor.objects.get_or_create(
+            datalogger=datalogger,
+            serial_number=sensor_serial,
+            defaults={
+                'label': sensor_serial,
+                'sensor_type': sensor_type,
+                'expected_heartbeat_interval': datalogger.expected_heartbeat_interval,
+                'first_seen_at': timestamp
+            }
+        )
+        return sensor.id
+
+    # Campi scritti dal path batch insieme a quelli cambiati (bulk_update)
+    BATCH_ALWAYS_FIELDS = ['updated_at', 'change_seq']
+    # Sensori esistenti: UPDATE per gruppo di timestamp (vedi _bulk_add_sensor_readings)
+    SENSOR_UPDATE_CHUNK = 200
+
+    def persist_telemetry_batch(self, site_id: int, messages: List[tuple], broadcast: bool = True) -> Dict[str, int]:
+        """
+        Persistenza batch di messaggi dataloggers/telemetry (usata dai job di force discovery).
+
+        Stessa semantica di _process_dataloggers_telemetry, ma gateway/datalogger/sensori
+        vengono precaricati con poche query __in e scritti con bulk_create/bulk_update
+        in un'unica transazione. Non aggiorna i DiscoveredTopic.
+        Le letture non più recenti dell'ultima salvata vengono ignorate (buffer ordinato).
+
+        Args:
+            site_id: ID del sito
+            messages: lista di (topic, payload_data) già decodificati
+
+        Returns:
+            Dict con messages, errors, gateways, dataloggers, sensors, readings
+        """
+        stats = self._new_batch_stats()
+        gateways: Dict[str, Dict[str, Any]] = {}
+        devices: Dict[str, Dict[str, Any]] = {}
+
+        # 1. Raccolta: per ogni gateway/device tiene il messaggio più recente
+        for topic, data in messages:
+            topic_info = self._parse_topic_structure(topic)
+            if topic_info['type'] != 'dataloggers_telemetry' or not self._collect_telemetry(
+                site_id, topic_info, data, gateways, devices
+            ):
+                stats['errors'] += 1
+                continue
+            stats['messages'] += 1
+
+        self._persist_collected_telemetry(site_id, gateways, devices, stats, broadcast)
+        logger.info(
+            f"Telemetry batch persisted for site {site_id}: {stats['messages']} messages, "
+            f"{stats['dataloggers']} dataloggers, {stats['sensors']} sensors"
+        )
+        return stats
+
+    def _new_batch_stats(self) -> Dict[str, int]:
+        return {'messages': 0, 'errors': 0, 'gateways': 0, 'dataloggers': 0, 'sensors': 0, 'readings': 0}
+
+    def _collect_telemetry(self, site_id: int, topic_info: Dict[str, Any], data: Any,
+                           gateways: Dict[str, Dict[str, Any]], devices: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Aggiunge un payload telemetry (v1 o v2) alle strutture del path batch.
+        Ritorna False se il payload non è valido.
+        """
+        if not isinstance(data, dict):
+            return False
+
+        route = self.versioned_processor.resolve(self.versioned_processor._extract_version_string(data))
+        if route.supported and route.version.major == 2:
+            return self.versioned_processor.processors[2].collect_telemetry(
+                self, site_id, topic_info, data, gateways, devices
+            )
+
+        gateway_serial = data.get('serial_number_gateway')
+        dataloggers_list = data.get('dataloggers', [])
+        if not gateway_serial or not isinstance(dataloggers_list, list):
+            return False
+
+        timestamp = self._parse_batch_timestamp(data.get('timestamp'))
+        message_interval = data.get('message_interval_seconds', 60)
+        self._collect_gateway(gateways, gateway_serial, topic_info['gateway_number'], timestamp, message_interval, data)
+
+        for dl_data in dataloggers_list:
+            if not isinstance(dl_data, dict) or not isinstance(dl_data.get('devices', []), list):
+                continue
+            for device in dl_data.get('devices', []):
+                if not isinstance(device, dict) or not device.get('serial_number_device'):
+                    continue
+                sensor_data_list = device.get('data', [])
+                readings = [
+                    (sensor_data['type'], sensor_data.get('value'))
+                    for sensor_data in (sensor_data_list if isinstance(sensor_data_list, list) else [])
+                    if isinstance(sensor_data, dict) and sensor_data.get('type')
+                ]
+                self._collect_device(
+                    devices, device['serial_number_device'], gateway_serial,
+                    device.get('type', 'unknown'), dl_data.get('status_datalogger', 'running'),
+                    message_interval, timestamp, readings
+                )
+        return True
+
+    def _parse_batch_timestamp(self, value: Any) -> datetime:
+        """Timestamp ISO 8601 o epoch (secondi) -> datetime aware"""
+        if value is None:
+            return timezone.now()
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        timestamp = self._parse_mqtt_timestamp(value)
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
+
+    def _collect_gateway(self, gateways: Dict[str, Dict[str, Any]], serial: str, number: Any,
+                         timestamp: datetime, interval: int, data: Dict[str, Any]) -> None:
+        current = gateways.get(serial)
+        if current is None or timestamp >= current['timestamp']:
+            gateways[serial] = {'number': number, 'timestamp': timestamp, 'interval': interval, 'data': data}
+
+    def _collect_device(self, devices: Dict[str, Dict[str, Any]], serial: str, gateway_serial: str,
+                        device_type: str, acquisition_status: str, interval: int, timestamp: datetime,
+                        readings: List[tuple]) -> None:
+        """readings: lista di (sensor_type, valore raw)"""
+        current = devices.get(serial)
+        if current is not None and current['timestamp'] > timestamp:
+            return
+        devices[serial] = {
+            'gateway_serial': gateway_serial,
+            'type': device_type.replace('-', '').lower(),
+            'acquisition_status': acquisition_status,
+            'interval': interval,
+            'timestamp': timestamp,
+            'readings': readings,
+        }
+
+    def _persist_collected_telemetry(self, site_id: int, gateways: Dict[str, Dict[str, Any]],
+                                     devices: Dict[str, Dict[str, Any]], stats: Dict[str, int],
+                                     broadcast: bool = True) -> None:
+        """Scrive gateway/datalogger/sensori raccolti con poche query e bulk_create/bulk_update"""
+        from sites.models import Site
+
+        if not gateways:
+            return
+
+        # Letture pendenti dell'hot state su Postgres prima del confronto con last_timestamp_1
+        if sensor_hot_state.enabled:
+            sensor_hot_state.flush(force=True)
+
+        now = timezone.now()
+        with transaction.atomic():
+            site = Site.objects.get(id=site_id)
+            # Un solo valore del change feed per tutte le righe scritte dal batch
+            change_seq = ChangeSequence.allocate()
+
+            # 2. GATEWAY
+            existing_gateways = {g.serial_number: g for g in Gateway.objects.filter(serial_number__in=list(gateways))}
+            new_gateways, updated_gateways, metadata_snapshots = [], [], []
+            for serial, info in gateways.items():
+                gateway = existing_gateways.get(serial)
+                if gateway is None:
+                    gateway = Gateway(site=site, serial_number=serial, label=f"Gateway {info['number']}")
+                gateway.site = site
+                gateway.expected_heartbeat_interval = info['interval']
+                gateway.updated_at = now
+                gateway.change_seq = change_seq
+                if not self._batch_validate(gateway, 'site'):
+                    stats['errors'] += 1
+                    continue
+                snapshot = gateway_metadata.prepare(gateway, info['data'])
+                if snapshot is not None:
+                    metadata_snapshots.append(snapshot)
+                (updated_gateways if gateway.pk else new_gateways).append(gateway)
+                existing_gateways[serial] = gateway
+
+            Gateway.objects.bulk_create(new_gateways)
+            self._bulk_update_dirty(Gateway, updated_gateways)
+            gateway_metadata.store(metadata_snapshots)
+            GatewayState.bulk_upsert([
+                GatewayState(
+                    gateway_id=gateway.id, is_online=True,
+                    last_seen_at=gateways[gateway.serial_number]['timestamp'], change_seq=change_seq
+                )
+                for gateway in new_gateways + updated_gateways
+            ], ['is_online', 'last_seen_at', 'change_seq'])
+            stats['gateways'] = len(new_gateways) + len(updated_gateways)
+
+            # 3. DATALOGGER (un device = un datalogger); a parità di serial preferisce quello del sito
+            existing_dataloggers: Dict[str, Datalogger] = {}
+            for datalogger in Datalogger.objects.filter(serial_number__in=list(devices)).order_by('id'):
+                current = existing_dataloggers.get(datalogger.serial_number)
+                if current is None or (current.site_id != site.id and datalogger.site_id == site.id):
+                    existing_dataloggers[datalogger.serial_number] = datalogger
+
+            new_dataloggers, updated_dataloggers = [], []
+            for serial, info in devices.items():
+                gateway = existing_gateways.get(info['gateway_serial'])
+                if gateway is None or gateway.pk is None:
+                    continue
+                datalogger = existing_dataloggers.get(serial)
+                if datalogger is None:
+                    datalogger = Datalogger(serial_number=serial, label=serial)
+                datalogger.site = site
+                datalogger.gateway = gateway
+                datalogger.datalogger_type = info['type']
+                datalogger.expected_heartbeat_interval = info['interval']
+                datalogger.updated_at = now
+                datalogger.change_seq = change_seq
+                if not self._batch_validate(datalogger, 'site', 'gateway'):
+                    stats['errors'] += 1
+                    continue
+                (updated_dataloggers if datalogger.pk else new_dataloggers).append(datalogger)
+                existing_dataloggers[serial] = datalogger
+
+            Datalogger.objects.bulk_create(new_dataloggers)
+            self._bulk_update_dirty(Datalogger, updated_dataloggers)
+            dataloggers = new_dataloggers + updated_dataloggers
+            DataloggerState.bulk_upsert([
+                DataloggerState(
+                    datalogger_id=datalogger.id, is_online=True,
+                    acquisition_status=devices[datalogger.serial_number]['acquisition_status'],
+                    last_seen_at=devices[datalogger.serial_number]['timestamp'], change_seq=change_seq
+                )
+                for datalogger in dataloggers
+            ], ['is_online', 'acquisition_status', 'last_seen_at', 'change_seq'])
+            stats['dataloggers'] = len(dataloggers)
+
+            # 4. SENSORI: serial = device_serial + "-" + type
+            existing_sensors = {
+                (s.datalogger_id, s.serial_number): s
+                for s in Sensor.objects.filter(datalogger__in=dataloggers)
+            }
+            existing_states = SensorState.objects.in_bulk([sensor.id for sensor in existing_sensors.values()])
+            states = {
+                key: existing_states[sensor.pk] for key, sensor in existing_sensors.items() if sensor.pk in existing_states
+            }
+            # Riga Sensor scritta solo se nuova o con metadati cambiati; la lettura va nello stato
+            new_sensors, changed_sensors, new_states, updated_states = [], [], [], []
+            for datalogger in dataloggers:
+                info = devices[datalogger.serial_number]
+                timestamp = info['timestamp']
+                for sensor_type, value in info['readings']:
+                    sensor_serial = f"{datalogger.serial_number}-{sensor_type}"
+                    sensor = existing_sensors.get((datalogger.id, sensor_serial))
+                    state = states.get((datalogger.id, sensor_serial))
+                    if sensor is None:
+                        sensor = Sensor(
+                            datalogger=datalogger,
+                            serial_number=sensor_serial,
+                            label=sensor_serial,
+                            sensor_type=sensor_type,
+                            first_seen_at=timestamp,
+                        )
+                    elif state is not None and state.last_timestamp_1 and state.last_timestamp_1 >= timestamp:
+                        # Lettura già presente (o più vecchia): non la riaggiungiamo
+                        continue
+
+                    sensor.expected_heartbeat_interval = info['interval']
+                    if sensor.first_seen_at is None:
+                        sensor.first_seen_at = timestamp
+                    sensor.updated_at = now
+                    sensor.change_seq = change_seq
+                    if state is None:
+                        state = SensorState(sensor=sensor)
+                    state.add_new_reading(timestamp, self._format_sensor_value(sensor_type, value))
+                    state.change_seq = change_seq
+                    if not self._batch_validate(sensor, 'datalogger') or not self._batch_validate(state, 'sensor'):
+                        stats['errors'] += 1
+                        continue
+                    if sensor.pk is None:
+                        new_sensors.append(sensor)
+                    else:
+                        changed_sensors.append(sensor)
+                    (updated_states if state.pk in existing_states else new_states).append(state)
+                    existing_sensors[(datalogger.id, sensor_serial)] = sensor
+                    states[(datalogger.id, sensor_serial)] = state
+
+            Sensor.objects.bulk_create(new_sensors, batch_size=500)
+            self._bulk_update_dirty(Sensor, changed_sensors)
+            SensorState.objects.bulk_create(new_states, batch_size=500)
+            self._bulk_add_sensor_readings(updated_states, change_seq)
+            written_states = new_states + updated_states
+            stats['sensors'] = len(written_states)
+            stats['readings'] = stats['sensors']
+
+        # Righe scritte direttamente: la lettura del batch entra nel buffer hot state, le letture
+        # pendenti arrivate nel frattempo restano in coda per il flush
+        if sensor_hot_state.enabled:
+            sensor_hot_state.merge_on_commit([
+                (state.sensor_id, state.last_timestamp_1, state.last_data_1) for state in written_states
+            ])
+
+        # 5. Broadcast dopo il commit, come nel path per-messaggio
+        if broadcast:
+            readings: Dict[int, List[tuple]] = {}
+            for state in written_states:
+                readings.setdefault(state.sensor.datalogger_id, []).append(
+                    (state.sensor_id, state.last_timestamp_1, state.last_data_1)
+                )
+            for datalogger in dataloggers:
+                self._broadcast_datalogger_telemetry(site_id, datalogger, readings.get(datalogger.id))
+        else:
+            # Nessun evento WebSocket (es. discovery job): invalida comunque le risposte in cache
+            for datalogger in dataloggers:
+                response_cache.invalidate_event(site_id, "datalogger_update", {"datalogger_id": datalogger.id})
+            site_health.mark_dirty_on_commit(site_id)
+
+    def _bulk_add_sensor_readings(self, states: List[SensorState], change_seq: int) -> None:
+        """
+        Scrive la nuova lettura di stati sensore esistenti (già applicata in memoria con add_new_reading).
+
+        Invece di bulk_update su tutti i campi (un CASE per campo e per riga) fa un UPDATE
+        per gruppo di timestamp: lo shift del buffer 1→2→3 e i contatori sono espressioni F()
+        valutate sui valori correnti della riga, solo last_data_1 varia per sensore.
+        """
+        groups: Dict[datetime, List[SensorState]] = {}
+        for state in states:
+            groups.setdefault(state.last_timestamp_1, []).append(state)
+
+        for timestamp, group in groups.items():
+            for start in range(0, len(group), self.SENSOR_UPDATE_CHUNK):
+                chunk = group[start:start + self.SENSOR_UPDATE_CHUNK]
+                SensorState.objects.filter(pk__in=[state.pk for state in chunk]).update(
+                    last_timestamp_3=models.F('last_timestamp_2'),
+                    last_data_3=models.F('last_data_2'),
+                    last_timestamp_2=models.F('last_timestamp_1'),
+                    last_data_2=models.F('last_data_1'),
+                    last_timestamp_1=timestamp,
+                    last_data_1=models.Case(
+                        *[
+                            models.When(pk=state.pk, then=models.Value(state.last_data_1, output_field=models.JSONField()))
+                            for state in chunk
+                        ],
+                        output_field=models.JSONField()
+                    ),
+                    total_messages=models.F('total_messages') + 1,
+                    total_readings=models.F('total_readings') + 1,
+                    last_reading=timestamp,
+                    last_seen_at=timestamp,
+                    consecutive_misses=0,
+                    is_online=True,
+                    change_seq=change_seq,
+                )
+
+    def _bulk_update_dirty(self, model, instances: List[models.Model]) -> int:
+        """
+        bulk_update delle sole righe cambiate (dirty tracking di ChangeTracked), un bulk_update
+        per insieme di campi cambiati: i campi invariati non vengono riscritti.
+        Ritorna il numero di righe scritte.
+        """
+        groups: Dict[tuple, List[models.Model]] = {}
+        for instance in instances:
+            dirty = instance.get_dirty_fields()
+            if dirty:
+                groups.setdefault(tuple(dirty), []).append(instance)
+        for dirty, group in groups.items():
+            fields = list(dirty) + self.BATCH_ALWAYS_FIELDS
+            model.objects.bulk_update(group, fields, batch_size=500)
+            for instance in group:
+                instance._remember_loaded_values(fields)
+        return sum(len(group) for group in groups.values())
+
+    def _batch_validate(self, instance: models.Model, *exclude: str) -> bool:
+        """Validazione equivalente a full_clean() per il path bulk (esclusi FK e unicità, già garantite)"""
+        try:
+            instance.clean_fields(exclude=list(exclude))
+            instance.clean()
+            return True
+        except ValidationError as e:
+            logger.warning(f"Skipping invalid {instance.__class__.__name__} in telemetry batch: {e}")
+            return False
+
     def _format_sensor_value(self, sensor_type: str, value: Any) -> Dict[str, Any]:
         """
         Formatta il valore del sensore in un dict appropriato.
@@ -601,25 +1171,14 @@ class MqttMessageProcessor:
                 defaults={
                     'label': s_serial,
                     'sensor_type': s_type,
-                    'is_online': True,
-                    'last_reading': timestamp,
                     'first_seen_at': timestamp
                 }
             )
 
-            sensor.is_online = True
-            sensor.last_reading = timestamp
-            
-            # Salva il valore principale se presente
-            sensor.save()
-            
+            # Solo lo stato: la riga Sensor non cambia
+            SensorState.upsert(sensor.id, is_online=True, last_reading=timestamp)
+
             processed_ids.append(sensor.id)
-            
-            # Qui potremmo chiamare sensor.add_new_reading(timestamp, s_data)
-            try:
-                sensor.add_new_reading(timestamp, s_data)
-            except Exception:
-                pass 
 
         return processed_ids
 
@@ -640,7 +1199,8 @@ class MqttMessageProcessor:
         except:
             return timezone.now()
 
-    def _save_discovered_topic(self, site_id: int, topic: str, payload_data: Optional[Dict], payload_raw: bytes) -> None:
+    def _save_discovered_topic(self, site_id: int, topic: str, payload_data: Optional[Dict], payload_raw: bytes,
+                               decoded: Optional[DecodedPayload] = None) -> None:
         """
         Salva o aggiorna un topic scoperto nel sistema di discovery.
         Questo permette di tracciare TUTTI i topic ricevuti, anche quelli non ancora gestiti.
@@ -650,6 +1210,7 @@ class MqttMessageProcessor:
             topic: Topic completo ricevuto (es: 'site_001/sensors/temp1')
             payload_data: Payload parsato come JSON (None se non JSON)
             payload_raw: Payload raw (bytes)
+            decoded: Payload decodificato (per i payload compressi aggiorna il rapporto di compressione)
         """
         try:
             from sites.models import Site
@@ -665,9 +1226,13 @@ class MqttMessageProcessor:
             topic_parts = topic.split('/', 1)
             topic_pattern = topic_parts[1] if len(topic_parts) > 1 else topic
 
-            # Calcola dimensione payload
+            # Calcola dimensione payload (byte ricevuti, compressi se il payload è compresso)
             payload_size = len(payload_raw) if payload_raw else 0
 
+            # Rapporto di compressione: byte decompressi / byte ricevuti
+            compression = decoded.compression if decoded else None
+            compression_ratio = decoded.size / decoded.wire_size if compression and decoded.wire_size else None
+
             # Get or create discovered topic
             discovered, created = DiscoveredTopic.objects.get_or_create(
                 site=site,
@@ -677,6 +1242,9 @@ class MqttMessageProcessor:
                     'message_count': 1,
                     'sample_payload': payload_data,
                     'payload_size_avg': float(payload_size),
+                    'compression': compression or '',
+                    'compressed_message_count': 1 if compression_ratio is not None else 0,
+                    'compression_ratio_avg': compression_ratio,
                     'is_processed': False
                 }
             )
@@ -700,9 +1268,22 @@ class MqttMessageProcessor:
                 else:
                     discovered.payload_size_avg = float(payload_size)
 
-                discovered.save(update_fields=[
-                    'message_count', 'last_seen_at', 'sample_payload', 'payload_size_avg'
-                ])
+                update_fields = ['message_count', 'last_seen_at', 'sample_payload', 'payload_size_avg']
+
+                # Aggiorna rapporto di compressione medio (solo sui messaggi compressi)
+                if compression_ratio is not None:
+                    discovered.compressed_message_count += 1
+                    if discovered.compression_ratio_avg:
+                        discovered.compression_ratio_avg = (
+                            (discovered.compression_ratio_avg * (discovered.compressed_message_count - 1) + compression_ratio)
+                            / discovered.compressed_message_count
+                        )
+                    else:
+                        discovered.compression_ratio_avg = compression_ratio
+                    discovered.compression = compression
+                    update_fields += ['compression', 'compressed_message_count', 'compression_ratio_avg']
+
+                discovered.save(update_fields=update_fields)
 
                 logger.debug(f"Updated discovered topic: {topic} (count: {discovered.message_count})")
             else:
@@ -729,7 +1310,6 @@ class MqttMessageProcessor:
             }
         """
         from django.db.models import F, Q
-        from datetime import timedelta
 
         now = timezone.now()
         stats = {
@@ -742,24 +1322,30 @@ class MqttMessageProcessor:
         }
 
         try:
+            # last_seen_at dei sensori con letture ancora solo nell'hot state
+            if sensor_hot_state.enabled:
+                sensor_hot_state.flush(force=True)
+
             # 1. CHECK GATEWAYS
             # Formula: timeout = expected_heartbeat_interval * 2.5
-            gateways = Gateway.objects.filter(
+            gateway_states = GatewayState.objects.filter(
                 is_online=True,
-                expected_heartbeat_interval__isnull=False,
+                gateway__expected_heartbeat_interval__isnull=False,
                 last_seen_at__isnull=False
-            )
+            ).select_related('gateway')
 
-            for gateway in gateways:
+            for state in gateway_states:
+                gateway = state.gateway
                 stats['gateways_checked'] += 1
 
                 timeout_seconds = gateway.expected_heartbeat_interval * 2.5
-                elapsed = (now - gateway.last_seen_at).total_seconds()
+                elapsed = (now - state.last_seen_at).total_seconds()
 
                 if elapsed > timeout_seconds:
-                    gateway.is_online = False
-                    gateway.save(update_fields=['is_online'])
+                    state.is_online = False
+                    state.save(update_fields=['is_online'])
                     stats['gateways_offline'] += 1
+                    metrics.offline_transitions.inc('gateway')
                     logger.warning(
                         f"Gateway {gateway.serial_number} marked OFFLINE "
                         f"(elapsed: {elapsed:.1f}s, timeout: {timeout_seconds:.1f}s)"
@@ -772,23 +1358,25 @@ class MqttMessageProcessor:
                     })
 
             # 2. CHECK DATALOGGERS
-            dataloggers = Datalogger.objects.filter(
+            datalogger_states = DataloggerState.objects.filter(
                 is_online=True,
-                expected_heartbeat_interval__isnull=False,
+                datalogger__expected_heartbeat_interval__isnull=False,
                 last_seen_at__isnull=False
-            )
+            ).select_related('datalogger')
 
-            for datalogger in dataloggers:
+            for state in datalogger_states:
+                datalogger = state.datalogger
                 stats['dataloggers_checked'] += 1
 
                 timeout_seconds = datalogger.expected_heartbeat_interval * 2.5
-                elapsed = (now - datalogger.last_seen_at).total_seconds()
+                elapsed = (now - state.last_seen_at).total_seconds()
 
                 if elapsed > timeout_seconds:
-                    datalogger.is_online = False
-                    datalogger.acquisition_status = 'offline'
-                    datalogger.save(update_fields=['is_online', 'acquisition_status'])
+                    state.is_online = False
+                    state.acquisition_status = 'offline'
+                    state.save(update_fields=['is_online', 'acquisition_status'])
                     stats['dataloggers_offline'] += 1
+                    metrics.offline_transitions.inc('datalogger')
                     logger.warning(
                         f"Datalogger {datalogger.serial_number} marked OFFLINE "
                         f"(elapsed: {elapsed:.1f}s, timeout: {timeout_seconds:.1f}s)"
@@ -802,22 +1390,24 @@ class MqttMessageProcessor:
                     })
 
             # 3. CHECK SENSORS
-            sensors = Sensor.objects.filter(
+            sensor_states = SensorState.objects.filter(
                 is_online=True,
-                expected_heartbeat_interval__isnull=False,
+                sensor__expected_heartbeat_interval__isnull=False,
                 last_seen_at__isnull=False
-            )
+            ).select_related('sensor__datalogger')
 
-            for sensor in sensors:
+            for state in sensor_states:
+                sensor = state.sensor
                 stats['sensors_checked'] += 1
 
                 timeout_seconds = sensor.expected_heartbeat_interval * 2.5
-                elapsed = (now - sensor.last_seen_at).total_seconds()
+                elapsed = (now - state.last_seen_at).total_seconds()
 
                 if elapsed > timeout_seconds:
-                    sensor.is_online = False
-                    sensor.save(update_fields=['is_online'])
+                    state.is_online = False
+                    state.save(update_fields=['is_online'])
                     stats['sensors_offline'] += 1
+                    metrics.offline_transitions.inc('sensor')
                     logger.debug(
                         f"Sensor {sensor.serial_number} marked OFFLINE "
                         f"(elapsed: {elapsed:.1f}s, timeout: {timeout_seconds:.1f}s)"
@@ -0,0 +1,109 @@
+"""
+Snapshot deduplicati del payload raw dei gateway (GatewayMetadataSnapshot).
+
+Il payload di telemetria / status contiene a ogni messaggio letture, timestamp e
+metriche di sistema: salvarlo intero su Gateway riscriveva kilobyte di JSONB ogni
+pochi secondi. Qui il payload viene ridotto ai soli campi strutturali (device,
+tipi, versioni, ...), identificato dall'hash SHA-256 del contenuto e scritto solo
+quando l'hash cambia rispetto a Gateway.raw_metadata_hash. Per gateway si tengono
+gli ultimi METADATA_SNAPSHOTS_KEEP contenuti distinti.
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Iterable, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import Gateway, GatewayMetadataSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Chiavi con letture o valori che cambiano a ogni messaggio, escluse a ogni livello del payload
+READING_KEYS = frozenset({
+    'value', 'values', 'timestamp',
+    'system_uptime', 'uptime', 'uptime_seconds', 'cpu_load_percent',
+    'ram_used_gb', 'ram_percent_used', 'disk_free_gb', 'disk_percent_used',
+})
+
+
+def strip_readings(data: Any) -> Any:
+    """Copia del payload senza le chiavi di READING_KEYS (ricorsiva su dict e liste)"""
+    if isinstance(data, dict):
+        return {key: strip_readings(value) for key, value in data.items() if key not in READING_KEYS}
+    if isinstance(data, list):
+        return [strip_readings(value) for value in data]
+    return data
+
+
+def content_hash(metadata: Any) -> str:
+    """SHA-256 della forma JSON canonica (chiavi ordinate)"""
+    encoded = json.dumps(metadata, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class GatewayMetadataSnapshots:
+    """Snapshot del payload raw dei gateway, scritti solo quando cambia il contenuto"""
+
+    def _keep(self) -> int:
+        return getattr(settings, 'MQTT_CONFIG', {}).get('METADATA_SNAPSHOTS_KEEP', 20)
+
+    def prepare(self, gateway: Gateway, data: Any) -> Optional[GatewayMetadataSnapshot]:
+        """
+        Aggiorna gateway.raw_metadata_hash (salvataggio a carico del chiamante) e ritorna
+        lo snapshot da scrivere con store(), o None se il contenuto non è cambiato.
+        Il gateway può non essere ancora salvato (path batch: store() dopo il bulk_create).
+        """
+        metadata = strip_readings(data if isinstance(data, dict) else {})
+        digest = content_hash(metadata)
+        if digest == gateway.raw_metadata_hash:
+            return None
+        gateway.raw_metadata_hash = digest
+        return GatewayMetadataSnapshot(gateway=gateway, content_hash=digest, metadata=metadata)
+
+    def store(self, snapshots: Iterable[GatewayMetadataSnapshot]) -> int:
+        """
+        Scrive gli snapshot (un contenuto già visto torna il più recente invece di duplicarsi)
+        e limita lo storico dei gateway coinvolti. Ritorna il numero di snapshot scritti.
+        """
+        now = timezone.now()
+        latest = {}
+        for snapshot in snapshots:
+            snapshot.recorded_at = now
+            latest[snapshot.gateway.pk] = snapshot
+        if not latest:
+            return 0
+
+        GatewayMetadataSnapshot.objects.bulk_create(
+            list(latest.values()),
+            update_conflicts=True,
+            unique_fields=['gateway', 'content_hash'],
+            update_fields=['recorded_at'],
+        )
+        self.prune(latest)
+        return len(latest)
+
+    def record(self, gateway: Gateway, data: Any) -> bool:
+        """prepare() + store() per un gateway già salvato. Ritorna True se il contenuto è cambiato"""
+        snapshot = self.prepare(gateway, data)
+        if snapshot is None:
+            return False
+        self.store([snapshot])
+        return True
+
+    def prune(self, gateway_ids: Iterable[int]) -> int:
+        """Elimina gli snapshot oltre gli ultimi METADATA_SNAPSHOTS_KEEP per gateway"""
+        keep = self._keep()
+        stale: List[int] = []
+        for gateway_id in gateway_ids:
+            stale += GatewayMetadataSnapshot.objects.filter(gateway_id=gateway_id).order_by(
+                '-recorded_at', '-id'
+            ).values_list('id', flat=True)[keep:]
+        if stale:
+            GatewayMetadataSnapshot.objects.filter(id__in=stale).delete()
+        return len(stale)
+
+
+# Singleton instance
+gateway_metadata = GatewayMetadataSnapshots()
@@ -0,0 +1,402 @@
+"""
+MQTT Metrics - Contatori in-process ed esposizione in formato Prometheus
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Bucket di default per le latenze (secondi): da 0.5ms a 10s
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Bucket per il numero di query SQL per messaggio
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentile con interpolazione lineare su una lista già ordinata"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * (pct / 100.0)
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class _Metric:
+    """Base comune: nome, help, label e lock per i valori"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labelvalues: Tuple) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}, got {labelvalues}"
+            )
+        return tuple(str(v) for v in labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contatore monotono"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(self._key(labelvalues), 0)
+
+    def total(self) -> float:
+        """Somma su tutte le combinazioni di label"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """Valore istantaneo, impostato direttamente o calcolato al momento dello scrape"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, *labelvalues) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set_function(self, fn: Callable[[], float], *labelvalues) -> None:
+        """Registra una funzione valutata ad ogni scrape (es. profondità di una coda)"""
+        key = self._key(labelvalues)
+        with self._lock:
+            self._functions[key] = fn
+
+    def remove(self, *labelvalues) -> None:
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values.pop(key, None)
+            self._functions.pop(key, None)
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        """Valori correnti per combinazione di label (funzioni incluse)"""
+        with self._lock:
+            items = dict(self._values)
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                items[key] = fn()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        return items
+
+    def _samples(self):
+        items = self.values()
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Istogramma a bucket fissi (cumulativi in esposizione)"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket..., count +Inf], sum, count
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues) -> None:
+        key = self._key(labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro delle metriche del processo"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Esposizione in formato testo Prometheus (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# ============================================================================
+# METRICHE PIPELINE DI INGEST
+# ============================================================================
+
+messages_received = registry.counter(
+    'mqtt_messages_received_total',
+    'MQTT messages received, by site and topic type',
+    ['site_id', 'topic_type']
+)
+messages_processed = registry.counter(
+    'mqtt_messages_processed_total',
+    'MQTT messages processed, by site, topic type and result',
+    ['site_id', 'topic_type', 'result']
+)
+message_duration = registry.histogram(
+    'mqtt_message_duration_seconds',
+    'End-to-end processing time of a single MQTT message',
+    ['topic_type']
+)
+stage_duration = registry.histogram(
+    'mqtt_stage_duration_seconds',
+    'Processing time per ingest stage (decode, discovery, persist, broadcast)',
+    ['stage']
+)
+db_queries_per_message = registry.histogram(
+    'mqtt_db_queries_per_message',
+    'SQL queries issued while processing a single MQTT message',
+    ['topic_type'],
+    buckets=QUERY_COUNT_BUCKETS
+)
+db_time_per_message = registry.histogram(
+    'mqtt_db_time_per_message_seconds',
+    'Time spent in SQL queries while processing a single MQTT message',
+    ['topic_type']
+)
+messages_in_flight = registry.gauge(
+    'mqtt_messages_in_flight',
+    'MQTT messages currently being processed (not queued work: see mqtt_spool_backlog_bytes)'
+)
+offline_transitions = registry.counter(
+    'mqtt_offline_transitions_total',
+    'Devices marked offline by the heartbeat timeout check',
+    ['device_type']
+)
+broadcasts = registry.counter(
+    'mqtt_broadcasts_total',
+    'WebSocket broadcasts sent by the ingest pipeline',
+    ['event_type']
+)
+broadcast_errors = registry.counter(
+    'mqtt_broadcast_errors_total',
+    'WebSocket broadcasts that failed',
+    ['event_type']
+)
+
+
+class QueryProbe:
+    """
+    Conta query SQL e tempo DB sulla connessione del thread corrente.
+    Usato come execute_wrapper di Django: costo trascurabile per query.
+    Con capture=True registra anche il testo SQL (usato dal tracing campionato).
+    """
+
+    __slots__ = ('count', 'seconds', 'queries', 'max_queries')
+
+    def __init__(self, capture: bool = False, max_queries: int = 200):
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = [] if capture else None
+        self.max_queries = max_queries
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds += elapsed
+            self.count += 1
+            if self.queries is not None and len(self.queries) < self.max_queries:
+                self.queries.append((sql, elapsed))
+
+
+@contextmanager
+def query_probe(capture: bool = False, max_queries: int = 200):
+    """Context manager che installa un QueryProbe sulla connessione DB corrente"""
+    probe = QueryProbe(capture, max_queries)
+    with connection.execute_wrapper(probe):
+        yield probe
+
+
+# ============================================================================
+# ESPOSIZIONE HTTP (/metrics) PER IL PROCESSO mqtt_service
+# ============================================================================
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/metrics/'):
+            self.send_error(404)
+            return
+
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Evita di riempire stdout con una riga per ogni scrape
+        logger.debug(f"Metrics request: {format % args}")
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port: int, addr: str = '0.0.0.0') -> bool:
+    """
+    Avvia il server HTTP /metrics in un thread daemon.
+
+    Returns:
+        bool: True se il server è attivo
+    """
+    global _server
+
+    with _server_lock:
+        if _server is not None:
+            return True
+
+        try:
+            _server = ThreadingHTTPServer((addr, port), _MetricsRequestHandler)
+            _server.daemon_threads = True
+        except OSError as e:
+            logger.error(f"Cannot start metrics server on {addr}:{port}: {e}")
+            _server = None
+            return False
+
+        thread = threading.Thread(
+            target=_server.serve_forever,
+            name="mqtt-metrics-http",
+            daemon=True
+        )
+        thread.start()
+        logger.info(f"Metrics endpoint listening on http://{addr}:{port}/metrics")
+        return True
+
+
+def stop_http_server() -> None:
+    """Ferma il server HTTP /metrics se attivo"""
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            return
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -12,6 +12,8 @@ import paho.mqtt.client as mqtt
 from django.db import transaction
 from django.utils import timezone as django_tz
 
+from mqtt.services.journal import message_journal
+
 logger = logging.getLogger(__name__)
 
 
@@ -165,6 +167,9 @@ class MQTTConnectionManager:
                 f"Message on {msg.topic} ({len(msg.payload)} bytes)"
             )
 
+            # Journal raw opzionale (prima di qualsiasi elaborazione)
+            message_journal.append(self.site_id, msg.topic, msg.qos, msg.retain, msg.payload)
+
             # Aggiorna last_heartbeat_at per indicare attività
             self._update_last_heartbeat()
 
@@ -13,6 +13,11 @@ from django.utils import timezone
 
 from mqtt.models import MqttConnection
 from mqtt.services.mqtt_connection import MQTTConnectionManager
+from mqtt.services import metrics
+from mqtt.services.discovery_jobs import discovery_job_runner
+from mqtt.services.ingest_spool import ingest_spool
+from mqtt.services.journal import message_journal
+from mqtt.services.status_registry import service_status
 
 logger = logging.getLogger(__name__)
 
@@ -60,29 +65,41 @@ class MQTTService:
     def process_message(self, site_id: int, topic: str, payload: bytes):
         """
         Callback per processare messaggi MQTT.
-        Delega al message_processor esistente.
+        Con lo spool di ingest attivo il messaggio viene solo scritto nello spool
+        (processato poi dal drainer), altrimenti delega subito al message_processor.
 
         Args:
             site_id: ID del sito
             topic: Topic MQTT
             payload: Payload del messaggio (bytes)
         """
+        if ingest_spool.running:
+            try:
+                ingest_spool.append(site_id, topic, payload)
+                return
+            except Exception as e:
+                # Spool non scrivibile (disco pieno, ecc.): meglio processare subito che perdere il messaggio
+                logger.error(f"[Site {site_id}] Ingest spool write failed, processing inline: {e}")
+
+        self._process_now(site_id, topic, payload)
+
+    def _process_now(self, site_id: int, topic: str, payload: bytes) -> bool:
+        """
+        Processa un messaggio con il message_processor esistente.
+
+        Returns:
+            bool: True se il messaggio è stato processato
+        """
+        metrics.messages_in_flight.inc()
         try:
             # Importa il message_processor esistente
             from mqtt.services.message_processor import message_processor
 
-            # Converti payload in stringa se necessario
-            if isinstance(payload, bytes):
-                payload_str = payload.decode('utf-8', errors='ignore')
-            else:
-                payload_str = str(payload)
-
-            # Chiama il processore esistente
-            # Nota: adatta i parametri se necessario
+            # Payload passato così com'è (bytes): decompressione e decodifica in decode_payload
             processed = message_processor.process_message(
                 site_id=site_id,
                 topic=topic,
-                payload=payload_str,
+                payload=payload,
                 qos=0,  # Non abbiamo QoS nel callback, usa default
                 retain=False  # Non abbiamo retain nel callback, usa default
             )
@@ -91,9 +108,13 @@ class MQTTService:
                 logger.debug(f"[Site {site_id}] Message processed: {topic}")
             else:
                 logger.debug(f"[Site {site_id}] Message not processed (unknown type): {topic}")
+            return processed
 
         except Exception as e:
             logger.error(f"[Site {site_id}] Error processing message from {topic}: {e}")
+            return False
+        finally:
+            metrics.messages_in_flight.dec()
 
     def start_connection(self, site_id: int, manual: bool = True) -> Dict[str, Any]:
         """
@@ -211,46 +232,7 @@ class MQTTService:
         """
         try:
             mqtt_conn = MqttConnection.objects.select_related('site').get(site_id=site_id)
-
-            # Stato dal DB
-            db_status = {
-                'connection_id': mqtt_conn.id,
-                'site_id': site_id,
-                'site_name': mqtt_conn.site.name,
-                'is_enabled': mqtt_conn.is_enabled,
-                'status': mqtt_conn.status,
-                'broker_host': mqtt_conn.broker_host,
-                'broker_port': mqtt_conn.broker_port,
-                'last_connected_at': mqtt_conn.last_connected_at.isoformat() if mqtt_conn.last_connected_at else None,
-                'last_heartbeat_at': mqtt_conn.last_heartbeat_at.isoformat() if mqtt_conn.last_heartbeat_at else None,
-                'connection_errors': mqtt_conn.connection_errors,
-                'error_message': mqtt_conn.error_message,
-                'mqtt_retry_count': mqtt_conn.mqtt_retry_count,
-                'mqtt_next_retry': mqtt_conn.mqtt_next_retry.isoformat() if mqtt_conn.mqtt_next_retry else None,
-            }
-
-            # Stato runtime dal manager
-            with self._connections_lock:
-                manager = self.connections.get(mqtt_conn.id)
-                if manager:
-                    runtime_status = manager.get_status()
-                    db_status.update({
-                        'handler_running': runtime_status['is_running'],
-                        'handler_connected': runtime_status['is_connected'],
-                        'retry_count': runtime_status['retry_count'],
-                        'subscribed_topics': runtime_status['subscribed_topics'],
-                        'topics_list': runtime_status['topics_list'],
-                    })
-                else:
-                    db_status.update({
-                        'handler_running': False,
-                        'handler_connected': False,
-                        'retry_count': 0,
-                        'subscribed_topics': 0,
-                        'topics_list': [],
-                    })
-
-            return db_status
+            return self._connection_status(mqtt_conn, self._remote_connections())
 
         except MqttConnection.DoesNotExist:
             return None
@@ -266,20 +248,80 @@ class MQTTService:
             Lista con stato di tutte le connessioni
         """
         try:
-            all_connections = MqttConnection.objects.select_related('site').all()
-            status_list = []
-
-            for mqtt_conn in all_connections:
-                site_status = self.get_connection_status(mqtt_conn.site.id)
-                if site_status:
-                    status_list.append(site_status)
-
-            return status_list
+            remote = self._remote_connections()
+            return [
+                self._connection_status(mqtt_conn, remote)
+                for mqtt_conn in MqttConnection.objects.select_related('site').all()
+            ]
 
         except Exception as e:
             logger.error(f"Error getting all connections status: {e}")
             return []
 
+    def _remote_connections(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Stato runtime pubblicato dal processo mqtt_service (status_registry).
+        Nel processo del servizio le connessioni sono già in memoria.
+        """
+        if self.running:
+            return {}
+        try:
+            return service_status.connections()
+        except Exception as e:
+            logger.warning(f"MQTT service status registry unavailable: {e}")
+            return {}
+
+    def _connection_status(self, mqtt_conn: MqttConnection, remote: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+        # Stato dal DB
+        db_status = {
+            'connection_id': mqtt_conn.id,
+            'site_id': mqtt_conn.site_id,
+            'site_name': mqtt_conn.site.name,
+            'is_enabled': mqtt_conn.is_enabled,
+            'status': mqtt_conn.status,
+            'broker_host': mqtt_conn.broker_host,
+            'broker_port': mqtt_conn.broker_port,
+            'last_connected_at': mqtt_conn.last_connected_at.isoformat() if mqtt_conn.last_connected_at else None,
+            'last_heartbeat_at': mqtt_conn.last_heartbeat_at.isoformat() if mqtt_conn.last_heartbeat_at else None,
+            'connection_errors': mqtt_conn.connection_errors,
+            'error_message': mqtt_conn.error_message,
+            'mqtt_retry_count': mqtt_conn.mqtt_retry_count,
+            'mqtt_next_retry': mqtt_conn.mqtt_next_retry.isoformat() if mqtt_conn.mqtt_next_retry else None,
+        }
+
+        # Stato runtime dal manager (in questo processo o pubblicato dal servizio)
+        with self._connections_lock:
+            manager = self.connections.get(mqtt_conn.id)
+            if manager:
+                runtime_status = manager.get_status()
+                db_status.update({
+                    'handler_running': runtime_status['is_running'],
+                    'handler_connected': runtime_status['is_connected'],
+                    'retry_count': runtime_status['retry_count'],
+                    'subscribed_topics': runtime_status['subscribed_topics'],
+                    'topics_list': runtime_status['topics_list'],
+                })
+                return db_status
+
+        runtime_status = remote.get(mqtt_conn.id)
+        if runtime_status:
+            db_status.update({
+                'handler_running': runtime_status['handler_running'],
+                'handler_connected': runtime_status['handler_connected'],
+                'retry_count': runtime_status['retry_count'],
+                'subscribed_topics': runtime_status['subscribed_topics'],
+                'topics_list': runtime_status['topics_list'],
+            })
+        else:
+            db_status.update({
+                'handler_running': False,
+                'handler_connected': False,
+                'retry_count': 0,
+                'subscribed_topics': 0,
+                'topics_list': [],
+            })
+        return db_status
+
     def start_all(self):
         """Avvia tutte le connessioni MQTT abilitate"""
         try:
@@ -337,6 +379,21 @@ class MQTTService:
                 except Exception as e:
                     logger.error(f"Error checking offline devices: {e}")
 
+                # Pulizia periodica dei tombstone del change feed (delta sync)
+                try:
+                    from mqtt.services.change_feed import change_feed
+                    change_feed.prune_tombstones()
+                except Exception as e:
+                    logger.error(f"Error pruning change feed tombstones: {e}")
+
+                # Contatori di salute dei siti: siti marcati dagli eventi e riconciliazione completa periodica
+                try:
+                    from mqtt.services.site_health import site_health
+                    site_health.flush(force=True)
+                    site_health.reconcile_all()
+                except Exception as e:
+                    logger.error(f"Error reconciling site health counters: {e}")
+
             except Exception as e:
                 logger.error(f"Monitor error: {e}")
 
@@ -376,6 +433,9 @@ class MQTTService:
         except Exception as e:
             logger.error(f"Error during startup offline check: {e}")
 
+        # Spool di ingest: il backlog di esecuzioni precedenti viene processato per primo
+        ingest_spool.start(self._process_now)
+
         # Avvia tutte le connessioni abilitate
         self.start_all()
 
@@ -387,6 +447,12 @@ class MQTTService:
         )
         self.monitor_thread.start()
 
+        # Worker dei job di force discovery (accodati dall'API)
+        discovery_job_runner.start()
+
+        # Stato live (heartbeat, connessioni, rate, code) per le API negli altri processi
+        service_status.start(self)
+
         logger.info("MQTT Service started")
         return True
 
@@ -448,6 +514,30 @@ class MQTTService:
             if self.monitor_thread.is_alive():
                 logger.warning("Monitor thread did not terminate cleanly")
 
+        # Il job di discovery in corso torna in coda e riparte al prossimo avvio
+        discovery_job_runner.stop()
+
+        # Ferma lo spool (i messaggi non processati restano per il prossimo avvio)
+        ingest_spool.stop()
+
+        # Ultimo: drainer e discovery sono fermi, nessuna lettura arriva più nell'hot state
+        # dopo questo flush verso Postgres
+        try:
+            from mqtt.services.hot_state import sensor_hot_state
+            sensor_hot_state.flush(force=True)
+        except Exception as e:
+            logger.error(f"Error flushing sensor hot state: {e}")
+
+        # Snapshot finale con running=False
+        service_status.stop()
+
+        # Flush finale del journal dei messaggi raw
+        message_journal.close()
+
+        # Flush finale dei contatori di utilizzo versioni API
+        from mqtt.services.mqtt_versioning import versioned_processor
+        versioned_processor.version_usage_tracker.flush()
+
         total_elapsed = time.time() - start_time
         logger.info(f"MQTT Service stopped (total time: {total_elapsed:.2f}s)")
         return True
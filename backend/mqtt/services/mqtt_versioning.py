@@ -1,15 +1,25 @@
 """
 MQTT API Versioning System
 Gestisce versioni MQTT API con supporto per backward/forward compatibility
+
+Ogni stringa mqtt_api_version distinta viene parsata una sola volta (cache di istanze
+con tuple (major, minor, patch) condivise); la risoluzione versione → tabella handler
+del major è anch'essa in cache, così il dispatch per messaggio costa un lookup.
 """
 import re
+import sys
 import logging
-from typing import Dict, Any, Optional, Tuple
+import threading
+import time
+from typing import Callable, Dict, Any, NamedTuple, Optional, Tuple
 from datetime import datetime, timedelta
+from django.conf import settings
 from django.utils import timezone
 
-logger = logging.getLogger(__name__)
+from . import metrics
+from .payload_codec import TOPIC_SUFFIXES
 
+logger = logging.getLogger(__name__)
 # Configurazione versioni supportate
 SUPPORTED_VERSIONS = {
     "v1": {
@@ -29,43 +39,56 @@ SUPPORTED_VERSIONS = {
 }
 
 
+# 'v1.2.3' / '1.2.3' (eventuale suffisso ignorato) oppure 'v1' / '1'
+VERSION_PATTERN = re.compile(r'v?(\d+)(?:\.(\d+)\.(\d+)|$)')
+DEFAULT_VERSION = 'v1.0.0'
+
+# Limite alle stringhe di versione in cache (protegge da payload con versioni arbitrarie)
+MAX_CACHED_VERSIONS = 256
+
+# Secondi prima di ritentare il caricamento da DB di uno schema v2 mancante
+SCHEMA_MISS_RETRY_SECONDS = 30
+
+v2_schema_misses = metrics.registry.counter(
+    'mqtt_v2_schema_misses_total',
+    'v2 telemetry messages dropped because the channel schema is unknown or outdated'
+)
+
+_version_cache: Dict[str, 'MqttApiVersion'] = {}
+_key_cache: Dict[Tuple[int, int, int], Tuple[int, int, int]] = {}
+
+
 class MqttApiVersion:
     """Parser e validator per versioni MQTT API"""
 
+    __slots__ = ('string', 'key', 'major', 'minor', 'patch')
+
     def __init__(self, version_string: str):
-        self.major, self.minor, self.patch = self._parse(version_string)
         self.string = version_string
+        self.key = self._parse(version_string)
+        self.major, self.minor, self.patch = self.key
+
+    @classmethod
+    def get(cls, version_string: str) -> 'MqttApiVersion':
+        """Istanza condivisa per stringa di versione: il parse avviene una sola volta"""
+        version = _version_cache.get(version_string)
+        if version is None:
+            version = cls(version_string)
+            if len(_version_cache) < MAX_CACHED_VERSIONS:
+                _version_cache[sys.intern(version_string)] = version
+        return version
 
     def _parse(self, version: str) -> Tuple[int, int, int]:
         """Parse 'v1.2.3' or '1.2.3' -> (1, 2, 3) or 'v1' -> (1, 0, 0)"""
-        try:
-            # Try full format with 'v' prefix: v1.2.3
-            match = re.match(r'v(\d+)\.(\d+)\.(\d+)', version)
-            if match:
-                return tuple(map(int, match.groups()))
-
-            # Try full format without 'v' prefix: 1.2.3
-            match = re.match(r'(\d+)\.(\d+)\.(\d+)', version)
-            if match:
-                return tuple(map(int, match.groups()))
-
-            # Try short format with 'v' prefix: v1
-            match = re.match(r'v(\d+)$', version)
-            if match:
-                major = int(match.group(1))
-                return (major, 0, 0)
-
-            # Try short format without 'v' prefix: 1
-            match = re.match(r'(\d+)$', version)
-            if match:
-                major = int(match.group(1))
-                return (major, 0, 0)
-
-            raise ValueError(f"Invalid version format: {version}")
-        except Exception as e:
-            logger.warning(f"Error parsing version {version}: {e}, using fallback v1.0.0")
-            # Fallback to v1.0.0
-            return (1, 0, 0)
+        match = VERSION_PATTERN.match(version) if isinstance(version, str) else None
+        if match is None:
+            logger.warning(f"Error parsing version {version}: invalid format, using fallback v1.0.0")
+            key = (1, 0, 0)
+        else:
+            major, minor, patch = match.groups()
+            key = (int(major), int(minor or 0), int(patch or 0))
+        # Tuple condivise tra stringhe equivalenti ('v1.0.0', '1.0.0', 'v1')
+        return _key_cache.setdefault(key, key)
 
     def is_compatible_with(self, other) -> bool:
         """Major version must match for compatibility"""
@@ -73,15 +96,16 @@ class MqttApiVersion:
 
     def is_newer_than(self, other) -> bool:
         """Check if this version is newer than other"""
-        return (self.major, self.minor, self.patch) > (other.major, other.minor, other.patch)
+        return self.key > other.key
 
     def __str__(self):
         return self.string
 
-    def __ge__(self, other_version_string: str) -> bool:
+    def __ge__(self, other) -> bool:
         """Allow version >= "v1.1.0" comparisons"""
-        other = MqttApiVersion(other_version_string)
-        return (self.major, self.minor, self.patch) >= (other.major, other.minor, other.patch)
+        if not isinstance(other, MqttApiVersion):
+            other = MqttApiVersion.get(other)
+        return self.key >= other.key
 
 
 class UnsupportedVersionError(Exception):
@@ -89,183 +113,407 @@ class UnsupportedVersionError(Exception):
     pass
 
 
+class VersionRoute(NamedTuple):
+    """Risultato (in cache) della risoluzione di una stringa di versione"""
+    version: MqttApiVersion
+    supported: bool
+    handlers: Dict[str, Callable]
+
+
 class VersionedMqttMessageProcessor:
     """Main processor che gestisce routing basato su versione"""
 
     def __init__(self):
         self.processors = {
             1: MqttV1Processor(),
-            # 2: MqttV2Processor(),  # Future expansion
+            2: MqttV2Processor(),
         }
         self.version_usage_tracker = VersionUsageTracker()
+        # Range supportati precalcolati: major -> (min, max)
+        self._supported_ranges = {
+            MqttApiVersion.get(config['min_supported']).major: (
+                MqttApiVersion.get(config['min_supported']).key,
+                MqttApiVersion.get(config['max_supported']).key,
+            )
+            for config in SUPPORTED_VERSIONS.values()
+        }
+        self._handler_tables: Dict[int, Dict[str, Callable]] = {}
+        self._routes: Dict[str, VersionRoute] = {}
+        self._lock = threading.Lock()
+
+    def bind(self, backend) -> None:
+        """
+        Precompila le tabelle handler per major version sul processore che esegue
+        la persistenza (MqttMessageProcessor). Chiamato una volta alla sua creazione.
+        """
+        with self._lock:
+            self._handler_tables = {
+                major: processor.build_handlers(backend)
+                for major, processor in self.processors.items()
+            }
+            self._routes = {}
+
+    def resolve(self, version_string: str) -> VersionRoute:
+        """Risolve una stringa di versione nella tabella handler (in cache per stringa)"""
+        route = self._routes.get(version_string)
+        if route is not None:
+            return route
+
+        version = MqttApiVersion.get(version_string)
+        supported = self._is_version_supported(version)
+        handlers = self._handler_tables.get(version.major) if supported else None
+        if handlers is None:
+            # Graceful degradation: versioni non supportate usano gli handler v1
+            # (warning una volta per stringa, non per messaggio)
+            logger.warning(f"Unsupported MQTT API version {version.string}, falling back to v1 handlers")
+            handlers = self._handler_tables.get(1, {})
+        else:
+            status = lifecycle_manager.check_deprecation_status(version.string)
+            if status in ('deprecated', 'sunset_warning'):
+                logger.warning(f"DEPRECATED API version {version.string} in use - status: {status}")
+
+        route = VersionRoute(version, supported, handlers)
+        with self._lock:
+            if len(self._routes) < MAX_CACHED_VERSIONS:
+                self._routes[version.string] = route
+        return route
+
+    def get_handler(self, site_id: int, topic: str, payload: Any, topic_type: str) -> Optional[Callable]:
+        """
+        Handler per il messaggio in base a mqtt_api_version del payload e tipo topic.
+        Registra anche l'utilizzo della versione (solo in memoria, flush in background).
+        """
+        version_string = self._extract_version_string(payload)
+        route = self.resolve(version_string)
+        self.version_usage_tracker.track_usage(route.version.string, topic, site_id)
+        return route.handlers.get(topic_type)
 
     def process_message(self, topic: str, payload: dict, site_id: int) -> bool:
         """Process message con version-aware routing"""
         try:
-            # Estrai version info
-            version_info = self._extract_version_info(payload)
-            api_version = MqttApiVersion(version_info['mqtt_api_version'])
-
-            # Track usage per analytics
-            self.version_usage_tracker.track_usage(api_version.string, topic, site_id)
+            from .message_processor import message_processor
 
-            # Validazione compatibilità
-            if not self._is_version_supported(api_version):
-                return self._handle_unsupported_version(api_version, payload, topic)
-
-            # Routing al processore corretto
-            processor = self.processors.get(api_version.major)
-            if not processor:
-                logger.error(f"No processor available for major version {api_version.major}")
-                return False
-
-            return processor.process(topic, payload, version_info, site_id)
+            topic_info = message_processor._parse_topic_structure(topic)
+            handler = self.get_handler(site_id, topic, payload, topic_info['type'])
+            if handler is None:
+                return topic_info['type'] == 'unknown'
+            return handler(site_id, topic, payload, topic_info)
 
         except Exception as e:
             logger.error(f"Error in versioned message processing: {e}")
             return False
 
+    def _extract_version_string(self, payload: Any) -> str:
+        """mqtt_api_version dal payload (default v1.0.0)"""
+        if not isinstance(payload, dict):
+            return DEFAULT_VERSION
+        version = payload.get('mqtt_api_version', DEFAULT_VERSION)
+        return version if isinstance(version, str) else str(version)
+
     def _extract_version_info(self, payload: dict) -> dict:
         """Estrae informazioni versioning dal payload"""
         return {
-            'mqtt_api_version': payload.get('mqtt_api_version', 'v1.0.0'),
+            'mqtt_api_version': self._extract_version_string(payload),
             'timestamp': payload.get('timestamp'),
             'message_interval_seconds': payload.get('message_interval_seconds', 60)
         }
 
     def _is_version_supported(self, version: MqttApiVersion) -> bool:
         """Check if version is supported"""
-        major_key = f"v{version.major}"
-        if major_key not in SUPPORTED_VERSIONS:
+        supported_range = self._supported_ranges.get(version.major)
+        if supported_range is None:
             return False
+        return supported_range[0] <= version.key <= supported_range[1]
 
-        config = SUPPORTED_VERSIONS[major_key]
-        min_version = MqttApiVersion(config['min_supported'])
-        max_version = MqttApiVersion(config['max_supported'])
 
-        return (version.major, version.minor, version.patch) >= (min_version.major, min_version.minor, min_version.patch) and \
-               (version.major, version.minor, version.patch) <= (max_version.major, max_version.minor, max_version.patch)
+class MqttV1Processor:
+    """Processor per MQTT API v1.x"""
 
-    def _handle_unsupported_version(self, version: MqttApiVersion, payload: dict, topic: str) -> bool:
-        """Handle unsupported version - try graceful degradation"""
-        logger.warning(f"Unsupported MQTT API version {version.string} on topic {topic}")
+    def build_handlers(self, backend) -> Dict[str, Callable]:
+        """Tabella tipo topic -> handler per payload v1"""
+        return {
+            'gateway_status': backend._process_gateway_status,
+            'datalogger_status_aggregated': backend._process_datalogger_status_aggregated,
+            'dataloggers_telemetry': backend._process_dataloggers_telemetry,
+        }
 
-        # Try to use latest supported processor as fallback
-        fallback_processor = self.processors.get(1)  # v1 as fallback
-        if fallback_processor:
-            logger.info(f"Attempting fallback processing with v1 processor")
-            version_info = self._extract_version_info(payload)
-            version_info['mqtt_api_version'] = 'v1.0.0'  # Override to v1
-            return fallback_processor.process(topic, payload, version_info, None)
 
-        return False
+class TelemetrySchema(NamedTuple):
+    """Dizionario canali v2 compilato: lo slot i di 'values' è il canale i nell'ordine dei device"""
+    schema_id: Any
+    gateway_serial: str
+    message_interval: int
+    devices: Tuple[Tuple[str, str, Tuple[str, ...]], ...]  # (serial device, tipo, canali)
+    slot_count: int
 
 
-class MqttV1Processor:
-    """Processor per MQTT API v1.x"""
+class MqttV2Processor:
+    """
+    Processor per MQTT API v2.x - telemetria compatta.
 
-    def process(self, topic: str, payload: dict, version_info: dict, site_id: int) -> bool:
-        """Process message according to v1 API specs"""
-        api_version = MqttApiVersion(version_info['mqtt_api_version'])
+    Il gateway pubblica (retained) il dizionario canali su [sito]/gateway/[n]/dataloggers/schema:
+        {"mqtt_api_version": "v2.0.0", "schema_id": 3, "serial_number_gateway": "...",
+         "message_interval_seconds": 5,
+         "devices": [{"serial": "MNA000123", "type": "monstr-o", "channels": ["accelerometer", "inclinometer"]}]}
 
-        # Import qui per evitare circular imports
-        from .message_processor import message_processor
+    e la telemetria su [sito]/gateway/[n]/dataloggers/telemetry con un solo array di valori
+    allineato agli slot dello schema (null = nessuna lettura):
+        {"mqtt_api_version": "v2.0.0", "schema_id": 3, "timestamp": 1732548744.661,
+         "values": [[1.342, 3.456, 4.567], [0.12, 0.05, 0.0]]}
 
-        # Log versioning info
-        logger.debug(f"Processing {api_version.string} message on topic {topic}")
+    La telemetria viene scritta con il path batch del message processor (bulk_create/bulk_update).
+    """
 
-        # V1 processing - usa il processore esistente ma con version awareness
-        if api_version >= "v1.0.0":
-            return self._process_v1_0_plus(topic, payload, version_info, site_id, message_processor)
-        else:
-            logger.warning(f"Version {api_version.string} below minimum v1.0.0")
+    def __init__(self):
+        self._backend = None
+        self._schemas: Dict[Tuple[int, str], TelemetrySchema] = {}
+        self._misses: Dict[Tuple[int, str], Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def build_handlers(self, backend) -> Dict[str, Callable]:
+        """Tabella tipo topic -> handler per payload v2 (status invariati rispetto a v1)"""
+        self._backend = backend
+        return {
+            'gateway_status': backend._process_gateway_status,
+            'datalogger_status_aggregated': backend._process_datalogger_status_aggregated,
+            'dataloggers_schema': self.process_schema,
+            'dataloggers_telemetry': self.process_telemetry,
+        }
+
+    def process_schema(self, site_id: int, topic: str, data: Dict[str, Any], topic_info: Dict[str, Any]) -> bool:
+        """Registra il dizionario canali di un gateway"""
+        schema = self.compile_schema(data)
+        if schema is None:
             return False
 
-    def _process_v1_0_plus(self, topic: str, payload: dict, version_info: dict,
-                          site_id: int, message_processor) -> bool:
-        """Process v1.0+ messages"""
+        key = self._schema_key(site_id, topic_info)
+        with self._lock:
+            self._schemas[key] = schema
+            self._misses.pop(key, None)
+        logger.info(
+            f"Telemetry schema {schema.schema_id} registered for {key[1]} "
+            f"({len(schema.devices)} devices, {schema.slot_count} channels)"
+        )
+        return True
+
+    def process_telemetry(self, site_id: int, topic: str, data: Dict[str, Any], topic_info: Dict[str, Any]) -> bool:
+        """Decodifica la telemetria compatta e la scrive con il path batch"""
+        backend = self._backend
         try:
-            # Aggiorna il payload con version info per il processore legacy
-            enhanced_payload = payload.copy()
-            enhanced_payload['_version_info'] = version_info
-
-            # Usa il processore esistente
-            payload_bytes = str(enhanced_payload).encode('utf-8')
+            gateways: Dict[str, Dict[str, Any]] = {}
+            devices: Dict[str, Dict[str, Any]] = {}
+            if not isinstance(data, dict) or not self.collect_telemetry(backend, site_id, topic_info, data, gateways, devices):
+                return False
 
-            # Call existing processor ma passa anche version info
-            return message_processor._process_versioned_message(
-                site_id, topic, payload, version_info
+            stats = backend._new_batch_stats()
+            backend._persist_collected_telemetry(site_id, gateways, devices, stats)
+            backend._count_devices(stats['dataloggers'])
+            logger.info(
+                f"Telemetry v2 processed: {stats['dataloggers']} dataloggers, {stats['sensors']} sensors"
             )
+            return stats['errors'] == 0
 
         except Exception as e:
-            logger.error(f"Error in v1 processing: {e}")
+            logger.error(f"Error processing v2 telemetry: {e}", exc_info=True)
+            return False
+
+    def collect_telemetry(self, backend, site_id: int, topic_info: Dict[str, Any], data: Dict[str, Any],
+                          gateways: Dict[str, Dict[str, Any]], devices: Dict[str, Dict[str, Any]]) -> bool:
+        """Aggiunge un messaggio v2 alle strutture del path batch del message processor"""
+        schema = self.get_schema(site_id, topic_info, data.get('schema_id'))
+        if schema is None:
+            v2_schema_misses.inc()
+            logger.warning(
+                f"No telemetry schema {data.get('schema_id')} for site {site_id} "
+                f"gateway {topic_info.get('gateway_number')}, message dropped"
+            )
+            return False
+
+        values = data.get('values')
+        if not isinstance(values, list) or len(values) != schema.slot_count:
+            logger.error(
+                f"Invalid v2 telemetry values for schema {schema.schema_id}: "
+                f"expected {schema.slot_count} slots"
+            )
             return False
 
+        timestamp = backend._parse_batch_timestamp(data.get('timestamp'))
+        interval = data.get('message_interval_seconds', schema.message_interval)
+        status = data.get('status_datalogger', 'running')
+        backend._collect_gateway(gateways, schema.gateway_serial, topic_info['gateway_number'], timestamp, interval, data)
+
+        position = 0
+        for device_serial, device_type, channels in schema.devices:
+            end = position + len(channels)
+            readings = [
+                (channel, value) for channel, value in zip(channels, values[position:end]) if value is not None
+            ]
+            position = end
+            backend._collect_device(
+                devices, device_serial, schema.gateway_serial, device_type, status, interval, timestamp, readings
+            )
+        return True
+
+    def get_schema(self, site_id: int, topic_info: Dict[str, Any], schema_id: Any) -> Optional[TelemetrySchema]:
+        """
+        Schema corrente del gateway. Se manca o non corrisponde a schema_id viene ricaricato
+        dal sample_payload del DiscoveredTopic dello schema (es. dopo un riavvio).
+        """
+        key = self._schema_key(site_id, topic_info)
+        schema = self._schemas.get(key)
+        if schema is not None and schema.schema_id == schema_id:
+            return schema
+
+        miss = self._misses.get(key)
+        if miss is not None and miss[0] == schema_id and time.monotonic() - miss[1] < SCHEMA_MISS_RETRY_SECONDS:
+            return None
+
+        from ..models import DiscoveredTopic
+        schema_topic = f"{key[1]}/dataloggers/schema"
+        payload = (
+            DiscoveredTopic.objects.filter(
+                site_id=site_id,
+                topic_path__in=[schema_topic] + [schema_topic + suffix for suffix in TOPIC_SUFFIXES]
+            )
+            .order_by('-last_seen_at')
+            .values_list('sample_payload', flat=True)
+            .first()
+        )
+        loaded = self.compile_schema(payload) if payload else None
+        with self._lock:
+            if loaded is not None and loaded.schema_id == schema_id:
+                self._schemas[key] = loaded
+                self._misses.pop(key, None)
+                return loaded
+            self._misses[key] = (schema_id, time.monotonic())
+        return None
+
+    def compile_schema(self, data: Any) -> Optional[TelemetrySchema]:
+        """Valida e compila il payload del dizionario canali (None se non valido)"""
+        if not isinstance(data, dict) or data.get('schema_id') is None:
+            logger.error("Invalid v2 telemetry schema: missing schema_id")
+            return None
+
+        gateway_serial = data.get('serial_number_gateway')
+        device_list = data.get('devices')
+        if not gateway_serial or not isinstance(device_list, list):
+            logger.error(f"Invalid v2 telemetry schema {data.get('schema_id')}: missing gateway serial or devices")
+            return None
+
+        devices = []
+        for device in device_list:
+            if not isinstance(device, dict) or not device.get('serial') or not isinstance(device.get('channels'), list):
+                logger.error(f"Invalid device in v2 telemetry schema {data['schema_id']}: {device}")
+                return None
+            channels = tuple(sys.intern(str(channel)) for channel in device['channels'])
+            devices.append((device['serial'], device.get('type', 'unknown'), channels))
+
+        return TelemetrySchema(
+            schema_id=data['schema_id'],
+            gateway_serial=gateway_serial,
+            message_interval=data.get('message_interval_seconds', 60),
+            devices=tuple(devices),
+            slot_count=sum(len(channels) for _, _, channels in devices),
+        )
+
+    def _schema_key(self, site_id: int, topic_info: Dict[str, Any]) -> Tuple[int, str]:
+        return site_id, f"{topic_info['site_code']}/gateway/{topic_info['gateway_number']}"
+
 
 class VersionUsageTracker:
-    """Tracks version usage for analytics"""
+    """
+    Tracks version usage for analytics.
+    Sul path dei messaggi incrementa solo contatori in memoria; un thread in background
+    li scrive periodicamente su MqttApiVersionUsage con un unico bulk upsert.
+    """
 
     def __init__(self):
-        self.usage_cache = {}  # In-memory cache per performance
-        self.cache_flush_interval = 300  # 5 minutes
-        self.last_flush = timezone.now()
+        config = getattr(settings, 'MQTT_CONFIG', {})
+        self.cache_flush_interval = config.get('VERSION_USAGE_FLUSH_INTERVAL', 60)
+        self.usage_cache: Dict[Tuple[str, str, int], int] = {}  # (version, topic, site_id) -> count
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
 
     def track_usage(self, version: str, topic: str, site_id: int):
         """Track version usage"""
-        try:
-            # Simple in-memory tracking
-            key = f"{version}:{topic}"
-            if key not in self.usage_cache:
-                self.usage_cache[key] = {
-                    'version': version,
-                    'topic': topic,
-                    'site_id': site_id,
-                    'count': 0,
-                    'first_seen': timezone.now(),
-                    'last_seen': timezone.now()
-                }
-
-            self.usage_cache[key]['count'] += 1
-            self.usage_cache[key]['last_seen'] = timezone.now()
-
-            # Flush periodically to database
-            if (timezone.now() - self.last_flush).seconds > self.cache_flush_interval:
-                self._flush_to_database()
+        key = (version, topic, site_id)
+        with self._lock:
+            self.usage_cache[key] = self.usage_cache.get(key, 0) + 1
+
+        if self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="mqtt-version-usage-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        from django.db import close_old_connections
+        while True:
+            time.sleep(self.cache_flush_interval)
+            self.flush()
+            close_old_connections()
+
+    @staticmethod
+    def topic_pattern(topic: str) -> str:
+        """'site_001/gateway/3/status' -> 'gateway/+/status' (un record per formato, non per gateway)"""
+        parts = topic.split('/')
+        if len(parts) > 2 and parts[1] == 'gateway':
+            parts[2] = '+'
+        return '/'.join(parts[1:]) if len(parts) > 1 else topic
+
+    def flush(self) -> int:
+        """
+        Scrive i contatori accumulati con un unico INSERT ... ON CONFLICT che somma il conteggio
+        a quello già salvato: l'incremento avviene nel database, quindi i flush concorrenti di
+        processi diversi (servizio, discovery, replay) non si sovrascrivono.
+        Ritorna il numero di record scritti.
+        """
+        with self._lock:
+            pending, self.usage_cache = self.usage_cache, {}
+        if not pending:
+            return 0
+
+        # Aggregazione per (versione, pattern, sito)
+        aggregated: Dict[Tuple[str, str, int], int] = {}
+        for (version, topic, site_id), count in pending.items():
+            if not site_id:
+                continue
+            key = (version[:20], self.topic_pattern(topic)[:255], site_id)
+            aggregated[key] = aggregated.get(key, 0) + count
+        if not aggregated:
+            return 0
 
-        except Exception as e:
-            logger.error(f"Error tracking version usage: {e}")
-
-    def _flush_to_database(self):
-        """Flush usage data to database"""
         try:
+            from django.db import connection
             from ..models import MqttApiVersionUsage
 
-            for key, data in self.usage_cache.items():
-                usage, created = MqttApiVersionUsage.objects.get_or_create(
-                    version=data['version'],
-                    topic_pattern=data['topic'],
-                    site_id=data['site_id'],
-                    defaults={
-                        'message_count': data['count'],
-                        'first_seen_at': data['first_seen'],
-                        'last_seen_at': data['last_seen']
-                    }
-                )
-
-                if not created:
-                    # Update existing record
-                    usage.message_count += data['count']
-                    usage.last_seen_at = data['last_seen']
-                    usage.save()
-
-            # Clear cache after flush
-            self.usage_cache.clear()
-            self.last_flush = timezone.now()
-
-            logger.debug("Version usage data flushed to database")
+            quote = connection.ops.quote_name
+            table = quote(MqttApiVersionUsage._meta.db_table)
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            params = []
+            for (version, pattern, site_id), count in aggregated.items():
+                params += [version, pattern, site_id, count, 1, now, now]
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(aggregated))
+            sql = (
+                f"INSERT INTO {table} (version, topic_pattern, site_id, message_count, device_count, "
+                f"first_seen_at, last_seen_at) VALUES {values} "
+                f"ON CONFLICT (version, topic_pattern, site_id) DO UPDATE SET "
+                f"message_count = {table}.message_count + EXCLUDED.message_count, "
+                f"last_seen_at = EXCLUDED.last_seen_at"
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+            logger.debug(f"Version usage data flushed to database ({len(aggregated)} records)")
+            return len(aggregated)
 
         except Exception as e:
+            # Dati di analytics: in caso di errore (es. sito eliminato) il batch viene scartato
             logger.error(f"Error flushing version usage to database: {e}")
+            return 0
 
 
 class VersionLifecycleManager:
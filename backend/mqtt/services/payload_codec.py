@@ -0,0 +1,170 @@
+"""
+Payload Codec - Decodifica dei payload MQTT compressi (gzip / zlib)
+
+I gateway che inviano batch di dati ad alta frequenza possono comprimere il JSON.
+La compressione viene riconosciuta da:
+- suffisso del topic: .../telemetry.gz (gzip), .../telemetry.zz o .zlib (zlib)
+- magic bytes: 1f 8b (gzip), header zlib 78 xx (CMF/FLG con checksum valido)
+
+Alcuni payload in chiaro formano un header zlib valido ('80', '(4', ...): se un
+payload riconosciuto solo dai magic bytes non si decomprime viene usato così com'è.
+La decompressione è a streaming con limite sulla dimensione decompressa
+(protezione da zip bomb).
+"""
+import logging
+import zlib
+from typing import NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from mqtt.services import metrics
+
+logger = logging.getLogger(__name__)
+
+GZIP = 'gzip'
+ZLIB = 'zlib'
+
+TOPIC_SUFFIXES = {
+    '.gz': GZIP,
+    '.gzip': GZIP,
+    '.zz': ZLIB,
+    '.zlib': ZLIB,
+}
+
+# wbits per zlib.decompressobj: 16 + 15 = gzip, 15 = zlib
+WBITS = {
+    GZIP: 16 + zlib.MAX_WBITS,
+    ZLIB: zlib.MAX_WBITS,
+}
+
+DEFAULT_MAX_DECOMPRESSED_BYTES = 8 * 1024 * 1024
+DECOMPRESS_CHUNK = 64 * 1024
+
+decompressed_payloads = metrics.registry.counter(
+    'mqtt_payload_decompressed_total',
+    'Compressed MQTT payloads decoded, by compression',
+    ['compression']
+)
+decode_errors = metrics.registry.counter(
+    'mqtt_payload_decode_errors_total',
+    'Compressed MQTT payloads rejected, by reason',
+    ['reason']
+)
+
+
+class PayloadDecodeError(Exception):
+    """Payload compresso non valido o troncato"""
+
+    reason = 'corrupted'
+
+
+class PayloadTooLargeError(PayloadDecodeError):
+    """Payload che supera il limite di dimensione decompressa"""
+
+    reason = 'too_large'
+
+
+class DecodedPayload(NamedTuple):
+    topic: str                  # topic logico (senza suffisso di compressione)
+    data: bytes                 # payload decompresso (o originale)
+    compression: Optional[str]  # None se non compresso
+    wire_size: int              # byte ricevuti
+    size: int                   # byte dopo la decompressione
+
+
+def max_decompressed_bytes() -> int:
+    return getattr(settings, 'MQTT_CONFIG', {}).get('MAX_DECOMPRESSED_PAYLOAD_BYTES', DEFAULT_MAX_DECOMPRESSED_BYTES)
+
+
+def split_topic_suffix(topic: str) -> Tuple[str, Optional[str]]:
+    """'site/gateway/1/dataloggers/telemetry.gz' -> ('site/gateway/1/dataloggers/telemetry', 'gzip')"""
+    last_dot = topic.rfind('.')
+    if last_dot > topic.rfind('/'):
+        compression = TOPIC_SUFFIXES.get(topic[last_dot:].lower())
+        if compression:
+            return topic[:last_dot], compression
+    return topic, None
+
+
+def sniff_compression(payload: bytes) -> Optional[str]:
+    """Riconosce gzip/zlib dai primi due byte"""
+    if len(payload) < 2:
+        return None
+    first, second = payload[0], payload[1]
+    if first == 0x1f and second == 0x8b:
+        return GZIP
+    # Header zlib: CM = 8 (deflate), finestra <= 32K, (CMF * 256 + FLG) multiplo di 31
+    if first & 0x0f == 8 and first >> 4 <= 7 and (first * 256 + second) % 31 == 0:
+        return ZLIB
+    return None
+
+
+def decompress(payload: bytes, compression: str, max_size: int) -> bytes:
+    """
+    Decompressione a streaming: l'output viene prodotto a blocchi e interrotto
+    appena supera max_size, senza mai allocare il payload completo.
+    """
+    decompressor = zlib.decompressobj(WBITS[compression])
+    chunks = []
+    size = 0
+    data = payload
+    try:
+        while True:
+            chunk = decompressor.decompress(data, DECOMPRESS_CHUNK)
+            size += len(chunk)
+            if size > max_size:
+                raise PayloadTooLargeError(f"Decompressed payload exceeds {max_size} bytes")
+            chunks.append(chunk)
+            data = decompressor.unconsumed_tail
+            # Buffer pieno: può esserci altro output anche con l'input esaurito
+            if decompressor.eof or (not data and len(chunk) < DECOMPRESS_CHUNK):
+                break
+        tail = decompressor.flush()
+        size += len(tail)
+        if size > max_size:
+            raise PayloadTooLargeError(f"Decompressed payload exceeds {max_size} bytes")
+        chunks.append(tail)
+    except zlib.error as e:
+        raise PayloadDecodeError(f"Invalid {compression} payload: {e}")
+
+    if not decompressor.eof:
+        raise PayloadDecodeError(f"Truncated {compression} payload")
+    if decompressor.unused_data:
+        logger.debug(f"Ignoring {len(decompressor.unused_data)} trailing bytes after {compression} stream")
+    return b''.join(chunks)
+
+
+def decode_payload(topic: str, payload) -> DecodedPayload:
+    """
+    Normalizza un payload ricevuto: rimuove il suffisso di compressione dal topic
+    e decomprime se necessario.
+
+    Raises:
+        PayloadDecodeError / PayloadTooLargeError
+    """
+    logical_topic, compression = split_topic_suffix(topic)
+    if not isinstance(payload, (bytes, bytearray, memoryview)):
+        return DecodedPayload(logical_topic, payload, None, len(payload or ''), len(payload or ''))
+
+    payload = bytes(payload)
+    sniffed = compression is None
+    compression = compression or sniff_compression(payload)
+    if compression is None:
+        return DecodedPayload(logical_topic, payload, None, len(payload), len(payload))
+
+    try:
+        data = decompress(payload, compression, max_decompressed_bytes())
+    except PayloadTooLargeError as e:
+        decode_errors.inc(e.reason)
+        raise
+    except PayloadDecodeError as e:
+        # Magic bytes senza suffisso: anche payload in chiaro validi ('80', '(4', 'Xf', ...)
+        # formano un header zlib. Se non si decomprime, è il payload originale
+        if sniffed:
+            logger.debug(f"Payload on {logical_topic} looks {compression} but is not ({e}), using it as is")
+            return DecodedPayload(logical_topic, payload, None, len(payload), len(payload))
+        decode_errors.inc(e.reason)
+        raise
+
+    decompressed_payloads.inc(compression)
+    return DecodedPayload(logical_topic, data, compression, len(payload), len(data))
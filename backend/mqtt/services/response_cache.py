@@ -0,0 +1,356 @@
+"""
+Response Cache - Cache delle risposte API invalidata dagli eventi di ingest
+
+Le risposte di liste/dettagli device e sensori sono salvate nella cache Django
+(Redis, condivisa tra gunicorn/daphne e mqtt_service) con una chiave che include
+la "generazione" degli scope da cui dipendono:
+
+    mqtt:gen:site:{id}         dati di gateway/datalogger/sensori del sito
+    mqtt:gen:datalogger:{id}   dati di un datalogger e dei suoi sensori
+    mqtt:gen:sites             anagrafica siti e accessi utente
+
+Il message processor incrementa le generazioni con gli stessi eventi che invia
+via WebSocket: le voci vecchie non vengono più lette e scadono per TTL. Le
+generazioni sono inizializzate all'istante corrente in ms, così una chiave persa
+(eviction, restart di Redis) non può far rileggere voci di una generazione passata.
+
+La chiave (quindi le generazioni) è anche l'ETag della risposta: una GET con
+If-None-Match uguale riceve 304 leggendo solo le generazioni, senza query sulle
+tabelle dei device né lettura della voce in cache.
+"""
+import functools
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Eventi di ingest che modificano dati serviti dalle API
+DATA_EVENTS = frozenset({
+    'gateway_update', 'gateway_offline', 'datalogger_update', 'sensor_offline',
+})
+
+# Contatori hit/miss aggregati in cache: flush ogni N richieste o T secondi per processo
+STATS_FLUSH_EVERY = 50
+STATS_FLUSH_INTERVAL = 10.0
+STATS_KEY = 'mqtt:resp:stats:{endpoint}:{result}'
+STATS_RESULTS = ('hit', 'miss', 'not_modified', 'bypass')
+
+cache_requests = metrics.registry.counter(
+    'mqtt_response_cache_requests_total',
+    'API response cache lookups, by endpoint and result (hit, miss, not_modified, bypass)',
+    ['endpoint', 'result']
+)
+cache_invalidations = metrics.registry.counter(
+    'mqtt_response_cache_invalidations_total',
+    'API response cache generation bumps, by scope',
+    ['scope']
+)
+
+
+def site_scope(site_id) -> str:
+    return f"site:{site_id}"
+
+
+def datalogger_scope(datalogger_id) -> str:
+    return f"datalogger:{datalogger_id}"
+
+
+SITES_SCOPE = 'sites'
+
+
+class ResponseCache:
+    """Cache delle risposte JSON con invalidazione per generazione di scope"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+        self._stats_lock = threading.Lock()
+        self._pending_stats: Dict[Tuple[str, str], int] = {}
+        self._pending_total = 0
+        self._last_stats_flush = time.monotonic()
+        self.endpoints: List[str] = []
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, 'MQTT_CONFIG', {}).get('RESPONSE_CACHE_ENABLED', True)
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, 'MQTT_CONFIG', {}).get('RESPONSE_CACHE_TTL', 300)
+
+    # ------------------------------------------------------------------
+    # Generazioni
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _generation_key(scope: str) -> str:
+        return f"mqtt:gen:{scope}"
+
+    @staticmethod
+    def _seed() -> int:
+        return int(time.time() * 1000)
+
+    def generations(self, scopes: Iterable[str]) -> List[int]:
+        """Generazione corrente di ogni scope (una sola round trip)"""
+        scopes = list(scopes)
+        keys = [self._generation_key(scope) for scope in scopes]
+        values = self.cache.get_many(keys)
+        result = []
+        for key in keys:
+            value = values.get(key)
+            if value is None:
+                seed = self._seed()
+                self.cache.add(key, seed, timeout=None)
+                value = self.cache.get(key, seed)
+            result.append(int(value))
+        return result
+
+    def bump(self, *scopes: str) -> None:
+        """Invalida gli scope: le voci delle generazioni precedenti non vengono più lette"""
+        if not self.enabled:
+            return
+        for scope in scopes:
+            key = self._generation_key(scope)
+            try:
+                try:
+                    self.cache.incr(key)
+                except ValueError:
+                    # Chiave assente: add() evita di sovrascrivere un incr concorrente
+                    self.cache.add(key, self._seed(), timeout=None)
+                    self.cache.incr(key)
+                cache_invalidations.inc(scope.split(':', 1)[0])
+            except Exception as e:
+                logger.warning(f"Response cache invalidation failed for {scope}: {e}")
+
+    def bump_on_commit(self, *scopes: str) -> None:
+        """
+        bump() dopo il commit della transazione corrente (subito se non in una transazione):
+        una lettura concorrente non può salvare dati vecchi nella nuova generazione.
+        """
+        if self.enabled:
+            transaction.on_commit(functools.partial(self.bump, *scopes))
+
+    def invalidate_event(self, site_id: int, event_type: str, data: Optional[dict] = None) -> None:
+        """
+        Invalida gli scope toccati da un evento di ingest (vedi _broadcast_update), dopo il commit.
+        """
+        if event_type not in DATA_EVENTS or not self.enabled:
+            return
+        scopes = [site_scope(site_id)]
+        datalogger_id = (data or {}).get('datalogger_id')
+        if datalogger_id:
+            scopes.append(datalogger_scope(datalogger_id))
+        self.bump_on_commit(*scopes)
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    def build_key(self, endpoint: str, scopes: List[str], access: str, params: Dict[str, str]) -> str:
+        generations = '.'.join(str(g) for g in self.generations(scopes))
+        query = '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+        digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+        return f"mqtt:resp:{endpoint}:{generations}:{access}:{digest}"
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, entry: dict) -> None:
+        self.cache.set(key, entry, timeout=self.ttl)
+
+    # ------------------------------------------------------------------
+    # Statistiche
+    # ------------------------------------------------------------------
+
+    def record(self, endpoint: str, result: str) -> None:
+        cache_requests.inc(endpoint, result)
+        with self._stats_lock:
+            key = (endpoint, result)
+            self._pending_stats[key] = self._pending_stats.get(key, 0) + 1
+            self._pending_total += 1
+            due = (self._pending_total >= STATS_FLUSH_EVERY
+                   or time.monotonic() - self._last_stats_flush >= STATS_FLUSH_INTERVAL)
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Somma i contatori del processo a quelli condivisi in cache"""
+        with self._stats_lock:
+            pending = self._pending_stats
+            self._pending_stats = {}
+            self._pending_total = 0
+            self._last_stats_flush = time.monotonic()
+        for (endpoint, result), count in pending.items():
+            key = STATS_KEY.format(endpoint=endpoint, result=result)
+            try:
+                try:
+                    self.cache.incr(key, count)
+                except ValueError:
+                    self.cache.add(key, 0, timeout=None)
+                    self.cache.incr(key, count)
+            except Exception as e:
+                logger.debug(f"Response cache stats flush failed: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss aggregati di tutti i processi, per endpoint (not_modified = 304 da ETag)"""
+        self.flush_stats()
+        keys = {
+            STATS_KEY.format(endpoint=endpoint, result=result): (endpoint, result)
+            for endpoint in self.endpoints for result in STATS_RESULTS
+        }
+        values = self.cache.get_many(list(keys))
+        stats = {}
+        for key, (endpoint, result) in keys.items():
+            stats.setdefault(endpoint, dict.fromkeys(STATS_RESULTS, 0))[result] = int(values.get(key) or 0)
+        for endpoint_stats in stats.values():
+            served = endpoint_stats['hit'] + endpoint_stats['not_modified']
+            lookups = served + endpoint_stats['miss']
+            endpoint_stats['hit_ratio'] = round(served / lookups, 4) if lookups else None
+        return stats
+
+
+def _request_from_args(args) -> Request:
+    """Request DRF dagli argomenti di una function view o di un metodo di ViewSet"""
+    for arg in args[:2]:
+        if isinstance(arg, Request):
+            return arg
+    raise TypeError('cached_response requires a DRF Request argument')
+
+
+def make_etag(key: str) -> str:
+    """ETag debole: il contenuto è lo stesso con o senza Content-Encoding gzip"""
+    return f'W/"{hashlib.md5(key.encode("utf-8")).hexdigest()}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    """If-None-Match contiene l'ETag (confronto debole, come richiesto per GET)"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    if '*' in candidates:
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(candidate.removeprefix('W/') == opaque for candidate in candidates)
+
+
+def _revalidation_headers(response, etag: str) -> None:
+    """Il browser deve sempre rivalidare (If-None-Match) prima di usare la copia locale"""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+
+def _entry_response(request, entry: dict, cache_status: str, etag: str) -> HttpResponse:
+    """Risposta dal contenuto in cache (gzip), decompresso se il client non accetta gzip"""
+    response = HttpResponse(content_type=entry['content_type'], status=entry['status'])
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '').lower():
+        response.content = entry['content']
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response.content = gzip.decompress(entry['content'])
+    _revalidation_headers(response, etag)
+    response['X-Cache'] = cache_status
+    return response
+
+
+def _entry_from_response(response) -> Optional[dict]:
+    """Contenuto da mettere in cache (solo 200), sempre compresso gzip"""
+    if response.status_code != 200:
+        return None
+    if isinstance(response, Response):
+        content = JSONRenderer().render(response.data)
+        content_type = 'application/json'
+    else:
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        content_type = response.get('Content-Type', 'application/json')
+    if response.get('Content-Encoding') != 'gzip':
+        content = compress_string(content)
+    return {'status': 200, 'content_type': content_type, 'content': content}
+
+
+def cached_response(endpoint: str, scopes: Callable[..., Optional[List[str]]],
+                    access: Callable[[Request], str] = lambda request: 'all'):
+    """
+    Decoratore per view GET (sotto @api_view / come metodo di ViewSet).
+    Risponde 304 se If-None-Match corrisponde all'ETag corrente, altrimenti dalla cache
+    o dalla view (salvando il risultato).
+
+    Args:
+        endpoint: nome dell'endpoint (chiave e metriche)
+        scopes: fn(request, **kwargs) -> scope da cui dipende la risposta (None = non cacheabile)
+        access: fn(request) -> scope di accesso dell'utente (risposte diverse per utenti diversi)
+    """
+    response_cache.endpoints.append(endpoint)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request = _request_from_args(args)
+            if not response_cache.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            view_scopes = scopes(request, **kwargs)
+            if not view_scopes:
+                response_cache.record(endpoint, 'bypass')
+                return view(*args, **kwargs)
+
+            try:
+                params = {k: v for k, v in request.GET.items()}
+                params.update({f"@{k}": str(v) for k, v in kwargs.items()})
+                key = response_cache.build_key(endpoint, view_scopes, access(request), params)
+                etag = make_etag(key)
+                if etag_matches(request, etag):
+                    response_cache.record(endpoint, 'not_modified')
+                    response = HttpResponseNotModified()
+                    _revalidation_headers(response, etag)
+                    return response
+                entry = response_cache.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache unavailable for {endpoint}: {e}")
+                response_cache.record(endpoint, 'bypass')
+                return view(*args, **kwargs)
+
+            if entry is not None:
+                response_cache.record(endpoint, 'hit')
+                return _entry_response(request, entry, 'HIT', etag)
+
+            response_cache.record(endpoint, 'miss')
+            response = view(*args, **kwargs)
+            entry = _entry_from_response(response)
+            if entry is None:
+                return response
+            try:
+                response_cache.set(key, entry)
+            except Exception as e:
+                logger.warning(f"Response cache store failed for {endpoint}: {e}")
+            return _entry_response(request, entry, 'MISS', etag)
+        return wrapper
+    return decorator
+
+
+# Singleton instance
+response_cache = ResponseCache()
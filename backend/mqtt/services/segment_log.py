@@ -0,0 +1,268 @@
+"""
+Segment Log - File append-only a segmenti per messaggi MQTT raw
+
+Formato comune a journal e spool di ingest. Ogni segmento inizia con un header
+di file (magic + versione) seguito da record:
+
+    crc32 (4) | payload_len (4) | received_at (8, float epoch) | site_id (4)
+    | qos (1) | retain (1) | topic_len (2) | topic (utf-8) | payload
+
+Il crc32 copre tutto ciò che segue il campo crc. Un record troncato o corrotto
+in coda al segmento (crash durante la scrittura) termina la lettura del segmento.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'BFGSEG01'
+RECORD_HEADER = struct.Struct('<IIdIBBH')
+SEGMENT_SUFFIX = '.seg'
+
+
+class SegmentRecord(NamedTuple):
+    """Record letto da un segmento (offset = posizione del record nel file)"""
+    segment: str
+    offset: int
+    end_offset: int
+    received_at: float
+    site_id: int
+    topic: str
+    qos: int
+    retain: bool
+    payload: bytes
+
+
+def encode_record(received_at: float, site_id: int, topic: str, qos: int, retain: bool, payload) -> bytes:
+    """Serializza un record nel formato binario del segment log"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    payload = bytes(payload or b'')
+    topic_bytes = topic.encode('utf-8')
+    body = RECORD_HEADER.pack(
+        0, len(payload), received_at, site_id or 0, qos or 0, 1 if retain else 0, len(topic_bytes)
+    )[4:] + topic_bytes + payload
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+def segment_start_time(path: str) -> float:
+    """Istante (epoch) del primo record, codificato nel nome del segmento"""
+    name = os.path.basename(path)
+    try:
+        return int(name.rsplit('-', 1)[-1][:-len(SEGMENT_SUFFIX)]) / 1_000_000
+    except ValueError:
+        return 0.0
+
+
+def list_segments(directory: str, prefix: str) -> List[str]:
+    """Segmenti di una directory in ordine cronologico"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = [
+        os.path.join(directory, name) for name in names
+        if name.startswith(f"{prefix}-") and name.endswith(SEGMENT_SUFFIX)
+    ]
+    return sorted(segments, key=segment_start_time)
+
+
+def iter_segment(path: str, start_offset: int = 0) -> Iterator[SegmentRecord]:
+    """
+    Itera i record di un segmento leggendolo via mmap.
+    Si ferma al primo record incompleto o con crc non valido.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if size <= len(FILE_MAGIC):
+        return
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(FILE_MAGIC)] != FILE_MAGIC:
+                logger.error(f"Not a segment file (bad magic): {path}")
+                return
+
+            offset = max(start_offset, len(FILE_MAGIC))
+            header_size = RECORD_HEADER.size
+
+            while offset + header_size <= size:
+                crc, payload_len, received_at, site_id, qos, retain, topic_len = RECORD_HEADER.unpack_from(data, offset)
+                end = offset + header_size + topic_len + payload_len
+                if end > size:
+                    # Normale sul segmento in scrittura; dopo un crash indica una scrittura interrotta
+                    logger.debug(f"Incomplete record at {path}:{offset}, stopping")
+                    return
+                if zlib.crc32(data[offset + 4:end]) != crc:
+                    logger.warning(f"Corrupted record at {path}:{offset}, stopping")
+                    return
+
+                topic_start = offset + header_size
+                yield SegmentRecord(
+                    segment=path,
+                    offset=offset,
+                    end_offset=end,
+                    received_at=received_at,
+                    site_id=site_id,
+                    topic=data[topic_start:topic_start + topic_len].decode('utf-8', errors='replace'),
+                    qos=qos,
+                    retain=bool(retain),
+                    payload=data[topic_start + topic_len:end],
+                )
+                offset = end
+
+
+class SegmentWriter:
+    """
+    Writer append-only con rotazione per dimensione/età e limite di spazio totale.
+    Thread-safe: più connessioni MQTT possono scrivere in parallelo.
+    """
+
+    def __init__(self, directory: str, prefix: str, segment_bytes: int, max_total_bytes: int = 0,
+                 max_segment_age: float = 0, flush_interval: float = 1.0, fsync: bool = False,
+                 buffered: bool = True, on_remove: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            flush_interval: secondi tra due flush del buffer (solo se buffered)
+            fsync: fsync alla chiusura/rotazione dei segmenti e nei flush
+            buffered: False = ogni record è scritto subito con una write (visibile ai lettori)
+            on_remove: callback(path) chiamata prima di eliminare un segmento per retention
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_segment_age = max_segment_age
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffered = buffered
+        self.on_remove = on_remove
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._path: Optional[str] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._last_flush = 0.0
+
+    @property
+    def current_segment(self) -> Optional[str]:
+        return self._path
+
+    def append(self, record: bytes, received_at: float) -> tuple:
+        """
+        Aggiunge un record serializzato.
+
+        Returns:
+            tuple: (segmento, offset di fine record)
+        """
+        with self._lock:
+            if self._file is None or self._should_rotate(len(record)):
+                self._rotate(received_at)
+            self._file.write(record)
+            self._size += len(record)
+
+            if self.buffered:
+                now = time.monotonic()
+                if now - self._last_flush >= self.flush_interval:
+                    self._file.flush()
+                    self._last_flush = now
+            return self._path, self._size
+
+    def flush(self) -> None:
+        """Scrive su disco i dati bufferizzati (con fsync se abilitato)"""
+        with self._lock:
+            self._flush_locked()
+            self._last_flush = time.monotonic()
+
+    def sync(self) -> None:
+        """Flush + fsync del segmento corrente, indipendentemente da self.fsync"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_locked()
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self._size + incoming > self.segment_bytes and self._size > len(FILE_MAGIC):
+            return True
+        return bool(self.max_segment_age) and time.monotonic() - self._opened_at >= self.max_segment_age
+
+    def _flush_locked(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _close_locked(self) -> None:
+        if self._file is None:
+            return
+        self._flush_locked()
+        self._file.close()
+        self._file = None
+
+    def _rotate(self, received_at: float) -> None:
+        self._close_locked()
+        os.makedirs(self.directory, exist_ok=True)
+
+        start_us = int(received_at * 1_000_000)
+        path = os.path.join(self.directory, f"{self.prefix}-{start_us:020d}{SEGMENT_SUFFIX}")
+        while os.path.exists(path):
+            start_us += 1
+            path = os.path.join(self.directory, f"{self.prefix}-{start_us:020d}{SEGMENT_SUFFIX}")
+
+        self._file = open(path, 'ab', buffering=-1 if self.buffered else 0)
+        self._file.write(FILE_MAGIC)
+        if self.fsync:
+            # Rende durevole anche la creazione del file (entry nella directory)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self._path = path
+        self._size = len(FILE_MAGIC)
+        self._opened_at = time.monotonic()
+        logger.info(f"Opened segment {path}")
+
+        if self.max_total_bytes:
+            self._enforce_retention()
+
+    def _enforce_retention(self) -> None:
+        """Elimina i segmenti più vecchi oltre il limite di spazio (mai quello corrente)"""
+        segments = list_segments(self.directory, self.prefix)
+        sizes = {}
+        for path in segments:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                sizes[path] = 0
+
+        total = sum(sizes.values())
+        for path in segments:
+            if total <= self.max_total_bytes or path == self._path:
+                break
+            try:
+                if self.on_remove:
+                    self.on_remove(path)
+                os.remove(path)
+                total -= sizes[path]
+                logger.info(f"Removed segment {path} (retention limit)")
+            except OSError as e:
+                logger.error(f"Cannot remove segment {path}: {e}")
+                break
@@ -0,0 +1,133 @@
+"""
+Contatori di salute per sito (gateway / datalogger / sensori totali e online).
+
+Ogni evento di ingest (message processor) e ogni creazione / eliminazione di device
+marca il sito come da ricalcolare dopo il commit; i siti marcati vengono riconciliati al più ogni
+SITE_HEALTH_FLUSH_INTERVAL secondi con tre GROUP BY e un upsert in SiteHealth,
+indipendentemente da quante transizioni ci sono state. mqtt_service riconcilia
+anche tutti i siti ogni SITE_HEALTH_FULL_RECONCILE_INTERVAL secondi (modifiche
+fatte da altri processi senza passare dagli eventi).
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from ..models import Datalogger, Gateway, Sensor, SiteHealth
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = (
+    'gateways_total', 'gateways_online',
+    'dataloggers_total', 'dataloggers_online',
+    'sensors_total', 'sensors_online',
+)
+
+
+class SiteHealthCounters:
+    """Siti da ricalcolare e riconciliazione set-based dei contatori SiteHealth"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._last_flush = 0.0
+        self._last_full_reconcile = 0.0
+
+    def _config(self, key: str, default: float) -> float:
+        return getattr(settings, 'MQTT_CONFIG', {}).get(key, default)
+
+    def mark_dirty(self, site_id: Optional[int]) -> None:
+        if site_id is not None:
+            with self._lock:
+                self._dirty.add(site_id)
+
+    def mark_dirty_on_commit(self, site_id: Optional[int], force: bool = False) -> None:
+        """
+        Marca il sito e riconcilia (al più ogni SITE_HEALTH_FLUSH_INTERVAL, se non force) dopo il
+        commit della transazione corrente: i GROUP BY vedono i dati committati e non girano dentro
+        la transazione di ingest (niente lock trattenuti, un errore non la invalida).
+        """
+        def run():
+            self.mark_dirty(site_id)
+            self.flush(force=force)
+        transaction.on_commit(run)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Riconcilia i siti marcati (al più ogni SITE_HEALTH_FLUSH_INTERVAL, se non force).
+        Ritorna il numero di siti aggiornati.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._dirty:
+                return 0
+            if not force and now - self._last_flush < self._config('SITE_HEALTH_FLUSH_INTERVAL', 2.0):
+                return 0
+            self._last_flush = now
+            site_ids, self._dirty = self._dirty, set()
+
+        try:
+            return self.reconcile(site_ids)
+        except Exception as e:
+            # Riprova al prossimo flush
+            with self._lock:
+                self._dirty |= site_ids
+            logger.error(f"Error reconciling site health counters: {e}")
+            return 0
+
+    def reconcile_all(self, force: bool = False) -> int:
+        """Riconciliazione completa periodica (al più ogni SITE_HEALTH_FULL_RECONCILE_INTERVAL, se non force)"""
+        now = time.monotonic()
+        interval = self._config('SITE_HEALTH_FULL_RECONCILE_INTERVAL', 600)
+        if not force and now - self._last_full_reconcile < interval:
+            return 0
+        self._last_full_reconcile = now
+        return self.reconcile()
+
+    def reconcile(self, site_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Ricalcola i contatori dei siti indicati (None = tutti): un GROUP BY per livello
+        e un solo upsert. Ritorna il numero di siti aggiornati.
+        """
+        from sites.models import Site
+
+        sites = Site.objects.all()
+        if site_ids is not None:
+            sites = sites.filter(pk__in=list(site_ids))
+        counters: Dict[int, Dict[str, int]] = {
+            site_id: dict.fromkeys(COUNTER_FIELDS, 0) for site_id in sites.values_list('id', flat=True)
+        }
+        if not counters:
+            return 0
+
+        for model, prefix, site_field in (
+            (Gateway, 'gateways', 'site_id'),
+            (Datalogger, 'dataloggers', 'site_id'),
+            (Sensor, 'sensors', 'datalogger__site_id'),
+        ):
+            rows = (
+                model.objects.filter(**{f'{site_field}__in': list(counters)})
+                .values(site_field)
+                .annotate(total=Count('id'), online=Count('id', filter=Q(state__is_online=True)))
+                .order_by()
+            )
+            for row in rows:
+                counters[row[site_field]][f'{prefix}_total'] = row['total']
+                counters[row[site_field]][f'{prefix}_online'] = row['online']
+
+        SiteHealth.objects.bulk_create(
+            [SiteHealth(site_id=site_id, **values) for site_id, values in counters.items()],
+            update_conflicts=True,
+            unique_fields=['site'],
+            update_fields=list(COUNTER_FIELDS) + ['updated_at'],
+            batch_size=500,
+        )
+        return len(counters)
+
+
+# Singleton instance
+site_health = SiteHealthCounters()
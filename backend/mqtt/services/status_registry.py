@@ -0,0 +1,197 @@
+"""
+Service Status Registry - Stato live del servizio MQTT condiviso tra processi
+
+MQTTService gira nel processo mqtt_service (supervisord); le API in gunicorn non
+vedono le sue connessioni in memoria. Un thread del servizio pubblica ogni
+STATUS_PUBLISH_INTERVAL secondi uno snapshot nella cache condivisa (Redis):
+
+    mqtt:service:status:{instance_id}   snapshot (heartbeat, connessioni, rate, code)
+                                        con TTL di 3 intervalli: un servizio morto sparisce
+    mqtt:service:instances              {instance_id: ultimo heartbeat} delle istanze note
+
+Le API di health/status leggono lo snapshot (due round trip, nessun processo esterno).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+STATUS_KEY = 'mqtt:service:status:{instance_id}'
+INSTANCES_KEY = 'mqtt:service:instances'
+# Istanze non più viste da questo tempo vengono rimosse dall'indice (secondi)
+INSTANCE_FORGET_AFTER = 24 * 3600
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class ServiceStatusRegistry:
+    """Pubblicazione (processo mqtt_service) e lettura (API) dello stato live del servizio"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._service = None
+        self._started_at: Optional[float] = None
+        self._last_totals: Optional[tuple] = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def interval(self) -> float:
+        return getattr(settings, 'MQTT_CONFIG', {}).get('STATUS_PUBLISH_INTERVAL', 5.0)
+
+    # ------------------------------------------------------------------
+    # Pubblicazione (processo mqtt_service)
+    # ------------------------------------------------------------------
+
+    def start(self, service) -> None:
+        """Avvia il thread di pubblicazione per il servizio (MQTTService.start)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._service = service
+        self._started_at = time.time()
+        self._last_totals = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="mqtt-status-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Ferma il thread e pubblica lo snapshot finale con running=False"""
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        self.publish(running=False)
+
+    def _loop(self) -> None:
+        while not self._stop_event.is_set():
+            self.publish()
+            self._stop_event.wait(self.interval)
+
+    def publish(self, running: Optional[bool] = None) -> None:
+        """Scrive lo snapshot corrente dell'istanza nella cache condivisa"""
+        service = self._service
+        if service is None:
+            return
+        try:
+            snapshot = self._collect(service, service.running if running is None else running)
+            key = STATUS_KEY.format(instance_id=service.instance_id)
+            self.cache.set(key, snapshot, timeout=max(int(self.interval * 3), 1))
+
+            instances = self.cache.get(INSTANCES_KEY) or {}
+            now = snapshot['heartbeat_ts']
+            instances = {
+                instance_id: seen for instance_id, seen in instances.items()
+                if now - seen < INSTANCE_FORGET_AFTER
+            }
+            instances[service.instance_id] = now
+            self.cache.set(INSTANCES_KEY, instances, timeout=None)
+        except Exception as e:
+            logger.warning(f"Could not publish MQTT service status: {e}")
+
+    def _collect(self, service, running: bool) -> Dict[str, Any]:
+        now = time.time()
+        with service._connections_lock:
+            managers = list(service.connections.items())
+        connections = {}
+        for connection_id, manager in managers:
+            runtime = manager.get_status()
+            connections[str(connection_id)] = {
+                'site_id': manager.site_id,
+                'handler_running': runtime['is_running'],
+                'handler_connected': runtime['is_connected'],
+                'retry_count': runtime['retry_count'],
+                'subscribed_topics': runtime['subscribed_topics'],
+                'topics_list': runtime['topics_list'],
+            }
+
+        # Rate dai contatori Prometheus del processo (differenza dallo snapshot precedente)
+        totals = (now, metrics.messages_received.total(), metrics.messages_processed.total())
+        rates = {'messages_received_per_sec': 0.0, 'messages_processed_per_sec': 0.0}
+        if self._last_totals is not None and totals[0] > self._last_totals[0]:
+            elapsed = totals[0] - self._last_totals[0]
+            rates = {
+                'messages_received_per_sec': round((totals[1] - self._last_totals[1]) / elapsed, 2),
+                'messages_processed_per_sec': round((totals[2] - self._last_totals[2]) / elapsed, 2),
+            }
+        self._last_totals = totals
+
+        # Unica coda reale del processo: lo spool su disco (i messaggi in elaborazione sono in 'messages')
+        queues = {}
+        from .ingest_spool import ingest_spool
+        if ingest_spool.running:
+            queues['spool_backlog_bytes'] = ingest_spool.backlog_bytes()
+
+        return {
+            'instance_id': service.instance_id,
+            'hostname': socket.gethostname(),
+            'pid': os.getpid(),
+            'running': running,
+            'started_at': _isoformat(self._started_at or now),
+            'heartbeat_at': _isoformat(now),
+            'heartbeat_ts': now,
+            'interval': self.interval,
+            'connections': connections,
+            'messages': {
+                'received_total': int(totals[1]),
+                'processed_total': int(totals[2]),
+                'in_flight': int(metrics.messages_in_flight.values().get((), 0)),
+                **rates,
+            },
+            'queues': queues,
+        }
+
+    # ------------------------------------------------------------------
+    # Lettura (API, qualsiasi processo)
+    # ------------------------------------------------------------------
+
+    def snapshots(self) -> List[Dict[str, Any]]:
+        """Snapshot delle istanze vive (heartbeat entro il TTL), con l'età del heartbeat"""
+        instances = self.cache.get(INSTANCES_KEY) or {}
+        if not instances:
+            return []
+        values = self.cache.get_many([STATUS_KEY.format(instance_id=i) for i in instances])
+        now = time.time()
+        result = []
+        for snapshot in values.values():
+            snapshot['heartbeat_age'] = round(now - snapshot['heartbeat_ts'], 1)
+            result.append(snapshot)
+        return sorted(result, key=lambda s: s['instance_id'])
+
+    def is_running(self, snapshots: Optional[List[Dict[str, Any]]] = None) -> bool:
+        snapshots = self.snapshots() if snapshots is None else snapshots
+        return any(snapshot['running'] for snapshot in snapshots)
+
+    def connections(self, snapshots: Optional[List[Dict[str, Any]]] = None) -> Dict[int, Dict[str, Any]]:
+        """Stato runtime per mqtt_connection_id, dalle istanze in esecuzione"""
+        snapshots = self.snapshots() if snapshots is None else snapshots
+        result = {}
+        for snapshot in snapshots:
+            if not snapshot['running']:
+                continue
+            for connection_id, runtime in snapshot['connections'].items():
+                current = result.get(int(connection_id))
+                # Con più istanze prevale quella connessa al broker
+                if current is None or (runtime['handler_connected'] and not current['handler_connected']):
+                    result[int(connection_id)] = runtime
+        return result
+
+
+# Singleton instance
+service_status = ServiceStatusRegistry()
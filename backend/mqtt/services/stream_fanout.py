@@ -0,0 +1,347 @@
+"""
+Stream live per sensore con decimazione per client (ispezioni in sito, accelerometri a piena frequenza).
+
+Ogni client si iscrive a un sensore indicando la frequenza massima che vuole ricevere
+(subscribe_stream nel consumer). La frequenza viene arrotondata a uno dei livelli fissi
+STREAM_RATES e ogni (sensore, livello, modalità) ha un gruppo Channels: la riduzione è
+calcolata una sola volta per livello nel processo di ingest e condivisa da tutti i client
+del gruppo, qualunque sia il loro numero.
+
+Modalità:
+    raw        ogni lettura così com'è (frequenza di ingest)
+    decimate   ultima lettura di ogni finestra di 1/rate secondi
+    envelope   min / max per canale numerico di ogni finestra (i picchi non si perdono)
+
+Le finestre sono allineate al timestamp delle letture. Se le letture non sono più frequenti
+del livello (telemetria ogni pochi secondi) la finestra viene inviata subito con la lettura
+che la apre; altrimenti quando arriva la prima lettura della finestra successiva, oppure
+se dopo la sua apertura passano 1/rate + STREAM_WINDOW_GRACE secondi (tempo del processo, non
+dei timestamp) senza chiuderla: un thread controlla le scadenze ogni STREAM_WINDOW_TICK
+secondi, quindi un sensore che si ferma non trattiene l'ultimo valore.
+Una finestra già inviata che riceve altre letture viene reinviata alla chiusura (stesso "t").
+
+I conteggi delle iscrizioni sono nella cache condivisa (i consumer girano in daphne,
+l'ingest in mqtt_service) con una generazione incrementata a ogni iscrizione / disiscrizione.
+Il processo di ingest rilegge solo la generazione, al più ogni STREAM_SUBSCRIPTION_REFRESH
+secondi per tutto il processo: i livelli attivi di un sensore vengono letti una volta e
+restano validi finché la generazione non cambia, e un sensore senza client non costa
+nessuna round trip sul path di ingest.
+"""
+import logging
+import math
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import caches
+
+from . import metrics
+from .ws_frame_codec import encode_stream_frame, numeric_channels
+
+logger = logging.getLogger(__name__)
+
+# Livelli di frequenza (Hz) condivisi tra i client; None = raw
+STREAM_RATES = (50.0, 10.0, 1.0)
+STREAM_MODES = ('decimate', 'envelope')
+RAW = 'raw'
+
+STREAM_SUBSCRIPTION_REFRESH = 2.0
+# Ritardo oltre la fine di una finestra prima di inviarla senza la lettura successiva (secondi)
+STREAM_WINDOW_GRACE = 1.0
+# Intervallo del controllo delle finestre scadute (secondi)
+STREAM_WINDOW_TICK = 0.25
+# Scadenza dei conteggi in cache (iscrizioni rimaste da consumer terminati senza disconnect)
+STREAM_SUBSCRIPTION_TTL = 24 * 3600
+
+stream_frames = metrics.registry.counter(
+    'mqtt_stream_frames_total',
+    'Live sensor stream frames sent to WebSocket groups, by mode',
+    ['mode']
+)
+
+
+def resolve_rate(max_rate: Optional[float]) -> Optional[float]:
+    """
+    Livello per una frequenza massima richiesta: il più alto non superiore a max_rate
+    (almeno il più basso). None o una frequenza oltre il livello più alto = raw.
+    """
+    if max_rate is None or max_rate > STREAM_RATES[0]:
+        return None
+    for rate in STREAM_RATES:
+        if rate <= max_rate:
+            return rate
+    return STREAM_RATES[-1]
+
+
+def _rate_label(rate: Optional[float]) -> str:
+    return RAW if rate is None else f"{rate:g}".replace('.', '_')
+
+
+def stream_group(sensor_id: int, rate: Optional[float], mode: str) -> str:
+    """Gruppo Channels di un livello di stream (rate None = raw)"""
+    if rate is None:
+        return f"mqtt_stream_{sensor_id}_{RAW}"
+    return f"mqtt_stream_{sensor_id}_{_rate_label(rate)}_{mode}"
+
+
+def _format_timestamp(timestamp: datetime) -> str:
+    value = timestamp.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class StreamSubscriptions:
+    """Conteggio delle iscrizioni per (sensore, livello, modalità) nella cache condivisa"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    GENERATION_KEY = 'mqtt:stream:subs:gen'
+
+    @staticmethod
+    def _key(sensor_id: int, rate: Optional[float], mode: str) -> str:
+        return f"mqtt:stream:subs:{sensor_id}:{_rate_label(rate)}:{RAW if rate is None else mode}"
+
+    def add(self, sensor_id: int, rate: Optional[float], mode: str) -> None:
+        key = self._key(sensor_id, rate, mode)
+        self.cache.add(key, 0, timeout=STREAM_SUBSCRIPTION_TTL)
+        self.cache.incr(key)
+        self.cache.touch(key, STREAM_SUBSCRIPTION_TTL)
+        self._bump()
+
+    def remove(self, sensor_id: int, rate: Optional[float], mode: str) -> None:
+        key = self._key(sensor_id, rate, mode)
+        try:
+            if self.cache.decr(key) <= 0:
+                self.cache.delete(key)
+        except ValueError:
+            pass
+        self._bump()
+
+    def generation(self) -> int:
+        """
+        Generazione delle iscrizioni: cambia a ogni add / remove. Come in response_cache
+        parte dall'istante corrente in ms (una chiave persa non riporta un valore già visto).
+        """
+        value = self.cache.get(self.GENERATION_KEY)
+        if value is None:
+            seed = int(time.time() * 1000)
+            self.cache.add(self.GENERATION_KEY, seed, timeout=None)
+            value = self.cache.get(self.GENERATION_KEY, seed)
+        return int(value)
+
+    def _bump(self) -> None:
+        try:
+            self.cache.incr(self.GENERATION_KEY)
+        except ValueError:
+            # Chiave assente: add() evita di sovrascrivere un incr concorrente
+            self.cache.add(self.GENERATION_KEY, int(time.time() * 1000), timeout=None)
+            self.cache.incr(self.GENERATION_KEY)
+
+    def active(self, sensor_id: int) -> List[Tuple[Optional[float], str]]:
+        """Livelli con almeno un client iscritto (una sola round trip)"""
+        levels = [(None, RAW)] + [(rate, mode) for rate in STREAM_RATES for mode in STREAM_MODES]
+        keys = {self._key(sensor_id, rate, mode): (rate, mode) for rate, mode in levels}
+        counts = self.cache.get_many(list(keys))
+        return [keys[key] for key, count in counts.items() if count and count > 0]
+
+
+class StreamFanout:
+    """Riduzione condivisa per livello e invio ai gruppi degli stream live"""
+
+    def __init__(self):
+        self.channel_layer = get_channel_layer()
+        self._lock = threading.Lock()
+        # sensor_id -> livelli attivi, validi finché non cambia la generazione delle iscrizioni
+        self._active: Dict[int, List[Tuple[Optional[float], str]]] = {}
+        self._generation: Optional[int] = None
+        self._generation_checked = float('-inf')
+        # (sensor_id, rate, mode) -> finestra aperta
+        self._windows: Dict[Tuple[int, float, str], Dict[str, Any]] = {}
+        self._ticker: Optional[threading.Thread] = None
+
+    def _refresh_generation(self, now: float) -> None:
+        """Al più una round trip ogni STREAM_SUBSCRIPTION_REFRESH per tutto il processo"""
+        if now - self._generation_checked < STREAM_SUBSCRIPTION_REFRESH:
+            return
+        self._generation_checked = now
+        try:
+            generation = stream_subscriptions.generation()
+        except Exception as e:
+            logger.debug(f"Stream subscriptions generation lookup failed: {e}")
+            generation = None
+        if generation is None or generation != self._generation:
+            self._generation = generation
+            self._active.clear()
+
+    def _active_levels(self, sensor_id: int) -> List[Tuple[Optional[float], str]]:
+        self._refresh_generation(time.monotonic())
+        levels = self._active.get(sensor_id)
+        if levels is not None:
+            return levels
+        try:
+            levels = stream_subscriptions.active(sensor_id)
+        except Exception as e:
+            logger.debug(f"Stream subscriptions lookup failed for sensor {sensor_id}: {e}")
+            levels = []
+        self._active[sensor_id] = levels
+        if not levels:
+            # Nessun client: le finestre aperte non verranno più emesse
+            for key in [key for key in self._windows if key[0] == sensor_id]:
+                del self._windows[key]
+        return levels
+
+    def publish(self, sensor_id: int, timestamp: datetime, data: Dict[str, Any]) -> None:
+        """Lettura appena salvata dal message processor: inoltro ai livelli con client iscritti"""
+        if not self.channel_layer or not isinstance(data, dict):
+            return
+
+        frames = []
+        with self._lock:
+            levels = self._active_levels(sensor_id)
+            if not levels:
+                return
+            t = timestamp.timestamp()
+            channels = numeric_channels(data)
+            for rate, mode in levels:
+                if rate is None:
+                    frames.append((sensor_id, RAW, None, self._new_window(None, timestamp, data, channels)))
+                    continue
+                for window in self._add_to_window((sensor_id, rate, mode), math.floor(t * rate), timestamp, data, channels):
+                    frames.append((sensor_id, mode, rate, window))
+            if self._windows and self._ticker is None:
+                self._start_ticker()
+
+        for frame_sensor_id, mode, rate, window in frames:
+            self._send(frame_sensor_id, rate, mode, window)
+
+    def _start_ticker(self) -> None:
+        self._ticker = threading.Thread(target=self._tick_loop, name="mqtt-stream-windows", daemon=True)
+        self._ticker.start()
+
+    def _tick_loop(self) -> None:
+        while True:
+            time.sleep(STREAM_WINDOW_TICK)
+            try:
+                self.flush_expired()
+            except Exception as e:
+                logger.error(f"Error flushing expired stream windows: {e}")
+
+    def flush_expired(self, now: Optional[float] = None) -> int:
+        """Invia le finestre scadute (thread delle finestre). Ritorna il numero di frame inviati"""
+        with self._lock:
+            frames = self._expired_windows(time.monotonic() if now is None else now)
+        for sensor_id, mode, rate, window in frames:
+            self._send(sensor_id, rate, mode, window)
+        return len(frames)
+
+    @staticmethod
+    def _new_window(index: Optional[int], timestamp: datetime, data: Dict[str, Any],
+                    channels: Dict[str, float]) -> Dict[str, Any]:
+        return {
+            'index': index, 'start': timestamp, 'count': 1, 'last': (timestamp, data, channels),
+            'min': dict(channels), 'max': dict(channels), 'sent': False,
+        }
+
+    @staticmethod
+    def _frozen(window: Dict[str, Any]) -> Dict[str, Any]:
+        """Copia da inviare di una finestra che resta aperta (altri thread possono aggiornarla)"""
+        return dict(window, min=dict(window['min']), max=dict(window['max']))
+
+    def _add_to_window(self, key: Tuple[int, float, str], index: int, timestamp: datetime,
+                       data: Dict[str, Any], channels: Dict[str, float]) -> List[Dict[str, Any]]:
+        """Aggiunge la lettura alla finestra del livello; ritorna le finestre da inviare"""
+        window = self._windows.get(key)
+        if window is not None and index < window['index']:
+            return []  # Lettura in ritardo rispetto alla finestra aperta
+        if window is None or index > window['index']:
+            frames = [window] if window is not None and not window['sent'] else []
+            opened = self._windows[key] = self._new_window(index, timestamp, data, channels)
+            rate = key[1]
+            opened['deadline'] = time.monotonic() + 1 / rate + STREAM_WINDOW_GRACE
+            # Letture non più frequenti del livello: nessun motivo di attendere la finestra successiva
+            if window is None or (timestamp - window['last'][0]).total_seconds() >= 1 / rate:
+                opened['sent'] = True
+                frames.append(self._frozen(opened))
+            return frames
+
+        window['count'] += 1
+        window['last'] = (timestamp, data, channels)
+        window['sent'] = False
+        for name, value in channels.items():
+            if name not in window['min'] or value < window['min'][name]:
+                window['min'][name] = value
+            if name not in window['max'] or value > window['max'][name]:
+                window['max'][name] = value
+        return []
+
+    def _expired_windows(self, now: float) -> List[Tuple[int, str, float, Dict[str, Any]]]:
+        """
+        Finestre non inviate oltre la scadenza (sensore fermo), al più una volta per periodo.
+        Una finestra già inviata e scaduta viene chiusa: la lettura successiva ne apre una
+        nuova, inviata subito (il sensore è fermo da più di un periodo).
+        """
+        frames = []
+        for key, window in list(self._windows.items()):
+            if window['deadline'] > now:
+                continue
+            sensor_id, rate, mode = key
+            if window['sent']:
+                del self._windows[key]
+                continue
+            window['sent'] = True
+            window['deadline'] = now + 1 / rate + STREAM_WINDOW_GRACE
+            frames.append((sensor_id, mode, rate, self._frozen(window)))
+        return frames
+
+    def _send(self, sensor_id: int, rate: Optional[float], mode: str, window: Dict[str, Any]) -> None:
+        """
+        Invia la finestra chiusa al gruppo del livello, in JSON e come frame binario
+        (codificato qui una volta sola, usato dai client col subprotocol binario)
+        """
+        timestamp, data, channels = window['last']
+        if mode == 'envelope':
+            sample = {
+                "t": _format_timestamp(window['start']),
+                "n": window['count'],
+                "min": window['min'],
+                "max": window['max'],
+            }
+            encode_args = (window['start'], window['count'], window['min'], window['max'])
+        else:
+            sample = {"t": _format_timestamp(timestamp), "v": data}
+            encode_args = (timestamp, window['count'], channels)
+
+        event = {
+            "type": "status_update",
+            "message": {
+                "type": "sensor_stream",
+                "sensor_id": sensor_id,
+                "rate": rate,
+                "mode": mode,
+                "sample": sample,
+            }
+        }
+        try:
+            event["channels"], event["binary"] = encode_stream_frame(sensor_id, rate, mode, *encode_args)
+        except (OverflowError, struct.error) as e:
+            logger.debug(f"Stream frame for sensor {sensor_id} not encodable as float32, JSON only: {e}")
+
+        try:
+            async_to_sync(self.channel_layer.group_send)(stream_group(sensor_id, rate, mode), event)
+            stream_frames.inc(mode)
+        except Exception as e:
+            metrics.broadcast_errors.inc("sensor_stream")
+            logger.error(f"Error sending stream frame for sensor {sensor_id}: {e}")
+
+
+# Singleton instance
+stream_subscriptions = StreamSubscriptions()
+stream_fanout = StreamFanout()
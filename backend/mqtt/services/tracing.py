@@ -0,0 +1,220 @@
+"""
+MQTT Message Tracing - Tracing campionato per-messaggio e slow log strutturato
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Logger dedicati: il file di destinazione è configurato in settings.LOGGING
+trace_logger = logging.getLogger('mqtt.trace')
+slow_logger = logging.getLogger('mqtt.slow')
+
+# Ogni quanto (secondi) ricontrollare il file di controllo per modifiche a runtime
+CONTROL_RELOAD_INTERVAL = 1.0
+
+
+class TracingConfig:
+    """Configurazione corrente del tracing (immutabile, sostituita al reload)"""
+
+    __slots__ = ('enabled', 'sample_rate', 'slow_threshold_ms', 'capture_sql', 'max_queries')
+
+    def __init__(self, enabled=False, sample_rate=0.01, slow_threshold_ms=500,
+                 capture_sql=True, max_queries=200):
+        self.enabled = bool(enabled)
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.slow_threshold_ms = float(slow_threshold_ms)
+        self.capture_sql = bool(capture_sql)
+        self.max_queries = int(max_queries)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], base: 'TracingConfig' = None) -> 'TracingConfig':
+        base = base or cls()
+        return cls(
+            enabled=data.get('enabled', base.enabled),
+            sample_rate=data.get('sample_rate', base.sample_rate),
+            slow_threshold_ms=data.get('slow_threshold_ms', base.slow_threshold_ms),
+            capture_sql=data.get('capture_sql', base.capture_sql),
+            max_queries=data.get('max_queries', base.max_queries),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class MessageTrace:
+    """Dati raccolti durante il processing di un singolo messaggio"""
+
+    __slots__ = (
+        'site_id', 'topic', 'topic_type', 'payload_size', 'sampled', 'handler',
+        'stages', 'device_count', 'query_count', 'db_ms', 'queries', 'total_ms', 'result'
+    )
+
+    def __init__(self, site_id: int, topic: str, payload_size: int, sampled: bool):
+        self.site_id = site_id
+        self.topic = topic
+        self.topic_type = 'unknown'
+        self.payload_size = payload_size
+        self.sampled = sampled
+        self.handler = None
+        self.stages: Dict[str, float] = {}
+        self.device_count = 0
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.queries = None
+        self.total_ms = 0.0
+        self.result = None
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000.0
+
+    def to_dict(self, include_queries: bool = False) -> Dict[str, Any]:
+        data = {
+            'site_id': self.site_id,
+            'topic': self.topic,
+            'topic_type': self.topic_type,
+            'handler': self.handler,
+            'payload_size': self.payload_size,
+            'device_count': self.device_count,
+            'query_count': self.query_count,
+            'db_ms': round(self.db_ms, 3),
+            'total_ms': round(self.total_ms, 3),
+            'stages_ms': {stage: round(ms, 3) for stage, ms in self.stages.items()},
+            'result': 'ok' if self.result else 'error',
+            'sampled': self.sampled,
+        }
+        if include_queries and self.queries is not None:
+            data['queries'] = [
+                {'sql': sql, 'ms': round(seconds * 1000.0, 3)} for sql, seconds in self.queries
+            ]
+        return data
+
+
+class MessageTracer:
+    """
+    Decide quali messaggi campionare ed emette trace e slow log.
+
+    La configurazione parte da settings.MQTT_TRACING e può essere modificata
+    a runtime scrivendo il file di controllo JSON (vedi comando mqtt_tracing):
+    il servizio lo rilegge senza restart.
+    """
+
+    def __init__(self):
+        defaults = getattr(settings, 'MQTT_TRACING', {})
+        self._defaults = TracingConfig(
+            enabled=defaults.get('ENABLED', False),
+            sample_rate=defaults.get('SAMPLE_RATE', 0.01),
+            slow_threshold_ms=defaults.get('SLOW_THRESHOLD_MS', 500),
+            capture_sql=defaults.get('CAPTURE_SQL', True),
+            max_queries=defaults.get('MAX_QUERIES', 200),
+        )
+        self.control_file = defaults.get('CONTROL_FILE')
+        self._config = self._defaults
+        self._control_mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @property
+    def config(self) -> TracingConfig:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._reload(now)
+        return self._config
+
+    def _reload(self, now: float) -> None:
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + CONTROL_RELOAD_INTERVAL
+
+            if not self.control_file:
+                return
+
+            try:
+                mtime = os.stat(self.control_file).st_mtime
+            except OSError:
+                # File rimosso: torna ai default di settings
+                if self._control_mtime is not None:
+                    logger.info("Tracing control file removed, using settings defaults")
+                    self._config = self._defaults
+                    self._control_mtime = None
+                return
+
+            if mtime == self._control_mtime:
+                return
+
+            try:
+                with open(self.control_file, 'r') as f:
+                    data = json.load(f)
+                self._config = TracingConfig.from_dict(data, self._defaults)
+                self._control_mtime = mtime
+                logger.info(f"Tracing configuration reloaded: {self._config.to_dict()}")
+            except (OSError, ValueError, TypeError) as e:
+                logger.error(f"Invalid tracing control file {self.control_file}: {e}")
+                self._control_mtime = mtime
+
+    def write_control(self, **changes) -> TracingConfig:
+        """Aggiorna il file di controllo (letto dal processo mqtt_service)"""
+        if not self.control_file:
+            raise ValueError("MQTT_TRACING['CONTROL_FILE'] is not configured")
+
+        current = self._defaults
+        try:
+            with open(self.control_file, 'r') as f:
+                current = TracingConfig.from_dict(json.load(f), self._defaults)
+        except (OSError, ValueError):
+            pass
+
+        data = current.to_dict()
+        data.update({key: value for key, value in changes.items() if value is not None})
+        new_config = TracingConfig.from_dict(data, self._defaults)
+
+        tmp_path = f"{self.control_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(new_config.to_dict(), f, indent=2)
+        os.replace(tmp_path, self.control_file)
+        return new_config
+
+    def begin(self, site_id: int, topic: str, payload) -> MessageTrace:
+        """Crea la trace del messaggio, decidendo se campionarlo"""
+        config = self.config
+        sampled = config.enabled and config.sample_rate > 0 and random.random() < config.sample_rate
+        payload_size = len(payload) if payload else 0
+        return MessageTrace(site_id, topic, payload_size, sampled)
+
+    def add_listener(self, callback) -> None:
+        """Registra una callback(trace) chiamata al termine di ogni messaggio (es. simulatore)"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback) -> None:
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def finish(self, trace: MessageTrace) -> None:
+        """Emette trace campionata e/o slow log"""
+        config = self._config
+
+        for listener in self._listeners:
+            try:
+                listener(trace)
+            except Exception as e:
+                logger.error(f"Trace listener error: {e}")
+
+        if trace.sampled:
+            trace_logger.info(json.dumps(trace.to_dict(include_queries=True), default=str))
+
+        if config.slow_threshold_ms > 0 and trace.total_ms >= config.slow_threshold_ms:
+            slow_logger.warning(json.dumps(trace.to_dict(include_queries=trace.sampled), default=str))
+
+
+# Singleton instance
+message_tracer = MessageTracer()
@@ -0,0 +1,89 @@
+"""
+WS Frame Codec - Frame binari compatti per gli stream live dei sensori
+
+Il formato JSON resta quello di default. Un client che apre il WebSocket con il
+subprotocol BINARY_SUBPROTOCOL riceve gli eventi sensor_stream come frame binari
+(tutti gli altri eventi restano frame di testo JSON):
+
+    offset  tipo      campo
+    0       uint8     tipo frame (1 = sensor_stream)
+    1       uint8     modalità (0 raw, 1 decimate, 2 envelope)
+    2       uint16    numero di canali C
+    4       uint32    sensor_id
+    8       float64   timestamp (ms dall'epoch, inizio finestra per envelope)
+    16      float32   rate (Hz, 0 = raw)
+    20      uint32    letture nella finestra
+    24      float32[] valori: C (raw / decimate) oppure C minimi + C massimi (envelope)
+
+Little-endian, header di 24 byte: i valori sono leggibili direttamente con
+new Float32Array(buffer, 24). I nomi dei canali non sono nel frame: il consumer
+invia {"type": "stream_schema", "sensor_id", "channels"} (testo) quando cambiano.
+I canali non numerici non entrano nel frame binario.
+
+Il frame è codificato una volta per livello in stream_fanout, non per client.
+"""
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+BINARY_SUBPROTOCOL = 'bfg.stream.v1'
+JSON_SUBPROTOCOL = 'bfg.json'
+
+FRAME_SENSOR_STREAM = 1
+MODE_CODES = {'raw': 0, 'decimate': 1, 'envelope': 2}
+
+_header = struct.Struct('<BBHIdfI')
+
+
+def numeric_channels(data: Dict[str, Any]) -> Dict[str, float]:
+    """Canali numerici di una lettura: {"x": 1.2, "y": ...}; le liste diventano values0, values1, ..."""
+    channels = {}
+    for key, value in data.items():
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            channels[key] = value
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, (int, float)) and not isinstance(item, bool):
+                    channels[f"{key}{index}"] = item
+    return channels
+
+
+def select_subprotocol(requested: List[str]) -> Optional[str]:
+    """Subprotocol da accettare tra quelli offerti dal client (None = JSON senza negoziazione)"""
+    if BINARY_SUBPROTOCOL in requested:
+        return BINARY_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in requested:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def encode_stream_frame(sensor_id: int, rate: Optional[float], mode: str, timestamp: datetime,
+                        count: int, values: Dict[str, float],
+                        maxima: Optional[Dict[str, float]] = None) -> Tuple[List[str], bytes]:
+    """
+    Frame binario di un campione sensor_stream.
+
+    Args:
+        values: canali del campione (raw / decimate) o minimi della finestra (envelope)
+        maxima: massimi della finestra (solo envelope, stessi canali di values)
+
+    Returns:
+        (nomi dei canali nell'ordine del frame, bytes del frame)
+    """
+    channels = list(values)
+    numbers = [float(values[name]) for name in channels]
+    if maxima is not None:
+        numbers += [float(maxima.get(name, values[name])) for name in channels]
+
+    header = _header.pack(
+        FRAME_SENSOR_STREAM,
+        MODE_CODES[mode],
+        len(channels),
+        sensor_id,
+        timestamp.timestamp() * 1000.0,
+        rate or 0.0,
+        count,
+    )
+    return channels, header + struct.pack(f'<{len(numbers)}f', *numbers)
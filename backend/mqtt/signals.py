@@ -1,7 +1,26 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import MqttConnection
+from sites.access import site_access
+from .models import Datalogger, DataloggerState, Gateway, GatewayState, MqttConnection, Sensor, SensorState
 from .services.broadcast import broadcast_status_update
+from .services.change_feed import change_feed
+from .services.hot_state import sensor_hot_state
+from .services.response_cache import datalogger_scope, response_cache, site_scope
+from .services.site_health import site_health
+
+
+# Stato live creato insieme al device (i path bulk lo creano esplicitamente)
+STATE_MODELS = {Gateway: GatewayState, Datalogger: DataloggerState, Sensor: SensorState}
+
+# Relazione in cache in site_access per HasSiteAccess (mqtt.api.permissions)
+ACCESS_PARENT_FIELDS = {Datalogger: 'site', Sensor: 'datalogger'}
+
+
+def _device_site_id(instance):
+    if isinstance(instance, Sensor):
+        return Datalogger.objects.filter(pk=instance.datalogger_id).values_list('site_id', flat=True).first()
+    return instance.site_id
+
 
 @receiver(post_save, sender=MqttConnection)
 def mqtt_connection_post_save(sender, instance, created, update_fields, **kwargs):
@@ -24,3 +43,40 @@ def mqtt_connection_post_save(sender, instance, created, update_fields, **kwargs
             status=instance.status,
             is_enabled=instance.is_enabled
         )
+
+
+@receiver(post_delete, sender=Gateway)
+@receiver(post_delete, sender=Datalogger)
+@receiver(post_delete, sender=Sensor)
+def mqtt_device_post_delete(sender, instance, **kwargs):
+    """
+    Le eliminazioni (admin, cleanup) non passano dagli eventi di ingest:
+    tombstone per il change feed e invalidazione delle risposte API in cache che includono il device.
+    """
+    change_feed.record_deletion(instance)
+    site_health.mark_dirty_on_commit(_device_site_id(instance), force=True)
+    if not isinstance(instance, Gateway):
+        site_access.invalidate_device(sender._meta.model_name, instance.pk)
+    if isinstance(instance, Sensor):
+        sensor_hot_state.forget([instance.pk])
+        response_cache.bump_on_commit(datalogger_scope(instance.datalogger_id))
+    elif isinstance(instance, Datalogger):
+        response_cache.bump_on_commit(site_scope(instance.site_id), datalogger_scope(instance.pk))
+    else:
+        response_cache.bump_on_commit(site_scope(instance.site_id))
+
+
+@receiver(post_save, sender=Gateway)
+@receiver(post_save, sender=Datalogger)
+@receiver(post_save, sender=Sensor)
+def mqtt_device_post_save(sender, instance, created, update_fields, **kwargs):
+    """
+    Nuovi device (ingest, admin, API): riga di stato live e contatori del sito da ricalcolare.
+    Le transizioni online/offline arrivano dagli eventi del message processor.
+    Datalogger / sensore spostati: relazione in cache per i controlli di accesso da rileggere.
+    """
+    if created:
+        STATE_MODELS[sender].objects.get_or_create(pk=instance.pk)
+        site_health.mark_dirty_on_commit(_device_site_id(instance))
+    elif sender in ACCESS_PARENT_FIELDS and (update_fields is None or ACCESS_PARENT_FIELDS[sender] in update_fields):
+        site_access.invalidate_device(sender._meta.model_name, instance.pk)
@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from mqtt.models import ChangeSequence, ChangeTombstone, Datalogger, Sensor, SensorState
+from mqtt.services.change_feed import CursorExpired, change_feed
+from sites.models import Site
+
+
+class ChangeFeedTest(TestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(name="Feed Site", code="feed_site", customer_name="Test",
+                                        latitude=0, longitude=0)
+        self.datalogger = Datalogger.objects.create(site=self.site, serial_number="feed-dl")
+        self.sensors = [
+            Sensor.objects.create(datalogger=self.datalogger, serial_number=f"feed-sensor-{i}")
+            for i in range(7)
+        ]
+
+    def sync(self, after, limit):
+        """Legge il feed fino alla fine: (id dei sensori per pagina, cursori, ultimo cursore)"""
+        pages, cursors = [], []
+        while True:
+            batch = change_feed.read(after, limit, site_id=self.site.id)
+            pages.append([sensor.id for sensor in batch.sensors])
+            cursors.append(batch.cursor)
+            after = batch.cursor
+            if not batch.has_more:
+                return pages, cursors, after
+
+    def test_full_sync_pages_through_every_sensor_once(self):
+        pages, cursors, _ = self.sync(None, 3)
+        ids = [sensor_id for page in pages for sensor_id in page]
+        self.assertEqual(sorted(ids), sorted(sensor.id for sensor in self.sensors))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(len(page) <= 3 for page in pages))
+        self.assertEqual(cursors, sorted(cursors))
+        self.assertEqual(cursors[-1], ChangeSequence.current())
+
+    def test_cursor_returns_only_later_changes(self):
+        _, _, cursor = self.sync(None, 100)
+        self.assertEqual(self.sync(cursor, 100)[0], [[]])
+
+        sensor = self.sensors[2]
+        sensor.label = "renamed"
+        sensor.save()
+        pages, _, _ = self.sync(cursor, 100)
+        self.assertEqual(pages, [[sensor.id]])
+
+    def test_state_change_is_reported_once(self):
+        _, _, cursor = self.sync(None, 100)
+        sensor = self.sensors[4]
+        SensorState.upsert(sensor.id, is_online=True)
+        sensor.label = "renamed"
+        sensor.save()
+        SensorState.upsert(sensor.id, is_online=False)
+
+        pages, _, _ = self.sync(cursor, 1)
+        self.assertEqual([sensor_id for page in pages for sensor_id in page], [sensor.id])
+
+    def test_page_never_splits_a_shared_change_seq(self):
+        _, _, cursor = self.sync(None, 100)
+        # Una sola scrittura (es. batch di telemetria) su più righe del limite
+        seq = ChangeSequence.allocate()
+        Sensor.objects.filter(datalogger=self.datalogger).update(change_seq=seq)
+
+        batch = change_feed.read(cursor, 3, site_id=self.site.id)
+        self.assertEqual(len(batch.sensors), len(self.sensors))
+        self.assertEqual(batch.cursor, seq)
+        self.assertFalse(batch.has_more)
+
+    def test_deleted_sensor_leaves_a_tombstone(self):
+        _, _, cursor = self.sync(None, 100)
+        sensor = self.sensors[0]
+        sensor_id = sensor.id
+        sensor.delete()
+
+        batch = change_feed.read(cursor, 100, site_id=self.site.id)
+        self.assertEqual(batch.sensors, [])
+        self.assertEqual([(t.kind, t.object_id, t.datalogger_id) for t in batch.deleted],
+                         [('sensor', sensor_id, self.datalogger.id)])
+
+        by_datalogger = change_feed.read(cursor, 100, datalogger_id=self.datalogger.id)
+        self.assertEqual([t.object_id for t in by_datalogger.deleted], [sensor_id])
+
+    @override_settings(MQTT_CONFIG={'CHANGE_TOMBSTONE_RETENTION_DAYS': 7})
+    def test_cursor_before_pruned_tombstones_expires(self):
+        cursor = change_feed.current_cursor()
+        self.sensors[0].delete()
+        ChangeTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(change_feed.prune_tombstones(force=True), 1)
+        with self.assertRaises(CursorExpired):
+            change_feed.read(cursor, 100, site_id=self.site.id)
+        # Un cursore letto dopo la pulizia resta valido
+        change_feed.read(change_feed.current_cursor(), 100, site_id=self.site.id)
+
+    def test_cursor_after_head_expires(self):
+        with self.assertRaises(CursorExpired):
+            change_feed.read(ChangeSequence.current() + 1, 100, site_id=self.site.id)
+
+    def test_api_returns_gone_for_expired_cursor(self):
+        user = get_user_model().objects.create_superuser(username="feed-admin", email="feed@example.com",
+                                                         password="x")
+        client = APIClient()
+        client.force_authenticate(user)
+        head = ChangeSequence.current()
+
+        response = client.get('/api/v1/mqtt/changes/', {'site_id': self.site.id, 'cursor': head + 10})
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json()['reset'])
+
+        response = client.get('/api/v1/mqtt/changes/', {'site_id': self.site.id, 'cursor': head})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cursor'], str(head))
@@ -0,0 +1,81 @@
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from mqtt.models import Datalogger, Gateway
+from sites.models import Site
+
+
+class DirtyTrackingTest(TestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(name="Dirty Site", code="dirty_site", customer_name="Test",
+                                        latitude=0, longitude=0)
+        Datalogger.objects.create(site=self.site, serial_number="dirty-dl", raw_metadata={'a': 1})
+        self.datalogger = Datalogger.objects.get(serial_number="dirty-dl")
+
+    def test_new_instance_is_fully_dirty(self):
+        gateway = Gateway(site=self.site, serial_number="dirty-gw")
+        self.assertIn('serial_number', gateway.get_dirty_fields())
+        self.assertIn('label', gateway.get_dirty_fields())
+
+    def test_noop_save_runs_no_query_and_keeps_change_seq(self):
+        change_seq = self.datalogger.change_seq
+        received = []
+
+        def handler(sender, instance, **kwargs):
+            received.append(instance)
+        post_save.connect(handler, sender=Datalogger)
+        self.addCleanup(post_save.disconnect, handler, sender=Datalogger)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.datalogger.save()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(received, [])
+        self.assertEqual(self.datalogger.change_seq, change_seq)
+
+    def test_save_writes_only_changed_fields(self):
+        change_seq = self.datalogger.change_seq
+        self.datalogger.label = "Renamed"
+        self.assertEqual(self.datalogger.get_dirty_fields(), ['label'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.datalogger.save()
+        update = next(q['sql'] for q in queries if q['sql'].startswith('UPDATE "mqtt_datalogger"'))
+        self.assertIn('"label"', update)
+        self.assertIn('"updated_at"', update)
+        self.assertIn('"change_seq"', update)
+        self.assertNotIn('"firmware_version"', update)
+        self.assertNotIn('"raw_metadata"', update)
+
+        self.assertGreater(self.datalogger.change_seq, change_seq)
+        self.assertEqual(self.datalogger.get_dirty_fields(), [])
+        self.assertEqual(Datalogger.objects.get(pk=self.datalogger.pk).label, "Renamed")
+
+    def test_in_place_json_mutation_is_dirty(self):
+        self.datalogger.raw_metadata['b'] = 2
+        self.assertEqual(self.datalogger.get_dirty_fields(), ['raw_metadata'])
+        self.datalogger.save()
+        self.assertEqual(Datalogger.objects.get(pk=self.datalogger.pk).raw_metadata, {'a': 1, 'b': 2})
+
+    def test_value_set_back_to_loaded_value_is_clean(self):
+        original = self.datalogger.label
+        self.datalogger.label = "Temporary"
+        self.datalogger.label = original
+        self.assertEqual(self.datalogger.get_dirty_fields(), [])
+
+    def test_refresh_from_db_resets_the_refreshed_fields(self):
+        self.datalogger.label = "Unsaved"
+        self.datalogger.firmware_version = "2.0"
+        self.datalogger.refresh_from_db(fields=['label'])
+        self.assertEqual(self.datalogger.get_dirty_fields(), ['firmware_version'])
+
+    def test_explicit_update_fields_are_saved(self):
+        self.datalogger.firmware_version = "3.1"
+        self.datalogger.label = "Not saved"
+        self.datalogger.save(update_fields=['firmware_version'])
+        stored = Datalogger.objects.get(pk=self.datalogger.pk)
+        self.assertEqual(stored.firmware_version, "3.1")
+        self.assertEqual(stored.label, "dirty-dl")
+        self.assertEqual(self.datalogger.get_dirty_fields(), ['label'])
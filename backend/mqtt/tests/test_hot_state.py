@@ -0,0 +1,141 @@
+import copy
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from mqtt.models import Sensor, SensorState
+from mqtt.services.hot_state import sensor_hot_state
+from mqtt.services.message_processor import message_processor
+from sites.models import Site
+
+TELEMETRY_TOPIC = "test_site/gateway/1/dataloggers/telemetry"
+FIRST_TIMESTAMP = datetime(2025, 11, 25, 15, 32, 24, tzinfo=dt_timezone.utc)
+
+TELEMETRY_PAYLOAD = {
+    "serial_number_gateway": "test-gw-hot",
+    "timestamp": "2025-11-25T15:32:24Z",
+    "message_interval_seconds": 5,
+    "dataloggers": [
+        {
+            "serial_number_datalogger": "test_datalogger",
+            "status_datalogger": "running",
+            "devices": [
+                {
+                    "type": "monstr-o",
+                    "serial_number_device": "TEST_HOT001",
+                    "data": [{"type": "accelerometer", "value": [1.0, 2.0, 3.0]}],
+                }
+            ],
+        }
+    ],
+}
+
+HOT_STATE_CONFIG = {
+    **settings.MQTT_CONFIG,
+    'HOT_STATE_ENABLED': True,
+    'HOT_STATE_FLUSH_INTERVAL': 3600,
+}
+
+
+@override_settings(MQTT_CONFIG=HOT_STATE_CONFIG)
+class HotStateTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        sensor_hot_state._buffers.clear()
+        sensor_hot_state._pending.clear()
+        # Nessun flush a intervallo durante il test: solo quelli forzati
+        sensor_hot_state._last_flush = time.monotonic()
+        self.site = Site.objects.create(name="Test Site", code="test_site", customer_name="Test",
+                                        latitude=0, longitude=0)
+
+    def tearDown(self):
+        sensor_hot_state._buffers.clear()
+        sensor_hot_state._pending.clear()
+
+    def process(self, payload=TELEMETRY_PAYLOAD):
+        return message_processor.process_message(
+            self.site.id, TELEMETRY_TOPIC, json.dumps(payload).encode('utf-8'), 0, False
+        )
+
+    def sensor(self):
+        return Sensor.objects.get(serial_number="TEST_HOT001-accelerometer")
+
+
+class HotStateOnCommitTest(HotStateTestCase):
+    """Le letture entrano in Redis e nella coda di flush solo dopo il commit dell'ingest"""
+
+    def test_readings_recorded_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertTrue(self.process())
+        sensor_id = self.sensor().pk
+
+        self.assertEqual(sensor_hot_state.latest([sensor_id]), {})
+        self.assertEqual(sensor_hot_state._pending, {})
+
+        for callback in callbacks:
+            callback()
+        entry = sensor_hot_state.latest([sensor_id])[sensor_id]
+        self.assertEqual(entry['pending'], 1)
+        self.assertEqual(entry['readings'][0][0], FIRST_TIMESTAMP)
+
+    def test_rollback_discards_readings(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.process()
+        sensor = self.sensor()
+        sensor_hot_state.flush(force=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    sensor_hot_state.record_on_commit(
+                        sensor.datalogger_id, 5, [(sensor.pk, FIRST_TIMESTAMP + timedelta(seconds=5), {'x': 9})]
+                    )
+                    raise RuntimeError("ingest failed")
+
+        self.assertEqual(sensor_hot_state._pending, {})
+        self.assertEqual(sensor_hot_state.latest([sensor.pk])[sensor.pk]['readings'][0][0], FIRST_TIMESTAMP)
+        self.assertEqual(SensorState.objects.get(pk=sensor.pk).total_messages, 1)
+
+
+class HotStateBatchMergeTest(HotStateTestCase):
+    """Il path batch non scarta le letture pendenti arrivate dopo il flush forzato"""
+
+    def test_batch_write_keeps_pending_readings(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.process()
+        sensor = self.sensor()
+        sensor_hot_state.flush(force=True)
+
+        # Due letture arrivate dal path live, non ancora su Postgres
+        sensor_hot_state.record(sensor.datalogger_id, 5, [
+            (sensor.pk, FIRST_TIMESTAMP + timedelta(seconds=5), {'x': 2}),
+        ])
+        sensor_hot_state.record(sensor.datalogger_id, 5, [
+            (sensor.pk, FIRST_TIMESTAMP + timedelta(seconds=10), {'x': 3}),
+        ])
+
+        batch_payload = copy.deepcopy(TELEMETRY_PAYLOAD)
+        batch_payload['timestamp'] = "2025-11-25T15:32:39Z"
+        # flush forzato del batch già avvenuto prima delle due letture
+        with mock.patch.object(sensor_hot_state, 'flush'), self.captureOnCommitCallbacks(execute=True):
+            stats = message_processor.persist_telemetry_batch(
+                self.site.id, [(TELEMETRY_TOPIC, batch_payload)], broadcast=False
+            )
+        self.assertEqual(stats['readings'], 1)
+        self.assertEqual(sensor_hot_state._pending[sensor.pk]['count'], 2)
+
+        sensor_hot_state.flush(force=True)
+        state = SensorState.objects.get(pk=sensor.pk)
+        self.assertEqual(state.total_messages, 4)
+        self.assertEqual(state.total_readings, 4)
+        self.assertEqual(state.last_timestamp_1, FIRST_TIMESTAMP + timedelta(seconds=15))
+        self.assertEqual(state.last_timestamp_2, FIRST_TIMESTAMP + timedelta(seconds=10))
+        self.assertEqual(state.last_timestamp_3, FIRST_TIMESTAMP + timedelta(seconds=5))
+        self.assertEqual(state.last_seen_at, FIRST_TIMESTAMP + timedelta(seconds=15))
@@ -0,0 +1,124 @@
+import shutil
+import tempfile
+import threading
+import time
+
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+
+from mqtt.services.ingest_spool import IngestSpool
+
+
+def failing_queries(count):
+    """execute_wrapper che simula il DB non raggiungibile per le prime count query"""
+    state = {'left': count}
+
+    def wrapper(execute, sql, params, many, context):
+        if state['left'] > 0:
+            state['left'] -= 1
+            raise OperationalError("server closed the connection unexpectedly")
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+class RecordingHandler:
+    """Handler dello spool: registra i payload processati con successo"""
+
+    def __init__(self, db_failures=0, result=True):
+        self.db_failures = failing_queries(db_failures)
+        self.result = result
+        self.attempts = 0
+        self.processed = []
+        self.done = threading.Event()
+        self.expected = None
+
+    def __call__(self, site_id, topic, payload):
+        self.attempts += 1
+        try:
+            # Come il message processor: l'errore del DB viene intercettato e diventa False
+            with connection.execute_wrapper(self.db_failures):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        except OperationalError:
+            return False
+        self.processed.append(payload)
+        if self.expected is not None and len(self.processed) >= self.expected:
+            self.done.set()
+        return self.result
+
+
+class IngestSpoolTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='mqtt-spool-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(MQTT_SPOOL={
+            'ENABLED': True,
+            'DIR': self.directory,
+            'SYNC_MODE': 'always',
+            'DB_RETRY_MAX_DELAY': 1,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def start_spool(self, handler):
+        spool = IngestSpool()
+        spool.start(handler)
+        self.addCleanup(spool.stop)
+        return spool
+
+    def wait_for(self, condition, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the spool drainer")
+            time.sleep(0.02)
+
+    def test_records_are_retried_after_a_database_outage(self):
+        handler = RecordingHandler(db_failures=1)
+        handler.expected = 3
+        spool = self.start_spool(handler)
+        for i in range(3):
+            spool.append(1, 'site/gateway/1/status', f'message {i}'.encode())
+
+        self.assertTrue(handler.done.wait(10))
+        self.assertEqual(handler.processed, [b'message 0', b'message 1', b'message 2'])
+        self.assertEqual(handler.attempts, 4)
+
+        spool.stop()
+        restarted = IngestSpool()
+        restarted._cursor = restarted._load_checkpoint()
+        self.assertEqual(restarted.backlog_bytes(), 0)
+
+    def test_rejected_payload_without_database_error_is_consumed(self):
+        handler = RecordingHandler(result=False)
+        handler.expected = 2
+        spool = self.start_spool(handler)
+        spool.append(1, 'site/gateway/1/status', b'not json')
+        spool.append(1, 'site/gateway/1/status', b'{}')
+
+        self.assertTrue(handler.done.wait(10))
+        self.assertEqual(handler.attempts, 2)
+        self.wait_for(lambda: spool.backlog_bytes() == 0)
+
+    def test_uncommitted_records_are_replayed_after_restart(self):
+        # DB giù per tutta la prima esecuzione: nessun record viene consumato
+        unavailable = RecordingHandler(db_failures=1000)
+        spool = self.start_spool(unavailable)
+        spool.append(1, 'site/gateway/1/status', b'first')
+        spool.append(1, 'site/gateway/1/status', b'second')
+        self.wait_for(lambda: unavailable.attempts >= 1)
+        spool.stop()
+        self.assertEqual(unavailable.processed, [])
+
+        handler = RecordingHandler()
+        handler.expected = 2
+        restarted = self.start_spool(handler)
+        self.assertTrue(handler.done.wait(10))
+        self.assertEqual(handler.processed, [b'first', b'second'])
+        self.wait_for(lambda: restarted.backlog_bytes() == 0)
+
+        restarted.stop()
+        again = IngestSpool()
+        again._cursor = again._load_checkpoint()
+        self.assertEqual(again.backlog_bytes(), 0)
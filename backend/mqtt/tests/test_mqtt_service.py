@@ -0,0 +1,63 @@
+import gzip
+import json
+import zlib
+
+from django.test import TestCase
+
+from mqtt.models import Gateway, Sensor
+from mqtt.services.mqtt_service import mqtt_service
+from sites.models import Site
+
+TELEMETRY_PAYLOAD = {
+    "serial_number_gateway": "test-gw-compressed",
+    "timestamp": "2025-11-25T15:32:24.661225Z",
+    "message_interval_seconds": 5,
+    "dataloggers": [
+        {
+            "serial_number_datalogger": "test_datalogger",
+            "status_datalogger": "running",
+            "devices": [
+                {
+                    "type": "monstr-o",
+                    "serial_number_device": "TEST_GZ001",
+                    "data": [{"type": "accelerometer", "value": [1.0, 2.0, 3.0]}],
+                }
+            ],
+        }
+    ],
+}
+
+TELEMETRY_TOPIC = "test_site/gateway/1/dataloggers/telemetry"
+
+
+class ProcessNowCompressedPayloadTest(TestCase):
+    """I payload compressi arrivano come bytes fino a decode_payload (live e spool)"""
+
+    def setUp(self):
+        self.site = Site.objects.create(name="Test Site", code="test_site", customer_name="Test",
+                                        latitude=0, longitude=0)
+        self.raw = json.dumps(TELEMETRY_PAYLOAD).encode('utf-8')
+
+    def assertTelemetryPersisted(self):
+        self.assertTrue(Gateway.objects.filter(serial_number="test-gw-compressed").exists())
+        self.assertTrue(Sensor.objects.filter(serial_number="TEST_GZ001-accelerometer").exists())
+
+    def test_gzip_topic_suffix(self):
+        ok = mqtt_service._process_now(self.site.id, TELEMETRY_TOPIC + ".gz", gzip.compress(self.raw))
+        self.assertTrue(ok)
+        self.assertTelemetryPersisted()
+
+    def test_gzip_sniffed_without_suffix(self):
+        ok = mqtt_service._process_now(self.site.id, TELEMETRY_TOPIC, gzip.compress(self.raw))
+        self.assertTrue(ok)
+        self.assertTelemetryPersisted()
+
+    def test_zlib_topic_suffix(self):
+        ok = mqtt_service._process_now(self.site.id, TELEMETRY_TOPIC + ".zlib", zlib.compress(self.raw))
+        self.assertTrue(ok)
+        self.assertTelemetryPersisted()
+
+    def test_plain_payload(self):
+        ok = mqtt_service._process_now(self.site.id, TELEMETRY_TOPIC, self.raw)
+        self.assertTrue(ok)
+        self.assertTelemetryPersisted()
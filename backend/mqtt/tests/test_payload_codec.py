@@ -0,0 +1,72 @@
+import gzip
+import json
+import zlib
+
+from django.test import SimpleTestCase, override_settings
+
+from mqtt.services.payload_codec import (
+    GZIP, ZLIB, PayloadDecodeError, PayloadTooLargeError, decode_payload, sniff_compression, split_topic_suffix,
+)
+
+TOPIC = 'site_001/gateway/1/dataloggers/telemetry'
+PAYLOAD = json.dumps({"serial_number_gateway": "gw-1", "dataloggers": []}).encode('utf-8')
+
+
+class SplitTopicSuffixTest(SimpleTestCase):
+
+    def test_known_suffixes(self):
+        self.assertEqual(split_topic_suffix(TOPIC + '.gz'), (TOPIC, GZIP))
+        self.assertEqual(split_topic_suffix(TOPIC + '.gzip'), (TOPIC, GZIP))
+        self.assertEqual(split_topic_suffix(TOPIC + '.zz'), (TOPIC, ZLIB))
+        self.assertEqual(split_topic_suffix(TOPIC + '.ZLIB'), (TOPIC, ZLIB))
+
+    def test_plain_topics_are_unchanged(self):
+        self.assertEqual(split_topic_suffix(TOPIC), (TOPIC, None))
+        self.assertEqual(split_topic_suffix('site.gz/gateway/1/status'), ('site.gz/gateway/1/status', None))
+
+
+class DecodePayloadTest(SimpleTestCase):
+
+    def test_gzip_topic_suffix(self):
+        decoded = decode_payload(TOPIC + '.gz', gzip.compress(PAYLOAD))
+        self.assertEqual(decoded.topic, TOPIC)
+        self.assertEqual(decoded.data, PAYLOAD)
+        self.assertEqual(decoded.compression, GZIP)
+        self.assertEqual(decoded.size, len(PAYLOAD))
+
+    def test_zlib_topic_suffix(self):
+        decoded = decode_payload(TOPIC + '.zlib', zlib.compress(PAYLOAD))
+        self.assertEqual((decoded.topic, decoded.data, decoded.compression), (TOPIC, PAYLOAD, ZLIB))
+
+    def test_compression_sniffed_from_magic_bytes(self):
+        self.assertEqual(sniff_compression(gzip.compress(PAYLOAD)), GZIP)
+        self.assertEqual(sniff_compression(zlib.compress(PAYLOAD)), ZLIB)
+        self.assertEqual(decode_payload(TOPIC, gzip.compress(PAYLOAD)).data, PAYLOAD)
+        self.assertEqual(decode_payload(TOPIC, zlib.compress(PAYLOAD)).data, PAYLOAD)
+
+    def test_plain_payload_is_returned_as_is(self):
+        decoded = decode_payload(TOPIC, PAYLOAD)
+        self.assertEqual((decoded.topic, decoded.data, decoded.compression), (TOPIC, PAYLOAD, None))
+
+    def test_plain_payload_with_zlib_like_header(self):
+        # '80' forma un header zlib valido: senza suffisso si usa il payload originale
+        self.assertEqual(sniff_compression(b'80'), ZLIB)
+        decoded = decode_payload(TOPIC, b'80')
+        self.assertEqual((decoded.data, decoded.compression), (b'80', None))
+
+    def test_corrupted_payload_with_suffix_raises(self):
+        with self.assertRaises(PayloadDecodeError):
+            decode_payload(TOPIC + '.gz', b'not gzip at all')
+
+    def test_truncated_payload_raises(self):
+        with self.assertRaises(PayloadDecodeError):
+            decode_payload(TOPIC + '.gz', gzip.compress(PAYLOAD)[:-12])
+
+    @override_settings(MQTT_CONFIG={'MAX_DECOMPRESSED_PAYLOAD_BYTES': 1024})
+    def test_decompressed_size_limit(self):
+        bomb = gzip.compress(b'0' * 100_000)
+        with self.assertRaises(PayloadTooLargeError):
+            decode_payload(TOPIC + '.gz', bomb)
+        # Il limite vale anche per i payload riconosciuti dai magic bytes
+        with self.assertRaises(PayloadTooLargeError):
+            decode_payload(TOPIC, bomb)
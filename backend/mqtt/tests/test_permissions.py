@@ -0,0 +1,90 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from mqtt.models import Datalogger, Sensor
+from sites.models import Site, UserSiteAccess
+
+
+class HasSiteAccessTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(name="Access Site", code="access_site", customer_name="Test",
+                                        latitude=0, longitude=0)
+        self.other_site = Site.objects.create(name="Other Site", code="other_site", customer_name="Test",
+                                              latitude=0, longitude=0)
+        self.datalogger = Datalogger.objects.create(site=self.site, serial_number="access-dl")
+        self.sensor = Sensor.objects.create(datalogger=self.datalogger, serial_number="access-sensor")
+
+        self.user = get_user_model().objects.create_user(username="access-user", email="access@example.com",
+                                                         password="x")
+        UserSiteAccess.objects.create(user=self.user, site=self.site)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def device_queries(self, queries):
+        return [q['sql'] for q in queries if '"mqtt_' in q['sql']]
+
+    def test_not_modified_datalogger_detail_reads_no_device_tables(self):
+        url = f'/api/v1/mqtt/devices/{self.datalogger.id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.device_queries(queries), [])
+
+    def test_not_modified_sensor_list_reads_no_device_tables(self):
+        url = '/api/v1/mqtt/sensors/by_datalogger/'
+        params = {'datalogger_id': self.datalogger.id}
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.device_queries(queries), [])
+
+    def test_sensor_route_uses_cached_datalogger_and_site(self):
+        url = f'/api/v1/mqtt/sensors/{self.sensor.id}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # Solo le query della view: sito del sensore dalla cache
+        lookups = ('SELECT "mqtt_sensor"."datalogger_id"', 'SELECT "mqtt_datalogger"."site_id"')
+        self.assertEqual([sql for sql in self.device_queries(queries) if sql.startswith(lookups)], [])
+
+    def test_moved_datalogger_is_checked_against_its_new_site(self):
+        url = f'/api/v1/mqtt/devices/{self.datalogger.id}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        sensor_url = f'/api/v1/mqtt/sensors/{self.sensor.id}/'
+        self.assertEqual(self.client.get(sensor_url).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.datalogger.site = self.other_site
+            self.datalogger.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(sensor_url).status_code, 403)
+
+    def test_moved_sensor_is_checked_against_its_new_datalogger(self):
+        sensor_url = f'/api/v1/mqtt/sensors/{self.sensor.id}/'
+        self.assertEqual(self.client.get(sensor_url).status_code, 200)
+
+        other = Datalogger.objects.create(site=self.other_site, serial_number="other-dl")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sensor.datalogger = other
+            self.sensor.save()
+        self.assertEqual(self.client.get(sensor_url).status_code, 403)
+
+    def test_inaccessible_site_is_forbidden(self):
+        other = Datalogger.objects.create(site=self.other_site, serial_number="forbidden-dl")
+        self.assertEqual(self.client.get(f'/api/v1/mqtt/devices/{other.id}/').status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/mqtt/devices/', {'site_id': self.other_site.id}).status_code, 403)
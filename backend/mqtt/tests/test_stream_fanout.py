@@ -0,0 +1,64 @@
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from mqtt.services.stream_fanout import STREAM_SUBSCRIPTION_REFRESH, StreamFanout, stream_subscriptions
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class StreamFanoutTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.fanout = StreamFanout()
+        self.sent = []
+        self.fanout._send = lambda sensor_id, rate, mode, window: self.sent.append(
+            (sensor_id, rate, mode, window['count'], window['last'][1])
+        )
+
+    def test_unsubscribed_sensors_are_skipped_locally(self):
+        with mock.patch.object(stream_subscriptions, 'generation', wraps=stream_subscriptions.generation) as generation, \
+                mock.patch.object(stream_subscriptions, 'active', wraps=stream_subscriptions.active) as active:
+            for i in range(200):
+                self.fanout.publish(i % 10, BASE + timedelta(seconds=i), {'x': i})
+
+        self.assertEqual(generation.call_count, 1)
+        # Una lettura dei livelli per sensore, poi nessuna round trip finché la generazione non cambia
+        self.assertEqual(active.call_count, 10)
+        self.assertEqual(self.sent, [])
+
+    def test_new_subscription_is_seen_after_the_refresh_interval(self):
+        self.fanout.publish(1, BASE, {'x': 0})
+        stream_subscriptions.add(1, None, 'raw')
+
+        self.fanout.publish(1, BASE + timedelta(seconds=1), {'x': 1})
+        self.assertEqual(self.sent, [])
+
+        self.fanout._generation_checked -= STREAM_SUBSCRIPTION_REFRESH
+        self.fanout.publish(1, BASE + timedelta(seconds=2), {'x': 2})
+        self.assertEqual(self.sent, [(1, None, 'raw', 1, {'x': 2})])
+
+    def test_sparse_readings_are_sent_immediately(self):
+        stream_subscriptions.add(2, 1.0, 'decimate')
+        for i in range(3):
+            self.fanout.publish(2, BASE + timedelta(seconds=5 * i), {'x': i})
+        self.assertEqual(self.sent, [(2, 1.0, 'decimate', 1, {'x': i}) for i in range(3)])
+
+    def test_window_of_a_sensor_that_stops_is_flushed_by_the_timer(self):
+        stream_subscriptions.add(3, 1.0, 'envelope')
+        for i in range(5):
+            self.fanout.publish(3, BASE + timedelta(milliseconds=100 * i), {'x': i})
+        # La prima lettura apre la finestra e viene inviata subito, le altre restano in attesa
+        self.assertEqual(self.sent, [(3, 1.0, 'envelope', 1, {'x': 0})])
+
+        self.assertEqual(self.fanout.flush_expired(time.monotonic()), 0)
+        self.assertEqual(self.fanout.flush_expired(time.monotonic() + 10), 1)
+        self.assertEqual(self.sent[-1], (3, 1.0, 'envelope', 5, {'x': 4}))
+
+        # Finestra già inviata e scaduta: chiusa, nessun nuovo invio
+        self.assertEqual(self.fanout.flush_expired(time.monotonic() + 20), 0)
+        self.assertEqual(self.fanout._windows, {})
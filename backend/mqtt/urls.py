@@ -13,11 +13,13 @@ urlpatterns = [
     path('sites/<int:site_id>/stop/', views.stop_connection, name='stop_connection'),
     path('sites/<int:site_id>/status/', views.connection_status, name='connection_status'),
     path('sites/<int:site_id>/discover/', views.force_discovery, name='force_discovery'),
+    path('discovery-jobs/<int:job_id>/', views.discovery_job_status, name='discovery_job_status'),
 
     # Stato generale manager
     path('manager/status/', views.manager_status, name='manager_status'),
     path('manager/restart/', views.restart_manager, name='restart_manager'),
     path('health/', views.mqtt_service_health, name='service_health'),
+    path('cache/stats/', views.response_cache_stats, name='response_cache_stats'),
 
     # Lista e stato tutte le connessioni
     path('connections/', views.connections_list, name='connections_list'),
@@ -33,6 +35,9 @@ urlpatterns = [
     path('sensors/<int:sensor_id>/', datalogger_views.sensor_detail, name='sensor_detail'),
     path('sensors/<int:sensor_id>/update_label/', datalogger_views.update_sensor_label, name='update_sensor_label'),
 
+    # Change feed (delta sync) di gateway, datalogger e sensori
+    path('changes/', datalogger_views.changes_feed, name='changes_feed'),
+
     # Datalogger Control - MQTT publish/subscribe
     path('sites/<int:site_id>/publish/', views.publish_mqtt_message, name='publish_mqtt_message'),
     path('sites/<int:site_id>/subscribe/', views.subscribe_mqtt_topic, name='subscribe_mqtt_topic'),
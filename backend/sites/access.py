@@ -0,0 +1,155 @@
+"""
+Siti accessibili per utente, risolti una volta e salvati nella cache condivisa (Redis).
+
+Le view e il consumer WebSocket filtrano con site_id IN (...) su questo insieme invece
+di ripetere il join su user_accesses (con .distinct()) a ogni richiesta.
+
+    sites:access:user:{id}       {'gen': [globale, utente], 'ids': [...]} dei siti attivi assegnati
+    sites:access:user:{id}:gen   generazione dell'utente, incrementata quando cambiano i suoi
+                                 UserSiteAccess (grant_access / revoke_access, admin)
+    sites:access:gen             generazione globale, incrementata quando cambia un Site
+                                 (is_active, eliminazione): invalida gli insiemi di tutti gli utenti
+    sites:access:{kind}:{id}     relazione di un device usata dai controlli di accesso (es. sito
+                                 di un datalogger), eliminata quando il device cambia padre o
+                                 viene eliminato: il controllo non legge le tabelle dei device
+
+Voce e generazioni sono lette con una sola round trip; una voce salvata con generazioni
+lette prima di un'invalidazione non viene più usata. Come in response_cache le generazioni
+partono dall'istante corrente in ms (una chiave persa non riattiva voci vecchie).
+"""
+import logging
+import time
+from typing import Callable, FrozenSet, Optional
+
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = 'sites:access:user:{user_id}'
+USER_GENERATION_KEY = 'sites:access:user:{user_id}:gen'
+GENERATION_KEY = 'sites:access:gen'
+DEVICE_KEY = 'sites:access:{kind}:{device_id}'
+ACCESS_TTL = 3600
+
+
+class SiteAccessCache:
+    """Insieme dei siti accessibili per utente con invalidazione su UserSiteAccess / Site"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def site_ids(self, user) -> Optional[FrozenSet[int]]:
+        """
+        Siti attivi accessibili all'utente; None = tutti i siti (superuser).
+        Gli utenti non autenticati non hanno accesso ad alcun sito.
+        """
+        if not getattr(user, 'is_authenticated', False):
+            return frozenset()
+        if user.is_superuser:
+            return None
+
+        user_key = USER_KEY.format(user_id=user.pk)
+        generation_keys = [GENERATION_KEY, USER_GENERATION_KEY.format(user_id=user.pk)]
+        try:
+            values = self.cache.get_many([user_key] + generation_keys)
+            generation = [self._generation(key, values.get(key)) for key in generation_keys]
+            entry = values.get(user_key)
+            if entry is not None and entry['gen'] == generation:
+                return frozenset(entry['ids'])
+        except Exception as e:
+            logger.warning(f"Site access cache unavailable for user {user.pk}: {e}")
+            return self._load(user.pk)
+
+        site_ids = self._load(user.pk)
+        try:
+            self.cache.set(user_key, {'gen': generation, 'ids': sorted(site_ids)}, ACCESS_TTL)
+        except Exception as e:
+            logger.warning(f"Site access cache store failed for user {user.pk}: {e}")
+        return site_ids
+
+    def _generation(self, key: str, value: Optional[int]) -> int:
+        if value is None:
+            seed = int(time.time() * 1000)
+            self.cache.add(key, seed, timeout=None)
+            value = self.cache.get(key, seed)
+        return int(value)
+
+    def _load(self, user_id: int) -> FrozenSet[int]:
+        from .models import UserSiteAccess
+
+        return frozenset(
+            UserSiteAccess.objects.filter(user_id=user_id, site__is_active=True)
+            .values_list('site_id', flat=True)
+        )
+
+    def has_access(self, user, site_id: int) -> bool:
+        site_ids = self.site_ids(user)
+        return site_ids is None or site_id in site_ids
+
+    def filter_queryset(self, queryset, user, field: str = 'site_id'):
+        """queryset filtrato sui siti accessibili (invariato per i superuser)"""
+        site_ids = self.site_ids(user)
+        if site_ids is None:
+            return queryset
+        return queryset.filter(**{f'{field}__in': site_ids})
+
+    def device_parent(self, kind: str, device_id: int, load: Callable[[int], Optional[int]]) -> Optional[int]:
+        """
+        Id del padre di un device (es. sito di un datalogger) dalla cache, caricato con
+        load(device_id) alla prima richiesta. None se il device non esiste (non salvato).
+        """
+        key = DEVICE_KEY.format(kind=kind, device_id=device_id)
+        try:
+            parent_id = self.cache.get(key)
+        except Exception as e:
+            logger.warning(f"Site access cache unavailable for {kind} {device_id}: {e}")
+            return load(device_id)
+        if parent_id is not None:
+            return parent_id
+
+        parent_id = load(device_id)
+        if parent_id is not None:
+            try:
+                self.cache.set(key, parent_id, ACCESS_TTL)
+            except Exception as e:
+                logger.warning(f"Site access cache store failed for {kind} {device_id}: {e}")
+        return parent_id
+
+    def invalidate_device(self, kind: str, device_id: int) -> None:
+        """Device spostato o eliminato (dopo il commit)"""
+        key = DEVICE_KEY.format(kind=kind, device_id=device_id)
+        transaction.on_commit(lambda: self._delete(key))
+
+    def _delete(self, key: str) -> None:
+        try:
+            self.cache.delete(key)
+        except Exception as e:
+            logger.warning(f"Site access cache invalidation failed for {key}: {e}")
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Accessi dell'utente cambiati (dopo il commit, come response_cache.invalidate_event)"""
+        transaction.on_commit(lambda: self._bump(USER_GENERATION_KEY.format(user_id=user_id)))
+
+    def invalidate_all(self) -> None:
+        """Un sito è cambiato (attivo / eliminato): insiemi di tutti gli utenti da ricaricare"""
+        transaction.on_commit(lambda: self._bump(GENERATION_KEY))
+
+    def _bump(self, key: str) -> None:
+        try:
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Chiave assente: add() evita di sovrascrivere un incr concorrente
+                self.cache.add(key, int(time.time() * 1000), timeout=None)
+                self.cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Site access cache invalidation failed for {key}: {e}")
+
+
+# Singleton instance
+site_access = SiteAccessCache()
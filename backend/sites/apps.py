@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class SitesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sites'
-    verbose_name = 'Site Management'
\ No newline at end of file
+    verbose_name = 'Site Management'
+
+    def ready(self):
+        # Importa i segnali per registrarli
+        import sites.signals
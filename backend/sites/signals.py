@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from mqtt.services.response_cache import SITES_SCOPE, response_cache, site_scope
+from .access import site_access
+from .models import Site, UserSiteAccess
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def site_changed(sender, instance, **kwargs):
+    """Invalida le risposte in cache con l'anagrafica siti (user_sites, liste del sito) e i siti accessibili"""
+    response_cache.bump_on_commit(SITES_SCOPE, site_scope(instance.pk))
+    site_access.invalidate_all()
+
+
+@receiver(post_save, sender=UserSiteAccess)
+@receiver(post_delete, sender=UserSiteAccess)
+def site_access_changed(sender, instance, **kwargs):
+    """Gli accessi cambiano i siti visibili in user_sites e i siti accessibili all'utente"""
+    response_cache.bump_on_commit(SITES_SCOPE)
+    site_access.invalidate_user(instance.user_id)
@@ -1,8 +1,11 @@
 from rest_framework import viewsets, permissions, status #type: ignore
 from rest_framework.decorators import action #type: ignore
 from rest_framework.response import Response #type: ignore
+from rest_framework.fields import DateTimeField #type: ignore
 from django.db.models import Q
 from django.contrib.auth import get_user_model
+from mqtt.services.response_cache import SITES_SCOPE, cached_response
+from .access import site_access
 from .models import Site, UserSiteAccess
 from .serializers import (
     SiteSerializer,
@@ -11,6 +14,11 @@ from .serializers import (
 )
 
 
+def _user_access_scope(request):
+    """Superuser vedono tutti i siti, gli altri utenti solo quelli assegnati"""
+    return 'all' if request.user.is_superuser else f"user:{request.user.pk}"
+
+
 class SiteViewSet(viewsets.ModelViewSet):
     queryset = Site.objects.all()
     serializer_class = SiteSerializer
@@ -18,23 +26,42 @@ class SiteViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filter sites based on user permissions"""
-        user = self.request.user
-        if user.is_superuser:
-            return Site.objects.all()
-
-        # Return only sites the user has access to
-        return Site.objects.filter(
-            user_accesses__user=user,
-            is_active=True
-        ).distinct()
+        # Siti accessibili risolti una volta per utente (cache, vedi sites.access): niente join su user_accesses
+        return site_access.filter_queryset(Site.objects.all(), self.request.user, field='pk')
 
     @action(detail=False, methods=['get'])
+    @cached_response('user_sites', lambda request, **kwargs: [SITES_SCOPE], access=_user_access_scope)
     def user_sites(self, request):
         """Get sites accessible by the current user for dropdown"""
         sites = self.get_queryset()
         serializer = SiteListSerializer(sites, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def health(self, request):
+        """
+        Gateway / datalogger / sensori totali e online per ogni sito accessibile,
+        dai contatori SiteHealth (una sola query, nessun conteggio sui device)
+        """
+        levels = ('gateways', 'dataloggers', 'sensors')
+        columns = ['id', 'name', 'health__updated_at']
+        for level in levels:
+            columns += [f'health__{level}_total', f'health__{level}_online']
+
+        updated_at = DateTimeField()
+        results = []
+        for row in self.get_queryset().values(*columns):
+            site_health = {'site_id': row['id'], 'name': row['name']}
+            for level in levels:
+                total = row[f'health__{level}_total'] or 0
+                online = row[f'health__{level}_online'] or 0
+                site_health[level] = {'total': total, 'online': online, 'offline': total - online}
+            site_health['updated_at'] = (
+                updated_at.to_representation(row['health__updated_at']) if row['health__updated_at'] else None
+            )
+            results.append(site_health)
+        return Response(results)
+
     @action(detail=True, methods=['post'])
     def grant_access(self, request, pk=None):
         """Grant user access to a site"""
@@ -118,10 +145,11 @@ class UserSiteAccessViewSet(viewsets.ModelViewSet):
         if user.is_superuser:
             return UserSiteAccess.objects.all()
 
-        # Return only access records for sites the user can see
+        # Return only access records for sites the user is assigned to, active or not
+        # (site_access only covers active sites); subquery instead of join + distinct
         return UserSiteAccess.objects.filter(
-            site__user_accesses__user=user
-        ).distinct()
+            site_id__in=UserSiteAccess.objects.filter(user=user).values('site_id')
+        )
 
     def perform_create(self, serializer):
         """Set granted_by when creating new access record"""
@@ -58,25 +58,25 @@ def print_device_status(gateway, datalogger, sensors):
 
     print(f"\n📊 STATO DISPOSITIVI:")
     print(f"   Gateway: {gateway.serial_number}")
-    print(f"     - Online: {gateway.is_online}")
+    print(f"     - Online: {gateway.state.is_online}")
     print(f"     - Expected interval: {gateway.expected_heartbeat_interval}s")
     print(f"     - Timeout threshold: {gateway.expected_heartbeat_interval * 2.5}s")
-    if gateway.last_seen_at:
-        elapsed = (now - gateway.last_seen_at).total_seconds()
+    if gateway.state.last_seen_at:
+        elapsed = (now - gateway.state.last_seen_at).total_seconds()
         print(f"     - Last seen: {elapsed:.1f}s ago")
 
     print(f"\n   Datalogger: {datalogger.serial_number}")
-    print(f"     - Online: {datalogger.is_online}")
+    print(f"     - Online: {datalogger.state.is_online}")
     print(f"     - Expected interval: {datalogger.expected_heartbeat_interval}s")
-    if datalogger.last_seen_at:
-        elapsed = (now - datalogger.last_seen_at).total_seconds()
+    if datalogger.state.last_seen_at:
+        elapsed = (now - datalogger.state.last_seen_at).total_seconds()
         print(f"     - Last seen: {elapsed:.1f}s ago")
 
     print(f"\n   Sensori ({len(sensors)}):")
     for sensor in sensors:
-        if sensor.last_seen_at:
-            elapsed = (now - sensor.last_seen_at).total_seconds()
-            print(f"     - {sensor.serial_number}: Online={sensor.is_online}, Last seen={elapsed:.1f}s ago")
+        if sensor.state.last_seen_at:
+            elapsed = (now - sensor.state.last_seen_at).total_seconds()
+            print(f"     - {sensor.serial_number}: Online={sensor.state.is_online}, Last seen={elapsed:.1f}s ago")
 
 
 def test_offline_detection():
@@ -155,17 +155,17 @@ def test_offline_detection():
         stats = message_processor.check_offline_devices()
 
         # Ricarica oggetti dal DB
-        gateway.refresh_from_db()
-        datalogger.refresh_from_db()
+        gateway.state.refresh_from_db()
+        datalogger.state.refresh_from_db()
         for sensor in sensors:
-            sensor.refresh_from_db()
+            sensor.state.refresh_from_db()
 
         print(f"\n   ⏱️  Tick {i+1}/4:")
-        print(f"      Gateway online: {gateway.is_online}")
-        print(f"      Datalogger online: {datalogger.is_online}")
-        print(f"      Sensors online: {all(s.is_online for s in sensors)}")
+        print(f"      Gateway online: {gateway.state.is_online}")
+        print(f"      Datalogger online: {datalogger.state.is_online}")
+        print(f"      Sensors online: {all(s.state.is_online for s in sensors)}")
 
-        if not (gateway.is_online and datalogger.is_online and all(s.is_online for s in sensors)):
+        if not (gateway.state.is_online and datalogger.state.is_online and all(s.state.is_online for s in sensors)):
             print("      ❌ ERRORE: Dispositivi sono andati offline mentre ricevevano messaggi!")
             return False
 
@@ -184,17 +184,17 @@ def test_offline_detection():
         stats = message_processor.check_offline_devices()
 
         # Ricarica oggetti dal DB
-        gateway.refresh_from_db()
-        datalogger.refresh_from_db()
+        gateway.state.refresh_from_db()
+        datalogger.state.refresh_from_db()
         for sensor in sensors:
-            sensor.refresh_from_db()
+            sensor.state.refresh_from_db()
 
         # Verifica se sono andati offline
-        if not gateway.is_online or not datalogger.is_online or not all(s.is_online for s in sensors):
+        if not gateway.state.is_online or not datalogger.state.is_online or not all(s.state.is_online for s in sensors):
             print(f"\n   ⏱️  Dopo {i+1} secondi:")
-            print(f"      Gateway offline: {not gateway.is_online}")
-            print(f"      Datalogger offline: {not datalogger.is_online}")
-            print(f"      Sensors offline: {sum(1 for s in sensors if not s.is_online)}/{len(sensors)}")
+            print(f"      Gateway offline: {not gateway.state.is_online}")
+            print(f"      Datalogger offline: {not datalogger.state.is_online}")
+            print(f"      Sensors offline: {sum(1 for s in sensors if not s.state.is_online)}/{len(sensors)}")
             print(f"\n✅ Dispositivi marcati OFFLINE correttamente!")
             break
     else:
@@ -219,16 +219,16 @@ def test_offline_detection():
     )
 
     # Ricarica oggetti dal DB
-    gateway.refresh_from_db()
-    datalogger.refresh_from_db()
+    gateway.state.refresh_from_db()
+    datalogger.state.refresh_from_db()
     for sensor in sensors:
-        sensor.refresh_from_db()
+        sensor.state.refresh_from_db()
 
-    print(f"\n   Gateway online: {gateway.is_online}")
-    print(f"   Datalogger online: {datalogger.is_online}")
-    print(f"   Sensors online: {all(s.is_online for s in sensors)}")
+    print(f"\n   Gateway online: {gateway.state.is_online}")
+    print(f"   Datalogger online: {datalogger.state.is_online}")
+    print(f"   Sensors online: {all(s.state.is_online for s in sensors)}")
 
-    if gateway.is_online and datalogger.is_online and all(s.is_online for s in sensors):
+    if gateway.state.is_online and datalogger.state.is_online and all(s.state.is_online for s in sensors):
         print("\n✅ Test Recovery SUPERATO: Dispositivi tornati online!")
     else:
         print("\n❌ ERRORE: Dispositivi non sono tornati online!")
@@ -16,7 +16,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
 from mqtt.services.message_processor import message_processor
-from mqtt.models import Gateway, Datalogger, Sensor
+from mqtt.models import Gateway, GatewayState, Datalogger, DataloggerState, Sensor
 from sites.models import Site
 from django.utils import timezone
 from datetime import timedelta
@@ -51,10 +51,9 @@ def test_startup_check():
         site=site,
         serial_number='startup_test_gw_online',
         label='Test Gateway Online',
-        is_online=True,
-        expected_heartbeat_interval=60,  # Timeout dopo 60 * 2.5 = 150s
-        last_seen_at=now - timedelta(seconds=5)  # 5 secondi fa - DENTRO timeout
+        expected_heartbeat_interval=60  # Timeout dopo 60 * 2.5 = 150s
     )
+    GatewayState.upsert(gw1.id, is_online=True, last_seen_at=now - timedelta(seconds=5))  # 5 secondi fa - DENTRO timeout
     print(f"✅ Gateway ONLINE creato: {gw1.serial_number}")
     print(f"   - last_seen_at: 5 secondi fa")
     print(f"   - timeout: 150 secondi")
@@ -65,10 +64,9 @@ def test_startup_check():
         site=site,
         serial_number='startup_test_gw_offline',
         label='Test Gateway Offline',
-        is_online=True,  # MARCATO ONLINE MA È VECCHIO
-        expected_heartbeat_interval=60,  # Timeout dopo 60 * 2.5 = 150s
-        last_seen_at=now - timedelta(seconds=200)  # 200 secondi fa - OLTRE timeout
+        expected_heartbeat_interval=60  # Timeout dopo 60 * 2.5 = 150s
     )
+    GatewayState.upsert(gw2.id, is_online=True, last_seen_at=now - timedelta(seconds=200))  # 200 secondi fa - OLTRE timeout
     print(f"\n✅ Gateway STALE creato: {gw2.serial_number}")
     print(f"   - last_seen_at: 200 secondi fa")
     print(f"   - timeout: 150 secondi")
@@ -79,10 +77,9 @@ def test_startup_check():
         site=site,
         serial_number='startup_test_dl_online',
         label='Test Datalogger Online',
-        is_online=True,
-        expected_heartbeat_interval=10,  # Timeout dopo 25s
-        last_seen_at=now - timedelta(seconds=3)  # 3 secondi fa - OK
+        expected_heartbeat_interval=10  # Timeout dopo 25s
     )
+    DataloggerState.upsert(dl1.id, is_online=True, last_seen_at=now - timedelta(seconds=3))  # 3 secondi fa - OK
     print(f"\n✅ Datalogger ONLINE creato: {dl1.serial_number}")
 
     # Datalogger 2: DOVREBBE ANDARE OFFLINE
@@ -90,10 +87,9 @@ def test_startup_check():
         site=site,
         serial_number='startup_test_dl_offline',
         label='Test Datalogger Offline',
-        is_online=True,
-        expected_heartbeat_interval=10,  # Timeout dopo 25s
-        last_seen_at=now - timedelta(seconds=50)  # 50 secondi fa - OLTRE timeout
+        expected_heartbeat_interval=10  # Timeout dopo 25s
     )
+    DataloggerState.upsert(dl2.id, is_online=True, last_seen_at=now - timedelta(seconds=50))  # 50 secondi fa - OLTRE timeout
     print(f"✅ Datalogger STALE creato: {dl2.serial_number}")
 
     # Scenario 2: Simula riavvio - esegui check
@@ -113,36 +109,36 @@ def test_startup_check():
     print("\n\n📝 SCENARIO 3: Verifica stato finale")
     print("-" * 80)
 
-    gw1.refresh_from_db()
-    gw2.refresh_from_db()
-    dl1.refresh_from_db()
-    dl2.refresh_from_db()
+    gw1.state.refresh_from_db()
+    gw2.state.refresh_from_db()
+    dl1.state.refresh_from_db()
+    dl2.state.refresh_from_db()
 
     success = True
 
     # Check Gateway 1 (dovrebbe rimanere online)
-    if gw1.is_online:
+    if gw1.state.is_online:
         print(f"✅ {gw1.serial_number}: ONLINE (corretto)")
     else:
         print(f"❌ {gw1.serial_number}: OFFLINE (ERRORE - doveva rimanere online!)")
         success = False
 
     # Check Gateway 2 (dovrebbe andare offline)
-    if not gw2.is_online:
+    if not gw2.state.is_online:
         print(f"✅ {gw2.serial_number}: OFFLINE (corretto)")
     else:
         print(f"❌ {gw2.serial_number}: ONLINE (ERRORE - doveva andare offline!)")
         success = False
 
     # Check Datalogger 1
-    if dl1.is_online:
+    if dl1.state.is_online:
         print(f"✅ {dl1.serial_number}: ONLINE (corretto)")
     else:
         print(f"❌ {dl1.serial_number}: OFFLINE (ERRORE - doveva rimanere online!)")
         success = False
 
     # Check Datalogger 2
-    if not dl2.is_online:
+    if not dl2.state.is_online:
         print(f"✅ {dl2.serial_number}: OFFLINE (corretto)")
     else:
         print(f"❌ {dl2.serial_number}: ONLINE (ERRORE - doveva andare offline!)")
@@ -156,7 +156,7 @@ def test_telemetry_parsing():
         print(f"✅ Gateway trovato: {gateway.serial_number}")
         print(f"   ID: {gateway.id}")
         print(f"   Label: {gateway.label}")
-        print(f"   Online: {gateway.is_online}")
+        print(f"   Online: {gateway.state.is_online}")
         print(f"   Site: {gateway.site.name}")
     else:
         print("❌ Gateway NON trovato!")
@@ -172,8 +172,8 @@ def test_telemetry_parsing():
             print(f"✅ Datalogger {device_serial}:")
             print(f"   ID: {datalogger.id}")
             print(f"   Type: {datalogger.datalogger_type}")
-            print(f"   Online: {datalogger.is_online}")
-            print(f"   Status: {datalogger.acquisition_status}")
+            print(f"   Online: {datalogger.state.is_online}")
+            print(f"   Status: {datalogger.state.acquisition_status}")
             print(f"   Sensori: {datalogger.sensors.count()}")
         else:
             print(f"❌ Datalogger {device_serial} NON trovato!")
@@ -196,9 +196,9 @@ def test_telemetry_parsing():
             print(f"✅ Sensor {sensor_serial}:")
             print(f"   ID: {sensor.id}")
             print(f"   Type: {sensor.sensor_type}")
-            print(f"   Online: {sensor.is_online}")
-            print(f"   Last data: {sensor.last_data_1}")
-            print(f"   Total readings: {sensor.total_readings}")
+            print(f"   Online: {sensor.state.is_online}")
+            print(f"   Last data: {sensor.state.last_data_1}")
+            print(f"   Total readings: {sensor.state.total_readings}")
         else:
             print(f"❌ Sensor {sensor_serial} NON trovato!")
             return False
@@ -208,8 +208,8 @@ def test_telemetry_parsing():
 
     # Accelerometro (dovrebbe avere x, y, z)
     acc_sensor = Sensor.objects.filter(serial_number="MNA000123-accelerometer").first()
-    if acc_sensor and acc_sensor.last_data_1:
-        data = acc_sensor.last_data_1
+    if acc_sensor and acc_sensor.state.last_data_1:
+        data = acc_sensor.state.last_data_1
         if 'x' in data and 'y' in data and 'z' in data:
             print(f"✅ Accelerometro formattato correttamente:")
             print(f"   x={data['x']}, y={data['y']}, z={data['z']}")
@@ -218,8 +218,8 @@ def test_telemetry_parsing():
 
     # Canale ADAQ (dovrebbe avere 'value')
     ch_sensor = Sensor.objects.filter(serial_number="MAS8AT00-ch1").first()
-    if ch_sensor and ch_sensor.last_data_1:
-        data = ch_sensor.last_data_1
+    if ch_sensor and ch_sensor.state.last_data_1:
+        data = ch_sensor.state.last_data_1
         if 'value' in data:
             print(f"✅ Canale ADAQ formattato correttamente:")
             print(f"   value={data['value']}")
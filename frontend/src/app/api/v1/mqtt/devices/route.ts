@@ -1,5 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { apiServer } from '@/lib/axios-server';
+import { acceptNotModified, conditionalRequestHeaders, conditionalResponse } from '@/lib/conditional-proxy';
 import { cookies } from 'next/headers';
 
 async function forwardRequest(request: NextRequest, endpoint: string) {
@@ -27,11 +28,12 @@ async function forwardRequest(request: NextRequest, endpoint: string) {
     const response = await apiServer({
       method: request.method,
       url: `/api/v1/mqtt/devices/${fullEndpoint}`,
-      headers,
+      headers: { ...headers, ...conditionalRequestHeaders(request) },
       data: body,
+      validateStatus: acceptNotModified,
     });
 
-    return NextResponse.json(response.data, { status: response.status });
+    return conditionalResponse(response);
   } catch (error: any) {
     console.error('MQTT Devices API Error:', error);
 
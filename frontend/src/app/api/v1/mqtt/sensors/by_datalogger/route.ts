@@ -1,5 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { apiServer } from '@/lib/axios-server';
+import { acceptNotModified, conditionalRequestHeaders, conditionalResponse } from '@/lib/conditional-proxy';
 import { cookies } from 'next/headers';
 
 export async function GET(request: NextRequest) {
@@ -22,10 +23,11 @@ export async function GET(request: NextRequest) {
     const response = await apiServer({
       method: 'GET',
       url: `/api/v1/mqtt/sensors/by_datalogger/${fullEndpoint}`,
-      headers,
+      headers: { ...headers, ...conditionalRequestHeaders(request) },
+      validateStatus: acceptNotModified,
     });
 
-    return NextResponse.json(response.data, { status: response.status });
+    return conditionalResponse(response);
   } catch (error: any) {
     console.error('MQTT Sensors by Datalogger API Error:', error);
 
@@ -0,0 +1,40 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { apiServer } from '@/lib/axios-server';
+import { cookies } from 'next/headers';
+
+export async function GET(request: NextRequest) {
+  try {
+    const cookieStore = await cookies();
+    const accessToken = cookieStore.get('access_token');
+
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+
+    if (accessToken) {
+      headers['Authorization'] = `Bearer ${accessToken.value}`;
+    }
+
+    const response = await apiServer({
+      method: 'GET',
+      url: '/api/v1/site/sites/health/',
+      headers,
+    });
+
+    return NextResponse.json(response.data);
+  } catch (error: any) {
+    console.error('Sites Health API Error:', error);
+
+    if (error.response) {
+      return NextResponse.json(
+        error.response.data || { error: 'API Error' },
+        { status: error.response.status }
+      );
+    }
+
+    return NextResponse.json(
+      { error: 'Internal Server Error' },
+      { status: 500 }
+    );
+  }
+}
\ No newline at end of file
@@ -1,5 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { apiServer } from '@/lib/axios-server';
+import { acceptNotModified, conditionalRequestHeaders, conditionalResponse } from '@/lib/conditional-proxy';
 import { cookies } from 'next/headers';
 
 export async function GET(request: NextRequest) {
@@ -18,10 +19,11 @@ export async function GET(request: NextRequest) {
     const response = await apiServer({
       method: 'GET',
       url: '/api/v1/site/sites/user_sites/',
-      headers,
+      headers: { ...headers, ...conditionalRequestHeaders(request) },
+      validateStatus: acceptNotModified,
     });
 
-    return NextResponse.json(response.data, { status: response.status });
+    return conditionalResponse(response);
   } catch (error: any) {
     console.error('User Sites API Error:', error);
 
@@ -2,10 +2,11 @@
  * Modern MQTT hooks with best practices
  * Replaces the old useMqttStatus.ts with clean, type-safe implementation
  */
-import { useMutation, useQuery, useQueryClient } from '@tanstack/react-query';
-import { useCallback } from 'react';
+import { QueryClient, useMutation, useQuery, useQueryClient } from '@tanstack/react-query';
+import { useCallback, useEffect } from 'react';
 import { toast } from 'sonner';
 import { api } from '@/lib/axios';
+import { subscribeSensorReadings } from '@/lib/live-readings';
 
 // Types
 export interface MqttConnectionStatus {
@@ -58,6 +59,7 @@ export interface Datalogger {
 
 export interface Sensor {
   id: number;
+  datalogger_id?: number; // presente nelle righe del change feed
   datalogger_label: string;
   site_name: string;
   serial_number: string;
@@ -180,10 +182,10 @@ export function useMqttControl() {
       toast.loading('Forcing topic discovery refresh...', { id: 'discovery-control' });
     },
     onSuccess: (data: any) => {
-      toast.success('Discovery Refresh Complete', {
+      // Il refresh gira in background: progress/fine arrivano via WebSocket (discovery_job_*)
+      toast.success(data.job_id ? 'Discovery Refresh Started' : 'Discovery Refresh Complete', {
         id: 'discovery-control',
-        description: `${data.success_count} topics processed successfully` +
-          (data.error_count > 0 ? `, ${data.error_count} errors` : ''),
+        description: data.message,
       });
     },
     onError: (err) => {
@@ -215,6 +217,153 @@ export function useMqttControl() {
   };
 }
 
+// Le liste device/sensori sono paginate con cursore: segue next_cursor fino all'ultima pagina.
+// meta.changeCursor riceve il change_cursor della prima pagina (punto di partenza del delta sync)
+async function fetchAllPages<T>(url: string, key: string, meta?: { changeCursor?: string | null }): Promise<T[]> {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const separator = url.includes('?') ? '&' : '?';
+    const response = await api.get(cursor ? `${url}${separator}cursor=${encodeURIComponent(cursor)}` : url);
+    if (meta && !cursor) {
+      meta.changeCursor = response.data.change_cursor ?? null;
+    }
+    items.push(...(response.data[key] || []));
+    cursor = response.data.next_cursor || null;
+  } while (cursor);
+  return items;
+}
+
+// Cursore del change feed per ogni lista ['sensors', dataloggerId] in cache
+const sensorChangeCursors = new Map<string, string>();
+const sensorSyncs = new Map<string, Promise<void>>();
+
+const isSensorsQueryOf = (dataloggerId: string) =>
+  (query: { queryKey: readonly unknown[] }) => query.queryKey[0] === 'sensors' && String(query.queryKey[1]) === dataloggerId;
+
+async function applySensorChanges(queryClient: QueryClient, dataloggerId: string): Promise<void> {
+  const predicate = isSensorsQueryOf(dataloggerId);
+  if (queryClient.getQueryCache().findAll({ predicate }).length === 0) {
+    return; // Lista non in cache: verrà caricata completa quando serve
+  }
+
+  let cursor = sensorChangeCursors.get(dataloggerId);
+  if (!cursor) {
+    await queryClient.invalidateQueries({ predicate });
+    return;
+  }
+
+  const changed = new Map<number, Sensor>();
+  const deleted = new Set<number>();
+  try {
+    let hasMore = true;
+    while (hasMore) {
+      const response = await api.get(`v1/mqtt/changes/?datalogger_id=${dataloggerId}&cursor=${cursor}`);
+      for (const sensor of response.data.sensors as Sensor[]) {
+        changed.set(sensor.id, sensor);
+      }
+      for (const tombstone of response.data.deleted as Array<{ kind: string; id: number }>) {
+        if (tombstone.kind !== 'sensor') {
+          throw new Error('Datalogger deleted');
+        }
+        changed.delete(tombstone.id);
+        deleted.add(tombstone.id);
+      }
+      cursor = response.data.cursor as string;
+      hasMore = response.data.has_more;
+    }
+  } catch {
+    // Cursore scaduto (410), datalogger eliminato o errore: ricarica completa
+    sensorChangeCursors.delete(dataloggerId);
+    await queryClient.invalidateQueries({ predicate });
+    return;
+  }
+
+  sensorChangeCursors.set(dataloggerId, cursor);
+  if (changed.size === 0 && deleted.size === 0) {
+    return;
+  }
+  for (const query of queryClient.getQueryCache().findAll({ predicate })) {
+    queryClient.setQueryData<Sensor[]>(query.queryKey, (current) => {
+      if (!current) {
+        return current;
+      }
+      const known = new Set(current.map(sensor => sensor.id));
+      const merged = current.filter(sensor => !deleted.has(sensor.id)).map(sensor => changed.get(sensor.id) ?? sensor);
+      const added = [...changed.values()].filter(sensor => !known.has(sensor.id));
+      if (added.length === 0) {
+        return merged;
+      }
+      // Stesso ordinamento della lista (label, id)
+      return [...merged, ...added].sort((a, b) => a.label.localeCompare(b.label) || a.id - b.id);
+    });
+  }
+}
+
+export interface SensorReading {
+  id: number;
+  timestamp: string;
+  data: Record<string, any>;
+  current_value: number | null;
+}
+
+/**
+ * Applica le letture di un evento sensor_readings alla lista sensori in cache, senza richieste HTTP.
+ * Ritorna false se l'evento contiene sensori non presenti in cache (serve syncSensorChanges).
+ */
+export function applySensorReadings(queryClient: QueryClient, dataloggerId: number | string, readings: SensorReading[]): boolean {
+  const byId = new Map(readings.map(reading => [reading.id, reading]));
+  let complete = true;
+  for (const query of queryClient.getQueryCache().findAll({ predicate: isSensorsQueryOf(String(dataloggerId)) })) {
+    queryClient.setQueryData<Sensor[]>(query.queryKey, (current) => {
+      if (!current) {
+        return current;
+      }
+      const known = new Set(current.map(sensor => sensor.id));
+      if (readings.some(reading => !known.has(reading.id))) {
+        complete = false;
+      }
+      return current.map(sensor => {
+        const reading = byId.get(sensor.id);
+        if (!reading) {
+          return sensor;
+        }
+        // Stesso aggiornamento di Sensor.add_new_reading lato backend
+        return {
+          ...sensor,
+          is_online: true,
+          last_reading: reading.timestamp,
+          last_seen_at: reading.timestamp,
+          first_seen_at: sensor.first_seen_at ?? reading.timestamp,
+          total_messages: sensor.total_messages + 1,
+          total_readings: sensor.total_readings + 1,
+          consecutive_misses: 0,
+          current_value: reading.current_value ?? undefined,
+          latest_readings: [{ timestamp: reading.timestamp, data: reading.data }, ...sensor.latest_readings].slice(0, 3),
+        };
+      });
+    });
+  }
+  return complete;
+}
+
+/**
+ * Aggiorna la lista sensori in cache di un datalogger con il change feed (solo le righe cambiate)
+ * invece di invalidarla e riscaricarla per intero. Le chiamate per lo stesso datalogger sono serializzate.
+ */
+export function syncSensorChanges(queryClient: QueryClient, dataloggerId: number | string): Promise<void> {
+  const key = String(dataloggerId);
+  const previous = sensorSyncs.get(key) ?? Promise.resolve();
+  const next = previous.then(() => applySensorChanges(queryClient, key));
+  sensorSyncs.set(key, next);
+  next.finally(() => {
+    if (sensorSyncs.get(key) === next) {
+      sensorSyncs.delete(key);
+    }
+  });
+  return next;
+}
+
 // Dataloggers Hook
 export function useDataloggers(siteId: number | null, onlineOnly: boolean = false) {
   const { data: dataloggers, isLoading: loading, error: queryError, refetch: refresh } = useQuery<Datalogger[], Error>({
@@ -227,8 +376,7 @@ export function useDataloggers(siteId: number | null, onlineOnly: boolean = fals
         site_id: siteId.toString(),
         ...(onlineOnly && { online_only: 'true' })
       });
-      const response = await api.get(`v1/mqtt/devices/?${params}`);
-      return response.data.dataloggers || [];
+      return fetchAllPages<Datalogger>(`v1/mqtt/devices/?${params}`, 'dataloggers');
     },
     enabled: !!siteId, // Abilita la query solo se siteId è presente
     staleTime: 5 * 60 * 1000, // I dati sono considerati 'freschi' per 5 minuti
@@ -302,13 +450,25 @@ export function useSensors(datalogger: Datalogger | null) {
       if (!dataloggerId) {
         return [];
       }
-      const response = await api.get(`v1/mqtt/sensors/by_datalogger?datalogger_id=${dataloggerId}`);
-      return response.data.sensors || [];
+      const meta: { changeCursor?: string | null } = {};
+      const items = await fetchAllPages<Sensor>(`v1/mqtt/sensors/by_datalogger?datalogger_id=${dataloggerId}`, 'sensors', meta);
+      if (meta.changeCursor) {
+        sensorChangeCursors.set(String(dataloggerId), meta.changeCursor);
+      }
+      return items;
     },
     enabled: !!dataloggerId,
     retry: 1,
   });
 
+  // Letture live via WebSocket (evento sensor_readings) finché la lista è montata
+  useEffect(() => {
+    if (!dataloggerId) {
+      return;
+    }
+    return subscribeSensorReadings(dataloggerId);
+  }, [dataloggerId]);
+
   const error = queryError ? queryError.message : null;
 
   const updateSensorLabel = useCallback(async (sensor: Sensor, newLabel: string) => {
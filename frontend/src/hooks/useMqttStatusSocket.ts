@@ -3,6 +3,17 @@ import { useEffect, useRef, useCallback } from 'react';
 import { useQueryClient } from '@tanstack/react-query';
 import { useWebSocketStore, WebSocketStatus } from '@/store/websocketStore';
 import { toast } from 'sonner';
+import { applySensorReadings, syncSensorChanges } from '@/hooks/useMqtt';
+import {
+  STREAM_BINARY_SUBPROTOCOL,
+  STREAM_JSON_SUBPROTOCOL,
+  attachReadingsSocket,
+  attachStreamSocket,
+  dispatchSensorStream,
+  dispatchStreamFrame,
+  isSubscribedToReadings,
+  setStreamSchema,
+} from '@/lib/live-readings';
 
 // URL del WebSocket (da configurare in base all'ambiente)
 // Assumiamo che il WebSocket sia sullo stesso host del backend, ma su porta 8000 e path /ws/status/
@@ -32,12 +43,16 @@ export const useMqttStatusSocket = () => {
     setStatus('CONNECTING');
     const url = getWebSocketUrl();
     console.log('Connecting to WebSocket URL:', url);
-    ws.current = new WebSocket(url);
+    // Frame binari compatti per gli stream live dei sensori, JSON per tutto il resto
+    ws.current = new WebSocket(url, [STREAM_BINARY_SUBPROTOCOL, STREAM_JSON_SUBPROTOCOL]);
+    ws.current.binaryType = 'arraybuffer';
 
     ws.current.onopen = () => {
       console.log('WebSocket Connected');
       setStatus('CONNECTED');
       reconnectAttempts.current = 0; // Reset tentativi al successo
+      attachReadingsSocket(ws.current); // Reinvia le iscrizioni alle letture live
+      attachStreamSocket(ws.current); // e agli stream dei sensori
       isIntentionalClose.current = false; // Reset flag chiusura volontaria
       if (reconnectTimeout.current) {
         clearTimeout(reconnectTimeout.current);
@@ -46,9 +61,40 @@ export const useMqttStatusSocket = () => {
     };
 
     ws.current.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        dispatchStreamFrame(event.data);
+        return;
+      }
       const data = JSON.parse(event.data);
+
+      // Stream live dei sensori (fino a 50 Hz): niente log per messaggio
+      if (data.type === 'sensor_stream') {
+        dispatchSensorStream(data.sensor_id, data.sample);
+        return;
+      }
+      if (data.type === 'stream_schema') {
+        setStreamSchema(data.sensor_id, data.channels);
+        return;
+      }
       console.log('WebSocket Message:', data);
 
+      // Letture live (solo per i datalogger iscritti): aggiornamento della cache senza REST
+      if (data.type === 'sensor_readings') {
+        if (!applySensorReadings(queryClient, data.datalogger_id, data.readings)) {
+          syncSensorChanges(queryClient, data.datalogger_id); // Sensori nuovi
+        }
+        return;
+      }
+
+      // Eventi di ingest: la lista sensori in cache del datalogger viene aggiornata col change feed.
+      // Se segue un evento sensor_readings (has_readings) e siamo iscritti, basta quello.
+      if ((data.type === 'datalogger_update' || data.type === 'sensor_offline') && data.datalogger_id !== undefined) {
+        if (!(data.has_readings && isSubscribedToReadings(data.datalogger_id))) {
+          syncSensorChanges(queryClient, data.datalogger_id);
+        }
+        return;
+      }
+
       // Assumiamo che il messaggio contenga site_id, status e is_enabled
       const { site_id, status, is_enabled } = data;
 
@@ -0,0 +1,27 @@
+import { NextRequest, NextResponse } from 'next/server';
+import type { AxiosResponse } from 'axios';
+
+// Revalidazione HTTP tra browser e Django attraverso le route proxy:
+// il browser invia If-None-Match con l'ETag della sua copia, Django risponde 304
+// se i dati (versione del sito / datalogger) non sono cambiati.
+
+export function conditionalRequestHeaders(request: NextRequest): Record<string, string> {
+  const ifNoneMatch = request.headers.get('if-none-match');
+  return ifNoneMatch ? { 'If-None-Match': ifNoneMatch } : {};
+}
+
+// 304 non è un errore: la copia nella cache del browser è ancora valida
+export const acceptNotModified = (status: number) => (status >= 200 && status < 300) || status === 304;
+
+export function conditionalResponse(response: AxiosResponse): NextResponse {
+  const headers: Record<string, string> = {};
+  const etag = response.headers['etag'];
+  if (etag) {
+    headers['ETag'] = etag;
+    headers['Cache-Control'] = response.headers['cache-control'] || 'private, no-cache';
+  }
+  if (response.status === 304) {
+    return new NextResponse(null, { status: 304, headers });
+  }
+  return NextResponse.json(response.data, { status: response.status, headers });
+}
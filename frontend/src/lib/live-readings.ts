@@ -0,0 +1,149 @@
+// Iscrizioni opt-in agli eventi WebSocket sensor_readings (letture appena salvate, per datalogger).
+// Conteggio dei riferimenti: più componenti possono seguire lo stesso datalogger.
+const subscriptions = new Map<string, number>();
+let socket: WebSocket | null = null;
+
+function send(type: 'subscribe_readings' | 'unsubscribe_readings', dataloggerIds: string[]) {
+  if (socket && socket.readyState === WebSocket.OPEN && dataloggerIds.length > 0) {
+    socket.send(JSON.stringify({ type, datalogger_ids: dataloggerIds.map(Number) }));
+  }
+}
+
+// Chiamata da useMqttStatusSocket all'apertura della connessione: reinvia le iscrizioni correnti
+export function attachReadingsSocket(ws: WebSocket | null) {
+  socket = ws;
+  send('subscribe_readings', [...subscriptions.keys()]);
+}
+
+export function isSubscribedToReadings(dataloggerId: number | string): boolean {
+  return subscriptions.has(String(dataloggerId));
+}
+
+export function subscribeSensorReadings(dataloggerId: number | string): () => void {
+  const key = String(dataloggerId);
+  const count = subscriptions.get(key) ?? 0;
+  subscriptions.set(key, count + 1);
+  if (count === 0) {
+    send('subscribe_readings', [key]);
+  }
+
+  return () => {
+    const remaining = (subscriptions.get(key) ?? 1) - 1;
+    if (remaining > 0) {
+      subscriptions.set(key, remaining);
+      return;
+    }
+    subscriptions.delete(key);
+    send('unsubscribe_readings', [key]);
+  };
+}
+
+// Stream live di un sensore (evento sensor_stream) alla frequenza massima indicata.
+// Il server arrotonda max_rate a un livello condiviso (50 / 10 / 1 Hz, assente = piena frequenza)
+// e calcola la riduzione una volta per livello. Una connessione segue un solo livello per sensore:
+// il primo componente che si iscrive lo sceglie, gli altri ricevono gli stessi campioni.
+export type SensorStreamMode = 'decimate' | 'envelope';
+
+export interface SensorStreamSample {
+  t: string | number; // ISO 8601 (JSON) o ms dall'epoch (frame binari)
+  v?: Record<string, unknown>; // raw / decimate: ultima lettura della finestra
+  n?: number; // envelope: letture nella finestra
+  min?: Record<string, number>;
+  max?: Record<string, number>;
+  // Solo frame binari (subprotocol STREAM_BINARY_SUBPROTOCOL): valori nell'ordine di channels,
+  // C per raw / decimate, C minimi + C massimi per envelope
+  channels?: string[];
+  values?: Float32Array;
+}
+
+interface StreamSubscription {
+  maxRate?: number;
+  mode: SensorStreamMode;
+  listeners: Set<(sample: SensorStreamSample) => void>;
+}
+
+const streams = new Map<string, StreamSubscription>();
+
+function sendStream(sensorId: string, stream?: StreamSubscription) {
+  if (!socket || socket.readyState !== WebSocket.OPEN) {
+    return;
+  }
+  socket.send(JSON.stringify(stream
+    ? { type: 'subscribe_stream', sensor_id: Number(sensorId), max_rate: stream.maxRate, mode: stream.mode }
+    : { type: 'unsubscribe_stream', sensor_id: Number(sensorId) }));
+}
+
+// Chiamata all'apertura della connessione (insieme ad attachReadingsSocket)
+export function attachStreamSocket(ws: WebSocket | null) {
+  socket = ws;
+  streams.forEach((stream, sensorId) => sendStream(sensorId, stream));
+}
+
+export function dispatchSensorStream(sensorId: number | string, sample: SensorStreamSample) {
+  streams.get(String(sensorId))?.listeners.forEach((listener) => listener(sample));
+}
+
+export function subscribeSensorStream(
+  sensorId: number | string,
+  onSample: (sample: SensorStreamSample) => void,
+  options: { maxRate?: number; mode?: SensorStreamMode } = {}
+): () => void {
+  const key = String(sensorId);
+  let stream = streams.get(key);
+  if (!stream) {
+    stream = { maxRate: options.maxRate, mode: options.mode ?? 'decimate', listeners: new Set() };
+    streams.set(key, stream);
+    sendStream(key, stream);
+  }
+  stream.listeners.add(onSample);
+
+  return () => {
+    const current = streams.get(key);
+    if (!current) {
+      return;
+    }
+    current.listeners.delete(onSample);
+    if (current.listeners.size === 0) {
+      streams.delete(key);
+      sendStream(key);
+    }
+  };
+}
+
+// Frame binari per sensor_stream (vedi backend/mqtt/services/ws_frame_codec.py).
+// Header little-endian di 24 byte, poi float32; i nomi dei canali arrivano con stream_schema.
+export const STREAM_BINARY_SUBPROTOCOL = 'bfg.stream.v1';
+export const STREAM_JSON_SUBPROTOCOL = 'bfg.json';
+
+const STREAM_FRAME_HEADER = 24;
+const STREAM_FRAME_MODES = ['raw', 'decimate', 'envelope'] as const;
+const streamSchemas = new Map<string, string[]>();
+
+export function setStreamSchema(sensorId: number | string, channels: string[]) {
+  streamSchemas.set(String(sensorId), channels);
+}
+
+export function dispatchStreamFrame(buffer: ArrayBuffer) {
+  const view = new DataView(buffer);
+  if (buffer.byteLength < STREAM_FRAME_HEADER || view.getUint8(0) !== 1) {
+    return;
+  }
+  const channelCount = view.getUint16(2, true);
+  const sensorId = view.getUint32(4, true);
+  const mode = STREAM_FRAME_MODES[view.getUint8(1)];
+  const values = new Float32Array(buffer, STREAM_FRAME_HEADER, (buffer.byteLength - STREAM_FRAME_HEADER) / 4);
+  const channels = streamSchemas.get(String(sensorId)) ?? [];
+
+  const sample: SensorStreamSample = { t: view.getFloat64(8, true), n: view.getUint32(20, true), channels, values };
+  if (channels.length === channelCount) {
+    // Anche in forma di oggetti, come i frame JSON
+    const pick = (offset: number) => Object.fromEntries(channels.map((name, i) => [name, values[offset + i]]));
+    if (mode === 'envelope') {
+      sample.min = pick(0);
+      sample.max = pick(channelCount);
+    } else {
+      sample.v = pick(0);
+    }
+  }
+  dispatchSensorStream(sensorId, sample);
+}
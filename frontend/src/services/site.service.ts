@@ -1,5 +1,5 @@
 import { api as axios } from "@/lib/axios";
-import { Site, SiteListItem } from "@/types";
+import { Site, SiteHealth, SiteListItem } from "@/types";
 
 export const siteService = {
   // Get user's accessible sites
@@ -8,6 +8,12 @@ export const siteService = {
     return response.data;
   },
 
+  // Online / total devices per accessible site (one call for the site list and map)
+  async getSitesHealth(): Promise<SiteHealth[]> {
+    const response = await axios.get('v1/site/sites/health/');
+    return response.data;
+  },
+
   // Get all sites (admin only)
   async getAllSites(): Promise<Site[]> {
     const response = await axios.get('v1/site/sites/');
@@ -39,6 +39,21 @@ export type SiteListItem = {
     site_type: SiteType;
 }
 
+export type DeviceHealthCount = {
+    total: number;
+    online: number;
+    offline: number;
+}
+
+export type SiteHealth = {
+    site_id: number;
+    name: string;
+    gateways: DeviceHealthCount;
+    dataloggers: DeviceHealthCount;
+    sensors: DeviceHealthCount;
+    updated_at: string | null;
+}
+
 export type ThemeOption = "light" | "dark" | "system";
 export type ShowResizeHandle = "show" | "hide";
 export type InclinometerUnit = "deg" | "rad";